@@ -0,0 +1,205 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Publish/subscribe throughput benchmark.
+
+Each publisher and subscriber is a separate process, so that the benchmark itself
+is not limited to one core.  Publisher i publishes to benchmark/i, every subscriber
+subscribes to benchmark/+, so each message is delivered to every subscriber.
+
+Start a broker, for example with several worker processes:
+
+  python3 startbroker.py --workers 4
+
+then:
+
+  python3 benchmark.py --publishers 4 --subscribers 4 --messages 10000
+
+"""
+
+import sys, socket, time, getopt, struct, logging, multiprocessing
+
+import mqtt.formats.MQTTV5 as MQTTV5
+
+logging.getLogger('MQTT broker').setLevel(logging.WARNING)
+
+def readPacket(sock, buffer):
+  "returns (first byte, packet body, remaining buffer), reading more from the socket as needed"
+  while True:
+    if len(buffer) >= 2:
+      multiplier = 1; remlength = 0; offset = 1
+      while offset < len(buffer):
+        digit = buffer[offset]
+        offset += 1
+        remlength += (digit & 127) * multiplier
+        if digit & 128 == 0:
+          if len(buffer) >= offset + remlength:
+            return buffer[0], buffer[offset:offset+remlength], buffer[offset+remlength:]
+          break
+        multiplier *= 128
+    data = sock.recv(65536)
+    if data == b"":
+      raise EOFError("connection closed")
+    buffer += data
+
+def connect(host, port, clientid, expiry=0):
+  "returns the connected socket, and the broker's receive maximum"
+  sock = socket.create_connection((host, port))
+  sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+  connect = MQTTV5.Connects()
+  connect.ClientIdentifier = clientid
+  connect.KeepAliveTimer = 0
+  if expiry > 0: # a session which outlives the connection, kept by a persistent broker
+    connect.properties.SessionExpiryInterval = expiry
+  sock.sendall(connect.pack())
+  first, body, buffer = readPacket(sock, b"")
+  connack = MQTTV5.unpackPacket(bytes([first]) + MQTTV5.VBIs.encode(len(body)) + body)
+  assert connack.reasonCode.value == 0, "connect failed %s" % connack
+  receiveMaximum = getattr(connack.properties, "ReceiveMaximum", 65535)
+  return sock, receiveMaximum, buffer
+
+def publisher(index, host, port, messages, qos, size, ready, start, results):
+  sock, receiveMaximum, buffer = connect(host, port, "benchmark_publisher_%d" % index)
+  topic = "benchmark/%d" % index
+  payload = b"x" * size
+  packets = []
+  for msgid in range(1, min(messages, 65535) + 1):
+    publish = MQTTV5.Publishes(QoS=qos, MsgId=msgid, TopicName=topic, Payload=payload)
+    packets.append(publish.pack())
+  ready.wait()
+  start.wait()
+  started = time.perf_counter()
+  inflight = 0
+  for i in range(messages):
+    if qos > 0 and inflight >= receiveMaximum:
+      first, body, buffer = readPacket(sock, buffer)
+      inflight -= 1
+    sock.sendall(packets[i % len(packets)])
+    inflight += 1
+  while qos > 0 and inflight > 0:
+    first, body, buffer = readPacket(sock, buffer)
+    inflight -= 1
+  results.put(("publisher", index, messages, time.perf_counter() - started))
+  sock.sendall(MQTTV5.Disconnects().pack())
+  sock.close()
+
+def subscriber(index, host, port, expected, qos, expiry, ready, start, results):
+  sock, receiveMaximum, buffer = connect(host, port, "benchmark_subscriber_%d" % index, expiry)
+  subscribe = MQTTV5.Subscribes()
+  subscribe.data.append(("benchmark/+", MQTTV5.SubscribeOptions(qos)))
+  sock.sendall(subscribe.pack())
+  first, body, buffer = readPacket(sock, buffer)
+  ready.wait()
+  start.wait()
+  started = time.perf_counter()
+  received = 0
+  sock.settimeout(30)
+  try:
+    while received < expected:
+      first, body, buffer = readPacket(sock, buffer)
+      if first >> 4 != MQTTV5.PacketTypes.PUBLISH:
+        continue
+      received += 1
+      if (first >> 1) & 0x03 == 1:
+        topiclen = struct.unpack_from("!H", body, 0)[0]
+        sock.sendall(b"\x40\x02" + body[2+topiclen:4+topiclen])
+  except (socket.timeout, EOFError):
+    pass
+  results.put(("subscriber", index, received, time.perf_counter() - started))
+  sock.close()
+
+def run(host, port, publishers, subscribers, messages, qos, size, expiry=0):
+  context = multiprocessing.get_context("spawn")
+  ready = context.Barrier(publishers + subscribers)
+  start = context.Barrier(publishers + subscribers)
+  results = context.Queue()
+  processes = []
+  for i in range(subscribers):
+    processes.append(context.Process(target=subscriber,
+        args=(i, host, port, publishers * messages, qos, expiry, ready, start, results)))
+  for i in range(publishers):
+    processes.append(context.Process(target=publisher,
+        args=(i, host, port, messages, qos, size, ready, start, results)))
+  for process in processes:
+    process.start()
+  outcomes = [results.get() for process in processes]
+  for process in processes:
+    process.join()
+
+  sent = sum([count for kind, index, count, elapsed in outcomes if kind == "publisher"])
+  received = sum([count for kind, index, count, elapsed in outcomes if kind == "subscriber"])
+  elapsed = max([elapsed for kind, index, count, elapsed in outcomes if kind == "subscriber"] or [0])
+  print("Publishers %d, subscribers %d, QoS %d, payload %d bytes" % (publishers, subscribers, qos, size))
+  print("Messages published %d, received %d of %d" % (sent, received, sent * subscribers))
+  if elapsed > 0:
+    print("Elapsed %.2f seconds, %d messages received per second" % (elapsed, received / elapsed))
+  return received, elapsed
+
+def usage():
+  print(
+"""
+MQTT V5 publish/subscribe throughput benchmark
+
+ -h --help: print this message
+ --host= broker host name, default localhost
+ --port= broker port, default 1883
+ -p --publishers= number of publishing processes, default 1
+ -s --subscribers= number of subscribing processes, default 1
+ -m --messages= messages sent by each publisher, default 10000
+ -q --qos= QoS of publications and subscriptions, default 0
+ --size= payload size in bytes, default 16
+ -e --expiry= session expiry interval of the subscribers, default 0
+
+""")
+
+def main(argv):
+  try:
+    opts, args = getopt.gnu_getopt(argv[1:], "hp:s:m:q:e:", ["help", "host=", "port=",
+        "publishers=", "subscribers=", "messages=", "qos=", "size=", "expiry="])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+  host = "localhost"; port = 1883
+  publishers = subscribers = 1
+  messages = 10000; qos = 0; size = 16; expiry = 0
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      usage()
+      sys.exit()
+    elif o == "--host":
+      host = a
+    elif o == "--port":
+      port = int(a)
+    elif o in ("-p", "--publishers"):
+      publishers = int(a)
+    elif o in ("-s", "--subscribers"):
+      subscribers = int(a)
+    elif o in ("-m", "--messages"):
+      messages = int(a)
+    elif o in ("-q", "--qos"):
+      qos = int(a)
+    elif o == "--size":
+      size = int(a)
+    elif o in ("-e", "--expiry"):
+      expiry = int(a)
+  run(host, port, publishers, subscribers, messages, qos, size, expiry)
+
+if __name__ == "__main__":
+  main(sys.argv)
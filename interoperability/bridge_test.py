@@ -0,0 +1,375 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Tests of the bridges, which start a local broker with a connection section and the
+remote broker it bridges to, on two free ports:
+
+  python3 bridge_test.py --port 18831 --remote_port 18832
+
+of the behaviour of the MQTT 5.0 test client which the bridges rely on, against a
+server in this process which closes the connection after the CONNACK, and of the spools,
+in a temporary directory:
+
+  python3 bridge_test.py SpoolTest
+
+"""
+
+import unittest
+
+import socket, threading, subprocess, tempfile, time, logging, sys, os, getopt
+
+import mqtt.clients.V5 as mqtt_client
+import mqtt.formats.MQTTV5 as MQTTV5
+from mqtt.brokers.bridges import Spools
+
+class Callbacks(mqtt_client.Callback):
+
+  def __init__(self):
+    self.messages = []
+    self.lost = []
+
+  def connectionLost(self, cause):
+    self.lost.append(cause)
+
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.messages.append((topicName, payload, qos, retained))
+    return True
+
+  def published(self, msgid):
+    pass
+
+  def subscribed(self, msgid, data):
+    pass
+
+def waitFor(condition, timeout=10):
+  "whether condition() became true within timeout seconds"
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(.1)
+  return True
+
+def listening(port):
+  try:
+    socket.create_connection((host, port), timeout=1).close()
+    return True
+  except OSError:
+    return False
+
+class Brokers:
+  "a broker process, started from the configuration lines given"
+
+  def __init__(self, port, lines):
+    self.port = port
+    self.config = os.path.join(directory.name, "broker%d.conf" % port)
+    with open(self.config, "w") as config:
+      config.write("\n".join(lines) + "\n")
+    self.process = None
+
+  def start(self):
+    self.process = subprocess.Popen([sys.executable, "startbroker.py", "-c", self.config],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    assert waitFor(lambda: listening(self.port)), "broker on port %d didn't start" % self.port
+
+  def stop(self):
+    if self.process:
+      self.process.terminate()
+      self.process.wait()
+      self.process = None
+      assert waitFor(lambda: not listening(self.port))
+
+def connected(clientid, port, topics=[]):
+  callback = Callbacks()
+  client = mqtt_client.Client(clientid.encode("utf-8"))
+  client.registerCallback(callback)
+  client.connect(host=host, port=port, cleanstart=True)
+  if len(topics) > 0:
+    client.subscribe([topic.encode("utf-8") for topic in topics], [MQTTV5.SubscribeOptions(1)] * len(topics))
+    time.sleep(.5)
+  return client, callback
+
+
+class BridgeTest(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.remote = Brokers(remote_port, ["listener %d" % remote_port])
+    cls.local = Brokers(port, ["listener %d" % port,
+                               "connection bridge_test",
+                               "address %s:%d" % (host, remote_port),
+                               "clientid bridge_test",
+                               "topic bridge_test/out/# out 1",
+                               "topic # in 1 bridge_test/in/ remote/in/",
+                               "restart_timeout 1 2"])
+    cls.remote.start()
+    cls.local.start()
+    time.sleep(2) # for the bridge to connect
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.local.stop()
+    cls.remote.stop()
+
+  def test_out_and_in(self):
+    localClient, localCallback = connected("bridge_test local", port, ["bridge_test/#"])
+    remoteClient, remoteCallback = connected("bridge_test remote", remote_port, ["bridge_test/#"])
+    try:
+      localClient.publish(b"bridge_test/out/a", b"out", 1)
+      remoteClient.publish(b"remote/in/b", b"in", 1)
+      remoteClient.publish(b"remote/other", b"not bridged", 1)
+      self.assertTrue(waitFor(lambda: len(remoteCallback.messages) > 0 and len(localCallback.messages) > 1))
+      time.sleep(.5)
+      self.assertEqual(remoteCallback.messages, [("bridge_test/out/a", b"out", 1, False)])
+      self.assertEqual(sorted(localCallback.messages),
+                       [("bridge_test/in/b", b"in", 1, False), ("bridge_test/out/a", b"out", 1, False)])
+    finally:
+      localClient.disconnect()
+      remoteClient.disconnect()
+
+  def test_reconnect(self):
+    remoteClient, remoteCallback = connected("bridge_test remote", remote_port, ["bridge_test/#"])
+    localClient, localCallback = connected("bridge_test local", port)
+    try:
+      # the remote broker closes the bridge connection when its client id is taken over
+      takeover, takeoverCallback = connected("bridge_test", remote_port)
+      takeover.terminate()
+      payloads = [("while reconnecting %d" % i).encode("utf-8") for i in range(5)]
+      for payload in payloads:
+        localClient.publish(b"bridge_test/out/c", payload, 1)
+      self.assertTrue(waitFor(lambda: len(remoteCallback.messages) >= len(payloads)))
+      self.assertEqual([message[1] for message in remoteCallback.messages], payloads)
+    finally:
+      localClient.disconnect()
+      remoteClient.disconnect()
+
+  def test_remote_restart(self):
+    localClient, localCallback = connected("bridge_test local", port)
+    self.remote.stop()
+    try:
+      localClient.publish(b"bridge_test/out/d", b"while the remote broker is down", 1, retained=True)
+    finally:
+      self.remote.start()
+    remoteClient, remoteCallback = connected("bridge_test remote", remote_port, ["bridge_test/out/d"])
+    try:
+      self.assertTrue(waitFor(lambda: len(remoteCallback.messages) > 0))
+      self.assertEqual(remoteCallback.messages[0][:2], ("bridge_test/out/d", b"while the remote broker is down"))
+    finally:
+      remoteClient.publish(b"bridge_test/out/d", b"", 1, retained=True)
+      localClient.publish(b"bridge_test/out/d", b"", 1, retained=True)
+      time.sleep(.5)
+      localClient.disconnect()
+      remoteClient.disconnect()
+
+
+class ClientTest(unittest.TestCase):
+
+  def setUp(self):
+    "a server which accepts one connection, sends a CONNACK and closes it"
+    self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.server.bind((host, 0))
+    self.server.listen(1)
+    self.thread = threading.Thread(target=self.serve, daemon=True)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.close()
+    self.thread.join()
+
+  def serve(self):
+    connection, address = self.server.accept()
+    connection.settimeout(5)
+    MQTTV5.getPacket(connection) # CONNECT
+    connection.sendall(MQTTV5.Connacks().pack())
+    time.sleep(.5)
+    connection.close()
+
+  def test_connection_lost(self):
+    callback = Callbacks()
+    client = mqtt_client.Client(b"bridge_test client")
+    client.registerCallback(callback)
+    client.connect(host=host, port=self.server.getsockname()[1])
+    self.assertTrue(waitFor(lambda: len(callback.lost) > 0, 5))
+    self.assertEqual(len(callback.lost), 1)
+    self.assertTrue(waitFor(lambda: not client.getReceiver().running, 5))
+    client.sock.close()
+
+  def test_send_errors(self):
+    for raiseErrors in [False, True]:
+      if raiseErrors:
+        self.tearDown()
+        self.setUp()
+      client = mqtt_client.Client(b"bridge_test client", raiseErrors)
+      client.registerCallback(Callbacks())
+      client.connect(host=host, port=self.server.getsockname()[1])
+      self.thread.join()
+      def publish():
+        for i in range(20): # the first sends to a closed connection may succeed
+          client.publish(b"bridge_test/e", b"after close", 0)
+          time.sleep(.1)
+      try:
+        if raiseErrors:
+          self.assertRaises(OSError, publish)
+        else:
+          publish()
+      finally:
+        client.sock.close()
+
+
+class SpoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.filename = os.path.join(self.directory.name, "remote1")
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def opened(self, segmentSize=Spools.SEGMENT_SIZE, maximum=0):
+    spool = Spools.Spools(self.filename, segmentSize, maximum)
+    spool.open()
+    return spool
+
+  def readAll(self, spool):
+    "the records and the positions after them, until all have been read"
+    entries = []
+    entry = spool.read()
+    while entry != None:
+      entries.append(entry)
+      entry = spool.read()
+    return entries
+
+  def truncate(self, segment, count):
+    "remove count bytes from the end of a segment"
+    name = self.filename + ".spool.%08d" % segment
+    with open(name, "r+b") as segmentFile:
+      segmentFile.truncate(os.path.getsize(name) - count)
+
+  def test_append_read_acknowledge(self):
+    spool = self.opened()
+    self.assertTrue(spool.empty())
+    for i in range(3):
+      spool.append(("record", i))
+    self.assertFalse(spool.empty())
+    entries = self.readAll(spool)
+    self.assertEqual([record for record, position in entries], [("record", i) for i in range(3)])
+    self.assertTrue(spool.empty())
+    start = spool.acknowledged
+    spool.acknowledge(entries[1][1]) # not in order, so nothing is acknowledged yet
+    self.assertEqual(spool.acknowledged, start)
+    spool.acknowledge(entries[0][1])
+    self.assertEqual(spool.acknowledged, entries[1][1])
+    spool.close()
+
+  def test_rewind(self):
+    spool = self.opened()
+    for i in range(3):
+      spool.append(("record", i))
+    entries = self.readAll(spool)
+    spool.acknowledge(entries[0][1])
+    spool.rewind()
+    self.assertEqual(self.readAll(spool), entries[1:])
+    spool.close()
+
+  def test_checkpoint(self):
+    spool = self.opened(segmentSize=100)
+    for i in range(20):
+      spool.append(("record", i))
+    self.assertGreater(len(spool.segments()), 2)
+    entries = self.readAll(spool)
+    for record, position in entries[:10]:
+      spool.acknowledge(position)
+    spool.checkpoint()
+    self.assertEqual(spool.segments()[0], entries[9][1][0]) # the segments before it are deleted
+    spool.close()
+    spool = self.opened(segmentSize=100)
+    self.assertEqual(self.readAll(spool), entries[10:])
+    spool.close()
+
+  def test_maximum(self):
+    spool = self.opened(segmentSize=100, maximum=300)
+    for i in range(20):
+      spool.append(("record", i))
+    self.assertGreater(spool.dropped, 0)
+    records = [record for record, position in self.readAll(spool)]
+    self.assertEqual(records, [("record", i) for i in range(20 - len(records), 20)])
+    spool.close()
+
+  def test_truncated_segments(self):
+    spool = self.opened(segmentSize=100)
+    for i in range(20):
+      spool.append(("record", i))
+    entries = self.readAll(spool)
+    segments = spool.segments()
+    spool.close()
+    positions = [position for record, position in entries if position[0] == segments[0]]
+    count = len(positions) # records in the first segment
+    size = positions[-1][1] - positions[-2][1] # bytes of the last of them
+    # an incomplete record at the end of the last segment is discarded on opening
+    self.truncate(segments[-1], 2)
+    spool = self.opened(segmentSize=100)
+    # and a segment cut short in a header after opening is read up to there
+    self.truncate(segments[0], size - 2)
+    records = [record for record, position in self.readAll(spool)]
+    self.assertEqual(records[:count - 1], [("record", i) for i in range(count - 1)])
+    self.assertNotIn(("record", count - 1), records)
+    self.assertEqual(records[count - 1], ("record", count))
+    self.assertNotIn(("record", 19), records)
+    spool.append(("record", 20)) # after the complete records of the last segment
+    self.assertEqual(spool.read()[0], ("record", 20))
+    spool.close()
+
+
+def usage():
+  print(
+"""bridge_test.py
+   [-h --hostname hostname]
+   [-p --port local broker port]
+   [--remote_port remote broker port]
+""")
+
+if __name__ == "__main__":
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h:p:",
+      ["help", "hostname=", "port=", "remote_port="])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+
+  host = "localhost"
+  port = 18831
+  remote_port = 18832
+  for o, a in opts:
+    if o == "--help":
+      usage()
+      sys.exit()
+    elif o in ("-h", "--hostname"):
+      host = a
+    elif o in ("-p", "--port"):
+      port = int(a)
+    elif o == "--remote_port":
+      remote_port = int(a)
+
+  logging.getLogger().setLevel(logging.ERROR)
+  directory = tempfile.TemporaryDirectory()
+  try:
+    unittest.main(argv=[sys.argv[0]] + args)
+  finally:
+    directory.cleanup()
@@ -856,6 +856,34 @@ class Test(unittest.TestCase):
       self.assertFalse(hasattr(callback.messagedicts[1]["properties"], "TopicAlias"), callback.messagedicts[1]["properties"])
       self.assertFalse(hasattr(callback.messagedicts[2]["properties"], "TopicAlias"), callback.messagedicts[2]["properties"])
 
+    def test_server_topic_alias_reassigned(self):
+      callback.clear()
+
+      # more topics than aliases: an alias may be given to another topic, with the topic name
+      connect_properties = MQTTV5.Properties(MQTTV5.PacketTypes.CONNECT)
+      connect_properties.TopicAliasMaximum = 1
+      aclient.connect(host=host, port=port, cleanstart=True, properties=connect_properties)
+      aclient.subscribe([topics[0], topics[1]], [MQTTV5.SubscribeOptions(2)]*2)
+      self.waitfor(callback.subscribeds, 1, 3)
+
+      published = [topics[0], topics[1], topics[0], topics[0], topics[1], topics[1], topics[0]]
+      for topic in published:
+        aclient.publish(topic, b"topic alias reassigned", 0)
+      self.waitfor(callback.messages, len(published), 3)
+      self.assertEqual(len(callback.messages), len(published), callback.messages)
+      aclient.disconnect()
+
+      aliases = {}
+      for topic, message in zip(published, callback.messagedicts):
+        if hasattr(message["properties"], "TopicAlias"):
+          alias = message["properties"].TopicAlias
+          self.assertTrue(0 < alias <= 1, alias)
+          if message["topicname"] != "":
+            aliases[alias] = message["topicname"]
+          self.assertEqual(aliases.get(alias), topic, message)
+        else:
+          self.assertEqual(message["topicname"], topic)
+
 
     def test_maximum_packet_size(self):
       callback.clear()
@@ -0,0 +1,220 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Tests of clusters, which start three brokers with cluster_listener and cluster_peer
+options, listening for clients on three ports from --port, and for each other on three
+ports from --cluster_port:
+
+  python3 cluster_test.py --port 18841 --cluster_port 18851
+
+The publications each broker sent to its peers are counted from the log it writes
+when it stops.
+
+"""
+
+import unittest
+
+import socket, subprocess, tempfile, time, logging, re, sys, os, getopt
+
+import mqtt.clients.V5 as mqtt_client
+import mqtt.formats.MQTTV5 as MQTTV5
+
+NODES = 3
+
+class Callbacks(mqtt_client.Callback):
+
+  def __init__(self):
+    self.messages = []
+
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.messages.append((topicName, payload))
+    return True
+
+  def published(self, msgid):
+    pass
+
+  def subscribed(self, msgid, data):
+    pass
+
+  def unsubscribed(self, msgid):
+    pass
+
+def waitFor(condition, timeout=10):
+  "whether condition() became true within timeout seconds"
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(.1)
+  return True
+
+def listening(port):
+  try:
+    socket.create_connection((host, port), timeout=1).close()
+    return True
+  except OSError:
+    return False
+
+class Nodes:
+  "a broker process in the cluster, node is 0 to NODES - 1"
+
+  def __init__(self, node):
+    self.port = port + node
+    self.clusterPort = cluster_port + node
+    self.config = os.path.join(directory.name, "node%d.conf" % node)
+    self.log = os.path.join(directory.name, "node%d.log" % node)
+    lines = ["cluster_listener %d" % self.clusterPort]
+    lines += ["cluster_peer %s:%d" % (host, cluster_port + peer) for peer in range(NODES) if peer != node]
+    lines += ["listener %d" % self.port]
+    with open(self.config, "w") as config:
+      config.write("\n".join(lines) + "\n")
+    self.process = None
+
+  def start(self):
+    with open(self.log, "w") as log:
+      self.process = subprocess.Popen([sys.executable, "startbroker.py", "-c", self.config],
+          cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=log)
+    assert waitFor(lambda: listening(self.port)), "node on port %d didn't start" % self.port
+
+  def stop(self):
+    "the number of publications sent to each peer, by its cluster port"
+    if self.process:
+      self.process.terminate()
+      self.process.wait()
+      self.process = None
+    with open(self.log) as log:
+      return {int(port) : int(count) for port, count in
+              re.findall(r"Cluster peer [^:\s]+:(\d+): (\d+) publications sent", log.read())}
+
+def connected(node, clientid, topics=[]):
+  callback = Callbacks()
+  client = mqtt_client.Client(clientid.encode("utf-8"))
+  client.registerCallback(callback)
+  client.connect(host=host, port=port + node, cleanstart=True)
+  if len(topics) > 0:
+    client.subscribe([topic.encode("utf-8") for topic in topics], [MQTTV5.SubscribeOptions(0)] * len(topics))
+  return client, callback
+
+
+class Test(unittest.TestCase):
+
+  def setUp(self):
+    self.nodes = [Nodes(node) for node in range(NODES)]
+    for node in self.nodes:
+      node.start()
+    time.sleep(2) # for the peers to connect to each other
+    self.clients = []
+
+  def tearDown(self):
+    for client in self.clients:
+      client.disconnect()
+    for node in self.nodes:
+      node.stop()
+
+  def connected(self, node, clientid, topics=[]):
+    client, callback = connected(node, clientid, topics)
+    self.clients.append(client)
+    return client, callback
+
+  def test_routing(self):
+    first, firstCallback = self.connected(0, "cluster_test first", ["cluster_test/a/#"])
+    third, thirdCallback = self.connected(2, "cluster_test third", ["cluster_test/b/#"])
+    time.sleep(1) # for the filters to reach the other nodes
+    publisher, publisherCallback = self.connected(1, "cluster_test publisher")
+    for i in range(10):
+      publisher.publish(b"cluster_test/a/%d" % i, b"a", 0)
+    for i in range(5):
+      publisher.publish(b"cluster_test/b/%d" % i, b"b", 0)
+      publisher.publish(b"cluster_test/c/%d" % i, b"c", 0) # no subscribers anywhere
+    self.assertTrue(waitFor(lambda: len(firstCallback.messages) == 10 and len(thirdCallback.messages) == 5))
+    time.sleep(.5)
+    self.assertEqual(len(firstCallback.messages), 10)
+    self.assertEqual(len(thirdCallback.messages), 5)
+    self.assertEqual(set(payload for topic, payload in firstCallback.messages), {b"a"})
+    self.assertEqual(set(payload for topic, payload in thirdCallback.messages), {b"b"})
+    for client in self.clients:
+      client.disconnect()
+    self.clients = []
+    sent = self.nodes[1].stop()
+    self.assertEqual(sent, {cluster_port : 10, cluster_port + 2 : 5})
+
+  def test_reconnect(self):
+    first, firstCallback = self.connected(0, "cluster_test first", ["cluster_test/old/#"])
+    time.sleep(1)
+    first.terminate()
+    self.clients.remove(first)
+    self.nodes[0].stop()
+    self.nodes[0].start()
+    # the filters of the restarted node replace those it had before
+    first, firstCallback = self.connected(0, "cluster_test first", ["cluster_test/new/#"])
+    publisher, publisherCallback = self.connected(1, "cluster_test publisher")
+    def received():
+      publisher.publish(b"cluster_test/new/x", b"after reconnecting", 0)
+      return len(firstCallback.messages) > 0
+    self.assertTrue(waitFor(received, 15))
+    self.assertEqual(firstCallback.messages[0], ("cluster_test/new/x", b"after reconnecting"))
+    for i in range(5):
+      publisher.publish(b"cluster_test/old/x", b"not subscribed to", 0)
+    time.sleep(.5)
+    count = len(firstCallback.messages)
+    for client in self.clients:
+      client.disconnect()
+    self.clients = []
+    sent = self.nodes[1].stop()
+    self.assertEqual(sent[cluster_port], count) # only those on the new filter
+    self.assertNotIn(("cluster_test/old/x", b"not subscribed to"), firstCallback.messages)
+
+
+def usage():
+  print(
+"""cluster_test.py
+   [-h --hostname hostname]
+   [-p --port first of the ports for MQTT clients]
+   [--cluster_port first of the ports for the cluster]
+""")
+
+if __name__ == "__main__":
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h:p:",
+      ["help", "hostname=", "port=", "cluster_port="])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+
+  host = "localhost"
+  port = 18841
+  cluster_port = 18851
+  for o, a in opts:
+    if o == "--help":
+      usage()
+      sys.exit()
+    elif o in ("-h", "--hostname"):
+      host = a
+    elif o in ("-p", "--port"):
+      port = int(a)
+    elif o == "--cluster_port":
+      cluster_port = int(a)
+
+  logging.getLogger().setLevel(logging.ERROR)
+  directory = tempfile.TemporaryDirectory()
+  try:
+    unittest.main(argv=[sys.argv[0]] + args)
+  finally:
+    directory.cleanup()
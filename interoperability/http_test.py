@@ -0,0 +1,285 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Tests of the HTTP API and the Prometheus metrics, against a running broker with an
+MQTT listener and an HTTP listener:
+
+  listener 1883
+  listener 8080 INADDR_ANY http
+
+  python3 http_test.py --port 1883 --http_port 8080
+
+"""
+
+import unittest
+
+import http.client, urllib.parse, json, base64, time, logging, sys, os, getopt, re
+
+import mqtt.clients.V5 as mqtt_client
+import mqtt.formats.MQTTV5 as MQTTV5
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[a-zA-Z_][a-zA-Z0-9_]*="[^"\\]*"(,[a-zA-Z_][a-zA-Z0-9_]*="[^"\\]*")*\})? (\S+)$')
+
+def cursorOf(value):
+  return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+def request(method, url, body=None, headers={}):
+  "the status and the JSON body of the response"
+  connection = http.client.HTTPConnection(host, http_port, timeout=10)
+  try:
+    connection.request(method, url, body, headers)
+    response = connection.getresponse()
+    data = response.read()
+    return response.status, json.loads(data.decode("utf-8")) if data else None
+  finally:
+    connection.close()
+
+def metrics():
+  """
+  the samples of a scrape of /metrics, name and labels -> value, checking that it is in the
+  Prometheus text format and that each sample follows the TYPE line of its family
+  """
+  connection = http.client.HTTPConnection(host, http_port, timeout=10)
+  try:
+    connection.request("GET", "/metrics")
+    response = connection.getresponse()
+    assert response.status == 200, response.status
+    assert response.getheader("Content-Type").startswith("text/plain; version=0.0.4"), response.getheader("Content-Type")
+    lines = response.read().decode("utf-8").splitlines()
+  finally:
+    connection.close()
+  samples = {}
+  families = {} # name -> type
+  for line in lines:
+    if line.startswith("# HELP "):
+      continue
+    if line.startswith("# TYPE "):
+      name, kind = line.split(" ")[2:4]
+      assert kind in ["counter", "gauge", "histogram"], line
+      families[name] = kind
+      continue
+    match = SAMPLE.match(line)
+    assert match, line
+    name = match.group(1)
+    family = re.sub("_(bucket|sum|count)$", "", name) if families.get(name) == None else name
+    assert family in families, line
+    if family != name:
+      assert families[family] == "histogram", line
+    samples[name + (match.group(2) or "")] = float(match.group(4))
+  return samples
+
+def waitFor(condition, timeout=10):
+  "whether condition() became true within timeout seconds"
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(.1)
+  return True
+
+class Callbacks(mqtt_client.Callback):
+
+  def __init__(self):
+    self.messages = []
+
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.messages.append((topicName, payload, qos))
+    return True
+
+  def published(self, msgid):
+    pass
+
+  def subscribed(self, msgid, data):
+    pass
+
+def connected(clientid, topics=[]):
+  callback = Callbacks()
+  client = mqtt_client.Client(clientid.encode("utf-8"))
+  client.registerCallback(callback)
+  client.connect(host=host, port=port, cleanstart=True)
+  if len(topics) > 0:
+    client.subscribe(topics, [MQTTV5.SubscribeOptions(1)] * len(topics))
+    time.sleep(.5)
+  return client, callback
+
+
+class Test(unittest.TestCase):
+
+  def test_cursors(self):
+    status, body = request("GET", "/api/v0001/clients?limit=1")
+    self.assertEqual(status, 200)
+    status, body = request("GET", "/api/v0001/clients?cursor=" + cursorOf(["a", "mqtt5"]))
+    self.assertEqual(status, 200)
+    for cursor in ["NQ==", "not%20base64", cursorOf({"a" : 1}), cursorOf([1, 2]), cursorOf("a")]:
+      for url in ["/api/v0001/clients", "/api/v0001/subscriptions", "/api/v0001/retained"]:
+        status, body = request("GET", url + "?cursor=" + cursor)
+        self.assertEqual(status, 400, url + "?cursor=" + cursor)
+        self.assertEqual(body, {"error" : "invalid cursor"})
+
+  def test_clients_while_streaming(self):
+    topic = "http_test/stream/%d/" % os.getpid() # streams of earlier runs may still be open
+    stream = http.client.HTTPConnection(host, http_port, timeout=10)
+    try:
+      stream.request("GET", "/api/v0001/stream?topic=" + urllib.parse.quote(topic + "#") + "&format=ndjson")
+      response = stream.getresponse()
+      self.assertEqual(response.status, 200)
+      time.sleep(.5)
+      status, body = request("GET", "/api/v0001/clients?limit=1000")
+      self.assertEqual(status, 200)
+      self.assertEqual([item for item in body["items"] if item["id"].startswith("$internal/")], [])
+      status, body = request("GET", "/api/v0001/subscriptions?topic=" + urllib.parse.quote(topic))
+      streams = [item["clientid"] for item in body["items"] if item["clientid"].startswith("$internal/")]
+      self.assertEqual(len(streams), 1)
+      status, body = request("GET", "/api/v0001/clients/" + urllib.parse.quote(streams[0], safe=""))
+      self.assertEqual(status, 404)
+    finally:
+      stream.close()
+
+  def test_publish_errors(self):
+    messages = [{"topic" : "http_test/a", "payload" : 5},
+                {"topic" : "http_test/a", "payload" : "aGk=", "properties" : {"CorrelationData" : [1]}},
+                {"topic" : "http_test/a", "payload" : "not base64"},
+                {"topic" : "http_test/a", "payload" : "aGk=", "qos" : 1}]
+    status, body = request("POST", "/api/v0001/publish", json.dumps(messages),
+                           {"Content-Type" : "application/json"})
+    self.assertEqual(status, 200)
+    self.assertEqual(body["published"], 1)
+    self.assertEqual(body["failed"], 3)
+    self.assertEqual(body["results"][0], {"error" : "payload must be a base64 string"})
+    self.assertEqual(body["results"][1], {"error" : "CorrelationData must be a base64 string"})
+    self.assertIn("error", body["results"][2])
+    self.assertEqual(body["results"][3], {"subscribers" : 0})
+
+  def test_invalid_bodies(self):
+    for method in ["DELETE", "POST"]:
+      status, body = request(method, "/api/v0001/publish", headers={"Content-Length" : "many"})
+      self.assertEqual(status, 400, method)
+      self.assertEqual(body, {"error" : "invalid body"})
+      status, body = request(method, "/api/v0001/publish", b"zz\r\n", {"Transfer-Encoding" : "chunked"})
+      self.assertEqual(status, 400, method)
+      self.assertEqual(body, {"error" : "invalid body"})
+
+  def test_metrics(self):
+    gauges = ['mqtt_clients_connected{protocol="mqtt5"}', 'mqtt_messages_queued{protocol="mqtt5"}',
+              'mqtt_messages_inflight{protocol="mqtt5"}']
+    before = metrics()
+    for gauge in gauges:
+      self.assertIn(gauge, before)
+    topic = "http_test/metrics/%d" % os.getpid()
+    subscriber, callback = connected("http_test metrics subscriber", [topic])
+    subscriber.pause() # so the publication stays in flight
+    publisher, publisherCallback = connected("http_test metrics publisher")
+    try:
+      publisher.publish(topic, b"in flight", 1)
+      self.assertTrue(waitFor(lambda: metrics()[gauges[2]] == before[gauges[2]] + 1))
+      self.assertEqual(metrics()[gauges[0]], before[gauges[0]] + 2)
+      received = 'mqtt_packets_received_total{protocol="mqtt5",type="publish"}'
+      self.assertGreater(metrics()[received], before.get(received, 0))
+    finally:
+      subscriber.terminate()
+      publisher.disconnect()
+    # with no clients connected, the gauges go back to 0
+    self.assertTrue(waitFor(lambda: [metrics()[gauge] for gauge in gauges] == [0, 0, 0]))
+
+  def test_latencies(self):
+    def count(body, name):
+      return body[name].get("mqtt5/qos1", {"count" : 0})["count"]
+    status, before = request("GET", "/api/v0001/latencies")
+    self.assertEqual(status, 200)
+    clientid = "http_test latencies %d" % os.getpid()
+    client, callback = connected(clientid, ["http_test/latencies"])
+    try:
+      for i in range(3):
+        client.publish("http_test/latencies", b"timed", 1)
+        self.assertTrue(waitFor(lambda: len(callback.messages) > i))
+      self.assertTrue(waitFor(lambda: len(client.getReceiver().outMsgs) == 0))
+    finally:
+      client.disconnect()
+    status, after = request("GET", "/api/v0001/latencies")
+    self.assertEqual(status, 200)
+    self.assertEqual(count(after, "deliveries"), count(before, "deliveries") + 3)
+    self.assertEqual(count(after, "acknowledgements"), count(before, "acknowledgements") + 3)
+    self.assertEqual(after["clients"][clientid]["count"], 3)
+    for summary in [after["deliveries"]["mqtt5/qos1"], after["clients"][clientid]]:
+      self.assertLessEqual(summary["p50"], summary["p99"])
+      self.assertLessEqual(summary["p99"], summary["max"])
+
+  def test_profiler(self):
+    status, body = request("GET", "/api/v0001/profiler")
+    self.assertEqual(status, 200)
+    if body["running"]: # started by an earlier run
+      request("POST", "/api/v0001/profiler/stop")
+    status, body = request("POST", "/api/v0001/profiler/stop")
+    self.assertEqual(status, 409)
+    self.assertFalse(body["running"])
+    status, body = request("POST", "/api/v0001/profiler/start")
+    self.assertEqual(status, 200)
+    self.assertTrue(body["running"])
+    status, body = request("POST", "/api/v0001/profiler/start")
+    self.assertEqual(status, 409)
+    self.assertTrue(body["running"])
+    publisher, callback = connected("http_test profiler", ["http_test/profiler"])
+    try:
+      for i in range(10):
+        publisher.publish("http_test/profiler", b"sampled", 0)
+      time.sleep(.5)
+    finally:
+      publisher.disconnect()
+    status, body = request("POST", "/api/v0001/profiler/stop")
+    self.assertEqual(status, 200)
+    self.assertFalse(body["running"])
+    self.assertGreater(body["samples"], 0)
+    self.assertIn("samples of all threads", body["summary"])
+    status, body = request("GET", "/api/v0001/profiler")
+    self.assertEqual((status, body["running"]), (200, False))
+
+
+def usage():
+  print(
+"""http_test.py
+   [-h --hostname hostname]
+   [-p --port mqtt port]
+   [--http_port http port]
+""")
+
+if __name__ == "__main__":
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h:p:",
+      ["help", "hostname=", "port=", "http_port="])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+
+  host = "localhost"
+  port = 1883
+  http_port = 8080
+  for o, a in opts:
+    if o == "--help":
+      usage()
+      sys.exit()
+    elif o in ("-h", "--hostname"):
+      host = a
+    elif o in ("-p", "--port"):
+      port = int(a)
+    elif o == "--http_port":
+      http_port = int(a)
+
+  logging.getLogger().setLevel(logging.ERROR)
+  unittest.main(argv=[sys.argv[0]] + args)
@@ -0,0 +1,240 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Tests of the messages the broker publishes about itself, which start a broker with
+$SYS statistics every second and visual mode, and of production mode and message
+sequence chart traces, which start others, on a free port:
+
+  python3 monitoring_test.py --port 18861
+
+"""
+
+import unittest
+
+import socket, subprocess, tempfile, time, logging, json, sys, os, getopt, re
+
+import mqtt.clients.V5 as mqtt_client
+import mqtt.formats.MQTTV5 as MQTTV5
+from mqtt.brokers.traces import MSCTraces
+
+RECORD = re.compile(r"^(client\d+=>broker|broker=>client\d+)\[label=\w+\];$") # of a text trace
+
+class Callbacks(mqtt_client.Callback):
+
+  def __init__(self):
+    self.messages = []
+
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.messages.append((topicName, payload, retained, properties))
+    return True
+
+  def published(self, msgid):
+    pass
+
+  def subscribed(self, msgid, data):
+    pass
+
+def waitFor(condition, timeout=10):
+  "whether condition() became true within timeout seconds"
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(.1)
+  return True
+
+def listening(port):
+  try:
+    socket.create_connection((host, port), timeout=1).close()
+    return True
+  except OSError:
+    return False
+
+def started(lines, log):
+  "a broker process, started from the configuration lines given, logging to the file log"
+  config = os.path.join(directory.name, "broker.conf")
+  with open(config, "w") as configfile:
+    configfile.write("\n".join(lines + ["listener %d" % port]) + "\n")
+  with open(log, "w") as logfile:
+    process = subprocess.Popen([sys.executable, "startbroker.py", "-c", config],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=logfile)
+  assert waitFor(lambda: listening(port)), "broker on port %d didn't start" % port
+  return process
+
+def stopped(process):
+  process.terminate()
+  process.wait()
+  assert waitFor(lambda: not listening(port))
+
+def subscribed(clientid, topic, subscriptionIdentifier):
+  "a client subscribed to topic with a subscription identifier"
+  callback = Callbacks()
+  client = mqtt_client.Client(clientid.encode("utf-8"))
+  client.registerCallback(callback)
+  client.connect(host=host, port=port, cleanstart=True)
+  properties = MQTTV5.Properties(MQTTV5.PacketTypes.SUBSCRIBE)
+  properties.SubscriptionIdentifier = subscriptionIdentifier
+  client.subscribe([topic], [MQTTV5.SubscribeOptions(0)], properties)
+  return client, callback
+
+
+class Test(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.log = os.path.join(directory.name, "broker.log")
+    cls.process = started(["sys_interval 1", "visual true"], cls.log)
+
+  @classmethod
+  def tearDownClass(cls):
+    stopped(cls.process)
+
+  def assertNoErrors(self):
+    with open(self.log) as log:
+      self.assertNotIn("Traceback", log.read())
+
+  def test_statistics(self):
+    client, callback = subscribed("monitoring_test", "$SYS/broker/#", 7)
+    try:
+      uptimes = lambda: [message for message in callback.messages if message[0] == "$SYS/broker/uptime"]
+      self.assertTrue(waitFor(lambda: len(uptimes()) >= 3)) # the retained value, then each second
+      topics = set(message[0] for message in callback.messages)
+      self.assertIn("$SYS/broker/clients/connected", topics)
+      self.assertIn("$SYS/broker/mqtt5/publish/messages/sent", topics)
+      for topic, payload, retained, properties in callback.messages:
+        if not retained: # published since the subscription, not sent from the retained messages
+          self.assertEqual(properties.SubscriptionIdentifier, [7], topic)
+      self.assertNoErrors()
+    finally:
+      client.disconnect()
+
+  def test_visual_mirrors(self):
+    client, callback = subscribed("monitoring_test", "$SYS/clients-packets", 9)
+    publisher, publisherCallback = subscribed("monitoring_test publisher", "monitoring_test/#", 1)
+    try:
+      publisher.publish(b"monitoring_test/a", b"mirrored", 1)
+      mirrored = lambda: [json.loads(payload.decode("utf-8")) for topic, payload, retained, properties
+                          in callback.messages if topic == "$SYS/clients-packets"]
+      published = lambda: [copy for copy in mirrored() if copy["packet"].get("TopicName") == "monitoring_test/a"]
+      self.assertTrue(waitFor(lambda: len(published()) >= 2)) # received, and sent to the subscriber
+      self.assertEqual(set(copy["direction"] for copy in published()), {"CtoS", "StoC"})
+      self.assertEqual(set(copy["clientid"] for copy in published()), {"monitoring_test publisher"})
+      for topic, payload, retained, properties in callback.messages:
+        self.assertEqual(properties.SubscriptionIdentifier, [9], topic)
+      self.assertNoErrors()
+    finally:
+      publisher.disconnect()
+      client.disconnect()
+
+
+class ProductionTest(unittest.TestCase):
+
+  def test_production(self):
+    "no conformance statements are logged or measured"
+    log = os.path.join(directory.name, "production.log")
+    process = started(["production true"], log)
+    try:
+      client, callback = subscribed("monitoring_test production", "monitoring_test/production", 1)
+      client.publish(b"monitoring_test/production", b"in production", 1)
+      self.assertTrue(waitFor(lambda: len(callback.messages) > 0))
+      client.disconnect()
+    finally:
+      stopped(process)
+    with open(log) as logfile:
+      lines = logfile.read().splitlines()
+    self.assertIn("Production mode: conformance statements are not recorded", "\n".join(lines))
+    self.assertEqual([line for line in lines if "[MQTT" in line or "coverage statements" in line], [])
+    self.assertNotIn("Traceback", "\n".join(lines))
+
+
+class TracesTest(unittest.TestCase):
+
+  def traced(self, lines, bursts):
+    "run a broker with the configuration lines given, and publish bursts of 20 messages"
+    process = started(lines, os.path.join(directory.name, "traces.log"))
+    try:
+      client, callback = subscribed("monitoring_test traces", "monitoring_test/traces", 1)
+      for burst in range(bursts):
+        for i in range(20):
+          client.publish(b"monitoring_test/traces", b"traced", 0)
+        time.sleep(.5) # longer than the interval between writes
+      self.assertTrue(waitFor(lambda: len(callback.messages) == 20 * bursts))
+      client.disconnect()
+    finally:
+      stopped(process)
+
+  def test_text(self):
+    "each file, the current one and the backups, is a complete chart"
+    filename = os.path.join(directory.name, "trace.msc")
+    self.traced(["mscfile " + filename, "mscfile_max_bytes 1000", "mscfile_backups 2"], 4)
+    names = [filename, filename + ".1", filename + ".2"]
+    for name in names:
+      with open(name) as trace:
+        chart = trace.read()
+      self.assertTrue(chart.startswith(MSCTraces.HEADER), name)
+      self.assertTrue(chart.endswith(MSCTraces.FOOTER), name)
+      for line in chart[len(MSCTraces.HEADER):-len(MSCTraces.FOOTER)].splitlines():
+        self.assertRegex(line, RECORD)
+    self.assertFalse(os.path.exists(filename + ".3"))
+    with open(filename) as trace:
+      self.assertIn("[label=Disconnects];", trace.read()) # the last packet
+
+  def test_binary(self):
+    filename = os.path.join(directory.name, "trace.bin")
+    self.traced(["mscfile " + filename, "mscfile_format binary"], 2)
+    MSCTraces.toMSC(filename, filename + ".msc")
+    with open(filename + ".msc") as trace:
+      lines = trace.read().splitlines()
+    self.assertEqual(len([line for line in lines if re.match(r"client\d+=>broker\[label=Publishes\]", line)]), 40)
+    self.assertEqual(len([line for line in lines if re.match(r"broker=>client\d+\[label=Publishes\]", line)]), 40)
+
+
+def usage():
+  print(
+"""monitoring_test.py
+   [-h --hostname hostname]
+   [-p --port port]
+""")
+
+if __name__ == "__main__":
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h:p:",
+      ["help", "hostname=", "port="])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+
+  host = "localhost"
+  port = 18861
+  for o, a in opts:
+    if o == "--help":
+      usage()
+      sys.exit()
+    elif o in ("-h", "--hostname"):
+      host = a
+    elif o in ("-p", "--port"):
+      port = int(a)
+
+  logging.getLogger().setLevel(logging.ERROR)
+  directory = tempfile.TemporaryDirectory()
+  try:
+    unittest.main(argv=[sys.argv[0]] + args)
+  finally:
+    directory.cleanup()
@@ -20,6 +20,7 @@ import types, time, logging
 
 from ..V311 import Topics
 from ..V311.SubscriptionEngines import SubscriptionEngines
+from mqtt.brokers.coverage import conformance
 
 logger = logging.getLogger('MQTT-SN broker')
  
@@ -32,6 +33,14 @@ class Brokers:
     self.overlapping_single = overlapping_single
     self.__broker3 = None
     self.__broker5 = None
+    self.cluster = None
+    self.gateway = None # publications are sent upstream instead, see Gateways
+
+  def setCluster(self, cluster):
+    self.cluster = cluster
+
+  def setGateway(self, gateway):
+    self.gateway = gateway
 
   def setBroker3(self, broker3):
     self.__broker3 = broker3
@@ -52,12 +61,12 @@ class Brokers:
   def cleanSession(self, aClientid):
     "clear any outstanding subscriptions and publications"
     if len(self.se.getRetainedTopics("#")) > 0:
-      logger.info("[MQTT-3.1.2-7] retained messages not cleaned up as part of session state for client %s", aClientid)
+      conformance("[MQTT-3.1.2-7] retained messages not cleaned up as part of session state for client %s", aClientid)
     self.se.clearSubscriptions(aClientid)
 
   def connect(self, aClient):
     aClient.connected = True
-    aClient.timestamp = time.clock()
+    aClient.timestamp = time.monotonic()
     self.__clients[aClient.id] = aClient
     if aClient.cleansession:
       self.cleanSession(aClient.id)
@@ -66,12 +75,12 @@ class Brokers:
     "Abrupt disconnect which also causes a will msg to be sent out"
     if aClientid in self.__clients.keys() and self.__clients[aClientid].connected:
       if self.__clients[aClientid].will != None:
-        logger.info("[MQTT-3.1.2-8] sending will message for client %s", aClientid)
+        conformance("[MQTT-3.1.2-8] sending will message for client %s", aClientid)
         willtopic, willQoS, willmsg, willRetain = self.__clients[aClientid].will
         if willRetain:
-          logger.info("[MQTT-3.1.2-17] sending will message retained for client %s", aClientid)
+          conformance("[MQTT-3.1.2-17] sending will message retained for client %s", aClientid)
         else:
-          logger.info("[MQTT-3.1.2-16] sending will message non-retained for client %s", aClientid)
+          conformance("[MQTT-3.1.2-16] sending will message non-retained for client %s", aClientid)
         self.publish(aClientid, willtopic, willmsg, willQoS, willRetain)
       self.disconnect(aClientid)
 
@@ -79,15 +88,15 @@ class Brokers:
     if aClientid in self.__clients.keys():
       self.__clients[aClientid].connected = False
       if self.__clients[aClientid].cleansession:
-        logger.info("[MQTT-3.1.2-6] broker must discard the session data for client %s", aClientid)
+        conformance("[MQTT-3.1.2-6] broker must discard the session data for client %s", aClientid)
         self.cleanSession(aClientid)
         del self.__clients[aClientid]
       else:
-        logger.info("[MQTT-3.1.2-4] broker must store the session data for client %s", aClientid)
-        self.__clients[aClientid].timestamp = time.clock()
+        conformance("[MQTT-3.1.2-4] broker must store the session data for client %s", aClientid)
+        self.__clients[aClientid].timestamp = time.monotonic()
         self.__clients[aClientid].connected = False 
-        logger.info("[MQTT-3.1.2-10] will message is deleted after use or disconnect, for client %s", aClientid)
-        logger.info("[MQTT-3.14.4-3] on receipt of disconnect, will message is deleted")
+        conformance("[MQTT-3.1.2-10] will message is deleted after use or disconnect, for client %s", aClientid)
+        conformance("[MQTT-3.14.4-3] on receipt of disconnect, will message is deleted")
         self.__clients[aClientid].will = None
 
   def disconnectAll(self):
@@ -98,18 +107,28 @@ class Brokers:
     """publish to all subscribed connected clients
        also to any disconnected non-cleansession clients with qos in [1,2]
     """
+    if self.gateway:
+      self.gateway.publish(aClientid, topic, message, qos, retained)
+      return
+
+    if self.cluster:
+      self.cluster.publish(topic, message, qos, retained, None)
+    self.deliver(topic, message, qos, retained)
+
+  def deliver(self, topic, message, qos, retained=False):
+    "send a publication to the subscribed clients, here rather than in other workers or upstream"
     if retained:
-      logger.info("[MQTT-2.1.2-6] store retained message and QoS")
-      self.se.setRetained(topic, message, qos)
+      conformance("[MQTT-2.1.2-6] store retained message and QoS")
+      self.se.setRetained(topic, message, qos, time.monotonic())
     else:
-      logger.info("[MQTT-2.1.2-12] non-retained message - do not store")
+      conformance("[MQTT-2.1.2-12] non-retained message - do not store")
 
     for subscriber in self.se.subscribers(topic):  # all subscribed clients
       # qos is lower of publication and subscription
       if len(self.se.getSubscriptions(topic, subscriber)) > 1:
-        logger.info("[MQTT-3.3.5-1] overlapping subscriptions")
+        conformance("[MQTT-3.3.5-1] overlapping subscriptions")
       if retained:
-        logger.info("[MQTT-2.1.2-10] outgoing publish does not have retained flag set")
+        conformance("[MQTT-2.1.2-10] outgoing publish does not have retained flag set")
       if self.overlapping_single:   
         out_qos = min(self.se.qosOf(subscriber, topic), qos)
         if subscriber in self.__clients.keys(): 
@@ -140,7 +159,7 @@ class Brokers:
         if s not in topicsUsed and Topics.topicMatches(t, s):
           # topic has retained publication
           topicsUsed.append(s)
-          (ret_msg, ret_qos) = self.se.getRetained(s)
+          (ret_msg, ret_qos) = self.se.getRetained(s)[:2] # then the received time, and any MQTT 5 properties
           thisqos = min(ret_qos, qos[i])
           self.__clients[aClientid].publishArrived(s, ret_msg, thisqos, True)
       i += 1
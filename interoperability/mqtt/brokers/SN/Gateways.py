@@ -0,0 +1,270 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+An aggregating MQTT-SN gateway: the MQTT-SN clients of this broker are served through
+a small pool of MQTT 5.0 connections to another broker, rather than by this broker.
+
+  gateway_address upstream.example.com:1883
+  gateway_connections 4
+  gateway_clientid gateway1
+
+Publications from MQTT-SN clients are sent upstream on the connection chosen by a hash
+of the client id, so those from each client stay in order.  Each connection has at most
+the receive maximum of the upstream broker of QoS 1 and 2 publications in flight, the
+rest are queued.  The MQTT-SN broker only queues them, holding its lock, and each
+connection's own thread sends them, so a slow or lost upstream connection doesn't hold
+up the MQTT-SN clients.  The QoS 1 and 2 publications in flight when a connection is lost
+are sent again after it is reconnected.
+
+The topic filters of the MQTT-SN clients are merged: the first connection subscribes
+upstream to each filter once, when the first client subscribes to it, and unsubscribes
+when the last client does.  Each publication received from upstream is passed to the
+MQTT-SN broker, which sends it to all the matching clients, and keeps it if retained for
+later subscribers.
+
+"""
+
+import threading, logging, zlib, collections, time
+
+import mqtt.clients.V5
+from mqtt.formats import MQTTV5
+from mqtt.brokers.clusters.Interests import Interests
+
+logger = logging.getLogger('MQTT broker')
+
+MAX_QUEUED = 10000 # publications queued for each connection while it's busy or down
+RECONNECT_INTERVAL = 5 # seconds
+
+
+class Callbacks(mqtt.clients.V5.Callback):
+  "the messages and acknowledgements received on one upstream connection"
+
+  def __init__(self, gateway, connection):
+    self.gateway = gateway
+    self.connection = connection
+
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.gateway.publishArrived(topicName, payload, qos, retained)
+    return True
+
+  def published(self, msgid):
+    self.connection.drain()
+
+  def subscribed(self, msgid, reasonCodes):
+    for reasonCode in reasonCodes:
+      if reasonCode.value >= 0x80:
+        logger.error("Gateway subscription rejected upstream: %s", reasonCode.getName())
+
+  def disconnected(self, reasoncode, properties):
+    logger.info("Gateway connection %s disconnected by upstream: %s", self.connection.clientid, reasoncode)
+
+
+class Connections:
+  """
+  one upstream connection and the requests waiting to be sent on it.  The MQTT-SN broker
+  only queues them, holding its lock, and the connection's own thread sends them.
+  """
+
+  def __init__(self, gateway, clientid):
+    self.clientid = clientid
+    self.client = mqtt.clients.V5.Client(clientid, raiseErrors=True)
+    self.client.registerCallback(Callbacks(gateway, self))
+    self.condition = threading.Condition() # for the queues and the connection state
+    self.queue = collections.deque() # (topic, payload, qos, retained)
+    self.subscriptions = collections.deque() # (client method name, topic filters)
+    self.receiveMaximum = MQTTV5.MAX_PACKETID
+    self.connected = False
+    self.connectedTime = 0
+    self.running = True
+    self.thread = threading.Thread(target=self.run, name="MQTT-SN gateway %s" % clientid, daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def connect(self, host, port):
+    receiver = self.client.getReceiver()
+    # publications in flight on the previous connection are sent again, in the same order
+    unacknowledged = [(pub.topicName, pub.data, pub.fh.QoS, pub.fh.RETAIN)
+                      for pub in receiver.outMsgs.values()] if receiver else []
+    try:
+      connack = self.client.connect(host=host, port=port, cleanstart=True)
+    except (OSError, MQTTV5.MQTTException, AssertionError) as error:
+      logger.info("Gateway connection %s to %s:%d failed: %s", self.clientid, host, port, error)
+      return False
+    with self.condition:
+      self.queue.extendleft(reversed(unacknowledged))
+      self.receiveMaximum = getattr(connack.properties, "ReceiveMaximum", MQTTV5.MAX_PACKETID)
+      self.subscriptions.clear() # all the filters are subscribed to again by the gateway
+      self.connected = True
+      self.connectedTime = time.monotonic()
+      self.condition.notify()
+    logger.info("Gateway connection %s to %s:%d, receive maximum %d", self.clientid, host, port,
+                self.receiveMaximum)
+    return True
+
+  def lost(self):
+    "has the receiver thread ended since the connection was made?"
+    receiver = self.client.getReceiver()
+    return self.connected and time.monotonic() - self.connectedTime > 1 and \
+           (receiver == None or not receiver.running)
+
+  def down(self, error):
+    "a request couldn't be sent, so the connection is made again by the gateway"
+    with self.condition:
+      if self.connected:
+        logger.info("Gateway connection %s failed sending: %s", self.clientid, error)
+        self.connected = False
+
+  def inflight(self):
+    receiver = self.client.getReceiver()
+    return len(receiver.outMsgs) if receiver else 0
+
+  def publish(self, topic, payload, qos, retained):
+    with self.condition:
+      if qos == 0 and not self.connected:
+        logger.debug("Gateway connection %s down, QoS 0 publication to %s dropped", self.clientid, topic)
+        return
+      if len(self.queue) >= MAX_QUEUED:
+        self.queue.popleft()
+        logger.info("Gateway connection %s queue full, oldest publication dropped", self.clientid)
+      self.queue.append((topic, payload, qos, retained))
+      self.condition.notify()
+
+  def drain(self):
+    "an acknowledgement has arrived, so more publications can be sent"
+    with self.condition:
+      self.condition.notify()
+
+  def subscribe(self, topicFilters):
+    with self.condition:
+      if self.connected and len(topicFilters) > 0:
+        self.subscriptions.append(("subscribe", topicFilters))
+        self.condition.notify()
+
+  def unsubscribe(self, topicFilter):
+    with self.condition:
+      if self.connected:
+        self.subscriptions.append(("unsubscribe", [topicFilter]))
+        self.condition.notify()
+
+  def next(self):
+    "the next request which can be sent, or None"
+    if not self.connected:
+      return None
+    if len(self.subscriptions) > 0:
+      return self.subscriptions.popleft()
+    if len(self.queue) > 0 and (self.queue[0][2] == 0 or self.inflight() < self.receiveMaximum):
+      return ("publish", self.queue.popleft())
+    return None
+
+  def run(self):
+    "send the requests queued, up to the receive maximum of publications in flight"
+    options = MQTTV5.SubscribeOptions(QoS=2, retainAsPublished=True)
+    while self.running:
+      with self.condition:
+        request = self.next()
+        while self.running and request == None:
+          self.condition.wait()
+          request = self.next()
+      if request == None:
+        break
+      name, args = request
+      try:
+        if name == "publish":
+          self.client.publish(*args)
+        elif name == "subscribe":
+          self.client.subscribe(args, [options] * len(args))
+        else:
+          self.client.unsubscribe(args)
+      except OSError as error:
+        self.down(error) # a QoS 1 or 2 publication is in flight, so is sent again after reconnecting
+
+  def disconnect(self):
+    with self.condition:
+      self.running = False
+      self.condition.notify()
+      if not self.connected:
+        return
+      self.connected = False
+    try:
+      self.client.terminate()
+    except OSError:
+      pass
+
+
+class Gateways:
+
+  def __init__(self, brokerSN, host, port, connections=4, clientid="gateway"):
+    "brokerSN is the MQTTSNBrokers object"
+    self.brokerSN = brokerSN
+    self.host = host
+    self.port = port
+    self.connections = [Connections(self, "%s-%d" % (clientid, i)) for i in range(connections)]
+    self.interests = Interests() # the topic filters subscribed to upstream
+    self.running = True
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.run, name="MQTT-SN gateway", daemon=True)
+
+  def start(self):
+    self.brokerSN.broker.setGateway(self)
+    self.brokerSN.broker.se.addObserver(self)
+    logger.info("MQTT-SN gateway to %s:%d with %d connections", self.host, self.port, len(self.connections))
+    for connection in self.connections:
+      connection.start()
+    self.thread.start()
+
+  def shutdown(self):
+    self.running = False
+    self.stopped.set()
+    for connection in self.connections:
+      connection.disconnect()
+
+  def run(self):
+    "connect, and reconnect the connections which are lost"
+    while self.running:
+      for connection in self.connections:
+        if connection.lost():
+          logger.info("Gateway connection %s lost", connection.clientid)
+          connection.connected = False
+        if not connection.connected and connection.connect(self.host, self.port) and \
+            connection == self.connections[0]:
+          with self.brokerSN.lock:
+            filters = self.interests.filters()
+          connection.subscribe(filters)
+      self.stopped.wait(RECONNECT_INTERVAL)
+
+  def publish(self, clientid, topic, payload, qos, retained):
+    "called by the MQTT-SN broker, with its lock held, for each publication from a client, which is queued"
+    index = zlib.crc32(str(clientid).encode()) % len(self.connections)
+    self.connections[index].publish(topic, payload, qos, retained)
+
+  def publishArrived(self, topic, payload, qos, retained):
+    "a publication from upstream, for the MQTT-SN clients"
+    with self.brokerSN.lock:
+      self.brokerSN.broker.deliver(topic, payload, qos, retained)
+
+  def subscribed(self, topicFilter):
+    if self.interests.add(topicFilter):
+      self.connections[0].subscribe([topicFilter])
+
+  def unsubscribed(self, topicFilter):
+    if self.interests.remove(topicFilter):
+      self.connections[0].unsubscribe(topicFilter)
+
@@ -1,6 +1,6 @@
 """
 *******************************************************************
-  Copyright (c) 2013, 2018 IBM Corp.
+  Copyright (c) 2013, 2026 IBM Corp.
 
   All rights reserved. This program and the accompanying materials
   are made available under the terms of the Eclipse Public License v1.0
@@ -16,16 +16,20 @@
 *******************************************************************
 """
 
-import traceback, random, sys, string, copy, threading, logging, socket, time, uuid
+import traceback, random, sys, string, copy, threading, logging, socket, time, uuid, collections
 
 from mqtt.formats import MQTTSN
 
 from .Brokers import Brokers
+from .TopicRegistries import TopicRegistries, Predefined, shortNameOf
+from mqtt.brokers.coverage import conformance
+from mqtt.brokers import guards
 
 logger = logging.getLogger('MQTT broker')
 
 def respond(address, callback, packet):
-  logger.debug("out: "+repr(packet))
+  if guards.debug:
+    logger.debug("out: %r", packet)
   if hasattr(callback[1], "handlePacket"):
     callback[1].handlePacket(packet)
   else:
@@ -38,90 +42,227 @@ def respond(address, callback, packet):
 
 class MQTTSNClients:
 
-  def __init__(self, anId, cleansession, keepalive, socket, broker):
+  def __init__(self, anId, cleansession, keepalive, socket, callback, broker):
     self.id = anId # required
     self.cleansession = cleansession
     self.socket = socket
+    self.callback = callback
     self.msgid = 1
     self.outbound = [] # message objects - for ordering
     self.outmsgs = {} # msgids to message objects
+    self.pubrecs = set() # msgids of QoS 2 messages whose pubrec has been received
     self.broker = broker
     if broker.publish_on_pubrel:
       self.inbound = {} # stored inbound QoS 2 publications
     else:
       self.inbound = []
+    self.topics = TopicRegistries(broker.predefined)
+    self.registering = {} # msgid of register sent -> topic id
+    self.waiting = {} # topic id being registered -> publications to send when it's acknowledged
     self.connected = False
     self.will = None
     self.keepalive = keepalive
     self.lastPacket = None
+    # sleeping clients
+    self.sleepUntil = None # time by which a sleeping client must wake, None when active
+    self.sleepDuration = 0
+    self.awake = False # woken by a pingreq, and being sent the messages held
+    self.held = collections.deque() # (topic, payload, qos, retained) held while asleep
+    self.heldBytes = 0
+    self.heldDropped = 0 # messages dropped from held because there were too many
+    self.wakeInflight = set() # msgids of the QoS 1 and 2 messages sent since waking
+
+  def send(self, packet):
+    respond(self.socket, self.callback, packet)
+
+  def nextMsgid(self):
+    msgid = self.msgid
+    if self.msgid == 65535:
+      self.msgid = 1
+    else:
+      self.msgid += 1
+    return msgid
+
+  def register(self, topic):
+    "register the topic with the client before sending it publications, returning the topic id"
+    topicId = self.topics.register(topic)
+    if topicId != None:
+      self.waiting[topicId] = []
+      self.sendRegister(topicId)
+    return topicId
+
+  def sendRegister(self, topicId):
+    reg = MQTTSN.Registers()
+    reg.TopicId = topicId
+    reg.MsgId = self.nextMsgid()
+    reg.TopicName = self.topics.names[topicId]
+    self.registering[reg.MsgId] = topicId
+    if self.connected or self.awake:
+      self.send(reg)
+
+  def regack(self, msgid, returnCode):
+    topicId = self.registering.pop(msgid, None)
+    if topicId == None:
+      logger.error("%s: Regack received for msgid %d, but no register found", self.id, msgid)
+      return
+    pubs = self.waiting.pop(topicId, [])
+    if returnCode == MQTTSN.ReturnCodes.ACCEPTED:
+      for pub in pubs:
+        self.send(pub)
+    else:
+      logger.error("%s: Register of topic %s rejected with return code %d, %d publications dropped",
+                   self.id, self.topics.names[topicId], returnCode, len(pubs))
+      for pub in pubs:
+        if pub.MsgId in self.outmsgs:
+          self.outbound.remove(pub)
+          del self.outmsgs[pub.MsgId]
+          self.acknowledged(pub.MsgId)
+      self.topics.unregister(topicId)
+
+  def isWaiting(self, pub):
+    return pub.Flags.TopicIdType == MQTTSN.TopicIdTypes.NORMAL and pub.TopicId in self.waiting
 
   def resend(self):
-    logger.debug("resending unfinished publications %s", str(self.outbound))
+    logger.debug("resending unfinished publications %s", self.outbound)
+    for msgid, topicId in list(self.registering.items()):
+      del self.registering[msgid]
+      self.sendRegister(topicId)
     if len(self.outbound) > 0:
-      logger.info("[MQTT-4.4.0-1] resending inflight QoS 1 and 2 messages")
+      conformance("[MQTT-4.4.0-1] resending inflight QoS 1 and 2 messages")
     for pub in self.outbound:
-      logger.debug("resending", pub)
-      logger.info("[MQTT-4.4.0-2] dup flag must be set on in re-publish")
-      if pub.fh.QoS == 0:
-        respond(self.socket, pub)
-      elif pub.fh.QoS == 1:
-        pub.fh.DUP = 1
-        logger.info("[MQTT-2.1.2-3] Dup when resending QoS 1 publish id %d", pub.messageIdentifier)
-        logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
-        logger.info("[MQTT-4.3.2-1] Resending QoS 1 with DUP flag")
-        respond(self.socket, pub)
-      elif pub.fh.QoS == 2:
-        if pub.qos2state == "PUBREC":
-          logger.info("[MQTT-2.1.2-3] Dup when resending QoS 2 publish id %d", pub.messageIdentifier)
-          pub.fh.DUP = 1
-          logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
-          logger.info("[MQTT-4.3.3-1] Resending QoS 2 with DUP flag")
-          respond(self.socket, pub)
+      if self.isWaiting(pub):
+        self.waiting[pub.TopicId].append(pub)
+        continue
+      logger.debug("resending %s", pub)
+      conformance("[MQTT-4.4.0-2] dup flag must be set on in re-publish")
+      if pub.Flags.QoS == 0:
+        self.send(pub)
+      elif pub.Flags.QoS == 1:
+        pub.Flags.DUP = True
+        conformance("[MQTT-2.1.2-3] Dup when resending QoS 1 publish id %d", pub.MsgId)
+        conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
+        conformance("[MQTT-4.3.2-1] Resending QoS 1 with DUP flag")
+        self.send(pub)
+      elif pub.Flags.QoS == 2:
+        if pub.MsgId not in self.pubrecs:
+          conformance("[MQTT-2.1.2-3] Dup when resending QoS 2 publish id %d", pub.MsgId)
+          pub.Flags.DUP = True
+          conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
+          conformance("[MQTT-4.3.3-1] Resending QoS 2 with DUP flag")
+          self.send(pub)
         else:
           resp = MQTTSN.Pubrels()
-          logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
-          resp.messageIdentifier = pub.messageIdentifier
-          respond(self.socket, resp)
+          conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
+          resp.MsgId = pub.MsgId
+          self.send(resp)
+
+  def sleep(self, duration):
+    self.sleepDuration = duration
+    self.sleepUntil = time.monotonic() + duration * 1.5
+    self.awake = False
+
+  def hold(self, topic, msg, qos, retained):
+    "keep a message for a sleeping client, dropping the oldest if there are too many"
+    self.held.append((topic, msg, qos, retained))
+    self.heldBytes += len(topic) + len(msg)
+    while len(self.held) > self.broker.sleep_buffer_maximum or \
+        (self.heldBytes > self.broker.sleep_buffer_bytes and len(self.held) > 1):
+      topic, msg, qos, retained = self.held.popleft()
+      self.heldBytes -= len(topic) + len(msg)
+      self.heldDropped += 1
+
+  def reportDropped(self):
+    if self.heldDropped > 0:
+      logger.info("%s: %d messages dropped while asleep", self.id, self.heldDropped)
+      self.heldDropped = 0
+
+  def wake(self):
+    "send the messages held, a burst at a time, then a pingresp"
+    self.awake = True
+    self.sleepUntil = time.monotonic() + self.sleepDuration * 1.5
+    self.wakeInflight = set()
+    self.reportDropped()
+    self.deliver()
+
+  def deliver(self):
+    while len(self.held) > 0 and len(self.wakeInflight) < self.broker.sleep_burst:
+      topic, msg, qos, retained = self.held.popleft()
+      self.heldBytes -= len(topic) + len(msg)
+      self.transmit(topic, msg, qos, retained)
+    if self.awake and len(self.held) == 0 and len(self.wakeInflight) == 0:
+      self.awake = False
+      self.send(MQTTSN.Pingresps())
+
+  def acknowledged(self, msgid):
+    "a QoS 1 or 2 message is complete"
+    if msgid in self.wakeInflight:
+      self.wakeInflight.discard(msgid)
+      if self.awake:
+        self.deliver()
+
+  def flush(self):
+    "send all the messages held, when a sleeping client connects"
+    self.sleepUntil = None
+    self.awake = False
+    self.reportDropped()
+    while len(self.held) > 0:
+      self.transmit(*self.held.popleft())
+    self.heldBytes = 0
+
+  def publishArrived(self, topic, msg, qos, retained=False, receivedTime=None):
+    if self.sleepUntil != None:
+      self.hold(topic, msg, qos, retained)
+      if self.awake:
+        self.deliver()
+    else:
+      self.transmit(topic, msg, qos, retained)
 
-  def publishArrived(self, topic, msg, qos, retained=False):
+  def transmit(self, topic, msg, qos, retained):
     pub = MQTTSN.Publishes()
-    logger.info("[MQTT-3.2.3-3] topic name must match the subscription's topic filter")
-    pub.topicName = topic
-    pub.data = msg
-    pub.fh.QoS = qos
-    pub.fh.RETAIN = retained
+    conformance("[MQTT-3.2.3-3] topic name must match the subscription's topic filter")
+    topicId = self.topics.idOf(topic)
+    if topicId == None:
+      topicId = self.register(topic)
+      if topicId == None:
+        logger.error("%s: too many topics registered, publication to %s dropped", self.id, topic)
+        return
+      topicId = (MQTTSN.TopicIdTypes.NORMAL, topicId)
+    pub.Flags.TopicIdType, pub.TopicId = topicId
+    pub.Data = msg
+    pub.Flags.QoS = qos
+    pub.Flags.RETAIN = retained
     if retained:
-      logger.info("[MQTT-2.1.2-7] Last retained message on matching topics sent on subscribe")
-    if pub.fh.RETAIN:
-      logger.info("[MQTT-2.1.2-9] Set retained flag on retained messages")
-    if qos == 2:
-      pub.qos2state = "PUBREC"
+      conformance("[MQTT-2.1.2-7] Last retained message on matching topics sent on subscribe")
+    if pub.Flags.RETAIN:
+      conformance("[MQTT-2.1.2-9] Set retained flag on retained messages")
     if qos in [1, 2]:
-      pub.messageIdentifier = self.msgid
-      logger.debug("client id: %d msgid: %d", self.id, self.msgid)
-      if self.msgid == 65535:
-        self.msgid = 1
-      else:
-        self.msgid += 1
+      pub.MsgId = self.nextMsgid()
+      logger.debug("client id: %s msgid: %d", self.id, pub.MsgId)
       self.outbound.append(pub)
-      self.outmsgs[pub.messageIdentifier] = pub
-    logger.info("[MQTT-4.6.0-6] publish packets must be sent in order of receipt from any given client")
-    if self.connected:
-      respond(self.socket, pub)
+      self.outmsgs[pub.MsgId] = pub
+      if self.awake:
+        self.wakeInflight.add(pub.MsgId)
+    conformance("[MQTT-4.6.0-6] publish packets must be sent in order of receipt from any given client")
+    if self.connected or self.awake:
+      if self.isWaiting(pub):
+        self.waiting[pub.TopicId].append(pub)
+      else:
+        self.send(pub)
     else:
       if qos == 0 and not self.broker.dropQoS0:
         self.outbound.append(pub)
       if qos in [1, 2]:
-        logger.info("[MQTT-3.1.2-5] storing of QoS 1 and 2 messages for disconnected client %s", self.id)
+        conformance("[MQTT-3.1.2-5] storing of QoS 1 and 2 messages for disconnected client %s", self.id)
 
   def puback(self, msgid):
     if msgid in self.outmsgs.keys():
       pub = self.outmsgs[msgid]
-      if pub.fh.QoS == 1:
+      if pub.Flags.QoS == 1:
         self.outbound.remove(pub)
         del self.outmsgs[msgid]
+        self.acknowledged(msgid)
       else:
-        logger.error("%s: Puback received for msgid %d, but QoS is %d", self.id, msgid, pub.fh.QoS)
+        logger.error("%s: Puback received for msgid %d, but QoS is %d", self.id, msgid, pub.Flags.QoS)
     else:
       logger.error("%s: Puback received for msgid %d, but no message found", self.id, msgid)
 
@@ -129,14 +270,14 @@ class MQTTSNClients:
     rc = False
     if msgid in self.outmsgs.keys():
       pub = self.outmsgs[msgid]
-      if pub.fh.QoS == 2:
-        if pub.qos2state == "PUBREC":
-          pub.qos2state = "PUBCOMP"
+      if pub.Flags.QoS == 2:
+        if msgid not in self.pubrecs:
+          self.pubrecs.add(msgid)
           rc = True
         else:
           logger.error("%s: Pubrec received for msgid %d, but message in wrong state", self.id, msgid)
       else:
-        logger.error("%s: Pubrec received for msgid %d, but QoS is %d", self.id, msgid, pub.fh.QoS)
+        logger.error("%s: Pubrec received for msgid %d, but QoS is %d", self.id, msgid, pub.Flags.QoS)
     else:
       logger.error("%s: Pubrec received for msgid %d, but no message found", self.id, msgid)
     return rc
@@ -144,30 +285,27 @@ class MQTTSNClients:
   def pubcomp(self, msgid):
     if msgid in self.outmsgs.keys():
       pub = self.outmsgs[msgid]
-      if pub.fh.QoS == 2:
-        if pub.qos2state == "PUBCOMP":
+      if pub.Flags.QoS == 2:
+        if msgid in self.pubrecs:
+          self.pubrecs.discard(msgid)
           self.outbound.remove(pub)
           del self.outmsgs[msgid]
+          self.acknowledged(msgid)
         else:
           logger.error("Pubcomp received for msgid %d, but message in wrong state", msgid)
       else:
-        logger.error("Pubcomp received for msgid %d, but QoS is %d", msgid, pub.fh.QoS)
+        logger.error("Pubcomp received for msgid %d, but QoS is %d", msgid, pub.Flags.QoS)
     else:
       logger.error("Pubcomp received for msgid %d, but no message found", msgid)
 
   def pubrel(self, msgid):
     rc = None
     if self.broker.publish_on_pubrel:
-      if msgid in self.inbound.keys():
-        pub = self.inbound[msgid]
-        if pub.fh.QoS == 2:
-          rc = pub
-        else:
-          logger.error("Pubrec received for msgid %d, but QoS is %d", msgid, pub.fh.QoS)
+      rc = self.inbound.get(msgid)
     else:
       rc = msgid in self.inbound
     if not rc:
-      logger.error("Pubrec received for msgid %d, but no message found", msgid)
+      logger.error("Pubrel received for msgid %d, but no message found", msgid)
     return rc
 
 
@@ -177,15 +315,25 @@ class MQTTSNBrokers:
     overlapping_single=True,
     dropQoS0=True,
     zero_length_clientids=True,
+    predefined_topics={},
+    sleep_buffer_maximum=100,
+    sleep_buffer_bytes=65536,
+    sleep_burst=10,
     lock=None, sharedData={}):
 
     # optional behaviours
     self.publish_on_pubrel = publish_on_pubrel
     self.dropQoS0 = dropQoS0                    # don't queue QoS 0 messages for disconnected clients
     self.zero_length_clientids = zero_length_clientids
+    self.predefined = Predefined(predefined_topics) # topic ids configured for all clients
+    self.sleep_buffer_maximum = sleep_buffer_maximum # messages held for each sleeping client
+    self.sleep_buffer_bytes = sleep_buffer_bytes     # bytes of topics and payloads held for each
+    self.sleep_burst = sleep_burst                   # QoS 1 and 2 messages unacknowledged on waking
 
     self.broker = Brokers(overlapping_single, sharedData=sharedData)
     self.clients = {}   # socket -> clients
+    self.sleeping = {}  # clientid -> sleeping clients, which can wake from another address
+    self.nextSweep = 0  # time to look for sleeping clients which haven't woken
     if lock:
       logger.info("Using shared lock %d", id(lock))
       self.lock = lock
@@ -197,10 +345,13 @@ class MQTTSNBrokers:
     logger.info("Optional behaviour, single publish on overlapping topics: %s", self.broker.overlapping_single)
     logger.info("Optional behaviour, drop QoS 0 publications to disconnected clients: %s", self.dropQoS0)
     logger.info("Optional behaviour, support zero length clientids: %s", self.zero_length_clientids)
+    logger.info("Predefined topics: %d", len(self.predefined.names))
+    logger.info("Sleeping clients: %d messages or %d bytes held, %d sent at a time on waking",
+                self.sleep_buffer_maximum, self.sleep_buffer_bytes, self.sleep_burst)
 
   def shutdown(self):
-    # do we need to do anything here?
-    pass
+    if self.broker.gateway:
+      self.broker.gateway.shutdown()
   
   def setBroker3(self, broker3):
     self.broker.setBroker3(broker3.broker)
@@ -211,6 +362,7 @@ class MQTTSNBrokers:
   def reinitialize(self):
     logger.info("Reinitializing broker")
     self.clients = {}
+    self.sleeping = {}
     self.broker.reinitialize()
 
   def handleRequest(self, raw_packet, client_address, callback):
@@ -218,9 +370,10 @@ class MQTTSNBrokers:
     self.lock.acquire()
     terminate = False
     try:
+      self.expireSleepers()
       if raw_packet == None:
         # will message
-        self.disconnect(sock, None, terminate=True)
+        self.disconnect(client_address, None, terminate=True)
         terminate = True
       else:
         packet = MQTTSN.unpackPacket(raw_packet)
@@ -234,9 +387,11 @@ class MQTTSNBrokers:
 
   def handlePacket(self, packet, sock, callback):
     terminate = False
-    logger.debug("in: "+str(packet))
+    if guards.debug:
+      logger.debug("in: %s", packet)
     if sock not in self.clients.keys() and not isinstance(packet, MQTTSN.Connects) and not \
-      (isinstance(packet, MQTTSN.Publishes) and packet.Flags.QoS == -1):
+      (isinstance(packet, MQTTSN.Publishes) and packet.Flags.QoS == -1) and not \
+      (isinstance(packet, MQTTSN.Pingreqs) and packet.ClientId):
       #print(self.clients.keys(), sock)
       self.disconnect(sock, packet)
       raise MQTTSN.MQTTSNException("[MQTT-3.1.0-1] Connect was not first packet on socket")
@@ -250,201 +405,288 @@ class MQTTSNBrokers:
 
   def connect(self, sock, packet, callback):
     if packet.ProtocolId != 1:
-      logger.error("[MQTT-3.1.2-2] Wrong protocol version %d", packet.ProtocolVersion)
+      logger.error("[MQTT-3.1.2-2] Wrong protocol id %d", packet.ProtocolId)
       resp = MQTTSN.Connacks()
-      resp.ReturnCode = 1
+      resp.ReturnCode = MQTTSN.ReturnCodes.REJECTED_NOT_SUPPORTED
       respond(sock, callback, resp)
-      logger.info("[MQTT-3.2.2-5] must close connection after non-zero connack")
+      conformance("[MQTT-3.2.2-5] must close connection after non-zero connack")
       self.disconnect(sock, None)
-      logger.info("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
+      conformance("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
       return
-    if sock in self.clients.keys():    # is socket is already connected?
+    if sock in self.clients.keys() and self.clients[sock].sleepUntil == None: # is socket is already connected?
       self.disconnect(sock, None)
-      logger.info("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
+      conformance("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
       raise MQTTSN.MQTTSNException("[MQTT-3.1.0-2] Second connect packet")
     if len(packet.ClientId) == 0:
-      if self.zero_length_clientids == False or packet.CleanSession == False:
+      if self.zero_length_clientids == False or packet.Flags.CleanSession == False:
         if self.zero_length_clientids:
-          logger.info("[MQTT-3.1.3-8] Reject 0-length clientid with cleansession false")
-        logger.info("[MQTT-3.1.3-9] if clientid is rejected, must send connack 2 and close connection")
+          conformance("[MQTT-3.1.3-8] Reject 0-length clientid with cleansession false")
+        conformance("[MQTT-3.1.3-9] if clientid is rejected, must send connack 2 and close connection")
         resp = MQTTSN.Connacks()
-        resp.returnCode = 2
+        resp.ReturnCode = MQTTSN.ReturnCodes.REJECTED_NOT_SUPPORTED
         respond(sock, callback, resp)
-        logger.info("[MQTT-3.2.2-5] must close connection after non-zero connack")
+        conformance("[MQTT-3.2.2-5] must close connection after non-zero connack")
         self.disconnect(sock, None)
-        logger.info("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
+        conformance("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
         return
       else:
-        logger.info("[MQTT-3.1.3-7] 0-length clientid must have cleansession true")
-        packet.ClientId = uuid.uuid4() # give the client a unique clientid
-        logger.info("[MQTT-3.1.3-6] 0-length clientid must be assigned a unique id %s", packet.ClientId)
-    logger.info("[MQTT-3.1.3-5] Clientids of 1 to 23 chars and ascii alphanumeric must be allowed")
+        conformance("[MQTT-3.1.3-7] 0-length clientid must have cleansession true")
+        packet.ClientId = str(uuid.uuid4()) # give the client a unique clientid
+        conformance("[MQTT-3.1.3-6] 0-length clientid must be assigned a unique id %s", packet.ClientId)
+    conformance("[MQTT-3.1.3-5] Clientids of 1 to 23 chars and ascii alphanumeric must be allowed")
     if packet.ClientId in [client.id for client in self.clients.values()]: # is this client already connected on a different socket?
       for s in self.clients.keys():
         if self.clients[s].id == packet.ClientId:
-          logger.info("[MQTT-3.1.4-2] Disconnecting old client %s", packet.ClientId)
+          conformance("[MQTT-3.1.4-2] Disconnecting old client %s", packet.ClientId)
           self.disconnect(s, None)
           break
     me = None
     if not packet.Flags.CleanSession:
       me = self.broker.getClient(packet.ClientId) # find existing state, if there is any
       if me:
-        logger.info("[MQTT-3.1.3-2] clientid used to retrieve client state")
+        conformance("[MQTT-3.1.3-2] clientid used to retrieve client state")
     resp = MQTTSN.Connacks()
     if me == None:
-      me = MQTTSNClients(packet.ClientId, packet.Flags.CleanSession, packet.Duration, sock, self)
+      me = MQTTSNClients(packet.ClientId, packet.Flags.CleanSession, packet.Duration, sock, callback, self)
     else:
       me.socket = sock # set existing client state to new socket
+      me.callback = callback
       me.cleansession = packet.Flags.CleanSession
       me.keepalive = packet.Duration
-    logger.info("[MQTT-4.1.0-1] server must store data for at least as long as the network connection lasts")
+    conformance("[MQTT-4.1.0-1] server must store data for at least as long as the network connection lasts")
     self.clients[sock] = me
     #me.will = (packet.WillTopic, packet.WillQoS, packet.WillMessage, packet.WillRETAIN) if packet.WillFlag else None
     self.broker.connect(me)
-    logger.info("[MQTT-3.2.0-1] the first response to a client must be a connack")
-    resp.ReturnCode = 0
+    conformance("[MQTT-3.2.0-1] the first response to a client must be a connack")
+    resp.ReturnCode = MQTTSN.ReturnCodes.ACCEPTED
     respond(sock, callback, resp)
     me.resend()
+    me.flush() # any messages held while it was asleep
 
-  def disconnect(self, sock, packet, terminate=False):
-    logger.info("[MQTT-3.14.4-2] Client must not send any more packets after disconnect")
+  def disconnect(self, sock, packet, callback=None, terminate=False):
+    "packet is the disconnect received from the client, or None"
+    if isinstance(packet, MQTTSN.Disconnects) and packet.Duration != None and sock in self.clients.keys():
+      self.sleep(sock, packet.Duration, callback)
+      return
+    conformance("[MQTT-3.14.4-2] Client must not send any more packets after disconnect")
     if sock in self.clients.keys():
+      me = self.clients[sock]
+      if self.sleeping.get(me.id) == me:
+        del self.sleeping[me.id]
       if terminate:
-        self.broker.terminate(self.clients[sock].id)
+        self.broker.terminate(me.id)
       else:
-        self.broker.disconnect(self.clients[sock].id)
+        self.broker.disconnect(me.id)
       del self.clients[sock]
+    if isinstance(packet, MQTTSN.Disconnects) and callback:
+      respond(sock, callback, MQTTSN.Disconnects())
+
+  def sleep(self, sock, duration, callback):
+    "the client keeps its session, and the messages for it are held until it wakes"
+    me = self.clients[sock]
+    logger.debug("%s: asleep for %d seconds", me.id, duration)
+    me.sleep(duration)
+    self.sleeping[me.id] = me
+    respond(sock, callback, MQTTSN.Disconnects())
+
+  def wake(self, sock, clientid, callback):
+    me = self.sleeping.get(clientid)
+    if me == None:
+      logger.error("Pingreq from %s to wake client %s, which is not asleep", sock, clientid)
+      return
+    if me.socket != sock: # woken at a new address
+      if self.clients.get(me.socket) == me:
+        del self.clients[me.socket]
+      if sock in self.clients.keys():
+        self.disconnect(sock, None)
+      self.clients[sock] = me
+      me.socket = sock
+    me.callback = callback
+    logger.debug("%s: awake, %d messages held", me.id, len(me.held))
+    me.wake()
+
+  def expireSleepers(self):
+    "sleeping clients which haven't woken in time are lost, at most once a second"
+    now = time.monotonic()
+    if now < self.nextSweep:
+      return
+    self.nextSweep = now + 1
+    for me in [me for me in self.sleeping.values() if now > me.sleepUntil]:
+      logger.info("%s: did not wake within %d seconds", me.id, me.sleepDuration)
+      if self.clients.get(me.socket) == me:
+        self.disconnect(me.socket, None, terminate=True)
+      else:
+        del self.sleeping[me.id]
+      me.sleepUntil = None
 
   def disconnectAll(self, sock):
     for sock in self.clients.keys():
       self.disconnect(sock, None)
 
-  def subscribe(self, sock, packet):
-    topics = []
-    qoss = []
-    respqoss = []
-    for p in packet.data:
-      if p[0] == "test/nosubscribe":
-        respqoss.append(0x80)
-      else:
-        if p[0] == "test/QoS 1 only":
-          respqoss.append(min(1), p[1])
-        elif p[0] == "test/QoS 0 only":
-          respqoss.append(min(0), p[1])
-        else:
-          respqoss.append(p[1])
-        topics.append(p[0])
-        qoss.append(respqoss[-1])
-    if len(topics) > 0:
-      self.broker.subscribe(self.clients[sock].id, topics, qoss)
+  def topicOf(self, sock, packet):
+    "the topic name or filter of a subscribe or unsubscribe, or None if the topic id isn't predefined"
+    if packet.Flags.TopicIdType == MQTTSN.TopicIdTypes.PREDEFINED:
+      return self.predefined.names.get(packet.TopicId)
+    return packet.TopicName
+
+  def register(self, sock, packet, callback):
+    resp = MQTTSN.Regacks()
+    resp.MsgId = packet.MsgId
+    topicId = self.clients[sock].topics.register(packet.TopicName)
+    if topicId == None:
+      resp.ReturnCode = MQTTSN.ReturnCodes.REJECTED_CONGESTION
+    else:
+      resp.TopicId = topicId
+    respond(sock, callback, resp)
+
+  def regack(self, sock, packet, callback):
+    self.clients[sock].regack(packet.MsgId, packet.ReturnCode)
+
+  def subscribe(self, sock, packet, callback):
+    me = self.clients[sock]
     resp = MQTTSN.Subacks()
-    logger.info("[MQTT-2.3.1-7][MQTT-3.8.4-2] Suback has same message id as subscribe")
-    logger.info("[MQTT-3.8.4-1] Must respond with suback")
-    resp.messageIdentifier = packet.messageIdentifier
-    logger.info("[MQTT-3.8.4-5] return code must be returned for each topic in subscribe")
-    logger.info("[MQTT-3.9.3-1] the order of return codes must match order of topics in subscribe")
-    resp.data = respqoss
-    respond(sock, resp)
-
-  def unsubscribe(self, sock, packet):
-    self.broker.unsubscribe(self.clients[sock].id, packet.data)
+    conformance("[MQTT-2.3.1-7][MQTT-3.8.4-2] Suback has same message id as subscribe")
+    conformance("[MQTT-3.8.4-1] Must respond with suback")
+    resp.MsgId = packet.MsgId
+    topic = self.topicOf(sock, packet)
+    if topic == None:
+      resp.ReturnCode = MQTTSN.ReturnCodes.REJECTED_INVALID_TOPIC_ID
+      respond(sock, callback, resp)
+      return
+    if packet.Flags.TopicIdType == MQTTSN.TopicIdTypes.PREDEFINED:
+      resp.TopicId = packet.TopicId
+    elif packet.Flags.TopicIdType == MQTTSN.TopicIdTypes.NORMAL and \
+        "+" not in topic and "#" not in topic:
+      topicId = me.topics.register(topic)
+      if topicId == None:
+        resp.ReturnCode = MQTTSN.ReturnCodes.REJECTED_CONGESTION
+        respond(sock, callback, resp)
+        return
+      resp.TopicId = topicId
+    qos = max(packet.Flags.QoS, 0)
+    resp.Flags.QoS = qos
+    # the suback goes before any retained messages, whose topic ids the client needs first
+    respond(sock, callback, resp)
+    self.broker.subscribe(me.id, [topic], [qos])
+
+  def unsubscribe(self, sock, packet, callback):
+    topic = self.topicOf(sock, packet)
+    if topic != None:
+      self.broker.unsubscribe(self.clients[sock].id, [topic])
     resp = MQTTSN.Unsubacks()
-    logger.info("[MQTT-2.3.1-7] Unsuback has same message id as unsubscribe")
-    logger.info("[MQTT-3.10.4-4] Unsuback must be sent - same message id as unsubscribe")
+    conformance("[MQTT-2.3.1-7] Unsuback has same message id as unsubscribe")
+    conformance("[MQTT-3.10.4-4] Unsuback must be sent - same message id as unsubscribe")
     me = self.clients[sock]
     if len(me.outbound) > 0:
-      logger.info("[MQTT-3.10.4-3] sending unsuback has no effect on outward inflight messages")
-    resp.messageIdentifier = packet.messageIdentifier
-    respond(sock, resp)
+      conformance("[MQTT-3.10.4-3] sending unsuback has no effect on outward inflight messages")
+    resp.MsgId = packet.MsgId
+    respond(sock, callback, resp)
 
   def publish(self, sock, packet, callback):
-    if packet.Flags.QoS == -1:
-      if packet.Flags.TopicIdType == 2:
-        topic = MQTTSN.writeInt16(packet.TopicId).decode()
-        logger.debug("topic %s", topic)
+    if packet.Flags.QoS == -1: # no connection, so only predefined and short topic ids
+      if packet.Flags.TopicIdType == MQTTSN.TopicIdTypes.NORMAL:
+        logger.error("QoS -1 publish with normal topic id %d from %s", packet.TopicId, sock)
+        return
+      topic = self.predefined.names.get(packet.TopicId) \
+        if packet.Flags.TopicIdType == MQTTSN.TopicIdTypes.PREDEFINED else shortNameOf(packet.TopicId)
+      if topic == None:
+        logger.error("QoS -1 publish with unknown topic id %d from %s", packet.TopicId, sock)
+        return
       self.broker.publish("QoS -1", # no clientid for QoS -1
              topic, packet.Data, 0, packet.Flags.RETAIN)
-    elif packet.Flags.QoS == 0:
-      if packet.Flags.TopicIdType == 2:
-        topic = MQTTSN.writeInt16(packet.TopicId).decode()
-        logger.debug("topic %s", topic)
-      self.broker.publish(self.clients[sock].id,
-             topic, packet.Data, packet.Flags.QoS, packet.Flags.RETAIN)
-    elif packet.fh.QoS == 1:
-      if packet.fh.DUP:
-        logger.info("[MQTT-3.3.1-3] Incoming publish DUP 1 ==> outgoing publish with DUP 0")
-        logger.info("[MQTT-4.3.2-2] server must store message in accordance with QoS 1")
-      self.broker.publish(self.clients[sock].id,
-             packet.topicName, packet.data, packet.fh.QoS, packet.fh.RETAIN)
+      return
+    myclient = self.clients[sock]
+    topic = myclient.topics.topicOf(packet.Flags.TopicIdType, packet.TopicId)
+    if topic == None:
       resp = MQTTSN.Pubacks()
-      logger.info("[MQTT-2.3.1-6] puback messge id same as publish")
-      resp.messageIdentifier = packet.messageIdentifier
+      resp.TopicId = packet.TopicId
+      resp.MsgId = packet.MsgId
+      resp.ReturnCode = MQTTSN.ReturnCodes.REJECTED_INVALID_TOPIC_ID
       respond(sock, callback, resp)
-    elif packet.fh.QoS == 2:
-      myclient = self.clients[sock]
+      return
+    if packet.Flags.QoS == 0:
+      self.broker.publish(myclient.id, topic, packet.Data, packet.Flags.QoS, packet.Flags.RETAIN)
+    elif packet.Flags.QoS == 1:
+      if packet.Flags.DUP:
+        conformance("[MQTT-3.3.1-3] Incoming publish DUP 1 ==> outgoing publish with DUP 0")
+        conformance("[MQTT-4.3.2-2] server must store message in accordance with QoS 1")
+      self.broker.publish(myclient.id, topic, packet.Data, packet.Flags.QoS, packet.Flags.RETAIN)
+      resp = MQTTSN.Pubacks()
+      conformance("[MQTT-2.3.1-6] puback messge id same as publish")
+      resp.TopicId = packet.TopicId
+      resp.MsgId = packet.MsgId
+      respond(sock, callback, resp)
+    elif packet.Flags.QoS == 2:
       if self.publish_on_pubrel:
-        if packet.messageIdentifier in myclient.inbound.keys():
-          if packet.fh.DUP == 0:
-            logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.messageIdentifier)
+        if packet.MsgId in myclient.inbound.keys():
+          if not packet.Flags.DUP:
+            logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.MsgId)
           else:
-            logger.info("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
+            conformance("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
         else:
-          myclient.inbound[packet.messageIdentifier] = packet
+          myclient.inbound[packet.MsgId] = (topic, packet.Data, packet.Flags.RETAIN)
       else:
-        if packet.messageIdentifier in myclient.inbound:
-          if packet.fh.DUP == 0:
-            logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.messageIdentifier)
+        if packet.MsgId in myclient.inbound:
+          if not packet.Flags.DUP:
+            logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.MsgId)
           else:
-            logger.info("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
+            conformance("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
         else:
-          myclient.inbound.append(packet.messageIdentifier)
-          logger.info("[MQTT-4.3.3-2] server must store message in accordance with QoS 2")
-          self.broker.publish(myclient, packet.topicName, packet.data, packet.fh.QoS, packet.fh.RETAIN)
+          myclient.inbound.append(packet.MsgId)
+          conformance("[MQTT-4.3.3-2] server must store message in accordance with QoS 2")
+          self.broker.publish(myclient.id, topic, packet.Data, packet.Flags.QoS, packet.Flags.RETAIN)
       resp = MQTTSN.Pubrecs()
-      logger.info("[MQTT-2.3.1-6] pubrec messge id same as publish")
-      resp.messageIdentifier = packet.messageIdentifier
+      conformance("[MQTT-2.3.1-6] pubrec messge id same as publish")
+      resp.MsgId = packet.MsgId
       respond(sock, callback, resp)
 
-  def pubrel(self, sock, packet):
+  def pubrel(self, sock, packet, callback):
     myclient = self.clients[sock]
-    pub = myclient.pubrel(packet.messageIdentifier)
+    pub = myclient.pubrel(packet.MsgId)
     if pub:
       if self.publish_on_pubrel:
-        self.broker.publish(myclient.id, pub.topicName, pub.data, pub.fh.QoS, pub.fh.RETAIN)
-        del myclient.inbound[packet.messageIdentifier]
+        topic, data, retained = pub
+        self.broker.publish(myclient.id, topic, data, 2, retained)
+        del myclient.inbound[packet.MsgId]
       else:
-        myclient.inbound.remove(packet.messageIdentifier)
+        myclient.inbound.remove(packet.MsgId)
     resp = MQTTSN.Pubcomps()
-    logger.info("[MQTT-2.3.1-6] pubcomp messge id same as publish")
-    resp.messageIdentifier = packet.messageIdentifier
-    respond(sock, resp)
+    conformance("[MQTT-2.3.1-6] pubcomp messge id same as publish")
+    resp.MsgId = packet.MsgId
+    respond(sock, callback, resp)
 
-  def pingreq(self, sock, packet):
+  def pingreq(self, sock, packet, callback):
+    if packet.ClientId:
+      self.wake(sock, packet.ClientId, callback) # which sends the pingresp once the messages held are sent
+      return
     resp = MQTTSN.Pingresps()
-    logger.info("[MQTT-3.12.4-1] sending pingresp in response to pingreq")
-    respond(sock, resp)
+    conformance("[MQTT-3.12.4-1] sending pingresp in response to pingreq")
+    respond(sock, callback, resp)
 
-  def puback(self, sock, packet):
+  def puback(self, sock, packet, callback):
     "confirmed reception of qos 1"
-    self.clients[sock].puback(packet.messageIdentifier)
+    if packet.ReturnCode == MQTTSN.ReturnCodes.REJECTED_INVALID_TOPIC_ID and \
+        packet.TopicId in self.clients[sock].topics.names:
+      logger.error("%s: topic id %d rejected by the client", self.clients[sock].id, packet.TopicId)
+    self.clients[sock].puback(packet.MsgId)
 
-  def pubrec(self, sock, packet):
+  def pubrec(self, sock, packet, callback):
     "confirmed reception of qos 2"
     myclient = self.clients[sock]
-    if myclient.pubrec(packet.messageIdentifier):
-      logger.info("[MQTT-3.5.4-1] must reply with pubrel in response to pubrec")
+    if myclient.pubrec(packet.MsgId):
+      conformance("[MQTT-3.5.4-1] must reply with pubrel in response to pubrec")
       resp = MQTTSN.Pubrels()
-      resp.messageIdentifier = packet.messageIdentifier
-      respond(sock, resp)
+      resp.MsgId = packet.MsgId
+      respond(sock, callback, resp)
 
-  def pubcomp(self, sock, packet):
+  def pubcomp(self, sock, packet, callback):
     "confirmed reception of qos 2"
-    self.clients[sock].pubcomp(packet.messageIdentifier)
+    self.clients[sock].pubcomp(packet.MsgId)
 
   def keepalive(self, sock):
     if sock in self.clients.keys():
       client = self.clients[sock]
       if client.keepalive > 0 and time.time() - client.lastPacket > client.keepalive * 1.5:
         # keep alive timeout
-        logger.info("[MQTT-3.1.2-22] keepalive timeout for client %s", client.id)
+        conformance("[MQTT-3.1.2-22] keepalive timeout for client %s", client.id)
         self.disconnect(sock, None, terminate=True)
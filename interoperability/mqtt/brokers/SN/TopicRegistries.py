@@ -0,0 +1,124 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+The topic ids an MQTT-SN client publishes and receives messages with, in place of
+topic names:
+
+  normal      registered by the client with REGISTER, or by the broker before it sends
+              the client a message on a new topic, for the life of the session
+  predefined  the same for all clients, from the broker configuration:
+                predefined_topic 1 sensors/temperature
+  short name  a topic name of two characters, sent as the id itself.  Each byte of the
+              id is one character (latin-1), so that any id has a topic name
+
+Each is looked up in a dictionary, so the broker doesn't build a topic name for each
+publication.
+
+"""
+
+from mqtt.formats import MQTTSN
+
+MAXIMUM = 1000 # topics registered for each client
+
+class Predefined:
+  "the predefined topics, shared by all clients"
+
+  def __init__(self, topics={}):
+    self.names = {} # id -> name
+    self.ids = {}   # name -> id
+    for topicId, name in topics.items():
+      self.add(topicId, name)
+
+  def add(self, topicId, name):
+    if topicId < 1 or topicId > 65534:
+      raise ValueError("Predefined topic id %d must be from 1 to 65534" % topicId)
+    self.names[topicId] = name
+    self.ids[name] = topicId
+
+
+shortNames = {} # short topic id -> topic name, as they are seen
+
+def shortNameOf(topicId):
+  name = shortNames.get(topicId)
+  if name == None:
+    name = shortNames[topicId] = MQTTSN.writeInt16(topicId).decode("latin-1")
+  return name
+
+def shortIdOf(name):
+  "the short topic id for name, or None if it isn't two latin-1 characters"
+  try:
+    data = name.encode("latin-1")
+  except UnicodeEncodeError:
+    return None
+  return MQTTSN.readInt16(data) if len(data) == 2 else None
+
+
+class TopicRegistries:
+  "the topic ids of one client"
+
+  def __init__(self, predefined, maximum=MAXIMUM):
+    self.predefined = predefined
+    self.maximum = maximum
+    self.names = {} # id -> name, registered by the client or the broker
+    self.ids = {}   # name -> id
+    self.nextId = 1
+
+  def register(self, name):
+    "the id for name, registering it if it's new, or None if the client has too many"
+    topicId = self.ids.get(name)
+    if topicId == None:
+      if len(self.names) >= self.maximum:
+        return None
+      while self.nextId in self.names or self.nextId in self.predefined.names:
+        self.nextId = self.nextId % 65534 + 1
+      topicId = self.nextId
+      self.nextId = self.nextId % 65534 + 1
+      self.names[topicId] = name
+      self.ids[name] = topicId
+    return topicId
+
+  def unregister(self, topicId):
+    name = self.names.pop(topicId, None)
+    if name != None:
+      del self.ids[name]
+
+  def topicOf(self, topicIdType, topicId):
+    "the topic name for a topic id received, or None if it isn't known"
+    if topicIdType == MQTTSN.TopicIdTypes.NORMAL:
+      return self.names.get(topicId)
+    if topicIdType == MQTTSN.TopicIdTypes.PREDEFINED:
+      return self.predefined.names.get(topicId)
+    if topicIdType == MQTTSN.TopicIdTypes.SHORT_NAME:
+      return shortNameOf(topicId)
+    return None
+
+  def idOf(self, name):
+    "(topic id type, topic id) to send name with, or None if it has to be registered first"
+    topicId = self.predefined.ids.get(name)
+    if topicId != None:
+      return MQTTSN.TopicIdTypes.PREDEFINED, topicId
+    topicId = self.ids.get(name)
+    if topicId != None:
+      return MQTTSN.TopicIdTypes.NORMAL, topicId
+    topicId = shortIdOf(name) if len(name) == 2 else None
+    if topicId != None:
+      return MQTTSN.TopicIdTypes.SHORT_NAME, topicId
+    return None
+
@@ -1,6 +1,6 @@
 """
 *******************************************************************
-  Copyright (c) 2013, 2018 IBM Corp.
+  Copyright (c) 2013, 2026 IBM Corp.
  
   All rights reserved. This program and the accompanying materials
   are made available under the terms of the Eclipse Public License v1.0
@@ -20,6 +20,8 @@ import types, time, logging
 
 from . import Topics
 from .SubscriptionEngines import SubscriptionEngines
+from mqtt.brokers.persistence.SessionStores import NEVER
+from mqtt.brokers.coverage import conformance
 
 logger = logging.getLogger('MQTT broker')
  
@@ -31,10 +33,20 @@ class Brokers:
     self.__clients = {} # clientid -> client
     self.overlapping_single = overlapping_single
     self.__broker5 = None
+    self.__brokerSN = None
+    self.cluster = None
+    self.store = None # session store, for persistence
+    self.fanout = None # histogram of the numbers of subscribers publications are sent to
 
   def setBroker5(self, broker5):
     self.__broker5 = broker5
 
+  def setBrokerSN(self, brokerSN):
+    self.__brokerSN = brokerSN
+
+  def setCluster(self, cluster):
+    self.cluster = cluster
+
   def reinitialize(self):
     self.__clients = {}
     self.se.reinitialize()
@@ -48,8 +60,14 @@ class Brokers:
   def cleanSession(self, aClientid):
     "clear any outstanding subscriptions and publications"
     if len(self.se.getRetainedTopics("#")) > 0:
-      logger.info("[MQTT-3.1.2-7] retained messages not cleaned up as part of session state for client %s", aClientid)
+      conformance("[MQTT-3.1.2-7] retained messages not cleaned up as part of session state for client %s", aClientid)
     self.se.clearSubscriptions(aClientid)
+    if self.store:
+      self.store.closeSession(aClientid)
+
+  def restoreClient(self, aClient):
+    "add the state of a disconnected client, read from persistent storage"
+    self.__clients[aClient.id] = aClient
 
   def connect(self, aClient):
     aClient.connected = True
@@ -65,12 +83,12 @@ class Brokers:
     "Abrupt disconnect which also causes a will msg to be sent out"
     if aClientid in self.__clients.keys() and self.__clients[aClientid].connected:
       if self.__clients[aClientid].will != None:
-        logger.info("[MQTT-3.1.2-8] sending will message for client %s", aClientid)
+        conformance("[MQTT-3.1.2-8] sending will message for client %s", aClientid)
         willtopic, willQoS, willmsg, willRetain = self.__clients[aClientid].will
         if willRetain:
-          logger.info("[MQTT-3.1.2-17] sending will message retained for client %s", aClientid)
+          conformance("[MQTT-3.1.2-17] sending will message retained for client %s", aClientid)
         else:
-          logger.info("[MQTT-3.1.2-16] sending will message non-retained for client %s", aClientid)
+          conformance("[MQTT-3.1.2-16] sending will message non-retained for client %s", aClientid)
         self.publish(aClientid, willtopic, willmsg, willQoS, willRetain, time.monotonic())
       self.disconnect(aClientid)
 
@@ -78,18 +96,20 @@ class Brokers:
     if aClientid in self.__clients.keys():
       self.__clients[aClientid].connected = False
       if self.__clients[aClientid].cleansession:
-        logger.info("[MQTT-3.1.2-6] broker must discard the session data for client %s", aClientid)
+        conformance("[MQTT-3.1.2-6] broker must discard the session data for client %s", aClientid)
         self.cleanSession(aClientid)
         del self.__clients[aClientid]
       else:
-        logger.info("[MQTT-3.1.2-4] broker must store the session data for client %s", aClientid)
+        conformance("[MQTT-3.1.2-4] broker must store the session data for client %s", aClientid)
+        if self.store and self.store.isDurable(aClientid):
+          self.store.endSession(aClientid, "V3", NEVER)
         try:
           self.__clients[aClientid].timestamp = time.clock() # time.clock is deprecated
         except:
           self.__clients[aClientid].timestamp = time.process_time()
         self.__clients[aClientid].connected = False 
-        logger.info("[MQTT-3.1.2-10] will message is deleted after use or disconnect, for client %s", aClientid)
-        logger.info("[MQTT-3.14.4-3] on receipt of disconnect, will message is deleted")
+        conformance("[MQTT-3.1.2-10] will message is deleted after use or disconnect, for client %s", aClientid)
+        conformance("[MQTT-3.14.4-3] on receipt of disconnect, will message is deleted")
         self.__clients[aClientid].will = None
 
   def disconnectAll(self):
@@ -100,31 +120,41 @@ class Brokers:
     """publish to all subscribed connected clients
        also to any disconnected non-cleansession clients with qos in [1,2]
     """
+    if self.cluster:
+      self.cluster.publish(topic, message, qos, retained, None)
+
     if retained:
-      logger.info("[MQTT-2.1.2-6] store retained message and QoS")
+      conformance("[MQTT-2.1.2-6] store retained message and QoS")
       self.se.setRetained(topic, message, qos, receivedTime)
     else:
-      logger.info("[MQTT-2.1.2-12] non-retained message - do not store")
+      conformance("[MQTT-2.1.2-12] non-retained message - do not store")
 
-    for subscriber in self.se.subscribers(topic):  # all subscribed clients
+    subscribers = self.se.subscribers(topic)
+    if self.fanout != None:
+      self.fanout.record(len(subscribers))
+    for subscriber in subscribers:  # all subscribed clients
       # qos is lower of publication and subscription
       if len(self.se.getSubscriptions(topic, subscriber)) > 1:
-        logger.info("[MQTT-3.3.5-1] overlapping subscriptions")
+        conformance("[MQTT-3.3.5-1] overlapping subscriptions")
       if retained:
-        logger.info("[MQTT-2.1.2-10] outgoing publish does not have retained flag set")
+        conformance("[MQTT-2.1.2-10] outgoing publish does not have retained flag set")
       if self.overlapping_single:   
         out_qos = min(self.se.qosOf(subscriber, topic), qos)
         if subscriber in self.__clients.keys(): 
-          self.__clients[subscriber].publishArrived(topic, message, out_qos)
+          self.__clients[subscriber].publishArrived(topic, message, out_qos, receivedTime=receivedTime)
+        elif self.__brokerSN and self.__brokerSN.getClient(subscriber):
+          self.__brokerSN.getClient(subscriber).publishArrived(topic, message, out_qos)
         else:
-          self.__broker5.getClient(subscriber).publishArrived(topic, message, out_qos, None, None)
+          self.__broker5.getClient(subscriber).publishArrived(topic, message, out_qos, None, receivedTime)
       else:
         for subscription in self.se.getSubscriptions(topic, subscriber):
           out_qos = min(subscription.getQoS(), qos)
           if subscriber in self.__clients.keys():         
-            self.__clients[subscriber].publishArrived(topic, message, out_qos)
+            self.__clients[subscriber].publishArrived(topic, message, out_qos, receivedTime=receivedTime)
+          elif self.__brokerSN and self.__brokerSN.getClient(subscriber):
+            self.__brokerSN.getClient(subscriber).publishArrived(topic, message, out_qos)
           else:
-            self.__broker5.getClient(subscriber).publishArrived(topic, message, out_qos, None, None)
+            self.__broker5.getClient(subscriber).publishArrived(topic, message, out_qos, None, receivedTime)
 
   def __doRetained__(self, aClientid, topic, qos):
     # topic can be single, or a list
@@ -22,19 +22,31 @@ import traceback, random, sys, string, copy, threading, logging, socket, time, u
 from mqtt.formats import MQTTV311 as MQTTV3
 
 from .Brokers import Brokers
+from mqtt.brokers.persistence.SessionStores import OUTBOUND, INBOUND, NEVER
+from mqtt.brokers.coverage import conformance
+from mqtt.brokers import guards
+from mqtt.brokers.monitoring import Statistics, Histograms
 
 logger = logging.getLogger('MQTT broker')
 
+counters = Statistics.Counters("mqtt311")
+
 def respond(sock, packet):
-  packet_string = str(packet)
-  if len(packet_string) > 256:
-    packet_string = packet_string[:255] + '...' + (' payload length:' + str(len(packet.data)) if hasattr(packet, "data") else "")
-  logger.debug("out: (%d) %s", sock.fileno(), packet_string)
+  if guards.debug:
+    packet_string = str(packet)
+    if len(packet_string) > 256:
+      packet_string = packet_string[:255] + '...' + (' payload length:' + str(len(packet.data)) if hasattr(packet, "data") else "")
+    logger.debug("out: (%d) %s", sock.fileno(), packet_string)
   if hasattr(sock, "handlePacket"):
     sock.handlePacket(packet)
   else:
+    started = time.perf_counter()
+    packed = packet.pack()
+    counters.encoding.record(time.perf_counter() - started)
+    counters.sent[packet.fh.MessageType] += 1
+    counters.bytesSent += len(packed)
     try:
-      sock.send(packet.pack()) # Could get socket error on send
+      sock.send(packed) # Could get socket error on send
     except:
       pass
 
@@ -56,46 +68,114 @@ class MQTTClients:
     self.will = None
     self.keepalive = keepalive
     self.lastPacket = None
+    self.inboundRefs = {} # inbound msgid -> session store reference
+    self.stored = False # are messages of a restored session still to be read from the store?
+    self.counted = True # are the messages counted in counters.inflight?
+
+  def durable(self):
+    "is this client's session state kept in the session store?"
+    return self.broker.store != None and self.broker.store.isDurable(self.id)
+
+  def storeUpdate(self, pub):
+    if getattr(pub, "storeRef", None) != None: # the session store reference of an outbound message
+      self.broker.store.update(pub.storeRef, pub.messageIdentifier, pub.qos2state)
+
+  def storeRemove(self, pub):
+    if getattr(pub, "storeRef", None) != None:
+      self.broker.store.remove(pub.storeRef)
+      pub.storeRef = None
+
+  def storeInbound(self, pub):
+    "store an inbound QoS 2 message, or just its msgid if it has been published already"
+    if self.durable():
+      if self.broker.publish_on_pubrel:
+        self.inboundRefs[pub.messageIdentifier] = self.broker.store.add(self.id, INBOUND,
+            pub.topicName, pub.data, None, pub.fh.QoS, pub.fh.RETAIN, pub.messageIdentifier)
+      else:
+        self.inboundRefs[pub.messageIdentifier] = self.broker.store.add(self.id, INBOUND,
+            None, None, None, pub.fh.QoS, False, pub.messageIdentifier)
+
+  def storeInboundRemove(self, msgid):
+    if msgid in self.inboundRefs:
+      self.broker.store.remove(self.inboundRefs.pop(msgid))
+
+  def loadStored(self):
+    "read the messages of a session restored at startup, when they are first needed"
+    if not self.stored:
+      return
+    self.stored = False
+    for (ref, direction, topic, payload, properties, qos, retained, msgid, state) in self.broker.store.messagesOf(self.id):
+      pub = None
+      if direction == OUTBOUND or self.broker.publish_on_pubrel:
+        pub = MQTTV3.Publishes()
+        pub.topicName = topic
+        pub.data = payload
+        pub.fh.QoS = qos
+        pub.fh.RETAIN = retained
+        pub.messageIdentifier = msgid
+      if direction == INBOUND:
+        if pub:
+          pub.receivedTime = time.monotonic()
+          self.inbound[msgid] = pub
+        else:
+          self.inbound.append(msgid)
+        self.inboundRefs[msgid] = ref
+        continue
+      if qos == 2:
+        pub.qos2state = state
+      pub.storeRef = ref
+      self.outbound.append(pub)
+      self.outmsgs[msgid] = pub
+      counters.inflight += 1
+      self.msgid = 1 if msgid == 65535 else msgid + 1
+
+  def discard(self):
+    "the session has ended, so its messages are no longer in flight"
+    if self.counted:
+      self.counted = False
+      counters.inflight -= len(self.outmsgs)
 
   def resend(self):
-    logger.debug("resending unfinished publications %s", str(self.outbound))
+    logger.debug("resending unfinished publications %s", self.outbound)
     if len(self.outbound) > 0:
-      logger.info("[MQTT-4.4.0-1] resending inflight QoS 1 and 2 messages")
+      conformance("[MQTT-4.4.0-1] resending inflight QoS 1 and 2 messages")
     for pub in self.outbound:
-      logger.debug("resending "+str(pub))
-      logger.info("[MQTT-4.4.0-2] dup flag must be set on in re-publish")
+      logger.debug("resending %s", pub)
+      conformance("[MQTT-4.4.0-2] dup flag must be set on in re-publish")
       if pub.fh.QoS == 0:
         respond(self.socket, pub)
       elif pub.fh.QoS == 1:
         pub.fh.DUP = 1
-        logger.info("[MQTT-2.1.2-3] Dup when resending QoS 1 publish id %d", pub.messageIdentifier)
-        logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
-        logger.info("[MQTT-4.3.2-1] Resending QoS 1 with DUP flag")
+        conformance("[MQTT-2.1.2-3] Dup when resending QoS 1 publish id %d", pub.messageIdentifier)
+        conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
+        conformance("[MQTT-4.3.2-1] Resending QoS 1 with DUP flag")
         respond(self.socket, pub)
       elif pub.fh.QoS == 2:
         if pub.qos2state == "PUBREC":
-          logger.info("[MQTT-2.1.2-3] Dup when resending QoS 2 publish id %d", pub.messageIdentifier)
+          conformance("[MQTT-2.1.2-3] Dup when resending QoS 2 publish id %d", pub.messageIdentifier)
           pub.fh.DUP = 1
-          logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
-          logger.info("[MQTT-4.3.3-1] Resending QoS 2 with DUP flag")
+          conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
+          conformance("[MQTT-4.3.3-1] Resending QoS 2 with DUP flag")
           respond(self.socket, pub)
         else:
           resp = MQTTV3.Pubrels()
-          logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
+          conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
           resp.messageIdentifier = pub.messageIdentifier
           respond(self.socket, resp)
 
-  def publishArrived(self, topic, msg, qos, retained=False):
+  def publishArrived(self, topic, msg, qos, retained=False, receivedTime=None):
+    self.loadStored() # so that message ids continue from the stored ones
     pub = MQTTV3.Publishes()
-    logger.info("[MQTT-3.2.3-3] topic name must match the subscription's topic filter")
+    conformance("[MQTT-3.2.3-3] topic name must match the subscription's topic filter")
     pub.topicName = topic
     pub.data = msg
     pub.fh.QoS = qos
     pub.fh.RETAIN = retained
+    pub.receivedTime = receivedTime
     if retained:
-      logger.info("[MQTT-2.1.2-7] Last retained message on matching topics sent on subscribe")
+      conformance("[MQTT-2.1.2-7] Last retained message on matching topics sent on subscribe")
     if pub.fh.RETAIN:
-      logger.info("[MQTT-2.1.2-9] Set retained flag on retained messages")
+      conformance("[MQTT-2.1.2-9] Set retained flag on retained messages")
     if qos == 2:
       pub.qos2state = "PUBREC"
     if qos in [1, 2]:
@@ -107,21 +187,37 @@ class MQTTClients:
         self.msgid += 1
       self.outbound.append(pub)
       self.outmsgs[pub.messageIdentifier] = pub
-    logger.info("[MQTT-4.6.0-6] publish packets must be sent in order of receipt from any given client")
+      counters.inflight += 1
+      if self.durable():
+        pub.storeRef = self.broker.store.add(self.id, OUTBOUND, topic, msg, None, qos, retained,
+            pub.messageIdentifier, pub.qos2state if qos == 2 else None)
+    conformance("[MQTT-4.6.0-6] publish packets must be sent in order of receipt from any given client")
     if self.connected:
       respond(self.socket, pub)
+      if not retained and receivedTime != None:
+        Histograms.latencies.delivered("mqtt311", qos, self.id, time.monotonic() - receivedTime)
     else:
       if qos == 0 and not self.broker.dropQoS0:
         self.outbound.append(pub)
+      elif qos == 0:
+        counters.dropped += 1
       if qos in [1, 2]:
-        logger.info("[MQTT-3.1.2-5] storing of QoS 1 and 2 messages for disconnected client %s", self.id)
+        conformance("[MQTT-3.1.2-5] storing of QoS 1 and 2 messages for disconnected client %s", self.id)
+
+  def acknowledged(self, pub):
+    receivedTime = getattr(pub, "receivedTime", None) # not kept for stored messages
+    if not (pub.fh.RETAIN or pub.fh.DUP) and receivedTime != None:
+      Histograms.latencies.acknowledged("mqtt311", pub.fh.QoS, time.monotonic() - receivedTime)
 
   def puback(self, msgid):
     if msgid in self.outmsgs.keys():
       pub = self.outmsgs[msgid]
       if pub.fh.QoS == 1:
+        self.acknowledged(pub)
         self.outbound.remove(pub)
         del self.outmsgs[msgid]
+        counters.inflight -= 1
+        self.storeRemove(pub)
       else:
         logger.error("%s: Puback received for msgid %d, but QoS is %d", self.id, msgid, pub.fh.QoS)
     else:
@@ -134,6 +230,7 @@ class MQTTClients:
       if pub.fh.QoS == 2:
         if pub.qos2state == "PUBREC":
           pub.qos2state = "PUBCOMP"
+          self.storeUpdate(pub)
           rc = True
         else:
           logger.error("%s: Pubrec received for msgid %d, but message in wrong state", self.id, msgid)
@@ -148,8 +245,11 @@ class MQTTClients:
       pub = self.outmsgs[msgid]
       if pub.fh.QoS == 2:
         if pub.qos2state == "PUBCOMP":
+          self.acknowledged(pub)
           self.outbound.remove(pub)
           del self.outmsgs[msgid]
+          counters.inflight -= 1
+          self.storeRemove(pub)
         else:
           logger.error("Pubcomp received for msgid %d, but message in wrong state", msgid)
       else:
@@ -191,6 +291,8 @@ class MQTTBrokers:
       setattr(self, key, options[key])
 
     self.broker = Brokers(self.overlapping_single, sharedData=sharedData)
+    self.broker.fanout = counters.fanout
+    self.store = None
     self.clients = {}   # socket -> clients
     if lock:
       logger.info("Using shared lock %d", id(lock))
@@ -207,17 +309,48 @@ class MQTTBrokers:
   def shutdown(self):
     self.disconnectAll()
 
+  def setBrokerSN(self, brokerSN):
+    self.broker.setBrokerSN(brokerSN.broker)
+
   def setBroker5(self, broker5):
     self.broker.setBroker5(broker5.broker)
 
+  def getStatistics(self):
+    "the numbers of clients and queued messages, for the $SYS topics"
+    connected = len(self.clients)
+    return {"clients/connected" : connected, "clients/disconnected" : len(self.broker.getClients()) - connected,
+            "messages/queued" : counters.queued + counters.inflight}
+
+  def setStore(self, store):
+    "use a session store, and restore the sessions held in it"
+    self.store = store
+    self.broker.store = store
+    count = 0
+    for clientid, expiry, elapsed in store.recover("V3"):
+      me = MQTTClients(clientid, False, 0, None, self)
+      me.stored = True # the messages are read when they are first needed
+      self.broker.restoreClient(me)
+      count += 1
+    logger.info("Restored %d MQTT 3.1.1 sessions", count)
+
+  def acknowledge(self, sock, packet):
+    "send an acknowledgement once the state changes it confirms are on disk"
+    if self.store:
+      self.store.afterSync(lambda: respond(sock, packet) if sock in self.clients else None)
+    else:
+      respond(sock, packet)
+
   def reinitialize(self):
     logger.info("Reinitializing broker")
     self.clients = {}
     self.broker.reinitialize()
+    counters.inflight = 0
 
   def handleRequest(self, sock):
     "this is going to be called from multiple threads, so synchronize"
+    started = time.perf_counter()
     self.lock.acquire()
+    Statistics.lockWaits.record(time.perf_counter() - started)
     terminate = False
     raw_packet = None
     try:
@@ -225,13 +358,18 @@ class MQTTBrokers:
         raw_packet = MQTTV3.getPacket(sock)
       except:
         pass # handled by raw_packet == None
+      if raw_packet != None:
+        counters.received[raw_packet[0] >> 4] += 1
+        counters.bytesReceived += len(raw_packet)
       if raw_packet == None:
-        logger.info("[MQTT-4.8.0-1] 'transient error' reading packet, closing connection")
+        conformance("[MQTT-4.8.0-1] 'transient error' reading packet, closing connection")
         # will message
         self.disconnect(sock, None, terminate=True)
         terminate = True
       else:
+        started = time.perf_counter()
         packet = MQTTV3.unpackPacket(raw_packet)
+        counters.decoding.record(time.perf_counter() - started)
         if packet:
           terminate = self.handlePacket(packet, sock)
         else:
@@ -242,10 +380,11 @@ class MQTTBrokers:
 
   def handlePacket(self, packet, sock):
     terminate = False
-    packet_string = str(packet)
-    if len(packet_string) > 256:
-      packet_string = packet_string[:255] + '...' + (' payload length:' + str(len(packet.data)) if hasattr(packet, "data") else "")
-    logger.debug("in: (%d) %s", sock.fileno(), packet_string)
+    if guards.debug:
+      packet_string = str(packet)
+      if len(packet_string) > 256:
+        packet_string = packet_string[:255] + '...' + (' payload length:' + str(len(packet.data)) if hasattr(packet, "data") else "")
+      logger.debug("in: (%d) %s", sock.fileno(), packet_string)
     if sock not in self.clients.keys() and packet.fh.MessageType != MQTTV3.CONNECT:
       self.disconnect(sock, packet)
       raise MQTTV3.MQTTException("[MQTT-3.1.0-1] Connect was not first packet on socket")
@@ -266,66 +405,75 @@ class MQTTBrokers:
       resp = MQTTV3.Connacks()
       resp.returnCode = 1
       respond(sock, resp)
-      logger.info("[MQTT-3.2.2-5] must close connection after non-zero connack")
+      conformance("[MQTT-3.2.2-5] must close connection after non-zero connack")
       self.disconnect(sock, None)
-      logger.info("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
+      conformance("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
       return
     if sock in self.clients.keys():    # is socket is already connected?
       self.disconnect(sock, None)
-      logger.info("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
+      conformance("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
       raise MQTTV3.MQTTException("[MQTT-3.1.0-2] Second connect packet")
     if len(packet.ClientIdentifier) == 0:
       if self.zero_length_clientids == False or packet.CleanSession == False:
         if self.zero_length_clientids:
-          logger.info("[MQTT-3.1.3-8] Reject 0-length clientid with cleansession false")
-        logger.info("[MQTT-3.1.3-9] if clientid is rejected, must send connack 2 and close connection")
+          conformance("[MQTT-3.1.3-8] Reject 0-length clientid with cleansession false")
+        conformance("[MQTT-3.1.3-9] if clientid is rejected, must send connack 2 and close connection")
         resp = MQTTV3.Connacks()
         resp.returnCode = 2
         respond(sock, resp)
-        logger.info("[MQTT-3.2.2-5] must close connection after non-zero connack")
+        conformance("[MQTT-3.2.2-5] must close connection after non-zero connack")
         self.disconnect(sock, None)
-        logger.info("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
+        conformance("[MQTT-3.1.4-5] When rejecting connect, no more data must be processed")
         return
       else:
-        logger.info("[MQTT-3.1.3-7] 0-length clientid must have cleansession true")
+        conformance("[MQTT-3.1.3-7] 0-length clientid must have cleansession true")
         packet.ClientIdentifier = uuid.uuid4() # give the client a unique clientid
-        logger.info("[MQTT-3.1.3-6] 0-length clientid must be assigned a unique id %s", packet.ClientIdentifier)
-    logger.info("[MQTT-3.1.3-5] Clientids of 1 to 23 chars and ascii alphanumeric must be allowed")
+        conformance("[MQTT-3.1.3-6] 0-length clientid must be assigned a unique id %s", packet.ClientIdentifier)
+    conformance("[MQTT-3.1.3-5] Clientids of 1 to 23 chars and ascii alphanumeric must be allowed")
     if packet.ClientIdentifier in [client.id for client in self.clients.values()]: # is this client already connected on a different socket?
       for s in self.clients.keys():
         if self.clients[s].id == packet.ClientIdentifier:
-          logger.info("[MQTT-3.1.4-2] Disconnecting old client %s", packet.ClientIdentifier)
+          conformance("[MQTT-3.1.4-2] Disconnecting old client %s", packet.ClientIdentifier)
           self.disconnect(s, None, terminate=True)
           break
     me = None
     if not packet.CleanSession:
       me = self.broker.getClient(packet.ClientIdentifier) # find existing state, if there is any
       if me:
-        logger.info("[MQTT-3.1.3-2] clientid used to retrieve client state")
+        conformance("[MQTT-3.1.3-2] clientid used to retrieve client state")
     resp = MQTTV3.Connacks()
     resp.flags = 0x01 if me else 0x00
     if me == None:
       me = MQTTClients(packet.ClientIdentifier, packet.CleanSession, packet.KeepAliveTimer, sock, self)
     else:
       me.socket = sock # set existing client state to new socket
+      me.loadStored()
       me.cleansession = packet.CleanSession
       me.keepalive = packet.KeepAliveTimer
-    logger.info("[MQTT-4.1.0-1] server must store data for at least as long as the network connection lasts")
+    conformance("[MQTT-4.1.0-1] server must store data for at least as long as the network connection lasts")
     self.clients[sock] = me
     me.will = (packet.WillTopic, packet.WillQoS, packet.WillMessage, packet.WillRETAIN) if packet.WillFlag else None
+    previous = self.broker.getClient(me.id)
+    if previous != None and previous is not me:
+      previous.discard()
     self.broker.connect(me)
-    logger.info("[MQTT-3.2.0-1] the first response to a client must be a connack")
+    if self.store and not me.cleansession:
+      self.store.openSession(me.id, "V3", NEVER)
+    conformance("[MQTT-3.2.0-1] the first response to a client must be a connack")
     resp.returnCode = 0
     respond(sock, resp)
     me.resend()
 
   def disconnect(self, sock, packet, terminate=False):
-    logger.info("[MQTT-3.14.4-2] Client must not send any more packets after disconnect")
+    conformance("[MQTT-3.14.4-2] Client must not send any more packets after disconnect")
     if sock in self.clients.keys():
+      me = self.clients[sock]
       if terminate:
-        self.broker.terminate(self.clients[sock].id)
+        self.broker.terminate(me.id)
       else:
-        self.broker.disconnect(self.clients[sock].id)
+        self.broker.disconnect(me.id)
+      if self.broker.getClient(me.id) is not me:
+        me.discard()
       del self.clients[sock]
     try:
       sock.shutdown(socket.SHUT_RDWR) # must call shutdown to close socket immediately
@@ -362,22 +510,22 @@ class MQTTBrokers:
     if len(topics) > 0:
       self.broker.subscribe(self.clients[sock].id, topics, qoss)
     resp = MQTTV3.Subacks()
-    logger.info("[MQTT-2.3.1-7][MQTT-3.8.4-2] Suback has same message id as subscribe")
-    logger.info("[MQTT-3.8.4-1] Must respond with suback")
+    conformance("[MQTT-2.3.1-7][MQTT-3.8.4-2] Suback has same message id as subscribe")
+    conformance("[MQTT-3.8.4-1] Must respond with suback")
     resp.messageIdentifier = packet.messageIdentifier
-    logger.info("[MQTT-3.8.4-5] return code must be returned for each topic in subscribe")
-    logger.info("[MQTT-3.9.3-1] the order of return codes must match order of topics in subscribe")
+    conformance("[MQTT-3.8.4-5] return code must be returned for each topic in subscribe")
+    conformance("[MQTT-3.9.3-1] the order of return codes must match order of topics in subscribe")
     resp.data = respqoss
     respond(sock, resp)
 
   def unsubscribe(self, sock, packet):
     self.broker.unsubscribe(self.clients[sock].id, packet.data)
     resp = MQTTV3.Unsubacks()
-    logger.info("[MQTT-2.3.1-7] Unsuback has same message id as unsubscribe")
-    logger.info("[MQTT-3.10.4-4] Unsuback must be sent - same message id as unsubscribe")
+    conformance("[MQTT-2.3.1-7] Unsuback has same message id as unsubscribe")
+    conformance("[MQTT-3.10.4-4] Unsuback must be sent - same message id as unsubscribe")
     me = self.clients[sock]
     if len(me.outbound) > 0:
-      logger.info("[MQTT-3.10.4-3] sending unsuback has no effect on outward inflight messages")
+      conformance("[MQTT-3.10.4-3] sending unsuback has no effect on outward inflight messages")
     resp.messageIdentifier = packet.messageIdentifier
     respond(sock, resp)
 
@@ -390,14 +538,14 @@ class MQTTBrokers:
              packet.topicName, packet.data, packet.fh.QoS, packet.fh.RETAIN, packet.receivedTime)
     elif packet.fh.QoS == 1:
       if packet.fh.DUP:
-        logger.info("[MQTT-3.3.1-3] Incoming publish DUP 1 ==> outgoing publish with DUP 0")
-        logger.info("[MQTT-4.3.2-2] server must store message in accordance with QoS 1")
+        conformance("[MQTT-3.3.1-3] Incoming publish DUP 1 ==> outgoing publish with DUP 0")
+        conformance("[MQTT-4.3.2-2] server must store message in accordance with QoS 1")
       self.broker.publish(self.clients[sock].id,
              packet.topicName, packet.data, packet.fh.QoS, packet.fh.RETAIN, packet.receivedTime)
       resp = MQTTV3.Pubacks()
-      logger.info("[MQTT-2.3.1-6] puback messge id same as publish")
+      conformance("[MQTT-2.3.1-6] puback messge id same as publish")
       resp.messageIdentifier = packet.messageIdentifier
-      respond(sock, resp)
+      self.acknowledge(sock, resp)
     elif packet.fh.QoS == 2:
       myclient = self.clients[sock]
       if self.publish_on_pubrel:
@@ -405,24 +553,26 @@ class MQTTBrokers:
           if packet.fh.DUP == 0:
             logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.messageIdentifier)
           else:
-            logger.info("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
+            conformance("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
         else:
           myclient.inbound[packet.messageIdentifier] = packet
+          myclient.storeInbound(packet)
       else:
         if packet.messageIdentifier in myclient.inbound:
           if packet.fh.DUP == 0:
             logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.messageIdentifier)
           else:
-            logger.info("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
+            conformance("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
         else:
           myclient.inbound.append(packet.messageIdentifier)
-          logger.info("[MQTT-4.3.3-2] server must store message in accordance with QoS 2")
+          myclient.storeInbound(packet)
+          conformance("[MQTT-4.3.3-2] server must store message in accordance with QoS 2")
           self.broker.publish(myclient, packet.topicName, packet.data, packet.fh.QoS, packet.fh.RETAIN,
                       packet.receivedTime)
       resp = MQTTV3.Pubrecs()
-      logger.info("[MQTT-2.3.1-6] pubrec messge id same as publish")
+      conformance("[MQTT-2.3.1-6] pubrec messge id same as publish")
       resp.messageIdentifier = packet.messageIdentifier
-      respond(sock, resp)
+      self.acknowledge(sock, resp)
 
   def pubrel(self, sock, packet):
     myclient = self.clients[sock]
@@ -433,14 +583,15 @@ class MQTTBrokers:
         del myclient.inbound[packet.messageIdentifier]
       else:
         myclient.inbound.remove(packet.messageIdentifier)
+      myclient.storeInboundRemove(packet.messageIdentifier)
     resp = MQTTV3.Pubcomps()
-    logger.info("[MQTT-2.3.1-6] pubcomp messge id same as publish")
+    conformance("[MQTT-2.3.1-6] pubcomp messge id same as publish")
     resp.messageIdentifier = packet.messageIdentifier
-    respond(sock, resp)
+    self.acknowledge(sock, resp)
 
   def pingreq(self, sock, packet):
     resp = MQTTV3.Pingresps()
-    logger.info("[MQTT-3.12.4-1] sending pingresp in response to pingreq")
+    conformance("[MQTT-3.12.4-1] sending pingresp in response to pingreq")
     respond(sock, resp)
 
   def puback(self, sock, packet):
@@ -451,7 +602,7 @@ class MQTTBrokers:
     "confirmed reception of qos 2"
     myclient = self.clients[sock]
     if myclient.pubrec(packet.messageIdentifier):
-      logger.info("[MQTT-3.5.4-1] must reply with pubrel in response to pubrec")
+      conformance("[MQTT-3.5.4-1] must reply with pubrel in response to pubrec")
       resp = MQTTV3.Pubrels()
       resp.messageIdentifier = packet.messageIdentifier
       respond(sock, resp)
@@ -465,5 +616,5 @@ class MQTTBrokers:
       client = self.clients[sock]
       if client.keepalive > 0 and time.time() - client.lastPacket > client.keepalive * 1.5:
         # keep alive timeout
-        logger.info("[MQTT-3.1.2-22] keepalive timeout for client %s", client.id)
+        conformance("[MQTT-3.1.2-22] keepalive timeout for client %s", client.id)
         self.disconnect(sock, None, terminate=True)
@@ -21,6 +21,7 @@ import types, logging
 from . import Topics, Subscriptions
 
 from .Subscriptions import *
+from mqtt.brokers.coverage import conformance
 
 logger = logging.getLogger('MQTT broker')
  
@@ -28,6 +29,7 @@ class SubscriptionEngines:
 
    def __init__(self, sharedData={}):
      self.sharedData = sharedData
+     self.observers = []
      if "subscriptions" not in self.sharedData:
        self.sharedData["subscriptions"] = []  # list of subscriptions
      else:
@@ -44,7 +46,16 @@ class SubscriptionEngines:
      self.__dollar_retained = self.sharedData["dollar_retained"]  
 
    def reinitialize(self):
+     observers = self.observers
+     for s in self.__subscriptions + self.__dollar_subscriptions:
+       for observer in observers:
+         observer.unsubscribed(s.getTopic())
      self.__init__()
+     self.observers = observers
+
+   def addObserver(self, observer):
+     "observer.subscribed and observer.unsubscribed are called when a subscription is added or removed"
+     self.observers.append(observer)
 
    def subscribe(self, aClientid, topic, qos):
      if type(topic) == type([]):
@@ -54,7 +65,7 @@ class SubscriptionEngines:
          rc.append(self.__subscribe(aClientid, aTopic, qos[count]))
          count += 1
        if count > 1:
-         logger.info("[MQTT-3.8.4-4] Multiple topics in one subscribe")
+         conformance("[MQTT-3.8.4-4] Multiple topics in one subscribe")
      else:
        rc = self.__subscribe(aClientid, topic, qos)
      return rc
@@ -68,23 +79,27 @@ class SubscriptionEngines:
        for s in subscriptions:
          if s.getClientid() == aClientid and s.getTopic() == aTopic:
            s.resubscribe(aQos)
+           if hasattr(subscriptions, "updated"): # persistent
+             subscriptions.updated(s)
            return s
        rc = Subscriptions(aClientid, aTopic, aQos)
        subscriptions.append(rc)
+       for observer in self.observers:
+         observer.subscribed(aTopic)
      return rc
 
    def unsubscribe(self, aClientid, aTopic):
      matched = False
      if type(aTopic) == type([]):
        if len(aTopic) > 1:
-         logger.info("[MQTT-3.10.4-6] each topic must be processed in sequence")
+         conformance("[MQTT-3.10.4-6] each topic must be processed in sequence")
        for t in aTopic:
          if not matched:
            matched = self.__unsubscribe(aClientid, t)
      else:
        matched = self.__unsubscribe(aClientid, aTopic)
      if not matched:
-       logger.info("[MQTT-3.10.4-5] Unsuback must be sent even if no topics are matched")
+       conformance("[MQTT-3.10.4-5] Unsuback must be sent even if no topics are matched")
 
    def __unsubscribe(self, aClientid, aTopic):
      "unsubscribe to one topic"
@@ -93,9 +108,11 @@ class SubscriptionEngines:
        subscriptions = self.__subscriptions if aTopic[0] != "$" else self.__dollar_subscriptions
        for s in subscriptions:
          if s.getClientid() == aClientid and s.getTopic() == aTopic:
-           logger.info("[MQTT-3.10.4-1] topic filters must be compared byte for byte")
-           logger.info("[MQTT-3.10.4-2] no more messages must be added after unsubscribe is complete")
+           conformance("[MQTT-3.10.4-1] topic filters must be compared byte for byte")
+           conformance("[MQTT-3.10.4-2] no more messages must be added after unsubscribe is complete")
            subscriptions.remove(s)
+           for observer in self.observers:
+             observer.unsubscribed(aTopic)
            matched = True
            break # once we've hit one, that's us done
      return matched
@@ -105,6 +122,8 @@ class SubscriptionEngines:
        for s in subscriptions[:]:
          if s.getClientid() == aClientid:
            subscriptions.remove(s)
+           for observer in self.observers:
+             observer.unsubscribed(s.getTopic())
 
    def getSubscriptions(self, aTopic, aClientid=None):
      "return a list of subscriptions for this client"
@@ -124,7 +143,7 @@ class SubscriptionEngines:
        if chosen == None:
          chosen = sub.getQoS()
        else:
-         logger.info("[MQTT-3.3.5-1] Overlapping subscriptions max QoS")
+         conformance("[MQTT-3.3.5-1] Overlapping subscriptions max QoS")
          if sub.getQoS() > chosen:
            chosen = sub.getQoS()
        # Omit the following optimization because we want to check for condition [MQTT-3.3.5-1]
@@ -149,7 +168,7 @@ class SubscriptionEngines:
        retained = self.__retained if aTopic[0] != "$" else self.__dollar_retained
        if len(aMessage) == 0:
          if aTopic in retained.keys():
-           logger.info("[MQTT-3.3.1-11] Deleting zero byte retained message")
+           conformance("[MQTT-3.3.1-11] Deleting zero byte retained message")
            del retained[aTopic]
        else:
          retained[aTopic] = (aMessage, aQoS, receivedTime)
@@ -18,6 +18,8 @@
 
 import time, logging
 
+from mqtt.brokers.coverage import conformance
+
 logger = logging.getLogger('MQTT broker')
  
 class Subscriptions:
@@ -37,8 +39,8 @@ class Subscriptions:
     return self.__qos
 
   def resubscribe(self, qos):
-    logger.info("[MQTT-1.1.0-1] resubscription for client %s on topic %s", self.__clientid, self.__topic)
-    logger.info("[MQTT-3.8.4-3] resubscription for client %s on topic %s", self.__clientid, self.__topic)
+    conformance("[MQTT-1.1.0-1] resubscription for client %s on topic %s", self.__clientid, self.__topic)
+    conformance("[MQTT-3.8.4-3] resubscription for client %s on topic %s", self.__clientid, self.__topic)
     self.__qos = qos
 
   def __repr__(self):
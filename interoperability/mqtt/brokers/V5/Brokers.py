@@ -21,9 +21,12 @@ import types, time, logging, random
 from . import Topics
 from .SubscriptionEngines import SubscriptionEngines
 from mqtt.formats.MQTTV5 import ProtocolError
+from mqtt.brokers.coverage import conformance
 
 logger = logging.getLogger('MQTT broker')
 
+INTERNAL = "$internal/" # client id prefix of subscribers within the broker, see attach
+
 class Brokers:
 
   def __init__(self, overlapping_single=True, topicAliasMaximum=0, sharedData={}):
@@ -33,13 +36,29 @@ class Brokers:
     self.overlapping_single = overlapping_single
     self.topicAliasMaximum = topicAliasMaximum
     self.__broker3 = None
+    self.__brokerSN = None
+    self.cluster = None
+    self.store = None # session store, for persistence
+    self.fanout = None # histogram of the numbers of subscribers publications are sent to
     self.willMessageClients = set() # set of clients for which will delay calculations are needed
+    self.internalClients = set() # ids of the clients added by attach
+    # the subscriptions of internal clients are not sessions, so are not kept over restarts
+    for clientid in set([s.getClientid() for name in ["subscriptions", "dollar_subscriptions"]
+                         for s in self.sharedData.get(name, []) if str(s.getClientid()).startswith(INTERNAL)]):
+      self.se.clearSubscriptions(clientid)
 
   def setBroker3(self, broker3):
     self.__broker3 = broker3
 
+  def setBrokerSN(self, brokerSN):
+    self.__brokerSN = brokerSN
+
+  def setCluster(self, cluster):
+    self.cluster = cluster
+
   def reinitialize(self):
     self.__clients = {}
+    self.internalClients = set()
     self.se.reinitialize()
 
   def getClients(self):
@@ -51,8 +70,14 @@ class Brokers:
   def cleanSession(self, aClientid):
     "clear any outstanding subscriptions and publications"
     if len(self.se.getRetainedTopics("#")) > 0:
-      logger.info("[MQTT-3.1.2-7] retained messages not cleaned up as part of session state for client %s", aClientid)
+      conformance("[MQTT-3.1.2-7] retained messages not cleaned up as part of session state for client %s", aClientid)
     self.se.clearSubscriptions(aClientid)
+    if self.store:
+      self.store.closeSession(aClientid)
+
+  def restoreClient(self, aClient):
+    "add the state of a disconnected client, read from persistent storage"
+    self.__clients[aClient.id] = aClient
 
   def connect(self, aClient, clean=False):
     aClient.connected = True
@@ -64,20 +89,37 @@ class Brokers:
     if clean:
       self.cleanSession(aClient.id)
 
+  def attach(self, aClient, topics, optionsprops):
+    """
+    subscribe a client within the broker, which has no connection or session, only a
+    publishArrived method.  Its id must start with INTERNAL.
+    """
+    assert aClient.id.startswith(INTERNAL)
+    self.__clients[aClient.id] = aClient
+    self.internalClients.add(aClient.id)
+    return self.subscribe(aClient.id, topics, optionsprops)
+
+  def detach(self, aClientid):
+    "remove a client added by attach"
+    if aClientid in self.internalClients:
+      self.internalClients.remove(aClientid)
+      self.se.clearSubscriptions(aClientid)
+      del self.__clients[aClientid]
+
   def sendWillMessage(self, aClientid):
     "Sends the will message, if any, for a client"
     self.__clients[aClientid].delayedWillTime = None
     if aClientid in self.willMessageClients:
       self.willMessageClients.remove(aClientid)
-    logger.info("[MQTT5-3.1.2-8] sending will message for client %s", aClientid)
+    conformance("[MQTT5-3.1.2-8] sending will message for client %s", aClientid)
     willtopic, willQoS, willmsg, willRetain, willProperties = self.__clients[aClientid].will
     if willRetain:
-      logger.info("[MQTT5-3.1.2-15] sending will message retained for client %s", aClientid)
+      conformance("[MQTT5-3.1.2-15] sending will message retained for client %s", aClientid)
     else:
-      logger.info("[MQTT5-3.1.2-14] sending will message non-retained for client %s", aClientid)
+      conformance("[MQTT5-3.1.2-14] sending will message non-retained for client %s", aClientid)
     self.publish(aClientid, willtopic, willmsg, willQoS, willRetain, willProperties, time.monotonic())
-    logger.info("[MQTT5-3.1.2-10] will message is deleted after use or disconnect, for client %s", aClientid)
-    logger.info("[MQTT-3.14.4-3] on receipt of disconnect, will message is deleted")
+    conformance("[MQTT5-3.1.2-10] will message is deleted after use or disconnect, for client %s", aClientid)
+    conformance("[MQTT-3.14.4-3] on receipt of disconnect, will message is deleted")
     self.__clients[aClientid].will = None
 
   def setupWillMessage(self, aClientid):
@@ -100,7 +142,9 @@ class Brokers:
         self.cleanSession(aClientid)
         del self.__clients[aClientid]
       else:
-        logger.info("[MQTT5-3.1.2-23] broker must store the session data for client %s", aClientid)
+        conformance("[MQTT5-3.1.2-23] broker must store the session data for client %s", aClientid)
+        if self.store and self.store.isDurable(aClientid):
+          self.store.endSession(aClientid, "V5", sessionExpiryInterval)
         self.__clients[aClientid].sessionEndedTime = time.monotonic()
         self.__clients[aClientid].connected = False
 
@@ -148,11 +192,14 @@ class Brokers:
           raise ProtocolError("Topic alias invalid", self.__clients[aClientid].topicAliasMaximum)
     assert len(topic) > 0
 
+    if self.cluster and aClientid != self.cluster.clientid:
+      self.cluster.publish(topic, message, qos, retained, properties)
+
     if retained:
-      logger.info("[MQTT-2.1.2-6] store retained message and QoS")
+      conformance("[MQTT-2.1.2-6] store retained message and QoS")
       self.se.setRetained(topic, message, qos, receivedTime, properties)
     else:
-      logger.info("[MQTT-2.1.2-12] non-retained message - do not store")
+      conformance("[MQTT-2.1.2-12] non-retained message - do not store")
 
     subscriptions = self.se.subscriptions(topic)
     # For shared subscriptions, there is only one recipient
@@ -176,10 +223,10 @@ class Brokers:
       overlapping = False
       subscriptions = self.se.getSubscriptions(topic, subscriber)
       if len(subscriptions) > 1:
-        logger.info("[MQTT-3.3.5-1] overlapping subscriptions")
+        conformance("[MQTT-3.3.5-1] overlapping subscriptions")
         overlapping = True
       if retained:
-        logger.info("[MQTT-2.1.2-10] outgoing publish does not have retained flag set")
+        conformance("[MQTT-2.1.2-10] outgoing publish does not have retained flag set")
       if self.overlapping_single:
         if subscriber in self.__clients.keys():
           options, subsprops = self.se.optionsOf(subscriber, topic)
@@ -199,9 +246,7 @@ class Brokers:
           if len(nolocalfilter) > 0:
             publishAction(options, subsprops, subsids=subsids)
         else:
-          # MQTT V3 subscription
-          out_qos = min(self.__broker3.se.qosOf(subscriber, topic), qos)
-          self.__broker3.getClient(subscriber).publishArrived(topic, message, out_qos)
+          self.publishOther(subscriber, topic, message, qos, receivedTime)
       else:
         for subscription in subscriptions:
           if subscriber in self.__clients.keys():
@@ -209,11 +254,20 @@ class Brokers:
             if not options.noLocal or subscriber != aClientid: # noLocal
               publishAction(options, subsprops)
           else:
-            # MQTT V3 subscription
-            out_qos = min(self.__broker3.se.qosOf(subscriber, topic), qos)
-            self.__broker3.getClient(subscriber).publishArrived(topic, message, out_qos)
+            self.publishOther(subscriber, topic, message, qos, receivedTime)
+    if self.fanout != None:
+      self.fanout.record(len(subscribed_clients))
     return subscribed_clients if len(subscribed_clients) > 0 else None
 
+  def publishOther(self, subscriber, topic, message, qos, receivedTime):
+    "send a message to an MQTT 3.1.1 or MQTT-SN subscriber"
+    out_qos = min(self.__broker3.se.qosOf(subscriber, topic), qos)
+    client = self.__broker3.getClient(subscriber)
+    if client:
+      client.publishArrived(topic, message, out_qos, receivedTime=receivedTime)
+    elif self.__brokerSN and self.__brokerSN.getClient(subscriber):
+      self.__brokerSN.getClient(subscriber).publishArrived(topic, message, out_qos)
+
   def __doRetained__(self, aClientid, topic, subsoptions, resubscribeds):
     # topic can be single, or a list
     if type(topic) != type([]):
@@ -22,53 +22,59 @@ import traceback, random, sys, string, copy, threading, logging, socket, time, u
 from mqtt.formats import MQTTV5
 
 from .Brokers import Brokers
+from .TopicAliases import TopicAliases, saving
+from mqtt.brokers.persistence.SessionStores import OUTBOUND, INBOUND
+from mqtt.brokers.coverage import conformance
+from mqtt.brokers import guards
+from mqtt.brokers.traces import MSCTraces, VisualMirrors
+from mqtt.brokers.monitoring import Statistics, Histograms
 
 logger = logging.getLogger('MQTT broker')
 
 mybroker = None
 
+counters = Statistics.Counters("mqtt5")
+
 def respond(sock, packet, maximumPacketSize=500):
+  "send a packet, returning False if it was discarded"
   # deal with expiry
   if packet.fh.PacketType == MQTTV5.PacketTypes.PUBLISH:
     if hasattr(packet.properties, "MessageExpiryInterval"):
-      timespent = int(time.monotonic() - packet.receivedTime)
+      timespent = int(time.monotonic() - packet.receivedTime) if packet.receivedTime != None else 0
       if timespent >= packet.properties.MessageExpiryInterval:
-        logger.info("[MQTT-3.3.2-5] Delete expired message")
-        return
+        conformance("[MQTT-3.3.2-5] Delete expired message")
+        counters.dropped += 1
+        return False
       else:
         try:
-          logger.info("[MQTT-3.3.2-6] Message Expiry Interval set to received value minus time waiting in the server")
+          conformance("[MQTT-3.3.2-6] Message Expiry Interval set to received value minus time waiting in the server")
           packet.properties.MessageExpiryInterval -= timespent
         except:
           traceback.print_exc()
+  started = time.perf_counter()
   packed = packet.pack()
+  counters.encoding.record(time.perf_counter() - started)
   # deal with packet size
   packlen = len(packed)
   if packlen > maximumPacketSize:
     logger.error("[MQTT5-3.1.2-24] Packet too big to send to client packet size %d max packet size %d" % (packlen, maximumPacketSize))
-    logger.info("[MQTT5-3.1.2-25] message must be discarded and behave as if it had been sent")
-    return
-  if hasattr(sock, "fileno"):
+    conformance("[MQTT5-3.1.2-25] message must be discarded and behave as if it had been sent")
+    counters.dropped += 1
+    return False
+  if guards.debug and hasattr(sock, "fileno"):
     packet_string = str(packet)
     if len(packet_string) > 256:
       packet_string = packet_string[:255] + '...' + (' payload length:' + str(len(packet.data)) if hasattr(packet, "data") else "")
     logger.debug("out: (%d) %s", sock.fileno(), packet_string)
   if mybroker.mscfile != None:
-    mybroker.mscfile.write("broker=>client%d[label=%s];\n" % (sock.fileno(), str(packet).split("(")[0]))
+    mybroker.mscfile.record(MSCTraces.OUT, sock.fileno(), packet.fh.PacketType)
   if hasattr(sock, "handlePacket"):
     sock.handlePacket(packet)
   else:
-    if mybroker.options["visual"]:
-      try:
-        data = {"direction" : "StoC", "socket" : sock.fileno(), 
-            "clientid":  mybroker.clients[sock].id if sock in mybroker.clients.keys() else "", 
-            "packet" : packet.json() }
-        # for any byte arrays, use base64 in json
-        databytes = bytes(json.dumps(data), 'utf-8')
-        mybroker.broker.publish('$internal', '$SYS/clients-packets', databytes, 
-                0, 0, None, time.monotonic())
-      except:
-        traceback.print_exc()
+    if mybroker.visual != None and mybroker.visual.active:
+      mybroker.visual.mirror("StoC", sock, mybroker.clients[sock].id if sock in mybroker.clients.keys() else "", packet, packed)
+    counters.sent[packet.fh.PacketType] += 1
+    counters.bytesSent += packlen
     try:
       bytes_sent = sock.send(packed) # Could get socket error on send
       if sock.websockets:
@@ -77,6 +83,11 @@ def respond(sock, packet, maximumPacketSize=500):
         assert bytes_sent == len(packed)
     except:
       traceback.print_exc()
+    if packet.fh.PacketType == MQTTV5.PacketTypes.PUBLISH and not (packet.fh.RETAIN or packet.fh.DUP) \
+        and packet.receivedTime != None and not getattr(packet, "resent", False) and sock in mybroker.clients:
+      Histograms.latencies.delivered("mqtt5", packet.fh.QoS, mybroker.clients[sock].id,
+          time.monotonic() - packet.receivedTime)
+  return True
 
 class MQTTClients:
 
@@ -108,40 +119,151 @@ class MQTTClients:
     self.lastPacket = None # time of last packet
     # Topic aliases
     self.clearTopicAliases()
+    self.topicAliasBytesSaved = 0 # by sending topic aliases in place of topic names
+    # persistence
+    self.inboundRefs = {} # inbound msgid -> session store reference
+    self.stored = False # are messages of a restored session still to be read from the store?
+    self.counted = True # are the messages counted in counters.queued and counters.inflight?
+
+  def durable(self):
+    "is this client's session state kept in the session store?"
+    return self.broker.store != None and self.broker.store.isDurable(self.id)
+
+  def storeUpdate(self, pub):
+    if getattr(pub, "storeRef", None) != None: # the session store reference of an outbound message
+      self.broker.store.update(pub.storeRef, pub.packetIdentifier,
+          pub.qos2state if pub.fh.QoS == 2 else None)
+
+  def storeRemove(self, pub):
+    if getattr(pub, "storeRef", None) != None:
+      self.broker.store.remove(pub.storeRef)
+      pub.storeRef = None
+
+  def storeInbound(self, pub):
+    "store an inbound QoS 2 message, or just its msgid if it has been published already"
+    if self.durable():
+      if self.broker.options["publish_on_pubrel"]:
+        self.inboundRefs[pub.packetIdentifier] = self.broker.store.add(self.id, INBOUND,
+            pub.topicName, pub.data, pub.properties, pub.fh.QoS, pub.fh.RETAIN, pub.packetIdentifier)
+      else:
+        self.inboundRefs[pub.packetIdentifier] = self.broker.store.add(self.id, INBOUND,
+            None, None, None, pub.fh.QoS, False, pub.packetIdentifier)
+
+  def storeInboundRemove(self, msgid):
+    if msgid in self.inboundRefs:
+      self.broker.store.remove(self.inboundRefs.pop(msgid))
+
+  def loadStored(self):
+    """
+    Read the messages of a session restored at startup, when its client reconnects.
+    Messages stored since the restart are already in memory, and come after these.
+    """
+    if not self.stored:
+      return
+    self.stored = False
+    known = set(pub.storeRef for pub in self.outbound + self.queued if getattr(pub, "storeRef", None) != None) | \
+            set(self.inboundRefs.values())
+    queued = []
+    for (ref, direction, topic, payload, properties, qos, retained, msgid, state) in self.broker.store.messagesOf(self.id):
+      if ref in known:
+        continue
+      if direction == INBOUND:
+        if self.broker.options["publish_on_pubrel"]:
+          pub = MQTTV5.Publishes(QoS=qos, RETAIN=retained, MsgId=msgid, TopicName=topic, Payload=payload)
+          if properties:
+            pub.properties = properties
+          pub.receivedTime = None # not kept for stored messages
+          self.inbound[msgid] = pub
+        else:
+          self.inbound.append(msgid)
+        self.inboundRefs[msgid] = ref
+        continue
+      pub = MQTTV5.Publishes(QoS=qos, RETAIN=retained, MsgId=msgid, TopicName=topic, Payload=payload)
+      if properties:
+        pub.properties = properties
+      pub.receivedTime = None # not kept for stored messages
+      if qos == 2:
+        pub.qos2state = state
+      pub.storeRef = ref
+      if msgid:
+        pub.fh.DUP = 1
+        self.outbound.append(pub)
+        self.outmsgs[msgid] = pub
+        self.msgid = 1 if msgid == MQTTV5.MAX_PACKETID else msgid + 1
+        counters.inflight += 1
+      else:
+        queued.append(pub)
+    self.queued = queued + self.queued
+    counters.queued += len(queued)
+
+  def discard(self):
+    "the session has ended, so its messages are no longer queued or in flight"
+    if self.counted:
+      self.counted = False
+      counters.queued -= len(self.queued)
+      counters.inflight -= len(self.outmsgs)
 
   def clearTopicAliases(self):
     self.topicAliasToNames = {} # int -> string, incoming
     self.topicAliasMaximum = 0 # for server topic aliases
-    self.outgoingTopicNamesToAliases = []
+    self.topicAliases = TopicAliases() # outgoing
+
+  def sendPublish(self, pub):
+    """
+    send a publication with a topic alias, if the client accepts them: with the topic name
+    too the first time, or when the alias has been given to another topic name.
+    """
+    topic = pub.topicName
+    alias, known = 0, False
+    if self.topicAliasMaximum == 0:
+      conformance("[MQTT5-3.1.2-27] if topic alias is 0, no topic aliases must be sent")
+    elif not hasattr(self.socket, "handlePacket"):
+      alias, known = self.topicAliases.alias(topic)
+    if alias > 0:
+      conformance("[MQTT5-3.1.2-26] Server must not send topic alias > max")
+      pub.properties.TopicAlias = alias # Topic aliases start at 1
+      if known:
+        pub.topicName = ""
+    sent = respond(self.socket, pub, self.maximumPacketSize)
+    if alias > 0:
+      pub.topicName = topic
+      del pub.properties.TopicAlias
+      if not sent and not known:
+        self.topicAliases.forget(topic)
+      elif sent:
+        saved = saving(topic, known)
+        self.topicAliasBytesSaved += saved
+        counters.aliasBytesSaved += saved
 
   def resendPub(self, pub):
-    logger.debug("resending %s", str(pub))
-    logger.info("[MQTT-4.4.0-2] dup flag must be set on in re-publish")
+    logger.debug("resending %s", pub)
+    conformance("[MQTT-4.4.0-2] dup flag must be set on in re-publish")
+    pub.resent = True # not counted in the latency histograms
     if pub.fh.QoS == 0:
-      respond(self.socket, pub, self.maximumPacketSize)
+      self.sendPublish(pub)
     elif pub.fh.QoS == 1:
-      logger.info("[MQTT-2.1.2-3] Dup when resending QoS 1 publish id %d", pub.packetIdentifier)
-      logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
-      logger.info("[MQTT-4.3.2-1] Resending QoS 1 with DUP flag")
-      respond(self.socket, pub, self.maximumPacketSize)
+      conformance("[MQTT-2.1.2-3] Dup when resending QoS 1 publish id %d", pub.packetIdentifier)
+      conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
+      conformance("[MQTT-4.3.2-1] Resending QoS 1 with DUP flag")
+      self.sendPublish(pub)
       pub.fh.DUP = 1
     elif pub.fh.QoS == 2:
       if pub.qos2state == "PUBREC":
-        logger.info("[MQTT-2.1.2-3] Dup when resending QoS 2 publish id %d", pub.packetIdentifier)
-        logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
-        logger.info("[MQTT-4.3.3-1] Resending QoS 2 with DUP flag")
-        respond(self.socket, pub, self.maximumPacketSize)
+        conformance("[MQTT-2.1.2-3] Dup when resending QoS 2 publish id %d", pub.packetIdentifier)
+        conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
+        conformance("[MQTT-4.3.3-1] Resending QoS 2 with DUP flag")
+        self.sendPublish(pub)
         pub.fh.DUP = 1
       else:
         resp = MQTTV5.Pubrels()
-        logger.info("[MQTT-2.3.1-4] Message id same as original publish on resend")
+        conformance("[MQTT-2.3.1-4] Message id same as original publish on resend")
         resp.packetIdentifier = pub.packetIdentifier
         respond(self.socket, resp, self.maximumPacketSize)
 
   def resend(self):
-    logger.debug("resending unfinished publications %s", str(self.outbound))
+    logger.debug("resending unfinished publications %s", self.outbound)
     if len(self.outbound) > 0:
-      logger.info("[MQTT-4.4.0-1] resending inflight QoS 1 and 2 messages")
+      conformance("[MQTT-4.4.0-1] resending inflight QoS 1 and 2 messages")
     for pub in self.outbound:
       self.resendPub(pub)
     self.sendQueued()
@@ -156,14 +278,17 @@ class MQTTClients:
         self.msgid += 1
       self.outbound.append(pub)
       self.outmsgs[pub.packetIdentifier] = pub
-      logger.info("[MQTT-4.6.0-6] publish packets must be sent in order of receipt from any given client")
-    respond(self.socket, pub, self.maximumPacketSize)
+      counters.inflight += 1
+      self.storeUpdate(pub)
+      conformance("[MQTT-4.6.0-6] publish packets must be sent in order of receipt from any given client")
+    self.sendPublish(pub)
     if pub.fh.QoS > 0:
       pub.fh.DUP = 1
 
   def sendQueued(self):
     while len(self.queued) > 0 and len(self.outbound) < self.receiveMaximum:
       self.outbound.append(self.queued.pop(0))
+      counters.queued -= 1
       self.sendFirst(self.outbound[-1])
 
   def publishArrived(self, topic, msg, qos, properties, receivedTime, retained=False):
@@ -172,42 +297,45 @@ class MQTTClients:
       if hasattr(properties, 'TopicAlias'):
         del properties.TopicAlias
       pub.properties = properties
-    logger.info("[MQTT-3.2.3-3] topic name must match the subscription's topic filter")
-    # Topic alias
-    if self.topicAliasMaximum == 0:
-      logger.info("[MQTT5-3.1.2-27] if topic alias is 0, no topic aliases must be sent") 
-    if len(self.outgoingTopicNamesToAliases) < self.topicAliasMaximum and not topic in self.outgoingTopicNamesToAliases:
-      logger.info("[MQTT5-3.1.2-26] Server must not send topic alias > max") 
-      self.outgoingTopicNamesToAliases.append(topic)       # add alias
-      pub.topicName = topic # include topic name as well as alias first time
-    if topic in self.outgoingTopicNamesToAliases:
-      pub.properties.TopicAlias = self.outgoingTopicNamesToAliases.index(topic) + 1 # Topic aliases start at 1
-    else:
-      pub.topicName = topic
+    conformance("[MQTT-3.2.3-3] topic name must match the subscription's topic filter")
+    pub.topicName = topic # the alias is chosen when the publication is sent
     pub.data = msg
     pub.fh.QoS = qos
     pub.fh.RETAIN = retained
     pub.receivedTime = receivedTime
     if retained:
-      logger.info("[MQTT-2.1.2-7] Last retained message on matching topics sent on subscribe")
+      conformance("[MQTT-2.1.2-7] Last retained message on matching topics sent on subscribe")
     if pub.fh.RETAIN:
-      logger.info("[MQTT-2.1.2-9] Set retained flag on retained messages")
+      conformance("[MQTT-2.1.2-9] Set retained flag on retained messages")
     if qos == 2:
       pub.qos2state = "PUBREC"
+    if qos > 0 and self.durable():
+      pub.storeRef = self.broker.store.add(self.id, OUTBOUND, topic, msg, properties, qos, retained,
+          0, pub.qos2state if qos == 2 else None)
     if len(self.outbound) >= self.receiveMaximum or not self.connected:
       if qos > 0 or not self.broker.options["dropQoS0"]:
         self.queued.append(pub) # this should never be infinite in reality
+        counters.queued += 1
+      else:
+        counters.dropped += 1
       if qos > 0 and not self.connected:
-        logger.info("[MQTT-3.1.2-5] storing of QoS 1 and 2 messages for disconnected client %s", self.id)
+        conformance("[MQTT-3.1.2-5] storing of QoS 1 and 2 messages for disconnected client %s", self.id)
     else:
       self.sendFirst(pub)
 
+  def acknowledged(self, pub):
+    if not (pub.fh.RETAIN or getattr(pub, "resent", False)) and pub.receivedTime != None:
+      Histograms.latencies.acknowledged("mqtt5", pub.fh.QoS, time.monotonic() - pub.receivedTime)
+
   def puback(self, msgid):
     if msgid in self.outmsgs.keys():
       pub = self.outmsgs[msgid]
       if pub.fh.QoS == 1:
+        self.acknowledged(pub)
         self.outbound.remove(pub)
         del self.outmsgs[msgid]
+        counters.inflight -= 1
+        self.storeRemove(pub)
         self.sendQueued()
       else:
         logger.error("%s: Puback received for msgid %d, but QoS is %d", self.id, msgid, pub.fh.QoS)
@@ -221,6 +349,7 @@ class MQTTClients:
       if pub.fh.QoS == 2:
         if pub.qos2state == "PUBREC":
           pub.qos2state = "PUBCOMP"
+          self.storeUpdate(pub)
           rc = True
         else:
           logger.error("%s: Pubrec received for msgid %d, but message in wrong state", self.id, msgid)
@@ -235,8 +364,11 @@ class MQTTClients:
       pub = self.outmsgs[msgid]
       if pub.fh.QoS == 2:
         if pub.qos2state == "PUBCOMP":
+          self.acknowledged(pub)
           self.outbound.remove(pub)
           del self.outmsgs[msgid]
+          counters.inflight -= 1
+          self.storeRemove(pub)
           self.sendQueued()
         else:
           logger.error("Pubcomp received for msgid %d, but message in wrong state", msgid)
@@ -301,6 +433,7 @@ class MQTTBrokers:
     self.options = options
 
     self.broker = Brokers(self.options["overlapping_single"], self.options["topicAliasMaximum"], sharedData=sharedData)
+    self.broker.fanout = counters.fanout
     self.clients = {}   # socket -> clients
     if lock:
       logger.info("Using shared lock %d", id(lock))
@@ -313,53 +446,102 @@ class MQTTBrokers:
     logger.info("MQTT 5.0 Paho Test Broker")
     logger.info("Options %s", self.options)
 
+    self.store = None
+
     self.mscfile = None
     if "mscfile" in self.options.keys():
-      self.mscfile = open(self.options["mscfile"], "w")
-      self.mscfile.write("msc {\n broker;\n")
+      self.mscfile = MSCTraces.MSCTraces(self.options["mscfile"],
+          binary=self.options.get("mscfile_format") == "binary",
+          maxBytes=self.options.get("mscfile_max_bytes", 0),
+          backups=self.options.get("mscfile_backups", 1))
+
+    self.visual = None
+    if self.options.get("visual"):
+      self.visual = VisualMirrors.VisualMirrors(self.broker, self.lock,
+          sample=self.options.get("visual_sample", 1),
+          clientids=VisualMirrors.splitOption(self.options.get("visual_clients")),
+          packetTypes=VisualMirrors.splitOption(self.options.get("visual_packet_types")))
+      self.visual.observe(self.broker.se)
 
   def shutdown(self):
     self.disconnectAll(reasonCode="Server shutting down")
     self.cleanupThread.stop()
+    if self.mscfile != None:
+      self.mscfile.close()
+    if self.visual != None:
+      self.visual.stop()
+
+  def getStatistics(self):
+    "the numbers of clients and queued messages, for the $SYS topics"
+    connected = len(self.clients)
+    disconnected = len(self.broker.getClients()) - connected - len(self.broker.internalClients)
+    return {"clients/connected" : connected, "clients/disconnected" : disconnected,
+            "messages/queued" : counters.queued + counters.inflight}
+
+  def setBrokerSN(self, brokerSN):
+    self.broker.setBrokerSN(brokerSN.broker)
 
   def setBroker3(self, broker3):
     self.broker.setBroker3(broker3.broker)
+    if self.visual != None: # MQTT 3.1.1 clients can subscribe to the copies too
+      self.visual.observe(broker3.broker.se)
+
+  def setStore(self, store):
+    "use a session store, and restore the sessions held in it"
+    self.store = store
+    self.broker.store = store
+    count = 0
+    for clientid, expiry, elapsed in store.recover("V5"):
+      me = MQTTClients(clientid, False, expiry, 0, 0, None, self)
+      me.sessionEndedTime = time.monotonic() - elapsed
+      me.stored = True # the messages are read when the client reconnects
+      self.broker.restoreClient(me)
+      count += 1
+    logger.info("Restored %d MQTT 5.0 sessions", count)
+
+  def acknowledge(self, sock, packet):
+    "send an acknowledgement once the state changes it confirms are on disk"
+    if self.store:
+      self.store.afterSync(lambda: respond(sock, packet) if sock in self.clients else None)
+    else:
+      respond(sock, packet)
 
   def reinitialize(self):
     logger.info("Reinitializing broker")
     self.clients = {}
     self.broker.reinitialize()
+    counters.queued = counters.inflight = 0
 
   def handleRequest(self, sock):
     "this is going to be called from multiple threads, so synchronize"
+    started = time.perf_counter()
     self.lock.acquire()
+    Statistics.lockWaits.record(time.perf_counter() - started)
     raw_packet = None
     try:
       try:
         raw_packet = MQTTV5.getPacket(sock)
       except:
         pass # handled by raw_packet == None
+      if raw_packet != None:
+        counters.received[raw_packet[0] >> 4] += 1
+        counters.bytesReceived += len(raw_packet)
       if raw_packet == None:
-        logger.info("[MQTT-4.8.0-1] 'transient error' reading packet, closing connection")
+        conformance("[MQTT-4.8.0-1] 'transient error' reading packet, closing connection")
         # will message
         if sock in self.clients.keys():
           self.disconnect(sock, None, sendWillMessage=True)
         terminate = True
       else:
         try:
+          started = time.perf_counter()
           packet = MQTTV5.unpackPacket(raw_packet, self.options["maximumPacketSize"])
-          if self.options["visual"]:
+          counters.decoding.record(time.perf_counter() - started)
+          if self.visual != None and self.visual.active:
             clientid = self.clients[sock].id if sock in self.clients.keys() else ""
             if clientid == "" and hasattr(packet, "ClientIdentifier"):
               clientid = packet.ClientIdentifier
-            try:
-              data = {"direction" : "CtoS", "socket" : sock.fileno(), 
-                    "clientid":  clientid, "packet" : packet.json() }
-              databytes = bytes(json.dumps(data), 'utf-8')
-              self.broker.publish('$internal', '$SYS/clients-packets', databytes,
-                   0, 0, None, time.monotonic())
-            except:
-              traceback.print_exc()
+            self.visual.mirror("CtoS", sock, clientid, packet, raw_packet)
           if packet:
             terminate = self.handlePacket(packet, sock)
           else:
@@ -383,19 +565,19 @@ class MQTTBrokers:
 
   def handlePacket(self, packet, sock):
     terminate = False
-    if hasattr(sock, "fileno"):
+    if guards.debug and hasattr(sock, "fileno"):
       packet_string = str(packet)
       if len(packet_string) > 256:
         packet_string = packet_string[0:256] + '...' + (' payload length:' + str(len(packet.data)) if hasattr(packet, "data") else "")
       logger.debug("in: (%d) %s", sock.fileno(), packet_string)
     if self.mscfile != None:
-      self.mscfile.write("client%d=>broker[label=%s];\n" % (sock.fileno(), str(packet).split("(")[0]))
+      self.mscfile.record(MSCTraces.IN, sock.fileno(), packet.fh.PacketType)
     if sock not in self.clients.keys() and packet.fh.PacketType != MQTTV5.PacketTypes.CONNECT:
       self.disconnect(sock, packet)
       raise MQTTV5.MQTTException("[MQTT5-3.1.0-1-error] Connect was not first packet on socket")
     else:
       if packet.fh.PacketType == MQTTV5.PacketTypes.CONNECT:
-        logger.info("[MQTT5-3.1.0-1] Connect must be first packet on socket")
+        conformance("[MQTT5-3.1.0-1] Connect must be first packet on socket")
       getattr(self, MQTTV5.Packets.Names[packet.fh.PacketType].lower())(sock, packet)
       if sock in self.clients.keys():
         self.clients[sock].lastPacket = time.monotonic()
@@ -408,56 +590,56 @@ class MQTTBrokers:
     if packet.ProtocolName != "MQTT":
       self.disconnect(sock, None)
       raise MQTTV5.MQTTException("[MQTT5-3.1.2-1-error] Wrong protocol name %s" % packet.ProtocolName)
-    logger.info("[MQTT5-3.1.2-1] Protocol name must be MQTT")
+    conformance("[MQTT5-3.1.2-1] Protocol name must be MQTT")
     if packet.ProtocolVersion != 5:
       logger.error("[MQTT5-3.1.2-2-error] Wrong protocol version %d", packet.ProtocolVersion)
       resp.reasonCode.set("Unsupported protocol version")
       respond(sock, resp)
-      logger.info("[MQTT5-3.2.2-6] must set session present to 0 with non-zero connack")
-      logger.info("[MQTT5-3.2.2-7] must close connection after connack reason >= 0x80")
+      conformance("[MQTT5-3.2.2-6] must set session present to 0 with non-zero connack")
+      conformance("[MQTT5-3.2.2-7] must close connection after connack reason >= 0x80")
       self.disconnect(sock, None)
-      logger.info("[MQTT5-3.1.4-6] When rejecting connect, no more data must be processed")
+      conformance("[MQTT5-3.1.4-6] When rejecting connect, no more data must be processed")
       return
-    logger.info("[MQTT5-3.1.2-2] Protocol version must be 5")
+    conformance("[MQTT5-3.1.2-2] Protocol version must be 5")
     if sock in self.clients.keys():    # is socket is already connected?
       self.disconnect(sock, None)
-      logger.info("[MQTT5-3.1.4-6] When rejecting connect, no more data must be processed")
+      conformance("[MQTT5-3.1.4-6] When rejecting connect, no more data must be processed")
       raise MQTTV5.MQTTException("[MQTT5-3.1.0-2] Second connect packet")
     if len(packet.ClientIdentifier) == 0:
       packet.ClientIdentifier = str(uuid.uuid4()) # give the client a unique clientid
-      logger.info("[MQTT5-3.1.3-6] 0-length clientid must be assigned a unique id %s", packet.ClientIdentifier)
+      conformance("[MQTT5-3.1.3-6] 0-length clientid must be assigned a unique id %s", packet.ClientIdentifier)
       resp.properties.AssignedClientIdentifier = packet.ClientIdentifier # returns the assigned client id
-      logger.info("[MQTT5-3.1.3-7] must return the assigned client id")
+      conformance("[MQTT5-3.1.3-7] must return the assigned client id")
     else:
-      logger.info("[MQTT5-3.1.3-5] Clientids of 1 to 23 chars and ascii alphanumeric must be allowed")
+      conformance("[MQTT5-3.1.3-5] Clientids of 1 to 23 chars and ascii alphanumeric must be allowed")
       if False: # reject clientid test
-        logger.info("[MQTT5-3.1.3-8] server rejects clientid - may return connack")
+        conformance("[MQTT5-3.1.3-8] server rejects clientid - may return connack")
     if packet.ClientIdentifier in [client.id for client in self.clients.values()]: # is this client already connected on a different socket?
       for cursock in self.clients.keys():
         if self.clients[cursock].id == packet.ClientIdentifier:
-          logger.info("[MQTT5-3.1.4-3] Disconnecting old client %s", packet.ClientIdentifier)
+          conformance("[MQTT5-3.1.4-3] Disconnecting old client %s", packet.ClientIdentifier)
           self.disconnect(cursock, reasonCode="Session taken over", sendWillMessage=True)
           break
     me = None
     clean = False
     if packet.CleanStart:
-      logger.info("[MQTT5-3.1.2-4] discard existing session when cleanstart set to 1")
-      logger.info("[MQTT5-3.1.4-4] server must perform clean start processing")
+      conformance("[MQTT5-3.1.2-4] discard existing session when cleanstart set to 1")
+      conformance("[MQTT5-3.1.4-4] server must perform clean start processing")
       clean = True
-      logger.info("[MQTT5-3.2.2-2] session present must be set to 0 if cleanstart is 1")
+      conformance("[MQTT5-3.2.2-2] session present must be set to 0 if cleanstart is 1")
     else:
       me = self.broker.getClient(packet.ClientIdentifier) # find existing state, if there is any
       if not me:
-        logger.info("[MQTT5-3.1.2-6] no existing session and cleanstart set to 0")
+        conformance("[MQTT5-3.1.2-6] no existing session and cleanstart set to 0")
       # has that state expired?
       if me and me.sessionExpiryInterval >= 0 and time.monotonic() - me.sessionEndedTime > me.sessionExpiryInterval:
         me = None
         clean = True
       else:
-        logger.info("[MQTT5-3.1.2-5] resume an existing session when cleanstart set to 0")
+        conformance("[MQTT5-3.1.2-5] resume an existing session when cleanstart set to 0")
       if me:
-        logger.info("[MQTT5-3.1.3-2] clientid used to retrieve client state")
-        logger.info("[MQTT5-3.2.2-3] session present must be set to 1")
+        conformance("[MQTT5-3.1.3-2] clientid used to retrieve client state")
+        conformance("[MQTT5-3.2.2-3] session present must be set to 1")
     resp.sessionPresent = True if me else False
     # Connack topic alias maximum for incoming client created topic aliases
     if self.options["topicAliasMaximum"] > 0:
@@ -470,7 +652,7 @@ class MQTTBrokers:
     if packet.KeepAliveTimer > 0 and self.options["serverKeepAlive"] < packet.KeepAliveTimer:
       keepalive = self.options["serverKeepAlive"]
       resp.properties.ServerKeepAlive = keepalive
-      logger.info("[MQTT5-3.1.2-21] client must use server keep alive if returned on connack")
+      conformance("[MQTT5-3.1.2-21] client must use server keep alive if returned on connack")
     # Session expiry
     if hasattr(packet.properties, "SessionExpiryInterval"):
       sessionExpiryInterval = packet.properties.SessionExpiryInterval
@@ -487,35 +669,45 @@ class MQTTBrokers:
       me = MQTTClients(packet.ClientIdentifier, packet.CleanStart, sessionExpiryInterval, willDelayInterval, keepalive, sock, self)
     else:
       me.socket = sock # set existing client state to new socket
+      me.loadStored()
       me.cleanStart = packet.CleanStart
       me.keepalive = keepalive
       me.sessionExpiryInterval = sessionExpiryInterval
       me.willDelayInterval = willDelayInterval
     if me.delayedWillTime:
       me.delayedWillTime = None
-      logger.info("[MQTT5-3.1.3-9] don't send delayed will if client connects in time")
+      conformance("[MQTT5-3.1.3-9] don't send delayed will if client connects in time")
     if me.id in self.broker.willMessageClients:
       self.broker.willMessageClients.remove(me.id)
     # the topic alias maximum in the connect properties sets the maximum outgoing topic aliases for a client
     me.topicAliasMaximum = packet.properties.TopicAliasMaximum if hasattr(packet.properties, "TopicAliasMaximum") else 0
+    me.topicAliases = TopicAliases(me.topicAliasMaximum, self.options.get("topic_alias_policy", "lru"))
     me.maximumPacketSize = packet.properties.MaximumPacketSize if hasattr(packet.properties, "MaximumPacketSize") else MQTTV5.MAX_PACKET_SIZE
     assert me.maximumPacketSize <= MQTTV5.MAX_PACKET_SIZE # is this the correct value?
     me.receiveMaximum = packet.properties.ReceiveMaximum if hasattr(packet.properties, "ReceiveMaximum") else MQTTV5.MAX_PACKETID
     assert me.receiveMaximum <= MQTTV5.MAX_PACKETID
-    logger.info("[MQTT-4.1.0-1] server must store data for at least as long as the network connection lasts")
+    conformance("[MQTT-4.1.0-1] server must store data for at least as long as the network connection lasts")
     self.clients[sock] = me
     me.will = (packet.WillTopic, packet.WillQoS, packet.WillMessage, packet.WillRETAIN, packet.WillProperties) if packet.WillFlag else None
     if me.will != None:
-      logger.info("[MQTT5-3.1.2-7] the will message must be stored if the WillFlag is set")
+      conformance("[MQTT5-3.1.2-7] the will message must be stored if the WillFlag is set")
+    previous = self.broker.getClient(me.id)
+    if previous != None and previous is not me:
+      previous.discard()
     self.broker.connect(me, clean)
-    logger.info("[MQTT5-3.2.0-1] the first response to a client must be a connack")
-    logger.info("[MQTT5-3.1.4-5] the server must acknowledge the connect with a connack success")
+    if self.store:
+      if me.sessionExpiryInterval != 0:
+        self.store.openSession(me.id, "V5", me.sessionExpiryInterval)
+      else:
+        self.store.closeSession(me.id) # the session ends with the connection
+    conformance("[MQTT5-3.2.0-1] the first response to a client must be a connack")
+    conformance("[MQTT5-3.1.4-5] the server must acknowledge the connect with a connack success")
     resp.reasonCode.set("Success")
     respond(sock, resp)
     me.resend()
 
   def disconnect(self, sock, packet=None, sendWillMessage=False, reasonCode=None, properties=None):
-    logger.info("[MQTT-3.14.4-2] Client must not send any more packets after disconnect")
+    conformance("[MQTT-3.14.4-2] Client must not send any more packets after disconnect")
     me = self.clients[sock]
     me.clearTopicAliases()
     # Session expiry
@@ -532,6 +724,8 @@ class MQTTBrokers:
     if sock in self.clients.keys():
       self.broker.disconnect(me.id, willMessage=sendWillMessage,
           sessionExpiryInterval=me.sessionExpiryInterval)
+      if self.broker.getClient(me.id) is not me:
+        me.discard()
       del self.clients[sock]
     try:
       sock.shutdown(socket.SHUT_RDWR) # must call shutdown to close socket immediately
@@ -567,11 +761,11 @@ class MQTTBrokers:
     if len(topics) > 0:
       self.broker.subscribe(self.clients[sock].id, topics, optionss)
     resp = MQTTV5.Subacks()
-    logger.info("[MQTT5-2.2.1-6-suback] Suback has same message id as subscribe")
-    logger.info("[MQTT-3.8.4-1] Must respond with suback")
+    conformance("[MQTT5-2.2.1-6-suback] Suback has same message id as subscribe")
+    conformance("[MQTT-3.8.4-1] Must respond with suback")
     resp.packetIdentifier = packet.packetIdentifier
-    logger.info("[MQTT-3.8.4-5] return code must be returned for each topic in subscribe")
-    logger.info("[MQTT-3.9.3-1] the order of return codes must match order of topics in subscribe")
+    conformance("[MQTT-3.8.4-5] return code must be returned for each topic in subscribe")
+    conformance("[MQTT-3.9.3-1] the order of return codes must match order of topics in subscribe")
     resp.reasonCodes = respqoss
     # propagating user property is broker specific behaviour, to aid testing
     if hasattr(packet.properties, "UserProperty"):
@@ -581,11 +775,11 @@ class MQTTBrokers:
   def unsubscribe(self, sock, packet):
     reasonCodes = self.broker.unsubscribe(self.clients[sock].id, packet.topicFilters)
     resp = MQTTV5.Unsubacks()
-    logger.info("[MQTT5-2.2.1-6-unsuback] Unsuback has same message id as unsubscribe")
-    logger.info("[MQTT-3.10.4-4] Unsuback must be sent - same message id as unsubscribe")
+    conformance("[MQTT5-2.2.1-6-unsuback] Unsuback has same message id as unsubscribe")
+    conformance("[MQTT-3.10.4-4] Unsuback must be sent - same message id as unsubscribe")
     me = self.clients[sock]
     if len(me.outbound) > 0:
-      logger.info("[MQTT-3.10.4-3] sending unsuback has no effect on outward inflight messages")
+      conformance("[MQTT-3.10.4-3] sending unsuback has no effect on outward inflight messages")
     # propagating user property is broker specific behaviour, to aid testing
     if hasattr(packet.properties, "UserProperty"):
       resp.properties.UserProperty = packet.properties.UserProperty
@@ -606,20 +800,20 @@ class MQTTBrokers:
              (self.options["receiveMaximum"], len(self.clients[sock].inbound)+1), sendWillMessage=True)
           return
         if hasattr(packet.properties, "UserProperty") and len(packet.properties.UserProperty) > 1:
-          logger.info("[MQTT-3.1.3-10] Must maintain order of user properties")
+          conformance("[MQTT-3.1.3-10] Must maintain order of user properties")
         if packet.fh.QoS == 0:
           self.broker.publish(self.clients[sock].id, packet.topicName,
                  packet.data, packet.fh.QoS, packet.fh.RETAIN, packet.properties,
                  packet.receivedTime)
         elif packet.fh.QoS == 1:
           if packet.fh.DUP:
-            logger.info("[MQTT-3.3.1-3] Incoming publish DUP 1 ==> outgoing publish with DUP 0")
-            logger.info("[MQTT-4.3.2-2] server must store message in accordance with QoS 1")
+            conformance("[MQTT-3.3.1-3] Incoming publish DUP 1 ==> outgoing publish with DUP 0")
+            conformance("[MQTT-4.3.2-2] server must store message in accordance with QoS 1")
           subscribers = self.broker.publish(self.clients[sock].id, packet.topicName,
                 packet.data, packet.fh.QoS, packet.fh.RETAIN, packet.properties,
                 packet.receivedTime)
           resp = MQTTV5.Pubacks()
-          logger.info("[MQTT5-2.2.1-5-puback] puback message id same as publish")
+          conformance("[MQTT5-2.2.1-5-puback] puback message id same as publish")
           resp.packetIdentifier = packet.packetIdentifier
           if subscribers == None:
             resp.reasonCode.set("No matching subscribers")
@@ -627,7 +821,7 @@ class MQTTBrokers:
             resp.reasonCode.set("Not authorized")
             if hasattr(packet.properties, "UserProperty"):
               resp.properties.UserProperty = packet.properties.UserProperty
-          respond(sock, resp)
+          self.acknowledge(sock, resp)
         elif packet.fh.QoS == 2:
           myclient = self.clients[sock]
           subscribers = None
@@ -636,21 +830,23 @@ class MQTTBrokers:
               if packet.fh.DUP == 0:
                 logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.packetIdentifier)
               else:
-                logger.info("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
+                conformance("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
             else:
               myclient.inbound[packet.packetIdentifier] = packet
               if len(packet.topicName) == 0 and hasattr(packet.properties, "TopicAlias"):
                 packet.topicName = self.broker.getAliasTopic(self.clients[sock].id, packet.properties.TopicAlias)
+              myclient.storeInbound(packet)
               subscribers = self.broker.se.getSubscriptions(packet.topicName)
           else:
             if packet.packetIdentifier in myclient.inbound:
               if packet.fh.DUP == 0:
                 logger.error("[MQTT-3.3.1-2] duplicate QoS 2 message id %d found with DUP 0", packet.packetIdentifier)
               else:
-                logger.info("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
+                conformance("[MQTT-3.3.1-2] DUP flag is 1 on redelivery")
             else:
               myclient.inbound.append(packet.packetIdentifier)
-              logger.info("[MQTT-4.3.3-2] server must store message in accordance with QoS 2")
+              myclient.storeInbound(packet)
+              conformance("[MQTT-4.3.3-2] server must store message in accordance with QoS 2")
               if len(packet.topicName) == 0 and hasattr(packet.properties, "TopicAlias"):
                 packet.topicName = self.broker.getAliasTopic(self.clients[sock].id, packet.properties.TopicAlias)
               subscribers = self.broker.publish(self.clients[sock].id, packet.topicName,
@@ -659,7 +855,7 @@ class MQTTBrokers:
               if packet.topicName == "test_qos_1_2_errors_pubcomp":
                 myclient.pubcomp_error = packet.packetIdentifier
           resp = MQTTV5.Pubrecs()
-          logger.info("[MQTT5-2.2.1-5-pubrec] pubrec message id same as publish")
+          conformance("[MQTT5-2.2.1-5-pubrec] pubrec message id same as publish")
           resp.packetIdentifier = packet.packetIdentifier
           if subscribers == None:
             resp.reasonCode.set("No matching subscribers")
@@ -669,9 +865,10 @@ class MQTTBrokers:
               del myclient.inbound[packet.packetIdentifier]
             else:
               myclient.inbound.remove(packet.packetIdentifier)
+            myclient.storeInboundRemove(packet.packetIdentifier)
             if hasattr(packet.properties, "UserProperty"):
               resp.properties.UserProperty = packet.properties.UserProperty
-          respond(sock, resp)
+          self.acknowledge(sock, resp)
 
   def handleBehaviourPublish(self,sock, topic, data):
     """Handle behaviour packet.
@@ -704,8 +901,9 @@ class MQTTBrokers:
         del myclient.inbound[packet.packetIdentifier]
       else:
         myclient.inbound.remove(packet.packetIdentifier)
+      myclient.storeInboundRemove(packet.packetIdentifier)
     resp = MQTTV5.Pubcomps()
-    logger.info("[MQTT5-2.2.1-5-pubcomp] pubcomp message id same as publish")
+    conformance("[MQTT5-2.2.1-5-pubcomp] pubcomp message id same as publish")
     resp.packetIdentifier = packet.packetIdentifier
     if not pub:
       resp.reasonCode.set("Packet identifier not found")
@@ -717,12 +915,12 @@ class MQTTBrokers:
         resp.properties.UserProperty = packet.properties.UserProperty
       if hasattr(myclient, "pubcomp_error"):
         del myclient.pubcomp_error
-    respond(sock, resp)
+    self.acknowledge(sock, resp)
 
   def pingreq(self, sock, packet):
-    logger.info("[MQTT5-3.1.2-20] client must send ping in the absence of other packets")
+    conformance("[MQTT5-3.1.2-20] client must send ping in the absence of other packets")
     resp = MQTTV5.Pingresps()
-    logger.info("[MQTT-3.12.4-1] sending pingresp in response to pingreq")
+    conformance("[MQTT-3.12.4-1] sending pingresp in response to pingreq")
     respond(sock, resp)
 
   def puback(self, sock, packet):
@@ -733,9 +931,9 @@ class MQTTBrokers:
     "confirmed reception of qos 2"
     myclient = self.clients[sock]
     if myclient.pubrec(packet.packetIdentifier):
-      logger.info("[MQTT-3.5.4-1] must reply with pubrel in response to pubrec")
+      conformance("[MQTT-3.5.4-1] must reply with pubrel in response to pubrec")
       resp = MQTTV5.Pubrels()
-      logger.info("[MQTT5-2.2.1-5-pubrel] pubrel message id same as publish")
+      conformance("[MQTT5-2.2.1-5-pubrel] pubrel message id same as publish")
       resp.packetIdentifier = packet.packetIdentifier
       respond(sock, resp)
 
@@ -748,5 +946,5 @@ class MQTTBrokers:
       client = self.clients[sock]
       if client.keepalive > 0 and time.monotonic() - client.lastPacket > client.keepalive * 1.5:
         # keep alive timeout
-        logger.info("[MQTT5-3.1.2-22] keepalive timeout for client %s", client.id)
+        conformance("[MQTT5-3.1.2-22] keepalive timeout for client %s", client.id)
         self.disconnect(sock, None, sendWillMessage=True)
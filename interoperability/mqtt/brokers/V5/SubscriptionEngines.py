@@ -22,6 +22,7 @@ from . import Topics, Subscriptions
 import mqtt.formats.MQTTV5 as MQTTV5
 
 from .Subscriptions import *
+from mqtt.brokers.coverage import conformance
 
 logger = logging.getLogger('MQTT broker')
 
@@ -32,6 +33,7 @@ class SubscriptionEngines:
 
    def __init__(self, sharedData={}):
      self.sharedData = sharedData
+     self.observers = []
      if "subscriptions" not in self.sharedData:
        self.sharedData["subscriptions"] = []  # list of subscriptions
      else:
@@ -48,7 +50,16 @@ class SubscriptionEngines:
      self.__dollar_retained = self.sharedData["dollar_retained"] 
 
    def reinitialize(self):
+     observers = self.observers
+     for s in self.__subscriptions + self.__dollar_subscriptions:
+       for observer in observers:
+         observer.unsubscribed(s.getTopic())
      self.__init__()
+     self.observers = observers
+
+   def addObserver(self, observer):
+     "observer.subscribed and observer.unsubscribed are called when a subscription is added or removed"
+     self.observers.append(observer)
 
    def subscribe(self, aClientid, topic, options):
      if type(topic) == type([]):
@@ -58,7 +69,7 @@ class SubscriptionEngines:
          rc.append(self.__subscribe(aClientid, aTopic, options[count]))
          count += 1
        if count > 1:
-         logger.info("[MQTT-3.8.4-4] Multiple topics in one subscribe")
+         conformance("[MQTT-3.8.4-4] Multiple topics in one subscribe")
      else:
        rc = self.__subscribe(aClientid, topic, options)
      return rc
@@ -72,10 +83,14 @@ class SubscriptionEngines:
        for s in subscriptions:
          if s.getClientid() == aClientid and s.getTopic() == aTopic:
            s.resubscribe(options)
+           if hasattr(subscriptions, "updated"): # persistent
+             subscriptions.updated(s)
            resubscribed = True
        if not resubscribed:
          rc = Subscriptions(aClientid, aTopic, options)
          subscriptions.append(rc)
+         for observer in self.observers:
+           observer.subscribed(aTopic)
      return rc, resubscribed
 
    def unsubscribe(self, aClientid, aTopic):
@@ -83,7 +98,7 @@ class SubscriptionEngines:
      matchedAny = False
      if type(aTopic) == type([]):
        if len(aTopic) > 1:
-         logger.info("[MQTT-3.10.4-6] each topic must be processed in sequence")
+         conformance("[MQTT-3.10.4-6] each topic must be processed in sequence")
        for t in aTopic:
          matched = self.__unsubscribe(aClientid, t)
          rc.append(MQTTV5.ReasonCodes(MQTTV5.PacketTypes.UNSUBACK, "Success") if matched else
@@ -94,7 +109,7 @@ class SubscriptionEngines:
        matchedAny = self.__unsubscribe(aClientid, aTopic)
        rc.append(ReasonCodes(UNSUBACK, "Success") if matched else ReasonCodes(UNSUBACK, "No subscription found"))
      if not matchedAny:
-       logger.info("[MQTT-3.10.4-5] Unsuback must be sent even if no topics are matched")
+       conformance("[MQTT-3.10.4-5] Unsuback must be sent even if no topics are matched")
      return rc
 
    def __unsubscribe(self, aClientid, aTopic):
@@ -104,9 +119,11 @@ class SubscriptionEngines:
        subscriptions = self.__subscriptions if not isDollarTopic(aTopic) else self.__dollar_subscriptions
        for s in subscriptions:
          if s.getClientid() == aClientid and s.getTopic() == aTopic:
-           logger.info("[MQTT-3.10.4-1] topic filters must be compared byte for byte")
-           logger.info("[MQTT-3.10.4-2] no more messages must be added after unsubscribe is complete")
+           conformance("[MQTT-3.10.4-1] topic filters must be compared byte for byte")
+           conformance("[MQTT-3.10.4-2] no more messages must be added after unsubscribe is complete")
            subscriptions.remove(s)
+           for observer in self.observers:
+             observer.unsubscribed(aTopic)
            matched = True
            break # once we've hit one, that's us done
      return matched
@@ -116,6 +133,8 @@ class SubscriptionEngines:
        for s in subscriptions[:]:
          if s.getClientid() == aClientid:
            subscriptions.remove(s)
+           for observer in self.observers:
+             observer.unsubscribed(s.getTopic())
 
    def getSubscriptions(self, aTopic, aClientid=None):
      "return a list of subscriptions for this client"
@@ -138,7 +157,7 @@ class SubscriptionEngines:
          else: # MQTT V3 case
            chosen = (MQTTV5.SubscribeOptions(QoS=sub.getQoS()), MQTTV5.Properties(MQTTV5.PacketTypes.SUBSCRIBE))
        else:
-         logger.info("[MQTT-3.3.5-1] Overlapping subscriptions max QoS")
+         conformance("[MQTT-3.3.5-1] Overlapping subscriptions max QoS")
          if sub.getQoS() > chosen[0].QoS:
            if hasattr(sub, "getOptions"):
              chosen = sub.getOptions()
@@ -165,10 +184,11 @@ class SubscriptionEngines:
        retained = self.__retained if not isDollarTopic(aTopic) else self.__dollar_retained
        if len(aMessage) == 0:
          if aTopic in retained.keys():
-           logger.info("[MQTT-3.3.1-11] Deleting zero byte retained message")
+           conformance("[MQTT-3.3.1-11] Deleting zero byte retained message")
            del retained[aTopic]
        else:
-         retained[aTopic] = (aMessage, aQoS, receivedTime, properties)
+         # the properties are kept packed: smaller, quicker to persist and not changed by later deliveries
+         retained[aTopic] = (aMessage, aQoS, receivedTime, properties.pack() if properties else None)
 
    def getRetained(self, aTopic):
      "returns (msg, QoS, properties) for a topic"
@@ -177,6 +197,10 @@ class SubscriptionEngines:
        retained = self.__retained if not isDollarTopic(aTopic) else self.__dollar_retained
        if aTopic in retained.keys():
          result = retained[aTopic]
+         if len(result) == 4 and isinstance(result[3], bytes):
+           properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+           properties.unpack(result[3])
+           result = result[:3] + (properties,)
      return result
 
    def getRetainedTopics(self, aTopic):
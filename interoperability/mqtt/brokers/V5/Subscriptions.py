@@ -18,16 +18,25 @@
 
 import time, logging
 
-#from mqtt.formats import MQTTV5
+from mqtt.formats import MQTTV5
+from mqtt.brokers.coverage import conformance
 
 logger = logging.getLogger('MQTT broker')
 
+def unpackOptions(data):
+  "subscription options and properties from the packed form used for persistence"
+  options = MQTTV5.SubscribeOptions()
+  options.unpack(data[:1])
+  properties = MQTTV5.Properties(MQTTV5.PacketTypes.SUBSCRIBE)
+  properties.unpack(data[1:])
+  return (options, properties)
+
 class Subscriptions:
 
   def __init__(self, aClientid, aTopic, options):
     self.__clientid = aClientid
     self.__topic = aTopic
-    self.__options = options
+    self.__options = options # or their packed form, until first used after recovery
 
   def getClientid(self):
     return self.__clientid
@@ -36,15 +45,26 @@ class Subscriptions:
     return self.__topic
 
   def getQoS(self):
+    if isinstance(self.__options, bytes):
+      return self.__options[0] & 0x03
     return self.__options[0].QoS
 
   def getOptions(self):
+    if isinstance(self.__options, bytes):
+      self.__options = unpackOptions(self.__options)
     return self.__options
 
   def resubscribe(self, options):
-    logger.info("[MQTT-1.1.0-1] resubscription for client %s on topic %s", self.__clientid, self.__topic)
-    logger.info("[MQTT-3.8.4-3] resubscription for client %s on topic %s", self.__clientid, self.__topic)
+    conformance("[MQTT-1.1.0-1] resubscription for client %s on topic %s", self.__clientid, self.__topic)
+    conformance("[MQTT-3.8.4-3] resubscription for client %s on topic %s", self.__clientid, self.__topic)
     self.__options = options
 
+  def __reduce__(self):
+    "persist the options packed, which is much smaller and quicker to load than the objects"
+    options = self.__options
+    if not isinstance(options, bytes):
+      options = options[0].pack() + options[1].pack()
+    return (Subscriptions, (self.__clientid, self.__topic, options))
+
   def __repr__(self):
-    return repr({"clientid":self.__clientid, "topic":self.__topic, "options":self.__options})
+    return repr({"clientid":self.__clientid, "topic":self.__topic, "options":self.getOptions()})
@@ -0,0 +1,148 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+The topic aliases the broker sends to one MQTT 5.0 client.
+
+The client's connect packet sets the number of aliases it accepts.  A publication is
+sent with the topic name and an alias, after which the client maps the alias to that
+name, or with the alias alone once the client has the name.  When all the aliases are
+in use, one is given to a new topic name, which is sent again in full:
+
+  topic_alias_policy lru   - the alias of the topic name sent least recently (default)
+  topic_alias_policy lfu   - the alias of the topic name sent least often, but only to a
+                             topic name which has been sent more often.  So the aliases
+                             stay with the busiest topics, and a topic name sent once
+                             doesn't displace one of them.
+
+For lfu, the publications sent are counted for the topic names with aliases and for up
+to MAX_COUNTED others.  Beyond that the counts are halved, and those which reach 0
+dropped, so that they follow changes in the traffic.  The topic names with aliases are
+kept in a heap, least often and then least recently sent first, so finding the one to
+replace takes O(log n) for n aliases, not a scan of them all.  A heap entry is added each
+time a topic name is sent, and the out of date ones skipped, or dropped when the heap is
+rebuilt at twice the number of aliases.
+
+"""
+
+import collections, heapq
+
+POLICIES = ["lru", "lfu"]
+ALIAS_BYTES = 3 # the size of a topic alias property: identifier and 2 byte integer
+MAX_COUNTED = 1000 # topic names without an alias counted for lfu
+
+
+class TopicAliases:
+
+  def __init__(self, maximum=0, policy="lru"):
+    "maximum is the topic alias maximum of the client's connect packet"
+    assert policy in POLICIES
+    self.maximum = maximum
+    self.policy = policy
+    self.aliases = collections.OrderedDict() # topic name -> alias, least recently sent first
+    self.free = [] # aliases given back by forget
+    self.next = 1 # the lowest alias never used
+    self.counts = {} # topic name -> publications sent, for lfu
+    self.heap = [] # (count, order, topic name) for lfu, some out of date
+    self.entries = {} # topic name with an alias -> its current heap entry, for lfu
+    self.order = 0 # of the publications sent, to keep the least recently sent of equals first
+    self.reassigned = 0
+
+  def __len__(self):
+    return len(self.aliases)
+
+  def alias(self, topic):
+    """
+    the alias to send a publication on topic with, and whether the client has the topic name
+    for it already.  (0, False) if the publication is to be sent without an alias.
+    """
+    if self.maximum == 0:
+      return 0, False
+    if self.policy == "lfu":
+      count = self.count(topic)
+    alias = self.aliases.get(topic)
+    if alias != None:
+      self.aliases.move_to_end(topic)
+      if self.policy == "lfu":
+        self.push(topic, count)
+      return alias, True
+    if len(self.free) > 0:
+      alias = self.free.pop()
+    elif self.next <= self.maximum:
+      alias = self.next
+      self.next += 1
+    else:
+      if self.policy == "lfu":
+        replaced = self.leastFrequent()
+        if self.counts[replaced] >= count:
+          return 0, False
+        del self.entries[replaced]
+      else:
+        replaced = next(iter(self.aliases))
+      alias = self.aliases.pop(replaced)
+      self.reassigned += 1
+    self.aliases[topic] = alias
+    if self.policy == "lfu":
+      self.push(topic, count)
+    return alias, False
+
+  def count(self, topic):
+    if topic not in self.counts and len(self.counts) >= len(self.aliases) + MAX_COUNTED:
+      self.counts = {name : count // 2 for name, count in self.counts.items()
+                     if count > 1 or name in self.aliases}
+      self.entries = {name : (self.counts[name], order, name) for (count, order, name) in self.entries.values()}
+      self.rebuild()
+    count = self.counts.get(topic, 0) + 1
+    self.counts[topic] = count
+    return count
+
+  def push(self, topic, count):
+    "record a publication sent on a topic name with an alias, for lfu"
+    self.order += 1
+    entry = (count, self.order, topic)
+    self.entries[topic] = entry
+    heapq.heappush(self.heap, entry)
+    if len(self.heap) > 2 * len(self.entries) + 16:
+      self.rebuild()
+
+  def rebuild(self):
+    "the heap without its out of date entries"
+    self.heap = list(self.entries.values())
+    heapq.heapify(self.heap)
+
+  def leastFrequent(self):
+    "the topic name with an alias sent least often, the least recently sent of equals"
+    while self.entries.get(self.heap[0][2]) != self.heap[0]:
+      heapq.heappop(self.heap)
+    return self.heap[0][2]
+
+  def forget(self, topic):
+    "the publication which would have given the client this topic name was not sent"
+    alias = self.aliases.pop(topic, None)
+    if alias != None:
+      self.free.append(alias)
+      self.entries.pop(topic, None)
+
+
+def saving(topic, known):
+  """
+  the bytes saved by sending a publication on topic with its alias, which is negative when
+  the client doesn't know the alias yet, so the topic name is sent too
+  """
+  return len(topic.encode("utf-8")) - ALIAS_BYTES if known else -ALIAS_BYTES
@@ -19,28 +19,29 @@
 
 import re, logging
 from mqtt.formats import MQTTV311 as MQTTV3
+from mqtt.brokers.coverage import conformance
 
 logger = logging.getLogger('MQTT broker')
 
  
 def isValidTopicName(aName):
-  logger.info("[MQTT-4.7.3-1] all topic names and filters must be at least 1 char")
+  conformance("[MQTT-4.7.3-1] all topic names and filters must be at least 1 char")
   if len(aName) < 1:
     raise MQTTV3.MQTTException("MQTT-4.7.3-1] all topic names and filters must be at least 1 char")
     return False
-  logger.info("[MQTT-4.7.3-3] all topic names and filters must be <= 65535 bytes long")
+  conformance("[MQTT-4.7.3-3] all topic names and filters must be <= 65535 bytes long")
   if len(aName) > 65535:
     raise MQTTV3.MQTTException("[MQTT-4.7.3-3] all topic names and filters must be <= 65535 bytes long")
     return False
   rc = True
 
   # '#' wildcard can be only at the end of a topic (used to be beginning as well)
-  logger.info("[MQTT-4.7.1-2] # must be last, and next to /")
+  conformance("[MQTT-4.7.1-2] # must be last, and next to /")
   if aName[0:-1].find('#') != -1:
     raise MQTTV3.MQTTException("[MQTT-4.7.1-2] # must be last, and next to /")
     rc = False
 
-  logger.info("[MQTT-4.7.1-3] + can be used at any complete level")
+  conformance("[MQTT-4.7.1-3] + can be used at any complete level")
   # '#' or '+' only next to a slash separator or end of name
   wilds = '#+'
   for c in wilds:
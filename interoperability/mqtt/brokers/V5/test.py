@@ -0,0 +1,81 @@
+import unittest, random
+
+import TopicAliases
+
+class Test(unittest.TestCase):
+
+    def testNone(self):
+      aliases = TopicAliases.TopicAliases(0)
+      self.assertEqual(aliases.alias("a"), (0, False))
+      self.assertEqual(len(aliases), 0)
+
+    def testLRU(self):
+      aliases = TopicAliases.TopicAliases(2, "lru")
+      self.assertEqual(aliases.alias("a"), (1, False))
+      self.assertEqual(aliases.alias("a"), (1, True))
+      self.assertEqual(aliases.alias("b"), (2, False))
+      self.assertEqual(aliases.alias("a"), (1, True))
+      self.assertEqual(aliases.alias("c"), (2, False)) # b was sent least recently
+      self.assertEqual(aliases.alias("b"), (1, False))
+      self.assertEqual(aliases.alias("c"), (2, True))
+      self.assertEqual(aliases.reassigned, 2)
+
+    def testLFU(self):
+      aliases = TopicAliases.TopicAliases(2, "lfu")
+      for i in range(3):
+        aliases.alias("a")
+      self.assertEqual(aliases.alias("b"), (2, False))
+      # a topic name sent as often as those with aliases doesn't take one
+      self.assertEqual(aliases.alias("c"), (0, False))
+      self.assertEqual(aliases.alias("c"), (2, False))
+      self.assertEqual(aliases.alias("a"), (1, True))
+      self.assertEqual(aliases.reassigned, 1)
+
+    def testLFUEquals(self):
+      "of topic names sent equally often, the least recently sent loses its alias"
+      aliases = TopicAliases.TopicAliases(2, "lfu")
+      for topic in ["a", "a", "b", "b"]:
+        aliases.alias(topic)
+      self.assertEqual(aliases.alias("c"), (0, False))
+      self.assertEqual(aliases.alias("c"), (0, False))
+      self.assertEqual(aliases.alias("c"), (1, False))
+      self.assertEqual(aliases.alias("b"), (2, True))
+
+    def testLFUHeap(self):
+      "the heap finds the same topic name as a scan, and stays small"
+      aliases = TopicAliases.TopicAliases(10, "lfu")
+      generator = random.Random(1)
+      for i in range(20000):
+        # a few busy topic names, and enough others for the counts to be halved
+        if generator.random() < .7:
+          topic = "topic/%d" % int(generator.expovariate(.05))
+        else:
+          topic = "topic/%d" % generator.randrange(3000)
+        aliases.alias(topic)
+        if generator.random() < .01:
+          aliases.forget(topic)
+        if len(aliases.aliases) > 0:
+          self.assertEqual(aliases.leastFrequent(), min(aliases.aliases, key=aliases.counts.__getitem__))
+        self.assertLessEqual(len(aliases.heap), 2 * aliases.maximum + 17)
+      self.assertGreater(aliases.reassigned, 0)
+      self.assertLessEqual(len(aliases.counts), len(aliases) + TopicAliases.MAX_COUNTED + 1)
+
+    def testForget(self):
+      for policy in TopicAliases.POLICIES:
+        aliases = TopicAliases.TopicAliases(2, policy)
+        self.assertEqual(aliases.alias("a"), (1, False))
+        self.assertEqual(aliases.alias("b"), (2, False))
+        aliases.forget("a")
+        self.assertEqual(len(aliases), 1)
+        self.assertEqual(aliases.alias("c"), (1, False)) # the alias given back is used again
+        self.assertEqual(aliases.alias("a"), (2, False)) # sent least recently, and for lfu less often
+        self.assertEqual(aliases.reassigned, 1)
+
+    def testSaving(self):
+      self.assertEqual(TopicAliases.saving("sensors/temperature", True), 19 - TopicAliases.ALIAS_BYTES)
+      self.assertEqual(TopicAliases.saving("sensors/temperature", False), -TopicAliases.ALIAS_BYTES)
+      self.assertEqual(TopicAliases.saving("capteurs/température", True), 21 - TopicAliases.ALIAS_BYTES)
+
+
+if __name__ == "__main__":
+  unittest.main()
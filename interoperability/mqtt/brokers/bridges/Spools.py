@@ -0,0 +1,252 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+The publications a bridge couldn't send, kept on disk until the remote broker has them.
+
+Publications are appended to segment files, and read back in order when the bridge
+can send them.  A position in the spool is (segment number, offset).  Once the remote
+broker has acknowledged every publication up to a position, that position is written
+to the checkpoint file, and the segments before it are deleted.  After a restart,
+reading starts again from the checkpoint, so only the publications which were in
+flight are sent twice.
+
+Files, for a name of "bridges/remote1":
+
+  bridges/remote1.spool.checkpoint   - the acknowledged position
+  bridges/remote1.spool.00000001     - segments, in order
+
+Each record is as in the write ahead log: 4 byte length, 4 byte crc32 of the data,
+pickled data.  An incomplete record at the end of the last segment is discarded when
+the spool is opened, and the rest of a segment after a corrupt or incomplete record is
+skipped when it is read.  Appends are flushed to the operating system at once, and synced
+to disk when the checkpoint is written.
+
+"""
+
+import os, glob, pickle, zlib, collections, logging
+
+from mqtt.brokers.persistence.WriteAheadLogs import HEADER
+
+logger = logging.getLogger('MQTT broker')
+
+SEGMENT_SIZE = 16 * 1024 * 1024 # bytes
+
+
+class Spools:
+
+  def __init__(self, filename, segmentSize=SEGMENT_SIZE, maximum=0):
+    """
+    filename: the path and prefix of the files
+    segmentSize: a new segment is started when the last one is bigger than this
+    maximum: bytes on disk beyond which the oldest segments are dropped, 0 for no limit
+    """
+    self.filename = filename
+    self.segmentSize = segmentSize
+    self.maximum = maximum
+    self.file = None       # the segment being appended to
+    self.reader = None     # the segment being read
+    self.readSegment = 0
+    self.readOffset = 0
+    self.writeSegment = 0
+    self.writeOffset = 0
+    self.sizes = {}        # segment number -> bytes, of the segments on disk
+    self.outstanding = collections.OrderedDict() # position after each record read -> acknowledged?
+    self.acknowledged = (0, 0) # every record before this position has been acknowledged
+    self.checkpointed = None
+    self.dropped = 0       # segments dropped when the spool was full
+
+  def segmentName(self, segment):
+    return "%s.spool.%08d" % (self.filename, segment)
+
+  def segments(self):
+    "segment numbers on disk, in order"
+    segments = []
+    for name in glob.glob(glob.escape(self.filename) + ".spool.*"):
+      try:
+        segments.append(int(name.rsplit(".", 1)[1]))
+      except ValueError:
+        pass
+    return sorted(segments)
+
+  def open(self):
+    directory = os.path.dirname(self.filename)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    segments = self.segments()
+    self.sizes = {segment : os.path.getsize(self.segmentName(segment)) for segment in segments}
+    checkpointName = self.filename + ".spool.checkpoint"
+    if os.path.exists(checkpointName):
+      with open(checkpointName, "rb") as checkpoint:
+        self.acknowledged = pickle.load(checkpoint)
+    elif len(segments) > 0:
+      self.acknowledged = (segments[0], 0)
+    else:
+      self.acknowledged = (1, 0)
+    self.checkpointed = self.acknowledged
+    for segment in [segment for segment in segments if segment < self.acknowledged[0]]:
+      del self.sizes[segment] # the checkpoint was written, but they weren't deleted
+      os.remove(self.segmentName(segment))
+    segments = sorted(self.sizes)
+    self.writeSegment = max(segments[-1] if len(segments) > 0 else 0, self.acknowledged[0])
+    self.writeOffset = self.validate(self.writeSegment)
+    self.file = open(self.segmentName(self.writeSegment), "ab")
+    self.sizes[self.writeSegment] = self.writeOffset
+    self.rewind()
+    if not self.empty():
+      logger.info("Spool %s has %d bytes to send", self.filename, self.pending())
+
+  def validate(self, segment):
+    "the length of the complete records at the start of a segment, to which it is truncated"
+    name = self.segmentName(segment)
+    if not os.path.exists(name):
+      return 0
+    with open(name, "rb") as segmentFile:
+      buffer = segmentFile.read()
+    offset = 0
+    while offset + HEADER.size <= len(buffer):
+      length, crc = HEADER.unpack_from(buffer, offset)
+      data = buffer[offset + HEADER.size:offset + HEADER.size + length]
+      if len(data) < length or zlib.crc32(data) != crc:
+        break
+      offset += HEADER.size + length
+    if offset < len(buffer):
+      logger.info("Discarding %d bytes of incomplete spool record at the end of %s", len(buffer) - offset, name)
+      with open(name, "r+b") as segmentFile:
+        segmentFile.truncate(offset)
+    return offset
+
+  def close(self):
+    self.checkpoint()
+    for segmentFile in [self.file, self.reader]:
+      if segmentFile:
+        segmentFile.close()
+    self.file = self.reader = None
+
+  def append(self, record):
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    if self.writeOffset >= self.segmentSize:
+      self.nextSegment()
+    self.file.write(HEADER.pack(len(data), zlib.crc32(data)) + data)
+    self.file.flush()
+    self.writeOffset += HEADER.size + len(data)
+    self.sizes[self.writeSegment] = self.writeOffset
+    if self.maximum > 0 and sum(self.sizes.values()) > self.maximum:
+      self.drop()
+
+  def nextSegment(self):
+    self.file.close()
+    self.writeSegment += 1
+    self.writeOffset = 0
+    self.file = open(self.segmentName(self.writeSegment), "ab")
+    self.sizes[self.writeSegment] = 0
+
+  def drop(self):
+    "make room by dropping the oldest segment, unless it's the one being appended to"
+    oldest = min(self.sizes)
+    if oldest == self.writeSegment:
+      return
+    logger.info("Spool %s full, dropping segment %d of %d bytes", self.filename, oldest, self.sizes[oldest])
+    self.dropped += 1
+    first = (oldest + 1, 0)
+    self.acknowledged = max(self.acknowledged, first)
+    for position in [position for position in self.outstanding if position < first]:
+      del self.outstanding[position]
+    if (self.readSegment, self.readOffset) < first:
+      self.seek(first)
+    del self.sizes[oldest]
+    os.remove(self.segmentName(oldest))
+
+  def readPosition(self):
+    return (self.readSegment, self.readOffset)
+
+  def endPosition(self):
+    return (self.writeSegment, self.writeOffset)
+
+  def empty(self):
+    "have all the records been read?"
+    return self.readPosition() >= self.endPosition()
+
+  def pending(self):
+    "bytes not yet read"
+    return sum(size for segment, size in self.sizes.items() if segment >= self.readSegment) - self.readOffset
+
+  def seek(self, position):
+    if self.reader:
+      self.reader.close()
+      self.reader = None
+    self.readSegment, self.readOffset = position
+
+  def read(self):
+    "the next record and the position after it, or None if all have been read"
+    while not self.empty():
+      if self.readOffset >= self.sizes.get(self.readSegment, 0) and self.readSegment < self.writeSegment:
+        self.seek((self.readSegment + 1, 0))
+        continue
+      if self.reader == None:
+        self.reader = open(self.segmentName(self.readSegment), "rb")
+        self.reader.seek(self.readOffset)
+      header = self.reader.read(HEADER.size)
+      data = None
+      if len(header) == HEADER.size:
+        length, crc = HEADER.unpack(header)
+        data = self.reader.read(length)
+      if data == None or len(data) < length or zlib.crc32(data) != crc:
+        logger.error("Spool %s segment %d is corrupt after offset %d", self.filename, self.readSegment, self.readOffset)
+        self.sizes[self.readSegment] = self.readOffset
+        if self.readSegment == self.writeSegment:
+          self.nextSegment()
+        continue
+      self.readOffset += HEADER.size + length
+      position = self.readPosition()
+      self.outstanding[position] = False
+      return pickle.loads(data), position
+    return None
+
+  def acknowledge(self, position):
+    "the record before position has been received by the remote broker"
+    if position in self.outstanding:
+      self.outstanding[position] = True
+      while len(self.outstanding) > 0 and next(iter(self.outstanding.values())):
+        self.acknowledged = self.outstanding.popitem(last=False)[0]
+
+  def rewind(self):
+    "read again from the first record not acknowledged, after the connection is lost"
+    self.outstanding.clear()
+    self.seek(self.acknowledged)
+
+  def checkpoint(self):
+    """
+    write the acknowledged position, if it has changed, and delete the segments before it.
+    Called at most once a second, as it syncs the files to disk.
+    """
+    acknowledged = self.acknowledged
+    if acknowledged == self.checkpointed or self.file == None:
+      return
+    os.fsync(self.file.fileno())
+    temporary = self.filename + ".spool.checkpoint.tmp"
+    with open(temporary, "wb") as checkpoint:
+      pickle.dump(acknowledged, checkpoint, pickle.HIGHEST_PROTOCOL)
+      checkpoint.flush()
+      os.fsync(checkpoint.fileno())
+    os.replace(temporary, self.filename + ".spool.checkpoint")
+    self.checkpointed = acknowledged
+    for segment in [segment for segment in self.sizes if segment < acknowledged[0]]:
+      del self.sizes[segment]
+      os.remove(self.segmentName(segment))
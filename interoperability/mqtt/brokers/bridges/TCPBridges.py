@@ -16,126 +16,459 @@
 *******************************************************************
 """
 
-import sys, traceback, socket, logging, getopt, hashlib, base64
-import threading, ssl, time
+"""
 
-import mqtt.clients.V5
-from mqtt.brokers.V5 import MQTTBrokers as MQTTV5Brokers
-from mqtt.formats import MQTTV311, MQTTV5
+A bridge to another broker over an MQTT 5.0 connection, configured in a section of the
+configuration file like that of Eclipse Mosquitto:
 
-server = None
-logger = logging.getLogger('MQTT broker')
+  connection remote1
+  address remote.example.com:1883
+  clientid site1-bridge
+  topic sensors/# out 1
+  topic commands/# in 2 site1/ factory/site1/
+  restart_timeout 1 60
 
+Each topic line is
 
-class Callbacks(mqtt.clients.V5.Callback):
+  topic <pattern> [in | out | both [<qos> [<local prefix> <remote prefix>]]]
 
-  def __init__(self, broker):
-    self.messages = []
-    self.messagedicts = []
-    self.publisheds = []
-    self.subscribeds = []
-    self.unsubscribeds = []
-    self.disconnects = []
-    self.broker = broker
+out (the default) sends the local publications matching local prefix + pattern to the
+remote broker, with the local prefix replaced by the remote prefix, and in the reverse.
+Publications are passed on at most at the QoS of the rule, 0 by default.
+
+Locally the bridge is an internal subscriber of the MQTT 5.0 broker (see Brokers.attach)
+and remotely an ordinary client.  Both subscriptions are noLocal, so a message the bridge
+publishes on one side isn't sent back to it, and retainAsPublished, so retained messages
+stay retained.  Holding its lock, the broker only queues the local publications for the
+bridge, whose own thread sends them, so a slow remote broker doesn't hold up the local
+clients.  Up to the remote broker's receive maximum of QoS 1 and 2 publications are in
+flight, the rest wait in the queue.  A lost connection is reopened after restart_timeout
+base seconds, doubling after each failure up to cap.  A connection on which a send fails
+is closed, and the publication queued again.
+
+With a spool, the publications which can't be sent at once, because the connection is
+down or the receive maximum has been reached, are written to disk (see Spools) instead
+of being queued in memory.  Only the bridge thread uses the spool, so the broker never
+waits for its writes, nor for the syncs of its checkpoint every second:
+
+  spool_location /var/lib/mqtt/bridges
+  spool_rate 100                # publications a second sent from the spool, 0 for no limit
+  spool_segment_size 16777216
+  spool_maximum 1073741824      # bytes, beyond which the oldest are dropped, 0 for no limit
+
+"""
+
+import threading, logging, collections, copy, random, time, os
+
+import mqtt.clients.V5
+from mqtt.formats import MQTTV5
+from mqtt.brokers.V5 import Brokers
+from mqtt.brokers.V5.Topics import topicMatches
+from mqtt.brokers.persistence.SessionStores import packMessage, unpackMessage
+from . import Spools
+
+logger = logging.getLogger('MQTT broker')
+
+MAX_QUEUED = 10000 # publications queued while the remote broker is busy or unreachable
+RESTART_TIMEOUT = (5, 30) # seconds before the first reconnect attempt, and at most
+TICK = 0.1 # seconds between sending spooled publications at a limited rate
+READ = "read" # from Bridges.next, the next publication to send is read from the spool
+
+
+class Mappings:
+  "one topic line: a topic pattern, a direction, a QoS and how the topic names are mapped"
+
+  directions = ["in", "out", "both"]
+
+  def __init__(self, pattern, direction="out", qos=0, localPrefix="", remotePrefix=""):
+    if direction not in self.directions:
+      raise ValueError("Bridge topic direction %s must be one of %s" % (direction, self.directions))
+    if qos not in [0, 1, 2]:
+      raise ValueError("Bridge topic QoS %d must be 0, 1 or 2" % qos)
+    self.direction = direction
+    self.qos = qos
+    self.localPrefix = localPrefix
+    self.remotePrefix = remotePrefix
+    self.localFilter = localPrefix + pattern
+    self.remoteFilter = remotePrefix + pattern
+
+  @classmethod
+  def parse(cls, words):
+    "from the words after topic on a configuration line, where \"\" is an empty prefix"
+    words = [word if word != '""' else "" for word in words]
+    args = [words[0], words[1] if len(words) > 1 else "out", int(words[2]) if len(words) > 2 else 0]
+    if len(words) > 3:
+      args += [words[3], words[4] if len(words) > 4 else ""]
+    return cls(*args)
+
+  def outward(self):
+    return self.direction in ["out", "both"]
+
+  def inward(self):
+    return self.direction in ["in", "both"]
+
+  def toRemote(self, topic):
+    "the remote topic name for a local publication, or None if this mapping doesn't send it"
+    if self.outward() and topicMatches(self.localFilter, topic):
+      return self.remotePrefix + topic[len(self.localPrefix):]
+    return None
+
+  def toLocal(self, topic):
+    "the local topic name for a remote publication, or None if this mapping doesn't receive it"
+    if self.inward() and topicMatches(self.remoteFilter, topic):
+      return self.localPrefix + topic[len(self.remotePrefix):]
+    return None
+
+  def options(self):
+    return MQTTV5.SubscribeOptions(QoS=self.qos, noLocal=True, retainAsPublished=True)
 
   def __str__(self):
-     return str(self.messages) + str(self.messagedicts) + str(self.publisheds) + \
-        str(self.subscribeds) + str(self.unsubscribeds) + str(self.disconnects)
+    return "%s %s %d %s" % (self.localFilter, self.direction, self.qos, self.remoteFilter)
 
-  def clear(self):
-    self.__init__()
+  __repr__ = __str__
 
-  def disconnected(self, reasoncode, properties):
-    logging.info("disconnected %s %s", str(reasoncode), str(properties))
-    self.disconnects.append({"reasonCode" : reasoncode, "properties" : properties})
 
-  def connectionLost(self, cause):
-    logging.info("connectionLost %s" % str(cause))
+class Callbacks(mqtt.clients.V5.Callback):
+  "the messages and acknowledgements received from the remote broker"
 
-  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
-    logging.info("publishArrived %s %s %d %s %d %s", topicName, payload, qos, retained, msgid, str(properties))
-    self.messages.append((topicName, payload, qos, retained, msgid, properties))
-    self.messagedicts.append({"topicname" : topicName, "payload" : payload,
-        "qos" : qos, "retained" : retained, "msgid" : msgid, "properties" : properties})
+  def __init__(self, bridge):
+    self.bridge = bridge
 
-    # add to local broker
-    self.broker.broker.publish(aClientid, topic, message, qos, properties, receivedTime, retained)
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.bridge.remoteArrived(topicName, payload, qos, retained, properties)
     return True
 
   def published(self, msgid):
-    logging.info("published %d", msgid)
-    self.publisheds.append(msgid)
+    self.bridge.published(msgid)
 
-  def subscribed(self, msgid, data):
-    logging.info("subscribed %d", msgid)
-    self.subscribeds.append((msgid, data))
+  def subscribed(self, msgid, reasonCodes):
+    for reasonCode in reasonCodes:
+      if reasonCode.value >= 0x80:
+        logger.error("Bridge %s subscription rejected by remote broker: %s", self.bridge.name,
+                     reasonCode.getName())
 
-  def unsubscribed(self, msgid):
-    logging.info("unsubscribed %d", msgid)
-    self.unsubscribeds.append(msgid)
+  def disconnected(self, reasoncode, properties):
+    logger.info("Bridge %s disconnected by remote broker: %s", self.bridge.name, reasoncode)
+
+  def connectionLost(self, cause):
+    self.bridge.lost(cause)
 
 
 class Bridges:
 
-  def __init__(self, host, port):
+  def __init__(self, broker, lock, name, host, port=1883, clientid=None, mappings=[],
+               restartTimeout=RESTART_TIMEOUT, spoolLocation=None, spoolSegmentSize=Spools.SEGMENT_SIZE,
+               spoolMaximum=0, spoolRate=0):
+    """
+    broker is the MQTT 5.0 Brokers object, lock the broker lock.  With a spoolLocation, the
+    publications which can't be sent at once are kept on disk, and sent at up to spoolRate a second.
+    """
+    self.id = "%sbridge/%s" % (Brokers.INTERNAL, name)
+    self.broker = broker
+    self.lock = lock # the broker lock, held when local publications arrive
+    self.condition = threading.Condition() # for the queue and the publications in flight
+    self.name = name
     self.host = host
     self.port = port
-    self.client = mqtt.clients.V5.Client("local")
-    self.callback = Callbacks(broker5)
-    self.client.registerCallback(self.callback)
-    self.local_connect()
-
-  def local_connect(self):
-    # connect locally with V5, so we get noLocal and retainAsPublished
-    connect = MQTTV5.Connects()
-    connect.ClientIdentifier = "local"
-    broker5.connect(self, connect)
-    subscribe = MQTTV5.Subscribes()
-    options = MQTTV5.SubscribeOptions()
-    options.noLocal = options.retainAsPublished = True
-    subscribe.data = [('+', options)]
-    broker5.subscribe(self, subscribe)
+    self.clientid = clientid or name
+    self.mappings = mappings
+    self.restartTimeout = restartTimeout
+    self.client = None
+    self.connected = False
+    self.receiveMaximum = MQTTV5.MAX_PACKETID
+    self.queue = collections.deque() # (publication, spool position to send it at)
+    self.inflight = collections.OrderedDict() # remote msgid -> (publication, spool position after it, mark)
+    self.early = set() # remote msgids acknowledged before send has put them in flight
+    self.dropped = 0
+    self.spool = None # only used by the bridge thread, once started
+    self.incoming = collections.deque() # publications for the bridge thread to spool
+    self.acknowledged = [] # spool positions for the bridge thread to acknowledge
+    self.spooled = False # whether the spool or incoming may have publications to send
+    if spoolLocation:
+      self.spool = Spools.Spools(os.path.join(spoolLocation, name), spoolSegmentSize, spoolMaximum)
+    self.spoolRate = spoolRate
+    self.tokens = 0 # spooled publications which can be sent now, at spoolRate
+    self.refilled = time.monotonic()
+    self.checkpointed = time.monotonic()
+    self.running = True
+    self.thread = threading.Thread(target=self.run, name="MQTT bridge %s" % name, daemon=True)
 
-  def connect(self):
-    self.client.connect(host=self.host, port=self.port, cleanstart=True)
-    # subscribe if necessary
-    options = MQTTV5.SubscribeOptions()
-    options.noLocal = options.retainAsPublished = True
-    self.client.subscribe(["+"], [options])
-
-  def getPacket(self):
-    # get packet from remote 
-    pass
-
-  def handlePacket(self, packet):
-    # response from local broker
-    logger.info("from local broker %s", str(packet))
-    if packet.fh.PacketType == MQTTV5.PacketTypes.PUBLISH:
-      self.client.publish(packet.topicName, packet.data, packet.fh.QoS) #retained=False, properties=None)
+  def __str__(self):
+    return "bridge %s to %s:%d" % (self.name, self.host, self.port)
+
+  def start(self):
+    if self.spool:
+      self.spool.open()
+    outward = [mapping for mapping in self.mappings if mapping.outward()]
+    if len(outward) > 0:
+      with self.lock:
+        self.broker.attach(self, [mapping.localFilter for mapping in outward],
+            [(mapping.options(), MQTTV5.Properties(MQTTV5.PacketTypes.SUBSCRIBE)) for mapping in outward])
+    logger.info("Starting %s, topics %s", self, ", ".join(str(mapping) for mapping in self.mappings))
+    self.thread.start()
+
+  def shutdown(self):
+    with self.lock:
+      self.broker.detach(self.id)
+    with self.condition:
+      self.running = False
+      self.condition.notify()
+      self.disconnect()
+    self.thread.join()
+    if self.spool:
+      for position in self.acknowledged:
+        self.spool.acknowledge(position)
+      # not yet acknowledged, so kept for the next start, after those already spooled
+      for publication, position, mark in self.inflight.values():
+        if position == None:
+          self.spoolAppend(publication)
+      for publication, mark in self.queue:
+        self.spoolAppend(publication)
+      for publication in self.incoming:
+        self.spoolAppend(publication)
+      self.spool.close()
 
   def run(self):
+    "connect, send, and reconnect whenever the connection is lost, backing off exponentially"
+    delay = self.restartTimeout[0]
+    while self.running:
+      if self.connect():
+        delay = self.restartTimeout[0]
+        self.sendLoop()
+        if not self.running:
+          break
+      wait = random.uniform(delay / 2, delay) # spreads out the reconnections of many bridges
+      logger.info("Bridge %s reconnecting in %.1f seconds", self.name, wait)
+      deadline = time.monotonic() + wait
+      while self.running and time.monotonic() < deadline:
+        with self.condition:
+          self.condition.wait_for(lambda: not self.running or len(self.incoming) > 0,
+                                  deadline - time.monotonic())
+        if self.spool:
+          self.flush()
+      delay = min(delay * 2, self.restartTimeout[1])
+
+  def sendLoop(self):
+    "send the queued and spooled publications, in order, up to the receive maximum, until disconnected"
     while True:
-      self.connect()
-      time.sleep(300)
-    self.shutdown()
-
-def setBroker5(aBroker5):
-  global broker5
-  broker5 = aBroker5
-
-def create(port, host="", TLS=False, 
-    cert_reqs=ssl.CERT_REQUIRED,
-    ca_certs=None, certfile=None, keyfile=None):
-
-  if host == "":
-    host = "localhost"
-  logger.info("Starting TCP bridge for address '%s' port %d %s", host, port, "with TLS support" if TLS else "")
-  bridge = Bridges(host, port)
-  thread = threading.Thread(target=bridge.run)
-  thread.start()
-  return bridge
-
-
+      if self.spool:
+        self.flush()
+      with self.condition:
+        if not self.connected or not self.running:
+          return
+        entry = self.next()
+        if entry == None:
+          # woken by local publications, acknowledgements and the end of the connection
+          self.condition.wait(TICK if self.spool else None)
+          continue
+      if entry == READ:
+        entry = self.read()
+        if entry == None:
+          continue
+      self.send(*entry)
+
+  def flush(self):
+    """
+    on the bridge thread, not holding the condition: spool the publications which have
+    arrived, acknowledge those the remote broker has, and checkpoint the spool every second
+    """
+    with self.condition:
+      incoming, self.incoming = self.incoming, collections.deque()
+      acknowledged, self.acknowledged = self.acknowledged, []
+    for publication in incoming:
+      self.spoolAppend(publication)
+    for position in acknowledged:
+      self.spool.acknowledge(position)
+    if time.monotonic() - self.checkpointed >= 1:
+      self.spool.checkpoint()
+      self.checkpointed = time.monotonic()
+    with self.condition:
+      self.spooled = len(self.incoming) > 0 or not self.spool.empty()
+
+  def next(self):
+    """
+    holding the condition, what can be sent now: (publication, None, mark) from the queue,
+    READ for the next publication in the spool, or None
+    """
+    if len(self.queue) > 0 and (self.spool == None or self.spool.empty() or self.queue[0][1] == None or
+                                self.queue[0][1] <= self.spool.readPosition()):
+      publication = self.queue[0][0]
+      if publication[2] > 0 and len(self.inflight) >= self.receiveMaximum:
+        return None
+      self.queue.popleft()
+      # where in the spool to send a publication which didn't come from it, if it has to be sent again
+      return publication, None, self.spool.endPosition() if self.spool else None
+    if self.spool and not self.spool.empty() and len(self.inflight) < self.receiveMaximum and self.take():
+      return READ
+    return None
+
+  def read(self):
+    "the next (publication, spool position after it, None) from the spool, on the bridge thread"
+    entry = self.spool.read()
+    if entry == None:
+      return None
+    (message, qos, retained), position = entry
+    topic, payload, properties = unpackMessage(message)
+    return (topic, payload, qos, retained, properties), position, None
 
+  def connect(self):
+    client = mqtt.clients.V5.Client(self.clientid, raiseErrors=True)
+    client.registerCallback(Callbacks(self))
+    inward = [mapping for mapping in self.mappings if mapping.inward()]
+    try:
+      connack = client.connect(host=self.host, port=self.port, cleanstart=True)
+      if len(inward) > 0:
+        client.subscribe([mapping.remoteFilter for mapping in inward], [mapping.options() for mapping in inward])
+    except (OSError, MQTTV5.MQTTException, AssertionError) as error:
+      logger.info("Bridge %s connection to %s:%d failed: %s", self.name, self.host, self.port, error)
+      try:
+        client.terminate()
+      except (OSError, AttributeError):
+        pass
+      return False
+    if self.spool:
+      self.flush()
+    with self.condition:
+      self.client = client
+      self.connected = True
+      self.receiveMaximum = getattr(connack.properties, "ReceiveMaximum", MQTTV5.MAX_PACKETID)
+      # publications in flight on the previous connection are sent again, in the same order
+      self.queue.extendleft(reversed([(publication, mark) for publication, position, mark
+                                      in self.inflight.values() if position == None]))
+      self.inflight.clear()
+      self.early.clear()
+      if self.spool:
+        self.spool.rewind()
+        self.spooled = True
+    logger.info("Bridge %s connected to %s:%d, receive maximum %d", self.name, self.host, self.port,
+                self.receiveMaximum)
+    return True
 
+  def lost(self, cause):
+    "called by the receiver thread of the remote connection when it ends"
+    logger.info("Bridge %s connection lost: %s", self.name, cause)
+    with self.condition:
+      self.connected = False
+      self.condition.notify()
+
+  def failed(self, error):
+    "a send to the remote broker failed, so the connection is closed and reopened, holding the condition"
+    logger.info("Bridge %s send failed: %s", self.name, error)
+    self.disconnect()
+    self.condition.notify()
+
+  def disconnect(self):
+    if self.connected:
+      self.connected = False
+      try:
+        self.client.terminate()
+      except OSError:
+        pass
+
+  def publishArrived(self, topic, msg, qos, properties=None, receivedTime=None, retained=False):
+    "a local publication, called by the broker holding its lock, which is queued for the bridge thread"
+    for mapping in self.mappings:
+      remoteTopic = mapping.toRemote(topic)
+      if remoteTopic != None:
+        break
+    if remoteTopic == None:
+      return
+    qos = min(qos, mapping.qos)
+    if properties:
+      properties = copy.copy(properties) # shared with the other subscribers
+      for name in ["SubscriptionIdentifier", "TopicAlias"]:
+        if hasattr(properties, name):
+          delattr(properties, name)
+    publication = (remoteTopic, msg, qos, retained, properties)
+    with self.condition:
+      if self.spool and (self.spooled or not self.connected or
+                         len(self.queue) + len(self.inflight) >= self.receiveMaximum):
+        self.incoming.append(publication) # written to the spool by the bridge thread
+        self.spooled = True
+      elif qos == 0 and not self.connected:
+        self.dropped += 1
+      else:
+        if len(self.queue) >= MAX_QUEUED:
+          self.queue.popleft()
+          self.dropped += 1
+          if self.dropped % 1000 == 1:
+            logger.info("Bridge %s queue full, %d publications dropped", self.name, self.dropped)
+        self.queue.append((publication, None))
+      self.condition.notify()
+
+  def spoolAppend(self, publication):
+    topic, payload, qos, retained, properties = publication
+    self.spool.append((packMessage(topic, payload, properties), qos, retained))
+
+  def send(self, publication, position, mark):
+    """
+    send a publication on the bridge thread, not holding the condition.  position is that after
+    the publication in the spool, if it was read from there, mark where in the spool to send it
+    again otherwise
+    """
+    topic, payload, qos, retained, properties = publication
+    try:
+      msgid = self.client.publish(topic, payload, qos, retained, properties)
+    except OSError as error:
+      with self.condition:
+        self.failed(error)
+        if position != None:
+          pass # still in the spool, which is rewound on reconnecting
+        elif qos > 0 or self.spool:
+          self.queue.appendleft((publication, mark))
+        else:
+          self.dropped += 1
+      return
+    with self.condition:
+      inflight = qos > 0 and msgid not in self.early
+      if inflight:
+        self.inflight[msgid] = (publication, position, mark)
+      else:
+        self.early.discard(msgid)
+    if not inflight and position != None:
+      self.spool.acknowledge(position)
+
+  def take(self):
+    "can a spooled publication be sent now, at spoolRate a second?"
+    if self.spoolRate == 0:
+      return True
+    now = time.monotonic()
+    self.tokens = min(max(self.spoolRate, 1), self.tokens + (now - self.refilled) * self.spoolRate)
+    self.refilled = now
+    if self.tokens < 1:
+      return False
+    self.tokens -= 1
+    return True
 
+  def published(self, msgid):
+    "a QoS 1 or 2 publication acknowledged by the remote broker"
+    with self.condition:
+      if msgid in self.inflight:
+        publication, position, mark = self.inflight.pop(msgid)
+        if position != None:
+          self.acknowledged.append(position) # by the bridge thread, which owns the spool
+      else:
+        self.early.add(msgid) # the bridge thread hasn't yet put it in flight
+      self.condition.notify()
+
+  def remoteArrived(self, topic, payload, qos, retained, properties):
+    "a publication from the remote broker, published locally as if by the bridge"
+    for mapping in self.mappings:
+      localTopic = mapping.toLocal(topic)
+      if localTopic != None:
+        break
+    if localTopic == None:
+      return
+    if properties == None:
+      properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+    elif hasattr(properties, "SubscriptionIdentifier"):
+      delattr(properties, "SubscriptionIdentifier")
+    with self.lock:
+      self.broker.publish(self.id, localTopic, payload, min(qos, mapping.qos), retained, properties,
+                          time.monotonic())
+
+
+def create(broker, lock, name, host, **kwargs):
+  bridge = Bridges(broker, lock, name, host, **kwargs)
+  bridge.start()
+  return bridge
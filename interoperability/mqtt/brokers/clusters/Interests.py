@@ -0,0 +1,191 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+Subscription interest tables, shared by the clustering code.
+
+Each broker in a cluster tells its peers which topic filters it has at least one
+subscriber for.  The peers keep those filters in a topic trie, so that when a
+message is published they can decide quickly which other brokers need a copy.
+
+Matching errs on the side of forwarding: a filter with a wildcard the trie does
+not model exactly (such as a '#' which is not the last level) matches everything.
+The receiving broker does its own exact matching, so the only cost of a false
+positive is one unnecessary message.
+
+"""
+
+import struct, logging
+
+from mqtt.formats import MQTTV5
+
+logger = logging.getLogger('MQTT broker')
+
+def interestOf(topicFilter):
+  "the filter which is routed on for a subscription, or None for local only topics"
+  if topicFilter.startswith('$share/'):
+    # shared subscription $share/sharename/filter
+    parts = topicFilter.split('/', 2)
+    return parts[2] if len(parts) == 3 else None
+  if topicFilter.startswith('$'):
+    return None # $SYS and similar are local to each broker
+  return topicFilter
+
+
+class Nodes:
+
+  __slots__ = ["children", "count", "wildcount"]
+
+  def __init__(self):
+    self.children = {} # level -> Nodes
+    self.count = 0     # number of filters ending at this node
+    self.wildcount = 0 # number of filters ending in '#' at this node
+
+
+class Interests:
+  """
+  A reference counted set of topic filters, organized as a trie for matching.
+  """
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.root = Nodes()
+    self.counts = {} # filter -> reference count
+
+  def __len__(self):
+    return len(self.counts)
+
+  def filters(self):
+    return list(self.counts.keys())
+
+  def add(self, topicFilter):
+    "returns True if this is the first reference to the filter"
+    if topicFilter in self.counts:
+      self.counts[topicFilter] += 1
+      return False
+    self.counts[topicFilter] = 1
+    node = self.root
+    levels = topicFilter.split('/')
+    for i, level in enumerate(levels):
+      if level == '#':
+        node.wildcount += 1
+        return True
+      node = node.children.setdefault(level, Nodes())
+    node.count += 1
+    return True
+
+  def remove(self, topicFilter):
+    "returns True if this was the last reference to the filter"
+    if topicFilter not in self.counts:
+      return False
+    self.counts[topicFilter] -= 1
+    if self.counts[topicFilter] > 0:
+      return False
+    del self.counts[topicFilter]
+    path = [] # (parent, level) pairs so that empty nodes can be pruned
+    node = self.root
+    for level in topicFilter.split('/'):
+      if level == '#':
+        node.wildcount -= 1
+        break
+      path.append((node, level))
+      node = node.children[level]
+    else:
+      node.count -= 1
+    while path:
+      parent, level = path.pop()
+      child = parent.children[level]
+      if child.count or child.wildcount or child.children:
+        break
+      del parent.children[level]
+    return True
+
+  def matches(self, topic):
+    "is there at least one filter which matches this topic name?"
+    return self.__matches(self.root, topic.split('/'), 0)
+
+  def __matches(self, node, levels, index):
+    if node.wildcount > 0:
+      return True
+    if index == len(levels):
+      return node.count > 0
+    child = node.children.get(levels[index])
+    if child and self.__matches(child, levels, index+1):
+      return True
+    child = node.children.get('+')
+    if child and self.__matches(child, levels, index+1):
+      return True
+    return False
+
+
+# Inter-broker frames.  Every frame starts with a one byte type.
+
+FRAME_INTEREST_ADD, FRAME_INTEREST_REMOVE, FRAME_PUBLISH, FRAME_INTEREST_RESET = range(1, 5)
+
+def writeString(data):
+  data = data.encode("utf-8")
+  return struct.pack("!H", len(data)) + data
+
+def readString(buffer, offset):
+  length = struct.unpack_from("!H", buffer, offset)[0]
+  offset += 2
+  return bytes(buffer[offset:offset+length]).decode("utf-8"), offset + length
+
+def encodeInterest(frameType, topicFilter):
+  return bytes([frameType]) + writeString(topicFilter)
+
+def encodeReset(topicFilters):
+  "the complete set of filters, sent when a link is (re)established"
+  return bytes([FRAME_INTEREST_RESET]) + struct.pack("!I", len(topicFilters)) + \
+         b"".join([writeString(f) for f in topicFilters])
+
+def encodePublish(topic, message, qos, retained, properties):
+  props = properties.pack() if properties else b""
+  return bytes([FRAME_PUBLISH, qos | (0x04 if retained else 0)]) + writeString(topic) + \
+         struct.pack("!I", len(props)) + props + message
+
+def decode(buffer):
+  "returns (frameType, args)"
+  frameType = buffer[0]
+  if frameType in [FRAME_INTEREST_ADD, FRAME_INTEREST_REMOVE]:
+    topicFilter, offset = readString(buffer, 1)
+    return frameType, (topicFilter,)
+  elif frameType == FRAME_INTEREST_RESET:
+    count = struct.unpack_from("!I", buffer, 1)[0]
+    offset = 5
+    topicFilters = []
+    for i in range(count):
+      topicFilter, offset = readString(buffer, offset)
+      topicFilters.append(topicFilter)
+    return frameType, (topicFilters,)
+  elif frameType == FRAME_PUBLISH:
+    qos = buffer[1] & 0x03
+    retained = (buffer[1] & 0x04) == 0x04
+    topic, offset = readString(buffer, 2)
+    propslen = struct.unpack_from("!I", buffer, offset)[0]
+    offset += 4
+    properties = None
+    if propslen > 0:
+      properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+      properties.unpack(bytes(buffer[offset:offset+propslen]))
+    offset += propslen
+    return frameType, (topic, bytes(buffer[offset:]), qos, retained, properties)
+  raise MQTTV5.MQTTException("Unknown cluster frame type %d" % frameType)
@@ -0,0 +1,303 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+A cluster of separate broker processes, perhaps on different machines, which pass each
+other only the publications the others have subscribers for.
+
+  cluster_listener 7001
+  cluster_peer node2.example.com:7001
+  cluster_peer node3.example.com:7001
+
+Every broker lists all the others: each publication goes directly from the broker it
+was published to to the brokers with a matching subscription, and is not passed on by
+them.  The frames are those exchanged by worker processes (see Interests), each with a
+4 byte length, over TCP.
+
+Each broker opens a connection to each of its peers.  On that connection it sends
+publications, and the peer sends back the topic filters it has subscribers for: all
+of them when the connection opens, then each one added or removed.  So a publication
+is sent to a peer only when one of its filters matches, and the traffic between the
+brokers follows the subscriptions rather than the total number of publications.
+Retained publications are sent to all the peers, so that each has the retained
+messages for new subscriptions.
+
+A lost connection is reopened, and the peer sends its filters again.  A connection on
+which a send fails is closed at once, so that nothing more is queued on it.  Publications
+are not kept for a peer while it is unreachable.
+
+"""
+
+import socket, struct, threading, queue, logging
+
+from .Interests import encodeInterest, encodeReset, interestOf, Interests, \
+     FRAME_INTEREST_ADD, FRAME_INTEREST_REMOVE
+from . import Workers
+
+logger = logging.getLogger('MQTT broker')
+
+RECONNECT_INTERVAL = (1, 30) # seconds, doubled after each failed attempt up to the maximum
+RECEIVE_SIZE = 64*1024
+
+
+class Connections:
+  """
+  A TCP connection to or from a peer.  As for a Workers.Links, frames are queued by the
+  publishing thread, which may be holding the broker lock, and written by a separate
+  thread.  When a write fails, failed is called with the connection, and the socket is
+  shut down so that the receiving thread ends too.
+  """
+
+  def __init__(self, sock, name, failed=None):
+    self.sock = sock
+    self.name = name
+    self.failed = failed
+    self.closing = False
+    self.buffer = b"" # the start of an incomplete frame
+    self.outqueue = queue.SimpleQueue()
+    self.sender = threading.Thread(target=self.sendLoop, name="cluster connection %s" % name)
+    self.sender.daemon = True
+    self.sender.start()
+
+  def send(self, frame):
+    self.outqueue.put(frame)
+
+  def sendLoop(self):
+    while True:
+      frame = self.outqueue.get()
+      if frame == None:
+        break
+      frames = [frame]
+      try:
+        while len(frames) < Workers.MAX_BATCH:
+          frame = self.outqueue.get_nowait()
+          if frame == None:
+            break
+          frames.append(frame)
+      except queue.Empty:
+        pass
+      try:
+        self.sock.sendall(b"".join([struct.pack("!I", len(f)) + f for f in frames]))
+      except OSError as error:
+        if self.closing:
+          break
+        logger.info("Cluster connection %s send failed: %s", self.name, error)
+        if self.failed:
+          self.failed(self)
+        try:
+          self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+          pass
+        break
+      if frame == None:
+        break
+
+  def receive(self):
+    "the complete frames received, each with its length, or None when the connection has closed"
+    try:
+      data = self.sock.recv(RECEIVE_SIZE)
+    except OSError:
+      data = b""
+    if len(data) == 0:
+      return None
+    self.buffer += data
+    offset = 0
+    while offset + 4 <= len(self.buffer):
+      length = struct.unpack_from("!I", self.buffer, offset)[0]
+      if offset + 4 + length > len(self.buffer):
+        break
+      offset += 4 + length
+    frames, self.buffer = self.buffer[:offset], self.buffer[offset:]
+    return frames
+
+  def close(self):
+    self.closing = True
+    self.outqueue.put(None)
+    try:
+      self.sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    self.sock.close()
+
+
+class Peers:
+  """
+  The connection from this broker to one of its peers: publications are sent on it,
+  and the peer's topic filters received.
+  """
+
+  def __init__(self, cluster, host, port):
+    self.cluster = cluster
+    self.host = host
+    self.port = port
+    self.name = "%s:%d" % (host, port)
+    self.interests = Interests() # filters subscribed to on the peer
+    self.connection = None
+    self.sent = 0 # publications
+    self.thread = threading.Thread(target=self.run, name="cluster peer %s" % self.name)
+    self.thread.daemon = True
+
+  def send(self, frame):
+    "called with the broker lock held.  Publications for an unreachable peer are dropped"
+    if self.connection:
+      self.connection.send(frame)
+      self.sent += 1
+
+  def failed(self, connection):
+    "a send failed, so no more publications are queued on the connection"
+    with self.cluster.lock:
+      if self.connection == connection:
+        self.connection = None
+        self.interests.clear()
+
+  def run(self):
+    "connect, and reconnect when the connection is lost"
+    delay = RECONNECT_INTERVAL[0]
+    while self.cluster.running:
+      try:
+        sock = socket.create_connection((self.host, self.port), timeout=10)
+      except OSError as error:
+        logger.debug("Cluster connection to peer %s failed: %s", self.name, error)
+        self.cluster.stopped.wait(delay)
+        delay = min(delay * 2, RECONNECT_INTERVAL[1])
+        continue
+      sock.settimeout(None)
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      delay = RECONNECT_INTERVAL[0]
+      logger.info("Cluster connection to peer %s open", self.name)
+      connection = Connections(sock, self.name, self.failed)
+      with self.cluster.lock:
+        self.connection = connection
+      self.cluster.receive(self, connection)
+      with self.cluster.lock:
+        self.connection = None
+        self.interests.clear()
+      connection.close()
+      if self.cluster.running:
+        logger.info("Cluster connection to peer %s closed", self.name)
+        self.cluster.stopped.wait(delay)
+
+
+class Clusters(Workers.Clusters):
+  """
+  The cluster as seen from one broker.  As for worker processes, registered as an
+  observer of the subscription engines, and called by the brokers for every publication.
+  The links are the connections to the peers, from which their filters are received.
+  """
+
+  def __init__(self, lock, listener, peers):
+    """
+    listener: (bind address, port) on which the peers connect, or None
+    peers: [(host, port)] of the other brokers
+    """
+    Workers.Clusters.__init__(self, None, {}, lock)
+    self.links = {}
+    for host, port in peers:
+      peer = Peers(self, host, port)
+      self.links[peer.name] = peer
+    self.inbound = set() # connections from the peers, to which the local filters are sent
+    self.stopped = threading.Event()
+    self.listener = None
+    if listener:
+      host, port = listener
+      self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      self.listener.bind(("" if host in ["", "INADDR_ANY"] else host, port))
+      self.listener.listen(50)
+      logger.info("Cluster listening on address '%s' port %d", host, port)
+    self.acceptor = threading.Thread(target=self.acceptLoop, name="cluster listener")
+    self.acceptor.daemon = True
+
+  def setBrokers(self, broker3, broker5, brokerSN):
+    self.broker5 = broker5
+    for broker in [broker3, broker5, brokerSN]:
+      broker.broker.setCluster(self)
+      broker.broker.se.addObserver(self)
+    if self.listener:
+      self.acceptor.start()
+    for peer in self.links.values():
+      peer.thread.start()
+
+  def shutdown(self):
+    self.running = False
+    self.stopped.set()
+    if self.listener:
+      self.listener.close()
+    with self.lock:
+      connections = list(self.inbound) + [peer.connection for peer in self.links.values() if peer.connection]
+    for connection in connections:
+      connection.close()
+    for peer in self.links.values():
+      logger.info("Cluster peer %s: %d publications sent", peer.name, peer.sent)
+
+  def subscribed(self, topicFilter):
+    interest = interestOf(topicFilter)
+    if interest and self.interests.add(interest):
+      frame = encodeInterest(FRAME_INTEREST_ADD, interest)
+      for connection in self.inbound:
+        connection.send(frame)
+
+  def unsubscribed(self, topicFilter):
+    interest = interestOf(topicFilter)
+    if interest and self.interests.remove(interest):
+      frame = encodeInterest(FRAME_INTEREST_REMOVE, interest)
+      for connection in self.inbound:
+        connection.send(frame)
+
+  def acceptLoop(self):
+    while self.running:
+      try:
+        sock, address = self.listener.accept()
+      except OSError:
+        break
+      thread = threading.Thread(target=self.serve, args=(sock, address), name="cluster peer %s:%d" % address[:2])
+      thread.daemon = True
+      thread.start()
+
+  def serve(self, sock, address):
+    "a connection from a peer: send it the local filters, and receive its publications"
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    name = "%s:%d" % address[:2]
+    connection = Connections(sock, name)
+    with self.lock:
+      self.inbound.add(connection)
+      connection.send(encodeReset(self.interests.filters()))
+    logger.info("Cluster connection from peer %s open", name)
+    self.receive(None, connection)
+    with self.lock:
+      self.inbound.discard(connection)
+    connection.close()
+    if self.running:
+      logger.info("Cluster connection from peer %s closed", name)
+
+  def receive(self, link, connection):
+    "handle the frames from a connection until it closes"
+    while self.running:
+      frames = connection.receive()
+      if frames == None:
+        break
+      if len(frames) == 0:
+        continue
+      self.lock.acquire()
+      try:
+        self.handleFrames(link, memoryview(frames))
+      except:
+        logger.exception("Cluster receive from peer %s", connection.name)
+      finally:
+        self.lock.release()
@@ -0,0 +1,414 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+Multi-process broker.
+
+A number of worker processes each run a complete set of brokers, so that the work
+is spread over more than one CPU core.  Every worker owns the sessions of the clients
+connected to it.  Workers are fully connected to each other by pipes, over which
+they exchange:
+
+  - the topic filters they have subscribers for
+  - publications which match a filter of the receiving worker
+
+Retained publications are sent to all workers, so that each has a full retained
+message store for new subscriptions.
+
+Connections reach the workers in one of two ways:
+
+  clientid:  the parent process accepts each connection, reads the MQTT connect
+             packet and passes the socket to the worker chosen by a hash of the
+             client id.  A client reconnecting always reaches the worker holding
+             its session.  Only used for plain TCP listeners.
+
+  reuseport: every worker listens on the same port with SO_REUSEPORT, and the
+             kernel spreads connections between them.  Used for TLS listeners,
+             and for all listeners if configured.  A client reconnecting may
+             reach another worker, without the session it left on the first.
+
+"""
+
+import sys, os, signal, socket, struct, select, threading, queue, logging, zlib, time, copy
+import multiprocessing, multiprocessing.connection
+
+from mqtt.formats import MQTTV5
+from .Interests import Interests, interestOf, encodeInterest, encodeReset, encodePublish, decode, \
+     FRAME_INTEREST_ADD, FRAME_INTEREST_REMOVE, FRAME_INTEREST_RESET, FRAME_PUBLISH
+
+logger = logging.getLogger('MQTT broker')
+
+MAX_BATCH = 1000 # maximum number of frames sent to another worker in one write
+MAX_PREFIX = 64*1024 # maximum size of a connect packet read by the dispatcher
+
+
+class Links:
+  """
+  The connection to one other worker.  Frames are queued by the publishing thread,
+  which may be holding the broker lock, and written by a separate thread so that
+  a busy peer can never block the local broker.
+  """
+
+  def __init__(self, index, connection):
+    self.index = index
+    self.connection = connection
+    self.interests = Interests() # filters subscribed to on the other worker
+    self.outqueue = queue.SimpleQueue()
+    self.running = True
+    self.sender = threading.Thread(target=self.sendLoop, name="cluster link %d" % index)
+    self.sender.daemon = True
+    self.sender.start()
+
+  def send(self, frame):
+    self.outqueue.put(frame)
+
+  def sendLoop(self):
+    while self.running:
+      frame = self.outqueue.get()
+      if frame == None:
+        break
+      frames = [frame]
+      try:
+        while len(frames) < MAX_BATCH:
+          frame = self.outqueue.get_nowait()
+          if frame == None:
+            self.running = False
+            break
+          frames.append(frame)
+      except queue.Empty:
+        pass
+      try:
+        self.connection.send_bytes(b"".join([struct.pack("!I", len(f)) + f for f in frames]))
+      except (OSError, EOFError):
+        logger.info("Cluster link to worker %d closed", self.index)
+        break
+
+  def stop(self):
+    self.running = False
+    self.outqueue.put(None)
+
+
+class Clusters:
+  """
+  The cluster as seen from one worker.  Registered as an observer of the
+  subscription engines, and called by the brokers for every publication.
+  """
+
+  clientid = "$cluster" # the client id used for publications received from other workers
+
+  def __init__(self, index, connections, lock):
+    self.index = index
+    self.lock = lock
+    self.interests = Interests() # local filters
+    self.links = {}
+    for peer in sorted(connections.keys()):
+      self.links[peer] = Links(peer, connections[peer])
+    self.broker5 = None
+    self.running = True
+    self.receiver = threading.Thread(target=self.receiveLoop, name="cluster receiver")
+    self.receiver.daemon = True
+
+  def setBrokers(self, broker3, broker5, brokerSN):
+    self.broker5 = broker5
+    for broker in [broker3, broker5, brokerSN]:
+      broker.broker.setCluster(self)
+      broker.broker.se.addObserver(self)
+    for link in self.links.values():
+      link.send(encodeReset(self.interests.filters()))
+    self.receiver.start()
+
+  def shutdown(self):
+    self.running = False
+    for link in self.links.values():
+      link.stop()
+
+  def subscribed(self, topicFilter):
+    interest = interestOf(topicFilter)
+    if interest and self.interests.add(interest):
+      frame = encodeInterest(FRAME_INTEREST_ADD, interest)
+      for link in self.links.values():
+        link.send(frame)
+
+  def unsubscribed(self, topicFilter):
+    interest = interestOf(topicFilter)
+    if interest and self.interests.remove(interest):
+      frame = encodeInterest(FRAME_INTEREST_REMOVE, interest)
+      for link in self.links.values():
+        link.send(frame)
+
+  def publish(self, topic, message, qos, retained, properties):
+    "send a locally originated publication to the workers which have a matching subscription"
+    if topic.startswith('$'):
+      return
+    frame = None
+    for link in self.links.values():
+      if retained or link.interests.matches(topic):
+        if frame == None:
+          if properties and hasattr(properties, "TopicAlias"):
+            # topic aliases are specific to the incoming connection
+            properties = copy.copy(properties)
+            delattr(properties, "TopicAlias")
+          frame = encodePublish(topic, message, qos, retained, properties)
+        link.send(frame)
+
+  def receiveLoop(self):
+    connections = {link.connection : link for link in self.links.values()}
+    while self.running and len(connections) > 0:
+      try:
+        ready = multiprocessing.connection.wait(list(connections.keys()), timeout=1)
+      except OSError:
+        break
+      for connection in ready:
+        try:
+          data = connection.recv_bytes()
+        except (OSError, EOFError):
+          logger.info("Cluster link from worker %d closed", connections[connection].index)
+          del connections[connection]
+          continue
+        self.lock.acquire()
+        try:
+          self.handleFrames(connections[connection], memoryview(data))
+        except:
+          logger.exception("Cluster receive from worker %d", connections[connection].index)
+        finally:
+          self.lock.release()
+
+  def handleFrames(self, link, data):
+    offset = 0
+    while offset < len(data):
+      length = struct.unpack_from("!I", data, offset)[0]
+      offset += 4
+      frameType, args = decode(data[offset:offset+length])
+      offset += length
+      if frameType == FRAME_PUBLISH:
+        topic, message, qos, retained, properties = args
+        if properties == None:
+          properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+        self.broker5.broker.publish(self.clientid, topic, message, qos, retained, properties, time.monotonic())
+      elif frameType == FRAME_INTEREST_ADD:
+        link.interests.add(args[0])
+      elif frameType == FRAME_INTEREST_REMOVE:
+        link.interests.remove(args[0])
+      elif frameType == FRAME_INTEREST_RESET:
+        link.interests.clear()
+        for topicFilter in args[0]:
+          link.interests.add(topicFilter)
+
+
+def readConnect(sock):
+  """
+  read the first MQTT packet from a new connection.
+
+  returns the bytes read, and the client id if the packet was a readable connect
+  """
+  data = sock.recv(1)
+  if data != b'\x10':
+    return data, None # not MQTT connect, maybe websockets
+  multiplier = 1; remaining = 0
+  while True:
+    byte = sock.recv(1)
+    if byte == b"":
+      return data, None
+    data += byte
+    remaining += (byte[0] & 0x7f) * multiplier
+    if byte[0] & 0x80 == 0:
+      break
+    multiplier *= 128
+    if multiplier > 128**3:
+      return data, None
+  if remaining > MAX_PREFIX:
+    return data, None
+  body = b""
+  while len(body) < remaining:
+    chunk = sock.recv(remaining - len(body))
+    if chunk == b"":
+      return data + body, None
+    body += chunk
+  return data + body, clientidOf(body)
+
+def clientidOf(body):
+  "the client id from the variable header and payload of a connect packet"
+  try:
+    namelen = struct.unpack_from("!H", body, 0)[0]
+    offset = 2 + namelen
+    version = body[offset]
+    offset += 4 # version, flags, keepalive
+    if version == 5:
+      # skip properties
+      multiplier = 1; propslen = 0
+      while True:
+        byte = body[offset]
+        offset += 1
+        propslen += (byte & 0x7f) * multiplier
+        if byte & 0x80 == 0:
+          break
+        multiplier *= 128
+      offset += propslen
+    idlen = struct.unpack_from("!H", body, offset)[0]
+    offset += 2
+    return body[offset:offset+idlen].decode("utf-8")
+  except:
+    return None
+
+
+class Dispatchers:
+  """
+  Runs in the parent process.  Accepts connections for the plain TCP listeners and
+  hands each one to a worker chosen by client id.
+  """
+
+  def __init__(self, listeners, channels):
+    self.channels = channels # one unix socket per worker
+    self.sockets = []
+    for host, port in listeners:
+      bind_address = "" if host in ["", "INADDR_ANY"] else host
+      listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      listener.bind((bind_address, port))
+      listener.listen(50)
+      self.sockets.append(listener)
+      logger.info("Dispatching connections for address '%s' port %d to %d workers", host, port, len(channels))
+
+  def workerOf(self, clientid, address):
+    key = clientid if clientid else str(address)
+    return zlib.crc32(key.encode("utf-8")) % len(self.channels)
+
+  def dispatch(self, sock, address):
+    try:
+      sock.settimeout(10)
+      data, clientid = readConnect(sock)
+      sock.settimeout(None)
+      worker = self.workerOf(clientid, address)
+      logger.debug("Dispatching connection from %s clientid %s to worker %d", address, clientid, worker)
+      socket.send_fds(self.channels[worker], [data], [sock.fileno()])
+    except:
+      logger.info("Connection from %s not dispatched %s", address, str(sys.exc_info()[1]))
+    finally:
+      sock.close() # the worker has its own copy now
+
+  def serve_forever(self):
+    while True:
+      ready, o, e = select.select(self.sockets, [], [], 1)
+      for listener in ready:
+        sock, address = listener.accept()
+        thread = threading.Thread(target=self.dispatch, args=(sock, address))
+        thread.daemon = True
+        thread.start()
+
+  def shutdown(self):
+    for listener in self.sockets:
+      listener.close()
+
+
+class Workers:
+  "the worker side of the process structure, passed to start.run"
+
+  def __init__(self, index, count, connections, channel):
+    self.index = index
+    self.count = count
+    self.connections = connections # peer index -> multiprocessing connection
+    self.channel = channel # unix socket for dispatched connections, or None
+
+  def isDispatched(self, server):
+    "is this listener served by the parent's dispatcher?"
+    module, kwargs = server
+    return self.channel != None and module.__name__.endswith("TCPListeners") and not kwargs.get("TLS", False)
+
+  def serve_forever(self, dispatched):
+    "run in the main thread of a worker, until a signal arrives"
+    if self.channel == None or dispatched == None:
+      while True:
+        time.sleep(60)
+    while True:
+      message, fds, flags, address = socket.recv_fds(self.channel, MAX_PREFIX + 8, 1)
+      if len(fds) == 0:
+        break # parent has gone
+      sock = socket.socket(fileno=fds[0])
+      try:
+        peer = sock.getpeername()
+      except OSError:
+        sock.close()
+        continue
+      dispatched.prefixes[sock.fileno()] = message
+      dispatched.process_request(sock, peer)
+
+
+def forkContext():
+  # forking keeps the logging configuration of the parent
+  if "fork" in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context("fork")
+  return multiprocessing.get_context()
+
+def run(count, dispatch, target, config, servers_to_create):
+  """
+  Start count worker processes, each running target(worker, config), and wait for them.
+
+  Runs in the parent process.
+  """
+  logger.info("Starting %d broker worker processes, %s connection dispatch", count, dispatch)
+  context = forkContext()
+  connections = [{} for i in range(count)]
+  for i in range(count):
+    for j in range(i+1, count):
+      connections[i][j], connections[j][i] = context.Pipe(duplex=True)
+  channels = [None] * count
+  dispatcher = None
+  if dispatch == "clientid" and hasattr(socket, "send_fds"):
+    listeners = [(kwargs["host"], kwargs["port"]) for module, kwargs in servers_to_create
+                 if module.__name__.endswith("TCPListeners") and not kwargs.get("TLS", False)]
+    if len(listeners) > 0:
+      pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for i in range(count)]
+      channels = [pair[1] for pair in pairs]
+      dispatcher = Dispatchers(listeners, [pair[0] for pair in pairs])
+  elif dispatch == "clientid":
+    logger.info("Passing sockets between processes is not supported here, using reuseport dispatch")
+
+  processes = []
+  for i in range(count):
+    worker = Workers(i, count, connections[i], channels[i])
+    process = context.Process(target=target, args=(worker, config), name="broker worker %d" % i)
+    process.start()
+    processes.append(process)
+
+  def forward(signum, frame):
+    for process in processes:
+      if process.is_alive():
+        os.kill(process.pid, signum)
+  if hasattr(signal, "SIGUSR1"): # start or stop the profilers of all the workers
+    signal.signal(signal.SIGUSR1, forward)
+
+  try:
+    if dispatcher:
+      dispatcher.serve_forever()
+    else:
+      for process in processes:
+        process.join()
+  except (KeyboardInterrupt, OSError):
+    pass
+  except:
+    logger.exception("Workers")
+  finally:
+    if dispatcher:
+      dispatcher.shutdown()
+    for process in processes:
+      if process.is_alive():
+        process.terminate()
+    for process in processes:
+      process.join()
+  logger.info("All broker worker processes stopped")
@@ -16,14 +16,13 @@
 *******************************************************************
 """
 
-import inspect, logging
-
-from . import V5
-from mqtt.formats import *
+import inspect, logging, array, threading, os, glob, hashlib, json, ast
 
 logger = logging.getLogger('MQTT broker')
 
-modules = [m for m in locals().values() if inspect.ismodule(m) and m.__name__.startswith("mqtt.")]
+# the statements found by getCoverage and the message formats found by getFormats, kept
+# with a hash of the sources they were found in
+manifestFilename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coverage_manifest.json")
 
 
 """
@@ -57,12 +56,19 @@ def getSources(anObject, depth=0):
   return total
 
 
+def getModules():
+  "the modules searched for conformance statements, imported here as they import this module"
+  from . import V5
+  from mqtt.formats import MQTTV311, MQTTV5
+  return [V5, MQTTV311, MQTTV5]
+
+
 def getCoverage():
 
   exceptions = set([])
   coverages = set([])
 
-  for module in modules:
+  for module in getModules():
     lines = getSources(module)
     for line in lines:
       line = line.strip()
@@ -74,12 +80,137 @@ def getCoverage():
           coverages.add(statement)
   return ({"exceptions" : exceptions, "coverages" : coverages})
 
+
+def getSourceFiles():
+  "the files of the modules returned by getModules, of the other brokers, and this one"
+  top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  filenames = [os.path.abspath(__file__)]
+  for directory in ["brokers/V5", "brokers/V311", "brokers/SN", "formats/MQTTV311", "formats/MQTTV5"]:
+    filenames += sorted(glob.glob(os.path.join(top, directory, "*.py")))
+  return [(os.path.relpath(filename, top), filename) for filename in filenames]
+
+
+def getFormats():
+  "the message formats passed to conformance in the source files"
+  formats = set([])
+  for name, filename in getSourceFiles():
+    with open(filename, encoding="utf-8") as sourcefile:
+      tree = ast.parse(sourcefile.read(), filename)
+    for node in ast.walk(tree):
+      if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "conformance" \
+          and len(node.args) > 0 and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+        formats.add(node.args[0].value)
+  return formats
+
+
+def getSourceHash():
+  digest = hashlib.sha256()
+  for name, filename in getSourceFiles():
+    digest.update(name.encode("utf-8"))
+    with open(filename, "rb") as sourcefile:
+      digest.update(sourcefile.read())
+  return digest.hexdigest()
+
+
+def writeManifest(coverages, formats, sourceHash):
+  manifest = {"hash" : sourceHash, "formats" : sorted(formats)}
+  for key in coverages.keys():
+    manifest[key] = sorted(coverages[key])
+  tempname = "%s.%d" % (manifestFilename, os.getpid())
+  with open(tempname, "w") as manifestfile:
+    json.dump(manifest, manifestfile, indent=1)
+  os.replace(tempname, manifestFilename) # another process may be writing it too
+
+
+def getManifest():
+  """
+  the statements and message formats in the manifest, or found by getCoverage and getFormats
+  when the manifest is missing or the sources have changed since it was written, in which
+  case it is rewritten
+  """
+  sourceHash = getSourceHash()
+  try:
+    with open(manifestFilename) as manifestfile:
+      manifest = json.load(manifestfile)
+    if manifest["hash"] == sourceHash:
+      return ({"exceptions" : set(manifest["exceptions"]), "coverages" : set(manifest["coverages"])},
+              manifest["formats"])
+  except (OSError, ValueError, KeyError):
+    pass
+  coverages = getCoverage()
+  formats = getFormats()
+  try:
+    writeManifest(coverages, formats, sourceHash)
+  except OSError as exc:
+    logger.info("Coverage manifest %s not written: %s", manifestFilename, exc)
+  return coverages, formats
+
+class Counters:
+  """
+  Counts of the conformance statements exercised by the broker, incremented directly
+  rather than found by parsing log records.
+
+  Each message format in the manifest is mapped, when it is loaded, to the integer index of
+  its statement, so each hit is one dictionary lookup and one array increment.  A format
+  not in the manifest is mapped the first time it is seen.  The message is logged on the
+  first hit only, as the filter would allow.
+  """
+
+  def __init__(self):
+    self.enabled = True
+    self.statements = []  # index -> statement
+    self.indexes = {}     # statement -> index
+    self.formats = {}     # message format -> index
+    self.counts = array.array("Q")
+    self.lock = threading.Lock()
+
+  def index(self, msg):
+    "the index of the statement in a message format"
+    with self.lock:
+      if msg not in self.formats:
+        statement = "[MQTT"+between(msg, "[MQTT", "]")+"]"
+        if statement not in self.indexes:
+          self.indexes[statement] = len(self.statements)
+          self.statements.append(statement)
+          self.counts.append(0)
+        self.formats[msg] = self.indexes[statement]
+      return self.formats[msg]
+
+  def load(self, formats):
+    "index the statements of the message formats passed to conformance"
+    for msg in formats:
+      self.index(msg)
+
+  def hit(self, msg, *args):
+    "a conformance statement has been exercised"
+    if self.enabled:
+      index = self.formats.get(msg)
+      if index == None:
+        index = self.index(msg)
+      self.counts[index] += 1
+      if self.counts[index] == 1:
+        logger.info(msg, *args, stacklevel=2)
+
+  def found(self):
+    "the statements exercised so far"
+    return set([self.statements[i] for i, count in enumerate(self.counts) if count > 0])
+
+  def getcounts(self):
+    "statement -> number of times exercised"
+    return dict([(self.statements[i], count) for i, count in enumerate(self.counts) if count > 0])
+
+
 class Filters:
 
   def __init__(self):
-    self.coverages = getCoverage()
+    self.coverages = None # loaded by load, once all the modules are loaded
     self.found = set([])
 
+  def load(self):
+    "read the manifest, and index the statements of the message formats in it"
+    self.coverages, formats = getManifest()
+    counters.load(formats)
+
   def filter(self, record):
     line = record.getMessage()
     rc = True
@@ -90,17 +221,20 @@ class Filters:
     return rc
 
   def getmeasures(self):
+    if self.coverages == None:
+      self.load()
+    allfound = self.found | counters.found()
     lines = []
     for key in self.coverages.keys():
-       found = self.coverages[key].intersection(self.found)
+       found = self.coverages[key].intersection(allfound)
        if len(self.coverages[key]) > 0:
         lines.append("%s %d out of %d = %d%%" % \
           ("coverage statements" if key == "coverages" else key,
                len(found), len(self.coverages[key]), (len(found) * 100) / len(self.coverages[key])))
 
     for key in self.coverages.keys():
-       found = self.coverages[key].intersection(self.found)
-       notfound = self.coverages[key].difference(self.found)
+       found = self.coverages[key].intersection(allfound)
+       notfound = self.coverages[key].difference(allfound)
        lines.append("%s found %s" % ("coverage statements" if key == "coverages" else key, found))
        lines.append("%s not found %s" % ("coverage statements" if key == "coverages" else key, notfound))
     return lines
@@ -109,10 +243,20 @@ class Filters:
     for curline in self.getmeasures():
       logger.info(curline)
 
+counters = Counters()
+
+conformance = counters.hit # record that the conformance statement which starts a message has been exercised
+
 filter = Filters()
 
+def load():
+  return filter.load()
+
 def measure():
   return filter.measure()
 
 def getmeasures():
   return filter.getmeasures()
+
+def getcounts():
+  return counters.getcounts()
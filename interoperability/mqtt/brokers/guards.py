@@ -0,0 +1,47 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+
+"""
+
+Guards for the logging on the hot paths of the brokers, resolved once at startup.
+
+In production mode conformance statements are not recorded, and packets are not
+formatted for debug logging unless the debug level was enabled at startup.
+
+"""
+
+import logging
+
+from . import coverage
+from mqtt.formats.MQTTV311 import MQTTV311
+from mqtt.formats.MQTTV5 import MQTTV5
+
+logger = logging.getLogger('MQTT broker')
+
+debug = True # format packets for debug logging, which logger.debug may then discard
+
+def ignore(msg, *args):
+  pass
+
+def setProduction(production):
+  global debug
+  debug = not production or logger.isEnabledFor(logging.DEBUG)
+  coverage.counters.enabled = not production
+  for module in [MQTTV311, MQTTV5]: # the packet formats log their statements
+    module.conformance = ignore if production else module.logger.info
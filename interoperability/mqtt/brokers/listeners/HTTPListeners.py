@@ -17,57 +17,299 @@
 """
 
 import sys, traceback, socket, logging, getopt, hashlib, base64
-import threading, ssl, json, re
+import threading, ssl, json, re, heapq, time
 import http.server, urllib, urllib.request, urllib.parse
 
+import mqtt.formats.MQTTV5 as MQTTV5
+import mqtt.formats.MQTTV311 as MQTTV3
 from mqtt.brokers.SN import MQTTSNBrokers
 from mqtt.brokers.V311 import MQTTBrokers as MQTTV3Brokers
 from mqtt.brokers.V5 import MQTTBrokers as MQTTV5Brokers
+from mqtt.brokers.V5.Subscriptions import Subscriptions as V5Subscriptions
+from mqtt.brokers.V5 import Topics
+from mqtt.brokers.listeners import Streams
+from mqtt.brokers.monitoring import Histograms, Profilers, Metrics
 
 logger = logging.getLogger('MQTT broker')
 
-def jsonize(obj):
-  name = None
-  if "__class__" in dir(obj):
-    name = obj.__class__.__name__
-  data = {}
-  for attrname in dir(obj):
-    if not attrname.startswith("__"):
-      value = getattr(obj, attrname)
-      try:
-        json.dumps(value)
-        if attrname.startswith("_"+name+"__"):
-          attrname = attrname[len(name)+3:] # remove class name for private attributes
-        data[attrname] = value
-      except:
-        traceback.print_exc()
-  return data
-
-def get_client(clientid, *args):
-  rc = 404; value = None
-  client = broker3.broker.getClient(clientid)
-  if client:
-    value = json.dumps(jsonize(client))
-    rc = 200
-  return rc, value
-
-def get_clients(*args):
-  clientids = broker3.broker.getClients()
-  clients = {}
-  for clientid in clientids:
-    clients[clientid] = jsonize(broker3.broker.getClient(clientid))
-  return 200, json.dumps(clients)
-
-def get_subscriptions(*args):
-  return 200, json.dumps([jsonize(s) for s in sharedData["subscriptions"]])
-
-def get_retained_messages(*args):
-  out = {}
-  for topic in sharedData["retained"].keys():
-    value = list(sharedData["retained"][topic])
-    value[0] = value[0].decode()
-    out[topic] = value
-  return 200, json.dumps(out)
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+KEEPALIVE_TIMEOUT = 60 # seconds an idle connection is kept open
+CHUNK_SIZE = 16384 # bytes of a streamed response sent at once
+
+class BadRequest(Exception):
+  pass
+
+def limitOf(query):
+  try:
+    limit = int(query.get("limit", DEFAULT_LIMIT))
+  except ValueError:
+    raise BadRequest("limit must be a number")
+  if limit < 1 or limit > MAX_LIMIT:
+    raise BadRequest("limit must be from 1 to %d" % MAX_LIMIT)
+  return limit
+
+def encodeCursor(key):
+  return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def decodeCursor(query):
+  if "cursor" not in query:
+    return None
+  try:
+    key = json.loads(base64.urlsafe_b64decode(query["cursor"].encode("ascii")))
+  except ValueError:
+    raise BadRequest("invalid cursor")
+  if not isinstance(key, list) or not all(isinstance(item, str) for item in key):
+    raise BadRequest("invalid cursor") # keys are tuples of strings
+  return tuple(key)
+
+def fieldsOf(query):
+  return query["fields"].split(",") if "fields" in query else None
+
+def page(keys, query):
+  """
+  the references with the lowest limit keys after the cursor, in order, and the cursor
+  of the next page or None.
+
+  keys is an iterable of (key, reference), where key is a tuple of strings, taken from
+  a copy of the broker's data so that it can be read without the lock.  Only limit + 1
+  keys are held at once.
+  """
+  limit = limitOf(query)
+  after = decodeCursor(query)
+  if after != None:
+    keys = (key for key in keys if key[0] > after)
+  selected = heapq.nsmallest(limit + 1, keys, key=lambda key: key[0])
+  cursor = encodeCursor(selected[limit - 1][0]) if len(selected) > limit else None
+  return [reference for key, reference in selected[:limit]], cursor
+
+def select(item, fields):
+  return item if fields == None else dict((name, item[name]) for name in fields if name in item)
+
+def encodeV5Client(client):
+  return {"id" : str(client.id), "protocol" : "mqtt5", "connected" : client.connected,
+          "cleanStart" : client.cleanStart, "keepalive" : client.keepalive,
+          "sessionExpiryInterval" : client.sessionExpiryInterval,
+          "receiveMaximum" : client.receiveMaximum, "maximumPacketSize" : client.maximumPacketSize,
+          "queued" : len(client.queued), "inflight" : len(client.outmsgs),
+          "topicAliasBytesSaved" : client.topicAliasBytesSaved,
+          "willTopic" : client.will[0] if client.will else None}
+
+def encodeV3Client(client):
+  return {"id" : str(client.id), "protocol" : "mqtt311", "connected" : client.connected,
+          "cleanSession" : client.cleansession, "keepalive" : client.keepalive,
+          "queued" : 0, "inflight" : len(client.outmsgs),
+          "willTopic" : client.will[0] if client.will else None}
+
+def encodeSubscription(subscription):
+  if isinstance(subscription, V5Subscriptions):
+    options, properties = subscription.getOptions()
+    return {"clientid" : str(subscription.getClientid()), "topic" : subscription.getTopic(),
+            "protocol" : "mqtt5", "qos" : options.QoS, "noLocal" : bool(options.noLocal),
+            "retainAsPublished" : bool(options.retainAsPublished), "retainHandling" : options.retainHandling}
+  return {"clientid" : str(subscription.getClientid()), "topic" : subscription.getTopic(),
+          "protocol" : "mqtt311", "qos" : subscription.getQoS()}
+
+def encodeRetained(topic, retained):
+  payload, encoding = Streams.encodePayload(retained[0])
+  return {"topic" : topic, "payload" : payload, "encoding" : encoding, "qos" : retained[1]}
+
+def encodeClient(protocol, client):
+  return encodeV5Client(client) if protocol == "mqtt5" else encodeV3Client(client)
+
+def get_client(clientid, query):
+  fields = fieldsOf(query)
+  with lock:
+    client5 = broker5.broker.getClient(clientid) if clientid not in broker5.broker.internalClients else None
+    items = [select(encodeClient(protocol, client), fields) for protocol, client in
+             [("mqtt311", broker3.broker.getClient(clientid)), ("mqtt5", client5)] if client]
+  if len(items) == 0:
+    return 404, json.dumps({"error" : "client %s not found" % clientid})
+  return 200, json.dumps(items[0] if len(items) == 1 else items)
+
+def get_clients(query):
+  """
+  clients of both protocols in client id order, optionally those with ids starting with
+  prefix, limit at a time
+  """
+  prefix = query.get("prefix", "")
+  internal = set(broker5.broker.internalClients) # subscribers within the broker, such as streams
+  ids5 = [clientid for clientid in list(broker5.broker.getClients().keys()) # copies which can be read without the lock
+          if clientid not in internal]
+  ids3 = broker3.broker.getClients()
+  keys = (((str(clientid), protocol), (protocol, clientid)) for protocol, ids in [("mqtt311", ids3), ("mqtt5", ids5)]
+          for clientid in ids if str(clientid).startswith(prefix))
+  selected, cursor = page(keys, query)
+  fields = fieldsOf(query)
+  items = []
+  with lock: # each page is consistent
+    for protocol, clientid in selected:
+      client = (broker5.broker if protocol == "mqtt5" else broker3.broker).getClient(clientid)
+      if client:
+        items.append(select(encodeClient(protocol, client), fields))
+  return 200, {"items" : items, "cursor" : cursor}
+
+def get_subscriptions(query):
+  """
+  subscriptions in client id and topic order, optionally of clients with ids starting with
+  prefix, and topic filters starting with topic, limit at a time
+  """
+  prefix = query.get("prefix", ""); topic = query.get("topic", "")
+  subscriptions = list(sharedData["subscriptions"]) + list(sharedData.get("dollar_subscriptions", []))
+  keys = (((str(s.getClientid()), s.getTopic(), type(s).__module__), s) for s in subscriptions
+          if str(s.getClientid()).startswith(prefix) and s.getTopic().startswith(topic))
+  selected, cursor = page(keys, query)
+  fields = fieldsOf(query)
+  with lock:
+    items = [select(encodeSubscription(subscription), fields) for subscription in selected]
+  return 200, {"items" : items, "cursor" : cursor}
+
+def get_retained_messages(query):
+  "retained messages in topic order, optionally with topics starting with topic, limit at a time"
+  topic = query.get("topic", "")
+  topics = list(sharedData["retained"].keys()) + list(sharedData.get("dollar_retained", {}).keys())
+  keys = (((name,), name) for name in topics if name.startswith(topic))
+  selected, cursor = page(keys, query)
+  fields = fieldsOf(query)
+  items = []
+  with lock:
+    for name in selected:
+      retained = sharedData["retained" if not name.startswith("$") else "dollar_retained"].get(name)
+      if retained:
+        items.append(select(encodeRetained(name, retained), fields))
+  return 200, {"items" : items, "cursor" : cursor}
+
+def get_stream(query):
+  "stream the publications matching topic, as server-sent events or, with format=ndjson, lines of JSON"
+  topic = query.get("topic", "")
+  try:
+    Topics.isValidTopicName(topic)
+  except MQTTV3.MQTTException:
+    return 400, json.dumps({"error" : "topic filter invalid %s" % topic})
+  if topic.startswith("$share/"):
+    return 400, json.dumps({"error" : "shared subscriptions can't be streamed"})
+  format = query.get("format", "sse")
+  if format not in Streams.Streams.formats:
+    return 400, json.dumps({"error" : "format must be one of %s" % list(Streams.Streams.formats.keys())})
+  stream = Streams.Streams(broker5.broker, lock, topic, format)
+  stream.open()
+  return 200, stream, stream.contentType
+
+def get_latencies(*args):
+  "delivery latency percentiles in microseconds, by protocol and QoS, and for the busiest clients"
+  return 200, Histograms.latencies.summary()
+
+def get_profiler(*args):
+  return 200, json.dumps(Profilers.profiler.status())
+
+def start_profiler(*args):
+  rc = 200 if Profilers.profiler.start() else 409 # already running
+  return rc, json.dumps(Profilers.profiler.status())
+
+def stop_profiler(*args):
+  summary = Profilers.profiler.stop()
+  if summary == None:
+    return 409, json.dumps(Profilers.profiler.status())
+  return 200, json.dumps(dict(Profilers.profiler.status(), summary=summary))
+
+def get_metrics(*args):
+  "the broker's counters in the Prometheus text format"
+  return 200, Metrics.exposition({"mqtt311" : broker3, "mqtt5" : broker5}, sharedData), Metrics.CONTENT_TYPE
+
+PUBLISHER = "$http" # the client id of publications made through the API
+NDJSON_TYPES = ["application/x-ndjson", "application/jsonl"]
+
+def propertiesOf(values):
+  "the MQTT 5.0 properties of a publication from their JSON form"
+  properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+  if type(values) != type({}):
+    raise ValueError("properties must be an object")
+  for name, value in values.items():
+    if name in ["PayloadFormatIndicator", "MessageExpiryInterval"]:
+      if type(value) != type(0) or value < 0 or value > (1 if name == "PayloadFormatIndicator" else 0xFFFFFFFF):
+        raise ValueError("invalid %s" % name)
+    elif name in ["ContentType", "ResponseTopic"]:
+      if type(value) != type(""):
+        raise ValueError("%s must be a string" % name)
+    elif name == "CorrelationData":
+      if type(value) != type(""):
+        raise ValueError("CorrelationData must be a base64 string")
+      value = base64.b64decode(value, validate=True)
+    elif name == "UserProperty":
+      if type(value) != type([]) or [pair for pair in value if type(pair) != type([]) or len(pair) != 2 or
+                                     [s for s in pair if type(s) != type("")]]:
+        raise ValueError("UserProperty must be a list of [name, value] strings")
+      value = [tuple(pair) for pair in value]
+    else:
+      raise ValueError("property %s can't be set" % name)
+    setattr(properties, name, value)
+  return properties
+
+def publicationOf(message):
+  "the topic, payload, qos, retained flag and properties of one message, or ValueError"
+  if type(message) != type({}):
+    raise ValueError("message must be an object")
+  topic = message.get("topic")
+  if type(topic) != type("") or len(topic) == 0 or len(topic.encode("utf-8")) > 65535:
+    raise ValueError("topic must be a string of 1 to 65535 bytes")
+  if topic.find("+") != -1 or topic.find("#") != -1 or topic.find("\0") != -1 or topic.startswith("$"):
+    raise ValueError("topic name invalid %s" % topic)
+  payload = message.get("payload", "")
+  if type(payload) != type(""):
+    raise ValueError("payload must be a base64 string")
+  payload = base64.b64decode(payload, validate=True)
+  qos = message.get("qos", 0)
+  if qos not in [0, 1, 2] or type(qos) != type(0):
+    raise ValueError("qos must be 0, 1 or 2")
+  retained = message.get("retain", False)
+  if type(retained) != type(True):
+    raise ValueError("retain must be true or false")
+  return topic, payload, qos, retained, propertiesOf(message.get("properties", {}))
+
+def post_publish(body):
+  """
+  publish a JSON array, or newline delimited JSON objects, of
+  {"topic", "payload" in base64, "qos", "retain", "properties"}
+
+  The messages are all checked first, then published in order holding the lock once.
+  The result of each is its number of subscribers or an error.
+  """
+  if type(body) == type([]):
+    messages = body
+  elif type(body) == type({}) and "data" in body:
+    if body["Content-Type"].split(";")[0].strip() not in NDJSON_TYPES:
+      return 415, json.dumps({"error" : "content type must be application/json or one of %s" % NDJSON_TYPES})
+    messages = []
+    for line in body["data"].split(b"\n"):
+      if line.strip():
+        try:
+          messages.append(json.loads(line))
+        except ValueError:
+          messages.append(None)
+  else:
+    return 400, json.dumps({"error" : "body must be an array of messages"})
+  publications = []
+  results = []
+  for message in messages:
+    try:
+      publications.append(publicationOf(message))
+      results.append(None)
+    except (ValueError, MQTTV5.MQTTException) as error:
+      publications.append(None)
+      results.append({"error" : str(error) if message != None else "invalid JSON"})
+  receivedTime = time.monotonic()
+  with lock:
+    for i, publication in enumerate(publications):
+      if publication:
+        try:
+          subscribers = broker5.broker.publish(PUBLISHER, *publication, receivedTime)
+          results[i] = {"subscribers" : len(subscribers) if subscribers else 0}
+        except:
+          logger.exception("HTTP publish to %s", publication[0])
+          results[i] = {"error" : "not published"}
+  failed = len([result for result in results if "error" in result])
+  logger.info("HTTP publish of %d messages, %d failed", len(results), failed)
+  return 200, {"published" : len(results) - failed, "failed" : failed, "results" : results}
 
 class APIs:
 
@@ -77,6 +319,10 @@ class APIs:
       ("/api/v0001/clients/([^/]*)$", get_client),   
       ("/api/v0001/subscriptions$", get_subscriptions),  
       ("/api/v0001/retained$", get_retained_messages), 
+      ("/api/v0001/stream$", get_stream),
+      ("/api/v0001/latencies$", get_latencies),
+      ("/api/v0001/profiler$", get_profiler),
+      ("/metrics$", get_metrics),
       ]
 
     self.puts = [
@@ -85,14 +331,17 @@ class APIs:
     self.patches = [
       ]
 
-    self.posts = [ 
+    self.posts = [
+      ("/api/v0001/publish$", post_publish),
+      ("/api/v0001/profiler/start$", start_profiler),
+      ("/api/v0001/profiler/stop$", stop_profiler),
       ]
 
     self.deletes = [
       ]
 
-  def operation(self, name, url, body=None):
-    logger.debug("Calling HTTP "+name+" "+url+(" with "+str(body) if (body != None) else ""))
+  def operation(self, name, url, body=None, query=None):
+    logger.debug("Calling HTTP %s %s%s", name, url, " with "+str(body) if (body != None) else "")
     rc = (404, None)
     ops = eval("self."+name+("es" if name.endswith("ch") else "s"))
     found = False
@@ -101,21 +350,26 @@ class APIs:
       res = expr.match(url)
       if res:
         args = res.groups()
-        if body:
+        if body != None:
           if args:
             args = tuple(list(args) + [body])
           else:
             args = (body,)
-        rc = op[1](*args)
+        if query != None:
+          args = tuple(args) + (query,)
+        try:
+          rc = op[1](*args)
+        except BadRequest as error:
+          rc = (400, json.dumps({"error" : str(error)}))
         found = True
         break
     if not found:
       logger.error("Request operation not found: %s %s %s" % (name, url, str(body)))
-    logger.debug("Result "+str(rc))
+    logger.debug("Result %s", rc)
     return rc
 
-  def get(self, url):
-    return self.operation("get", url)
+  def get(self, url, query={}):
+    return self.operation("get", url, query=query)
 
   def put(self, url, body):
     return self.operation("put", url, body)
@@ -132,9 +386,13 @@ class APIs:
 api = APIs()
 
 class requestHandler(http.server.BaseHTTPRequestHandler):
+  """
+  HTTP/1.1, so a client can send many requests on one connection.  Each connection has its
+  own thread, which waits at most KEEPALIVE_TIMEOUT seconds for the next request.
+  """
 
-  #def __init__(self, request, client_address, server):
-  #  BaseHTTPRequestHandler.__init__(self, request, client_address, server)
+  protocol_version = "HTTP/1.1"
+  timeout = KEEPALIVE_TIMEOUT
 
   def log_request(self, *args):
     # Redefing this method to remove logging of request
@@ -144,52 +402,23 @@ class requestHandler(http.server.BaseHTTPRequestHandler):
   def do_GET(self):
     logger.debug("do_GET")
     logger.info("GET %s", urllib.request.unquote(self.path))
-    rc = api.get(urllib.request.unquote(self.path))
-    value = None
-    if type(rc) == type((0,)):
-      rc, value = rc
-    logger.debug("Response %s", str((rc, value)))
-    self.send_response(rc)
-    self.send_header("Content-type", "application/json")
-    self.end_headers()
-    if value:
-      self.wfile.write(bytes(value + "\n", 'utf8'))
+    url = urllib.parse.urlsplit(self.path)
+    query = dict((name, values[0]) for name, values in urllib.parse.parse_qs(url.query).items())
+    self.respond(api.get(urllib.request.unquote(url.path), query))
 
   def do_DELETE(self):
     logger.debug("do_DELETE")
-    rc = http.delete(urllib.request.unquote(self.path))
-    value = None
-    if type(rc) == type((0,)):
-      rc, value = rc
-    self.send_response(rc)
-    self.send_header("Content-type", "application/json")
-    self.end_headers()
-    if value:
-      self.wfile.write(bytes(value + "\n", 'utf8'))
+    try:
+      self.readBody() # anything sent must be read before the next request on the connection
+    except ValueError:
+      self.respond((400, json.dumps({"error" : "invalid body"})))
+      self.close_connection = True
+      return
+    self.respond(api.delete(urllib.request.unquote(self.path)))
 
   def do_PATCH(self):
     logger.debug("do_PATCH")
-    self.headers["Content-Disposition"] = 'inline; filename=""'
-    form = cgi.FieldStorage(fp=self.rfile,
-                            headers=self.headers,
-                            environ={"REQUEST_METHOD": 'PATCH',
-                                      "CONTENT_TYPE": self.headers['Content-Type'], })
-    if self.headers["Content-Type"] == "application/json":
-      if type(form.value) == type(b""):
-        form.value = form.value.decode()
-      body = json.loads(form.value)
-    rc = http.patch(urllib.request.unquote(self.path), body)
-    value = None
-    if type(rc) == type((0,)):
-      rc, value = rc
-    self.send_response(rc)
-    self.send_header("Content-type", "application/json")
-    self.end_headers()
-    if value:
-      self.wfile.write(bytes(value + "\n", 'utf8'))
-    if persistence:
-      deviceAndThingDB._p_changed = True
-      transaction.commit()
+    self.do_postput("patch")
 
   def do_POST(self):
     logger.debug("do_POST")
@@ -200,39 +429,104 @@ class requestHandler(http.server.BaseHTTPRequestHandler):
     self.do_postput("put")
 
   def do_postput(self, op):
-    # next line is workaround for bug: https://bugs.python.org/issue27308
-    self.headers["Content-Disposition"] = 'inline; filename=""'
-    form = cgi.FieldStorage(fp=self.rfile,
-                            headers=self.headers,
-                            environ={"REQUEST_METHOD": op.upper(),
-                                      "CONTENT_TYPE": self.headers['Content-Type'], })
-    body = {"Content-Type": self.headers['Content-Type']}
-    if self.headers["Content-Type"] == "application/json":
-      if type(form.value) == type(b""):
-        form.value = form.value.decode()
-      body = json.loads(form.value)
-    elif type(form.value) == type([]):
-      for key in form.keys():
-        if key == "schemaFile":
-          # a bit ugly, but everyone has to do it
-          # retrieve filename from the Content-Disposition header of the "file" part
-          body["schemaFileName"] = form[key].disposition_options["filename"]
-          body["Content-Type"] = form[key].type
-        body[key] = form[key].value
-    rc = getattr(http, op)(self.path, body)
+    try:
+      data = self.readBody()
+    except ValueError:
+      self.respond((400, json.dumps({"error" : "invalid body"})))
+      self.close_connection = True
+      return
+    contentType = self.headers.get("Content-Type", "")
+    if contentType.split(";")[0].strip() == "application/json":
+      try:
+        body = json.loads(data.decode("utf-8"))
+      except ValueError:
+        self.respond((400, json.dumps({"error" : "invalid JSON"})))
+        return
+    else:
+      body = {"Content-Type" : contentType, "data" : data}
+    self.respond(getattr(api, op)(urllib.request.unquote(self.path), body))
+
+  def readBody(self):
+    "the request body, given a Content-Length or in chunks"
+    if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+      chunks = []
+      while True:
+        size = int(self.rfile.readline().split(b";")[0], 16)
+        if size == 0:
+          while self.rfile.readline() not in [b"\r\n", b"\n", b""]: # trailers
+            pass
+          return b"".join(chunks)
+        chunks.append(self.rfile.read(size))
+        self.rfile.readline()
+    length = int(self.headers.get("Content-Length", 0))
+    return self.rfile.read(length) if length > 0 else b""
+
+  def respond(self, rc):
+    """
+    rc is a status, or a tuple of status, value and optionally content type.  A string value
+    is sent whole.  A value with a chunks method, a stream, is sent as it produces them, and
+    then closed.  Any other value is encoded in JSON as it is sent, in chunks, so that a
+    large response is never held in memory as a whole.
+    """
     value = None
+    contentType = "application/json"
     if type(rc) == type((0,)):
-      rc, value = rc
+      if len(rc) == 3:
+        rc, value, contentType = rc
+      else:
+        rc, value = rc
+    logger.debug("Response %s", (rc, value))
     self.send_response(rc)
-    self.send_header("Content-type", "application/json")
-    self.end_headers()
-    if value:
-      self.wfile.write(bytes(value + "\n", 'utf8'))
-    """
-    if persistence:
-      deviceAndThingDB._p_changed = True
-      transaction.commit()
-    """
+    self.send_header("Content-Type", contentType)
+    if value == None or type(value) == type(""):
+      data = bytes(value + "\n", "utf8") if value else b""
+      self.send_header("Content-Length", str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+    else:
+      streamed = hasattr(value, "chunks")
+      try:
+        if streamed:
+          self.send_header("Cache-Control", "no-cache")
+        chunks = value.chunks() if streamed else self.encode(value)
+        if self.request_version == "HTTP/1.0": # no chunks, the end of the response is the end of the connection
+          self.close_connection = True
+          self.end_headers()
+          for data in chunks:
+            self.wfile.write(data)
+        else:
+          self.send_header("Transfer-Encoding", "chunked")
+          self.end_headers()
+          for data in chunks:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+          self.wfile.write(b"0\r\n\r\n")
+      finally:
+        if streamed:
+          value.close()
+
+  def encode(self, value):
+    "value in JSON, in pieces of about CHUNK_SIZE bytes"
+    pieces = []; size = 0
+    for piece in json.JSONEncoder().iterencode(value):
+      pieces.append(piece); size += len(piece)
+      if size >= CHUNK_SIZE:
+        yield "".join(pieces).encode("utf-8")
+        pieces = []; size = 0
+    pieces.append("\n")
+    yield "".join(pieces).encode("utf-8")
+
+
+class ThreadingHTTPServer(http.server.ThreadingHTTPServer):
+  "a thread for each connection, so that one slow request or client doesn't hold up the others"
+  daemon_threads = True
+  request_queue_size = 50
+
+  def handle_error(self, request, client_address):
+    if isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+      logger.debug("HTTP connection from %s closed", client_address)
+    else:
+      http.server.ThreadingHTTPServer.handle_error(self, request, client_address)
+
 
 def setBrokers(aBroker3, aBroker5, aBrokerSN):
   global broker3, broker5, brokerSN
@@ -252,14 +546,18 @@ def create(port, host="", TLS=False, serve_forever=False,
   bind_address = ""
   if host not in ["", "INADDR_ANY"]:
     bind_address = host
-  httpd = http.server.HTTPServer((bind_address, port), requestHandler)
+  httpd = ThreadingHTTPServer((bind_address, port), requestHandler)
   if TLS:
-    httpd.socket = ssl.wrap_socket(httpd.socket,
-      ca_certs=ca_certs, certfile=certfile, keyfile=keyfile,
-      cert_reqs=cert_reqs, server_side=True)
+    context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    if ca_certs:
+      context.load_verify_locations(ca_certs)
+    context.verify_mode = cert_reqs
+    httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
   if serve_forever:
     httpd.serve_forever()
   else:
     thread = threading.Thread(target = httpd.serve_forever)
     thread.daemon = True
     thread.start()
+  return httpd
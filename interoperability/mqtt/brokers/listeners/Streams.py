@@ -0,0 +1,130 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+The publications matching a topic filter, streamed to an HTTP client as server-sent
+events or newline delimited JSON:
+
+  GET /api/v0001/stream?topic=sensors/%2B/temperature
+  GET /api/v0001/stream?topic=sensors/%23&format=ndjson
+
+Each stream is an internal subscriber of the MQTT 5.0 broker (see Brokers.attach).  The
+broker calls publishArrived holding its lock, so that only puts the message in the
+stream's buffer, which the HTTP connection's thread writes out.  The buffer holds the
+latest message for each of at most limit topics: a newer message on the same topic
+replaces the one waiting, and when the buffer is full the oldest topic is dropped.  A
+slow client therefore sees the latest values, not a growing backlog.
+
+"""
+
+import threading, collections, itertools, json, base64, logging
+
+import mqtt.formats.MQTTV5 as MQTTV5
+from mqtt.brokers.V5 import Brokers
+
+logger = logging.getLogger('MQTT broker')
+
+LIMIT = 1000 # topics held for each stream
+HEARTBEAT = 15 # seconds without messages before something is written, to find closed connections
+
+ids = itertools.count(1)
+
+def encodePayload(payload):
+  "a payload as a string, and its encoding, utf-8 or base64"
+  try:
+    return payload.decode("utf-8"), "utf-8"
+  except UnicodeDecodeError:
+    return base64.b64encode(payload).decode("ascii"), "base64"
+
+def encodeMessage(topic, payload, qos, retained):
+  payload, encoding = encodePayload(payload)
+  return {"topic" : topic, "payload" : payload, "encoding" : encoding, "qos" : qos, "retain" : retained}
+
+
+class Streams:
+
+  formats = {"sse" : "text/event-stream", "ndjson" : "application/x-ndjson"}
+
+  def __init__(self, broker, lock, topicFilter, format="sse", limit=LIMIT, heartbeat=HEARTBEAT):
+    "broker is the MQTT 5.0 Brokers object, lock the broker lock"
+    self.id = "%sstream/%d" % (Brokers.INTERNAL, next(ids))
+    self.broker = broker
+    self.lock = lock
+    self.topicFilter = topicFilter
+    self.format = format
+    self.contentType = self.formats[format]
+    self.limit = limit
+    self.heartbeat = heartbeat
+    self.condition = threading.Condition()
+    self.pending = collections.OrderedDict() # topic -> (payload, qos, retained), oldest first
+    self.coalesced = self.dropped = 0
+    self.closed = False
+
+  def open(self):
+    "subscribe, which puts the retained messages for the topic filter in the buffer"
+    with self.lock:
+      self.broker.attach(self, [self.topicFilter],
+          [(MQTTV5.SubscribeOptions(QoS=0), MQTTV5.Properties(MQTTV5.PacketTypes.SUBSCRIBE))])
+    logger.info("Stream %s opened for %s", self.id, self.topicFilter)
+
+  def close(self):
+    with self.lock:
+      self.broker.detach(self.id)
+    with self.condition:
+      self.closed = True
+      self.condition.notify()
+    logger.info("Stream %s closed, %d messages coalesced, %d dropped", self.id, self.coalesced, self.dropped)
+
+  def publishArrived(self, topic, msg, qos, properties=None, receivedTime=None, retained=False):
+    "called by the broker holding its lock, so never waits for the HTTP client"
+    with self.condition:
+      if topic in self.pending:
+        self.coalesced += 1
+      elif len(self.pending) >= self.limit:
+        self.pending.popitem(last=False)
+        self.dropped += 1
+      self.pending[topic] = (msg, qos, retained)
+      self.condition.notify()
+
+  def event(self, data):
+    data = json.dumps(data)
+    return ("data: %s\n\n" % data if self.format == "sse" else data + "\n").encode("utf-8")
+
+  def chunks(self):
+    "the bytes of the response as the messages arrive, until the stream is closed"
+    lost = (0, 0) # coalesced and dropped when last reported
+    if self.format == "sse":
+      yield b": %s\n\n" % self.topicFilter.encode("utf-8")
+    while True:
+      with self.condition:
+        if len(self.pending) == 0 and not self.closed:
+          self.condition.wait(self.heartbeat)
+        if self.closed:
+          return
+        messages, self.pending = self.pending, collections.OrderedDict()
+        counts = (self.coalesced, self.dropped)
+      data = []
+      if counts != lost:
+        data.append(self.event({"coalesced" : counts[0], "dropped" : counts[1]}))
+        lost = counts
+      for topic, (payload, qos, retained) in messages.items():
+        data.append(self.event(encodeMessage(topic, payload, qos, retained)))
+      if len(data) == 0: # heartbeat
+        data.append(b":\n\n" if self.format == "sse" else b"\n")
+      yield b"".join(data)
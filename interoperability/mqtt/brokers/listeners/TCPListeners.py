@@ -25,6 +25,7 @@ from mqtt.brokers.V311 import MQTTBrokers as MQTTV3Brokers
 from mqtt.brokers.V5 import MQTTBrokers as MQTTV5Brokers
 from mqtt.formats.MQTTV311 import MQTTException as MQTTV3Exception
 from mqtt.formats.MQTTV5 import MQTTException as MQTTV5Exception
+from mqtt.brokers import guards
 
 server = None
 logger = logging.getLogger('MQTT broker')
@@ -149,13 +150,19 @@ class WebSocketTCPHandler(socketserver.StreamRequestHandler):
     broker = None
     sock = BufferedSockets(self.request)
     sock_no = sock.fileno()
+    if sock_no in self.server.prefixes:
+      # data already read by the dispatcher of a multi-process broker
+      sock.rebuffer(self.server.prefixes.pop(sock_no))
     terminate = keptalive = False
     logger.info("Starting communications for socket %d", sock_no)
     while not terminate and server and not server.terminate:
       try:
-        if not keptalive:
+        if not keptalive and guards.debug:
           logger.debug("Waiting for request")
-        (i, o, e) = select.select([sock], [], [], 1)
+        if len(sock.buffer) > 0: # data has been read already
+          (i, o, e) = ([sock], [], [])
+        else:
+          (i, o, e) = select.select([sock], [], [], 1)
         if i == [sock]:
           if first:
             char = sock.recv(1)
@@ -219,7 +226,14 @@ class WebSocketTCPHandler(socketserver.StreamRequestHandler):
 
 class ThreadingTCPServer(socketserver.ThreadingMixIn,
                            socketserver.TCPServer):
-  pass
+  prefixes = {} # socket number -> data read before the socket was handed to this process
+
+
+class DispatchedTCPServer(ThreadingTCPServer):
+  "never listens, connections accepted by another process are passed to process_request"
+
+  def shutdown(self):
+    self.terminate = True
 
 
 def setBrokers(aBroker3, aBroker5):
@@ -231,8 +245,19 @@ def setBrokers(aBroker3, aBroker5):
 
 def create(port, host="", TLS=False, serve_forever=False,
     cert_reqs=ssl.CERT_REQUIRED,
-    ca_certs=None, certfile=None, keyfile=None, allow_non_sni_connections=True):
+    ca_certs=None, certfile=None, keyfile=None, allow_non_sni_connections=True,
+    reuse_port=False, dispatched=False):
+  """
+  reuse_port: allow other processes to listen on the same port (multi-process broker)
+  dispatched: don't listen at all, connections are passed in by process_request
+  """
   global server
+  if dispatched:
+    logger.info("Starting TCP listener for dispatched connections")
+    server = DispatchedTCPServer((host, port), WebSocketTCPHandler, False)
+    server.prefixes = {}
+    server.terminate = False
+    return server
   logger.info("Starting TCP listener on address '%s' port %d %s", host, port, "with TLS support" if TLS else "")
 
   def snicallback(socket, text, context):
@@ -267,6 +292,8 @@ def create(port, host="", TLS=False, serve_forever=False,
   server.request_queue_size = 50
   server.terminate = False
   server.allow_reuse_address = True
+  if reuse_port:
+    server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
   server.server_bind()
   server.server_activate()
   if serve_forever:
@@ -18,14 +18,26 @@
 *******************************************************************
 """
 
+"""
+
+MQTT-SN over UDP.  By default each datagram is handled in a new thread, as socketserver
+does.  With threads false in the listener's configuration, one thread reads the
+datagrams into a buffer it reuses, handles as many as are waiting, up to BATCH, holding
+the broker lock once, and then sends the responses.
+
+"""
+
 import socketserver, select, sys, traceback, socket, logging, getopt, hashlib, base64
 import threading, ssl
 
 from mqtt.brokers.SN import MQTTSNBrokers
-from mqtt.formats.MQTTSN import MQTTSNException
+from mqtt.formats.MQTTSN import MQTTSNException, MAX_PACKET_SIZE
 
 logger = logging.getLogger('MQTT broker')
 
+BATCH = 256 # datagrams handled for each acquisition of the broker lock
+MAX_ADDRESSES = 10000 # addresses whose callbacks are kept, beyond those of connected clients
+
 def respond(handler, data):
   socket = handler.request[1]
   socket.sendto(data, handler.client_address)
@@ -47,20 +59,101 @@ class ThreadingUDPServer(socketserver.ThreadingMixIn,
   pass
 
 
+def respondDatagram(context, data):
+  "queue a response of the datagram loop, or send it now if it's from another thread"
+  server, address = context
+  if threading.get_ident() == server.thread:
+    server.outgoing.append((data, address))
+  else:
+    server.send(data, address)
+
+
+class DatagramServers:
+  "all the datagrams read, handled and answered by the thread which calls serve_forever"
+
+  def __init__(self, server_address):
+    self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.socket.bind(server_address)
+    self.socket.setblocking(False)
+    self.buffer = bytearray(MAX_PACKET_SIZE + 1)
+    self.view = memoryview(self.buffer)
+    self.callbacks = {} # client address -> callback for MQTTSNBrokers.handleRequest
+    self.outgoing = [] # (data, address) to send once the current batch has been handled
+    self.thread = None
+    self.running = True
+    self.stopped = threading.Event()
+
+  def serve_forever(self):
+    self.thread = threading.get_ident()
+    try:
+      while self.running:
+        if select.select([self.socket], [], [], 0.5)[0]:
+          self.handleBatch()
+    finally:
+      self.stopped.set()
+
+  def callbackOf(self, address):
+    callback = self.callbacks.get(address)
+    if callback == None:
+      if len(self.callbacks) >= MAX_ADDRESSES: # forget the addresses which have no client
+        self.callbacks = dict([(a, c) for a, c in self.callbacks.items() if a in brokerSN.clients])
+      callback = self.callbacks[address] = (respondDatagram, (self, address))
+    return callback
+
+  def handleBatch(self):
+    with brokerSN.lock:
+      for i in range(BATCH):
+        try:
+          length, address = self.socket.recvfrom_into(self.buffer)
+        except (BlockingIOError, InterruptedError):
+          break
+        except OSError as error: # an ICMP error for an earlier datagram sent, on some platforms
+          logger.debug("UDP receive: %s", error)
+          continue
+        try:
+          brokerSN.handleRequest(bytes(self.view[:length]), address, self.callbackOf(address))
+        except MQTTSNException as error:
+          logger.error("MQTT-SN datagram from %s: %s", address, error)
+        except:
+          logger.exception("MQTT-SN datagram from %s", address)
+    outgoing, self.outgoing = self.outgoing, []
+    for data, address in outgoing:
+      self.send(data, address)
+
+  def send(self, data, address):
+    try:
+      self.socket.sendto(data, address)
+    except OSError as error: # the send buffer is full, or the address unreachable
+      logger.debug("UDP send to %s: %s", address, error)
+
+  def shutdown(self):
+    self.running = False
+    if self.thread not in [None, threading.get_ident()]:
+      self.stopped.wait()
+
+  def server_close(self):
+    self.socket.close()
+
+
 def setBroker(aBrokerSN):
   global brokerSN
   brokerSN = aBrokerSN
 
-def create(port, host="", serve_forever=False):
-  logger.info("Starting UDP listener on address '%s' port %d", host, port)
+def create(port, host="", serve_forever=False, threads=True):
+  "threads: a thread for each datagram, otherwise one thread for all"
+  logger.info("Starting UDP listener on address '%s' port %d%s", host, port, "" if threads else ", single threaded")
   bind_address = ""
   if host not in ["", "INADDR_ANY"]:
     bind_address = host
-  server = ThreadingUDPServer((bind_address, port), UDPHandler, False)
-  server.terminate = False
-  server.allow_reuse_address = True
-  server.server_bind()
-  server.server_activate()
+  if threads:
+    server = ThreadingUDPServer((bind_address, port), UDPHandler, False)
+    server.terminate = False
+    server.allow_reuse_address = True
+    server.server_bind()
+    server.server_activate()
+  else:
+    server = DatagramServers((bind_address, port))
   if serve_forever:
     server.serve_forever()
   else:
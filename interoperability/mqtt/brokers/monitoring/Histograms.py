@@ -0,0 +1,165 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+
+"""
+
+Latency histograms with a fixed number of buckets, in the manner of HDR histograms.
+
+Values are in microseconds.  Up to 32 each value has its own bucket; above that each
+power of two is divided into 16 buckets, so a bucket is at most 1/16 of its lower bound
+wide, and percentiles are accurate to about 6%.  Values up to 2**31 microseconds, about
+35 minutes, are kept in 32 + 26 * 16 = 448 buckets; larger ones are counted in the last.
+
+The broker records the time from receiving a publication to writing it to the socket of
+each subscriber, and for QoS 1 and 2 to receiving its PUBACK or PUBCOMP, in latencies.
+Histograms are kept by protocol and QoS, and for the clients with the most deliveries.
+
+"""
+
+import threading, bisect
+
+SUBBUCKETS = 16
+LINEAR = 2 * SUBBUCKETS # values below this have one bucket each
+MAXSHIFT = 26
+BUCKETS = LINEAR + MAXSHIFT * SUBBUCKETS
+
+def bucketOf(value):
+  if value < LINEAR:
+    return max(value, 0)
+  shift = value.bit_length() - 5
+  if shift > MAXSHIFT:
+    return BUCKETS - 1
+  return LINEAR + (shift - 1) * SUBBUCKETS + (value >> shift) - SUBBUCKETS
+
+def highestOf(index):
+  "the highest value in a bucket"
+  if index < LINEAR:
+    return index
+  shift = (index - LINEAR) // SUBBUCKETS + 1
+  sub = (index - LINEAR) % SUBBUCKETS + SUBBUCKETS
+  return ((sub + 1) << shift) - 1
+
+
+class Histograms:
+
+  def __init__(self):
+    self.counts = [0] * BUCKETS
+    self.count = 0
+    self.maximum = 0
+
+  def record(self, seconds):
+    value = int(seconds * 1000000)
+    self.counts[bucketOf(value)] += 1
+    self.count += 1
+    if value > self.maximum:
+      self.maximum = value
+
+  def percentile(self, percent):
+    "the value below which percent of the values lie, in microseconds"
+    if self.count == 0:
+      return 0
+    wanted = self.count * percent / 100
+    total = 0
+    for index, count in enumerate(self.counts):
+      total += count
+      if total >= wanted and count > 0:
+        return min(highestOf(index), self.maximum)
+    return self.maximum
+
+  def summary(self):
+    return {"count" : self.count, "p50" : self.percentile(50), "p99" : self.percentile(99),
+            "p999" : self.percentile(99.9), "max" : self.maximum}
+
+
+class Buckets:
+  """
+  The number of values no greater than each of a list of bounds, with their sum, as
+  Prometheus histograms are kept.  Values above the last bound are counted in counts[-1].
+  """
+
+  def __init__(self, bounds):
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.count = 0
+    self.sum = 0
+
+  def record(self, value):
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.count += 1
+    self.sum += value
+
+
+class Latencies:
+  """
+  Delivery and acknowledgement latencies by protocol and QoS, and delivery latencies
+  for at most maxClients clients.  When a new client is seen and the table is full, the
+  client with the fewest deliveries is replaced (the space-saving algorithm), so the
+  clients with the most deliveries are kept.
+  """
+
+  def __init__(self, maxClients=100):
+    self.maxClients = maxClients
+    self.deliveries = {}       # (protocol, qos) -> Histograms
+    self.acknowledgements = {} # (protocol, qos) -> Histograms
+    self.clients = {}          # clientid -> Histograms
+    self.ranks = {}            # clientid -> deliveries, including those of the client it replaced
+    self.lock = threading.Lock() # for changes to the tables, not the counts
+
+  def histogramOf(self, table, key):
+    histogram = table.get(key)
+    if histogram == None:
+      with self.lock:
+        histogram = table.setdefault(key, Histograms())
+    return histogram
+
+  def clientHistogram(self, clientid):
+    histogram = self.clients.get(clientid)
+    if histogram == None:
+      with self.lock:
+        rank = 0
+        if len(self.clients) >= self.maxClients:
+          fewest = min(self.ranks.keys(), key=self.ranks.get)
+          del self.clients[fewest]
+          rank = self.ranks.pop(fewest) # an overestimate, as in space-saving
+        histogram = self.clients[clientid] = Histograms()
+        self.ranks[clientid] = rank
+    return histogram
+
+  def delivered(self, protocol, qos, clientid, seconds):
+    "a publication has been written to the socket of a subscriber"
+    self.histogramOf(self.deliveries, (protocol, qos)).record(seconds)
+    self.clientHistogram(clientid).record(seconds)
+    self.ranks[clientid] += 1
+
+  def acknowledged(self, protocol, qos, seconds):
+    "a QoS 1 or 2 publication has been acknowledged by a subscriber"
+    self.histogramOf(self.acknowledgements, (protocol, qos)).record(seconds)
+
+  def summary(self, top=10):
+    "percentiles in microseconds, for the HTTP API"
+    result = {"deliveries" : {}, "acknowledgements" : {}, "clients" : {}}
+    with self.lock:
+      for name in ["deliveries", "acknowledgements"]:
+        for (protocol, qos), histogram in sorted(getattr(self, name).items()):
+          result[name]["%s/qos%d" % (protocol, qos)] = histogram.summary()
+      for clientid in sorted(self.ranks.keys(), key=self.ranks.get, reverse=True)[:top]:
+        result["clients"][clientid] = self.clients[clientid].summary()
+    return result
+
+latencies = Latencies()
@@ -0,0 +1,131 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+Broker metrics in the Prometheus text exposition format, served at /metrics by the HTTP
+listener.  The values are read from the counters the brokers keep as they run (see
+Statistics), so a scrape neither takes the broker lock nor looks at each client:
+
+  mqtt_clients_connected{protocol}               gauge
+  mqtt_sessions_disconnected{protocol}           gauge, sessions kept without a connection
+  mqtt_packets_received_total{protocol,type}     counter
+  mqtt_packets_sent_total{protocol,type}         counter
+  mqtt_bytes_received_total{protocol}            counter
+  mqtt_bytes_sent_total{protocol}                counter
+  mqtt_publish_dropped_total{protocol}           counter
+  mqtt_messages_queued{protocol}                 gauge, waiting to be sent
+  mqtt_messages_inflight{protocol}               gauge, QoS 1 and 2 waiting to be acknowledged
+  mqtt_publish_fanout{protocol}                  histogram, subscribers of each publication
+  mqtt_codec_seconds{protocol,operation}         histogram, operation decode or encode
+  mqtt_lock_wait_seconds                         histogram
+  mqtt_subscriptions                             gauge
+  mqtt_retained_messages                         gauge
+
+"""
+
+from mqtt.formats import MQTTV5
+from mqtt.brokers.monitoring import Statistics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+typeNames = [name.lower() for name in MQTTV5.Packets.Names]
+
+def labelsOf(labels):
+  return "{" + ",".join(['%s="%s"' % (name, value) for name, value in labels]) + "}" if labels else ""
+
+class Exposition:
+  "the lines of one scrape"
+
+  def __init__(self):
+    self.lines = []
+
+  def family(self, name, kind, help):
+    self.lines.append("# HELP %s %s" % (name, help))
+    self.lines.append("# TYPE %s %s" % (name, kind))
+
+  def sample(self, name, value, labels=()):
+    self.lines.append("%s%s %s" % (name, labelsOf(labels), value))
+
+  def histogram(self, name, buckets, labels=()):
+    counts = list(buckets.counts) # the counts can change while this runs
+    bounds = ["%g" % bound for bound in buckets.bounds] + ["+Inf"]
+    total = 0
+    for bound, count in zip(bounds, counts):
+      total += count
+      self.sample(name + "_bucket", total, labels + (("le", bound),))
+    self.sample(name + "_sum", "%g" % buckets.sum, labels)
+    self.sample(name + "_count", total, labels)
+
+  def text(self):
+    return "\n".join(self.lines)
+
+
+def exposition(brokers, sharedData):
+  "brokers is protocol name -> MQTTBrokers object"
+  out = Exposition()
+  statistics = dict([(protocol, broker.getStatistics()) for protocol, broker in brokers.items()])
+  counters = [(protocol, Statistics.protocols[protocol]) for protocol in brokers.keys()]
+
+  out.family("mqtt_clients_connected", "gauge", "Clients connected.")
+  for protocol, values in statistics.items():
+    out.sample("mqtt_clients_connected", values["clients/connected"], (("protocol", protocol),))
+  out.family("mqtt_sessions_disconnected", "gauge", "Sessions kept for clients which are not connected.")
+  for protocol, values in statistics.items():
+    out.sample("mqtt_sessions_disconnected", values["clients/disconnected"], (("protocol", protocol),))
+
+  for direction in ["received", "sent"]:
+    name = "mqtt_packets_%s_total" % direction
+    out.family(name, "counter", "Packets %s, by type." % direction)
+    for protocol, counter in counters:
+      for packetType, count in enumerate(getattr(counter, direction)):
+        if count > 0:
+          out.sample(name, count, (("protocol", protocol), ("type", typeNames[packetType])))
+  out.family("mqtt_bytes_received_total", "counter", "Bytes received in MQTT packets.")
+  for protocol, counter in counters:
+    out.sample("mqtt_bytes_received_total", counter.bytesReceived, (("protocol", protocol),))
+  out.family("mqtt_bytes_sent_total", "counter", "Bytes sent in MQTT packets.")
+  for protocol, counter in counters:
+    out.sample("mqtt_bytes_sent_total", counter.bytesSent, (("protocol", protocol),))
+  out.family("mqtt_publish_dropped_total", "counter",
+             "Publications expired, too big, or QoS 0 for a client which is not connected.")
+  for protocol, counter in counters:
+    out.sample("mqtt_publish_dropped_total", counter.dropped, (("protocol", protocol),))
+
+  out.family("mqtt_messages_queued", "gauge", "Publications waiting to be sent to clients.")
+  for protocol, counter in counters:
+    out.sample("mqtt_messages_queued", counter.queued, (("protocol", protocol),))
+  out.family("mqtt_messages_inflight", "gauge", "QoS 1 and 2 publications sent, or to be resent, and not acknowledged.")
+  for protocol, counter in counters:
+    out.sample("mqtt_messages_inflight", counter.inflight, (("protocol", protocol),))
+
+  out.family("mqtt_publish_fanout", "histogram", "Subscribers each publication is sent to.")
+  for protocol, counter in counters:
+    out.histogram("mqtt_publish_fanout", counter.fanout, (("protocol", protocol),))
+  out.family("mqtt_codec_seconds", "histogram", "Time taken to unpack a packet received or pack one sent.")
+  for protocol, counter in counters:
+    out.histogram("mqtt_codec_seconds", counter.decoding, (("protocol", protocol), ("operation", "decode")))
+    out.histogram("mqtt_codec_seconds", counter.encoding, (("protocol", protocol), ("operation", "encode")))
+  out.family("mqtt_lock_wait_seconds", "histogram", "Time taken to get the broker lock for each packet received.")
+  out.histogram("mqtt_lock_wait_seconds", Statistics.lockWaits.histogram)
+
+  out.family("mqtt_subscriptions", "gauge", "Subscriptions.")
+  out.sample("mqtt_subscriptions", sum([len(sharedData.get(name, [])) for name in ["subscriptions", "dollar_subscriptions"]]))
+  out.family("mqtt_retained_messages", "gauge", "Retained messages.")
+  out.sample("mqtt_retained_messages", len(sharedData.get("retained", {})))
+  return out.text()
@@ -0,0 +1,183 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+A sampling profiler for the running broker, started and stopped through the HTTP API
+or with SIGUSR1.
+
+cProfile only sees the thread which enables it, and the broker has a thread for each
+connection, so instead a thread takes the stacks of all the other threads every interval
+seconds.  A thread found at the same point as in the previous sample is taken to be
+waiting, for a socket, a timer or a lock, and that sample is not counted.  When the
+profiler is stopped the stacks are written to a file in the collapsed form which flame
+graph tools read:
+
+  TCPListeners.py:147(handle);MQTTBrokers.py:471(handleRequest);... 12
+
+and a summary of the functions in the brokers, the subscription engines and the codecs
+found most often to a file with the same name and .txt appended.
+
+"""
+
+import sys, os, time, signal, threading, logging, collections
+
+logger = logging.getLogger('MQTT broker')
+
+def groupOf(filename):
+  "the part of the broker a source file belongs to, or None"
+  filename = filename.replace(os.sep, "/")
+  if filename.endswith("MQTTBrokers.py") or filename.endswith("MQTTSNBrokers.py"):
+    return "MQTTBrokers"
+  if filename.endswith("SubscriptionEngines.py"):
+    return "SubscriptionEngines"
+  if "/mqtt/formats/" in filename:
+    return "codecs"
+  return None
+
+groups = ["MQTTBrokers", "SubscriptionEngines", "codecs"]
+
+def nameOf(code):
+  return "%s:%d(%s)" % (os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+
+class Profilers:
+
+  def __init__(self, filename="broker.profile", interval=0.005):
+    self.filename = filename
+    self.interval = interval
+    self.thread = None
+    self.stopping = threading.Event()
+    self.lock = threading.Lock() # for starting and stopping
+    self.stacks = collections.Counter() # tuple of code objects, innermost first -> samples
+    self.samples = 0
+    self.waiting = 0 # thread samples not counted
+    self.started = self.elapsed = 0
+
+  def running(self):
+    return self.thread != None
+
+  def start(self):
+    "returns False if the profiler was already running"
+    with self.lock:
+      if self.thread:
+        return False
+      self.stacks = collections.Counter()
+      self.samples = self.waiting = 0
+      self.started = time.monotonic()
+      self.stopping.clear()
+      self.thread = threading.Thread(target=self.sample, name="profiler", daemon=True)
+      self.thread.start()
+    logger.info("Profiler started, sampling every %g seconds", self.interval)
+    return True
+
+  def stop(self):
+    "write the profile, and return the summary, or None if the profiler was not running"
+    with self.lock:
+      if not self.thread:
+        return None
+      self.stopping.set()
+      self.thread.join()
+      self.thread = None
+      self.elapsed = time.monotonic() - self.started
+    summary = self.summary()
+    try:
+      self.write(summary)
+      logger.info("Profile of %d samples written to %s", self.samples, self.filename)
+    except OSError:
+      logger.exception("Writing profile to %s", self.filename)
+    return summary
+
+  def toggle(self):
+    if not self.start():
+      self.stop()
+
+  def sample(self):
+    me = threading.get_ident()
+    previous = {} # thread ident -> (innermost frame, instruction) at the last sample
+    while not self.stopping.wait(self.interval):
+      frames = sys._current_frames()
+      current = {}
+      for ident, frame in frames.items():
+        if ident == me:
+          continue
+        current[ident] = (frame, frame.f_lasti)
+        if previous.get(ident) == current[ident]:
+          self.waiting += 1
+          continue
+        stack = []
+        while frame != None:
+          stack.append(frame.f_code)
+          frame = frame.f_back
+        self.stacks[tuple(stack)] += 1
+      previous = current
+      self.samples += 1
+
+  def status(self):
+    return {"running" : self.running(), "file" : self.filename, "interval" : self.interval,
+            "samples" : self.samples}
+
+  def summary(self, top=20):
+    "the functions of the brokers, subscription engines and codecs found in the most samples"
+    totals = collections.Counter()  # samples with the function anywhere in the stack
+    selfs = collections.Counter()   # samples with the function innermost
+    busy = 0
+    for stack, count in self.stacks.items():
+      selfs[stack[0]] += count
+      found = False
+      for code in set(stack):
+        totals[code] += count
+        found = found or groupOf(code.co_filename) != None
+      if found:
+        busy += count
+    lines = ["%d samples of all threads every %g seconds over %.1f seconds: %d threads running, "
+             "%d of those in the brokers, subscription engines or codecs, %d threads waiting" %
+             (self.samples, self.interval, self.elapsed, sum(self.stacks.values()), busy, self.waiting)]
+    for group in groups:
+      codes = [code for code in totals.keys() if groupOf(code.co_filename) == group]
+      codes.sort(key=lambda code: (totals[code], selfs[code]), reverse=True)
+      lines += ["", group, "%8s %8s  %s" % ("total", "self", "function")]
+      for code in codes[:top]:
+        lines.append("%8d %8d  %s" % (totals[code], selfs[code], nameOf(code)))
+    return "\n".join(lines) + "\n"
+
+  def write(self, summary):
+    with open(self.filename, "w") as profile:
+      for stack, count in self.stacks.items():
+        profile.write("%s %d\n" % (";".join([nameOf(code) for code in reversed(stack)]), count))
+    with open(self.filename + ".txt", "w") as text:
+      text.write(summary)
+
+profiler = Profilers()
+
+toggled = threading.Event() # set by the signal handler
+
+def toggler():
+  while True:
+    toggled.wait()
+    toggled.clear()
+    profiler.toggle()
+
+def signalHandler(signum, frame):
+  # stopping takes the profiler lock, joins its thread and writes files, so is left to the toggler
+  toggled.set()
+
+def handleSignal(signum):
+  "start or stop the profiler when the process receives the signal"
+  threading.Thread(target=toggler, name="profiler toggler", daemon=True).start()
+  signal.signal(signum, signalHandler)
@@ -0,0 +1,176 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+
+"""
+
+Broker statistics, published as retained messages under $SYS/broker.
+
+The brokers update counters as they run: a Counters object for each protocol, counting
+packets by type and bytes, and lockWaits, the time taken to get the broker lock.  Every
+interval seconds a thread collects these with the numbers of clients, subscriptions,
+retained and queued messages, and publishes the values which have changed:
+
+  $SYS/broker/uptime                              seconds
+  $SYS/broker/clients/connected
+  $SYS/broker/clients/disconnected                sessions kept without a connection
+  $SYS/broker/subscriptions/count
+  $SYS/broker/retained messages/count
+  $SYS/broker/lock/wait/average                   microseconds, over the last interval
+  $SYS/broker/lock/wait/maximum                   microseconds, over the last interval
+  $SYS/broker/<protocol>/messages/received        all packets
+  $SYS/broker/<protocol>/messages/sent
+  $SYS/broker/<protocol>/publish/messages/received
+  $SYS/broker/<protocol>/publish/messages/sent
+  $SYS/broker/<protocol>/publish/messages/dropped  expired, too big, or QoS 0 to a disconnected client
+  $SYS/broker/<protocol>/bytes/received
+  $SYS/broker/<protocol>/bytes/sent
+  $SYS/broker/<protocol>/bytes/saved              by sending topic aliases in place of topic names
+  $SYS/broker/<protocol>/clients/connected
+  $SYS/broker/<protocol>/clients/disconnected
+  $SYS/broker/<protocol>/messages/queued          held for clients, waiting to be sent or acknowledged
+
+where protocol is mqtt311 or mqtt5.  In a multi-process broker each worker publishes
+its own values under $SYS/broker/worker/<index>.
+
+"""
+
+import time, threading, logging
+
+from mqtt.formats import MQTTV5
+from mqtt.brokers.monitoring import Histograms
+
+logger = logging.getLogger('MQTT broker')
+
+PUBLISH = 3 # packet type, the same in both protocols
+
+FANOUT_BOUNDS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 10000] # subscribers
+SECONDS_BOUNDS = [0.000001, 0.000002, 0.000005, 0.00001, 0.00002, 0.00005, 0.0001, 0.0002,
+                  0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1]
+
+protocols = {} # protocol name -> Counters
+
+
+class Counters:
+  "packet and byte counts of one protocol"
+
+  def __init__(self, protocol):
+    self.protocol = protocol
+    self.received = [0] * 16 # by packet type
+    self.sent = [0] * 16
+    self.bytesReceived = 0
+    self.bytesSent = 0
+    self.dropped = 0 # publications discarded
+    self.queued = 0 # publications waiting to be sent
+    self.inflight = 0 # QoS 1 and 2 publications sent, or to be resent, and not yet acknowledged
+    self.fanout = Histograms.Buckets(FANOUT_BOUNDS) # subscribers each publication is sent to
+    self.decoding = Histograms.Buckets(SECONDS_BOUNDS) # time to unpack each packet received
+    self.encoding = Histograms.Buckets(SECONDS_BOUNDS) # time to pack each packet sent
+    self.aliasBytesSaved = 0 # by sending topic aliases in place of topic names
+    protocols[protocol] = self
+
+
+class LockWaits:
+  "time taken to get the broker lock"
+
+  def __init__(self):
+    self.histogram = Histograms.Buckets(SECONDS_BOUNDS) # since the start, unlike the others
+    self.reset()
+
+  def reset(self):
+    self.count = 0
+    self.total = 0.0
+    self.maximum = 0.0
+
+  def record(self, seconds):
+    self.histogram.record(seconds)
+    self.count += 1
+    self.total += seconds
+    if seconds > self.maximum:
+      self.maximum = seconds
+
+lockWaits = LockWaits()
+
+
+class Statistics:
+
+  def __init__(self, brokers, lock, sharedData, interval=10, prefix="$SYS/broker/"):
+    self.brokers = brokers # protocol name -> MQTTBrokers object
+    self.lock = lock
+    self.sharedData = sharedData
+    self.interval = interval
+    self.prefix = prefix
+    self.started = time.monotonic()
+    self.published = {} # topic -> last value published
+    self.running = True
+    self.stopped = threading.Event()
+    self.publisher = threading.Thread(target=self.publishLoop, name="$SYS publisher", daemon=True)
+    self.publisher.start()
+
+  def getValues(self):
+    "topic -> value, called with the lock held"
+    values = {"uptime" : int(time.monotonic() - self.started)}
+    connected = disconnected = 0
+    for protocol, broker in self.brokers.items():
+      for name, value in broker.getStatistics().items():
+        values[protocol + "/" + name] = value
+      connected += values[protocol + "/clients/connected"]
+      disconnected += values[protocol + "/clients/disconnected"]
+    values["clients/connected"] = connected
+    values["clients/disconnected"] = disconnected
+    values["subscriptions/count"] = sum([len(self.sharedData.get(name, []))
+        for name in ["subscriptions", "dollar_subscriptions"]])
+    values["retained messages/count"] = len(self.sharedData.get("retained", {}))
+    for protocol, counters in protocols.items():
+      values[protocol + "/messages/received"] = sum(counters.received)
+      values[protocol + "/messages/sent"] = sum(counters.sent)
+      values[protocol + "/publish/messages/received"] = counters.received[PUBLISH]
+      values[protocol + "/publish/messages/sent"] = counters.sent[PUBLISH]
+      values[protocol + "/publish/messages/dropped"] = counters.dropped
+      values[protocol + "/bytes/received"] = counters.bytesReceived
+      values[protocol + "/bytes/sent"] = counters.bytesSent
+      values[protocol + "/bytes/saved"] = counters.aliasBytesSaved
+    count, total, maximum = lockWaits.count, lockWaits.total, lockWaits.maximum
+    lockWaits.reset()
+    values["lock/wait/average"] = round(total * 1000000 / count, 1) if count > 0 else 0
+    values["lock/wait/maximum"] = round(maximum * 1000000, 1)
+    return values
+
+  def publish(self):
+    "publish the values which have changed since they were last published"
+    publisher = self.brokers["mqtt5"].broker
+    with self.lock:
+      for name, value in self.getValues().items():
+        topic = self.prefix + name
+        if self.published.get(topic) != value:
+          publisher.publish('$internal', topic, bytes(str(value), 'utf-8'), 0, True,
+                            MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH), time.monotonic())
+          self.published[topic] = value
+
+  def publishLoop(self):
+    while self.running:
+      try:
+        self.publish()
+      except:
+        logger.exception("$SYS publisher")
+      self.stopped.wait(self.interval)
+
+  def stop(self):
+    self.running = False
+    self.stopped.set()
+    self.publisher.join()
@@ -0,0 +1,201 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+Durable session state: the QoS 1 and 2 messages queued for, or in flight to or from,
+clients with sessions which outlive their connections.
+
+The data is kept in three logged dictionaries in the shared data, so it is written
+to the same write-ahead log, and included in the same snapshots, as subscriptions:
+
+  sessions:          clientid -> (protocol, session expiry interval, time of disconnection)
+  messages:          message number -> compact binary message (topic, properties, payload)
+  session_messages:  reference number -> (clientid, direction, message number, qos, retained,
+                                          packet id, state, subscription identifiers)
+
+A message published to many clients is stored once, and referenced by each session.
+It is deleted when its last reference is.
+
+"""
+
+import struct, time, logging
+
+from mqtt.formats import MQTTV5
+
+logger = logging.getLogger('MQTT broker')
+
+OUTBOUND, INBOUND = range(2) # directions
+
+NEVER = 0xFFFFFFFF # session expiry interval for sessions which don't expire
+
+def packMessage(topic, payload, properties):
+  "the compact binary form of a message"
+  topic = topic.encode("utf-8")
+  props = properties.pack() if properties else b""
+  return struct.pack("!HI", len(topic), len(props)) + topic + props + payload
+
+def unpackMessage(data):
+  "returns topic, payload, properties"
+  topiclen, propslen = struct.unpack_from("!HI", data, 0)
+  offset = 6
+  topic = data[offset:offset+topiclen].decode("utf-8")
+  offset += topiclen
+  properties = None
+  if propslen > 0:
+    properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+    properties.unpack(data[offset:offset+propslen])
+  return topic, data[offset+propslen:], properties
+
+
+class SessionStores:
+
+  def __init__(self, sharedData, log):
+    self.log = log
+    for name in ["sessions", "messages", "session_messages"]:
+      if name not in sharedData:
+        sharedData[name] = {}
+    self.sessions = sharedData["sessions"]
+    self.messages = sharedData["messages"]
+    self.references = sharedData["session_messages"]
+    self.refcounts = {}   # message number -> number of references
+    self.bySession = {}   # clientid -> set of reference numbers
+    for ref, (clientid, direction, msgno, qos, retained, packetid, state, subids) in self.references.items():
+      self.bySession.setdefault(clientid, set()).add(ref)
+      if msgno != None:
+        self.refcounts[msgno] = self.refcounts.get(msgno, 0) + 1
+    self.nextMessage = max(self.messages.keys(), default=0) + 1
+    self.nextReference = max(self.references.keys(), default=0) + 1
+    self.last = None # (topic, payload, properties, message number) of the last message stored
+
+  def openSession(self, clientid, protocol, expiry):
+    "record a connected session which will outlive its connection"
+    self.sessions[clientid] = (protocol, expiry, None)
+
+  def endSession(self, clientid, protocol, expiry):
+    "record the disconnection of a session which is to be kept"
+    self.sessions[clientid] = (protocol, expiry, time.time())
+
+  def closeSession(self, clientid):
+    "remove a session and all its messages"
+    if clientid in self.sessions:
+      del self.sessions[clientid]
+    for ref in list(self.bySession.get(clientid, [])):
+      self.remove(ref)
+    self.bySession.pop(clientid, None)
+
+  def isDurable(self, clientid):
+    return clientid in self.sessions
+
+  def storeMessage(self, topic, payload, properties):
+    "store a message, or find the one just stored for another client"
+    if self.last and self.last[0] == topic and self.last[1] is payload and self.last[2] is properties \
+        and self.last[3] in self.messages:
+      return self.last[3]
+    if properties and (hasattr(properties, "TopicAlias") or hasattr(properties, "SubscriptionIdentifier")):
+      # aliases are per connection and subscription identifiers per subscription
+      stored = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+      stored.unpack(properties.pack())
+      for name in ["TopicAlias", "SubscriptionIdentifier"]:
+        if hasattr(stored, name):
+          delattr(stored, name)
+      props = stored
+    else:
+      props = properties
+    msgno = self.nextMessage
+    self.nextMessage += 1
+    self.messages[msgno] = packMessage(topic, payload, props)
+    self.last = (topic, payload, properties, msgno)
+    return msgno
+
+  def add(self, clientid, direction, topic, payload, properties, qos, retained, packetid=0, state=None):
+    "add a message to a session, returns the reference number"
+    msgno = None
+    if topic != None:
+      msgno = self.storeMessage(topic, payload, properties)
+      self.refcounts[msgno] = self.refcounts.get(msgno, 0) + 1
+    subids = None
+    if properties and hasattr(properties, "SubscriptionIdentifier"):
+      subids = list(properties.SubscriptionIdentifier)
+    ref = self.nextReference
+    self.nextReference += 1
+    self.references[ref] = (clientid, direction, msgno, qos, retained, packetid, state, subids)
+    self.bySession.setdefault(clientid, set()).add(ref)
+    return ref
+
+  def update(self, ref, packetid, state):
+    "the packet id or QoS 2 state of a message has changed"
+    if ref in self.references:
+      clientid, direction, msgno, qos, retained, oldid, oldstate, subids = self.references[ref]
+      self.references[ref] = (clientid, direction, msgno, qos, retained, packetid, state, subids)
+
+  def remove(self, ref):
+    "remove a message from a session, and the message itself if that was the last reference"
+    if ref not in self.references:
+      return
+    clientid, direction, msgno, qos, retained, packetid, state, subids = self.references[ref]
+    del self.references[ref]
+    refs = self.bySession.get(clientid)
+    if refs:
+      refs.discard(ref)
+    if msgno != None:
+      self.refcounts[msgno] -= 1
+      if self.refcounts[msgno] == 0:
+        del self.refcounts[msgno]
+        del self.messages[msgno]
+
+  def afterSync(self, callback):
+    "call callback once everything stored so far is on disk"
+    self.log.afterSync(callback)
+
+  def recover(self, protocol):
+    """
+    the stored sessions for a protocol, as a list of (clientid, expiry, seconds since disconnection).
+    Expired sessions are removed.  The messages of a session are read with messagesOf.
+    """
+    sessions = []
+    now = time.time()
+    for clientid, (sessionProtocol, expiry, ended) in list(self.sessions.items()):
+      if sessionProtocol != protocol:
+        continue
+      ended = ended or now # the broker stopped while the client was connected
+      if expiry != NEVER and now - ended > expiry:
+        logger.info("Stored session for client %s has expired", clientid)
+        self.closeSession(clientid)
+        continue
+      sessions.append((clientid, expiry, now - ended))
+    return sessions
+
+  def messagesOf(self, clientid):
+    """
+    the messages of a session, in the order they were stored, as a list of
+      (ref, direction, topic, payload, properties, qos, retained, packetid, state)
+    """
+    messages = []
+    for ref in sorted(self.bySession.get(clientid, [])):
+      owner, direction, msgno, qos, retained, packetid, state, subids = self.references[ref]
+      topic = payload = properties = None
+      if msgno != None:
+        topic, payload, properties = unpackMessage(self.messages[msgno])
+        if subids:
+          if properties == None:
+            properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+          for subid in subids:
+            properties.SubscriptionIdentifier = subid
+      messages.append((ref, direction, topic, payload, properties, qos, retained, packetid, state))
+    return messages
@@ -0,0 +1,426 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+
+Append-only log persistence for the data shared between brokers.
+
+Every change to a subscription list or retained message map is appended to a log
+segment as one record.  A writer thread writes and fsyncs records in batches, so the
+cost of an fsync is shared by all the changes made while the previous one was in
+progress (group commit).
+
+Periodically a snapshot of all the data is written and the log segments it covers
+are deleted.  Records are idempotent (set or delete by key), so the snapshot can be
+taken while the log continues to be written, and recovery is: load the snapshot,
+then replay the segments written after it.  Only copying the containers holds the
+broker lock; the snapshot is pickled and written without it.
+
+Files, for a name of "sharedData":
+
+  sharedData.snapshot         - the last complete snapshot
+  sharedData.log.00000001     - log segments, replayed in order
+
+Each record is: 4 byte length, 4 byte crc32 of the data, pickled data.  A record
+which is incomplete or fails its crc marks the end of the log - it was being written
+when the broker stopped.
+
+"""
+
+import os, glob, struct, pickle, zlib, threading, time, logging
+
+logger = logging.getLogger('MQTT broker')
+
+HEADER = struct.Struct("!II") # length, crc32
+
+SET, DELETE, CLEAR = range(3) # record types
+
+def keyOf(item):
+  "the key of an item in a logged list - subscriptions are identified by client id and topic"
+  return (item.getClientid(), item.getTopic())
+
+
+class LoggedLists(list):
+  """
+  A list whose changes are recorded in a write-ahead log.
+
+  In-place changes to an item are not seen, so must be reported with updated().
+  """
+
+  def __init__(self, name, log, items=[]):
+    list.__init__(self, items)
+    self.name = name
+    self.log = log
+
+  def append(self, item):
+    list.append(self, item)
+    self.log.write((SET, self.name, keyOf(item), item))
+
+  def remove(self, item):
+    list.remove(self, item)
+    self.log.write((DELETE, self.name, keyOf(item), None))
+
+  def updated(self, item):
+    self.log.write((SET, self.name, keyOf(item), item))
+
+  def clear(self):
+    list.clear(self)
+    self.log.write((CLEAR, self.name, None, None))
+
+  def extend(self, items):
+    for item in items:
+      self.append(item)
+
+  def insert(self, index, item):
+    list.insert(self, index, item)
+    self.log.write((SET, self.name, keyOf(item), item))
+
+  def pop(self, index=-1):
+    item = list.pop(self, index)
+    self.log.write((DELETE, self.name, keyOf(item), None))
+    return item
+
+  def __delitem__(self, index):
+    items = self[index] if isinstance(index, slice) else [self[index]]
+    list.__delitem__(self, index)
+    for item in items:
+      self.log.write((DELETE, self.name, keyOf(item), None))
+
+  def __reduce__(self):
+    return (list, (list(self),))
+
+
+class LoggedDicts(dict):
+  "A dictionary whose changes are recorded in a write-ahead log"
+
+  def __init__(self, name, log, items={}):
+    dict.__init__(self, items)
+    self.name = name
+    self.log = log
+
+  def __setitem__(self, key, value):
+    dict.__setitem__(self, key, value)
+    self.log.write((SET, self.name, key, value))
+
+  def __delitem__(self, key):
+    dict.__delitem__(self, key)
+    self.log.write((DELETE, self.name, key, None))
+
+  def pop(self, key, *default):
+    present = key in self
+    value = dict.pop(self, key, *default)
+    if present:
+      self.log.write((DELETE, self.name, key, None))
+    return value
+
+  def clear(self):
+    dict.clear(self)
+    self.log.write((CLEAR, self.name, None, None))
+
+  def update(self, *args, **kwargs):
+    for key, value in dict(*args, **kwargs).items():
+      self[key] = value
+
+  def setdefault(self, key, default=None):
+    if key not in self:
+      self[key] = default
+    return self[key]
+
+  def __reduce__(self):
+    return (dict, (dict(self),))
+
+
+class SharedData(dict):
+  "the top level of the shared data: lists and dictionaries stored here are logged"
+
+  def __init__(self, log):
+    dict.__init__(self)
+    self.log = log
+
+  def __setitem__(self, name, value):
+    if isinstance(value, list):
+      value = LoggedLists(name, self.log, value)
+    elif isinstance(value, dict):
+      value = LoggedDicts(name, self.log, value)
+    dict.__setitem__(self, name, value)
+    self.log.write((CLEAR, name, None, value.__reduce__()[1][0]))
+
+  def restore(self, name, value):
+    "set a container during recovery, without logging it"
+    if isinstance(value, list):
+      value = LoggedLists(name, self.log, value)
+    else:
+      value = LoggedDicts(name, self.log, value)
+    dict.__setitem__(self, name, value)
+
+
+class WriteAheadLogs:
+
+  def __init__(self, filename, lock, snapshot_interval=300, segment_size=64*1024*1024):
+    """
+    filename: the path and prefix of the files
+    lock: the broker lock, held while the snapshot copies the data
+    snapshot_interval: seconds between snapshots, if the log has been written to
+    segment_size: a snapshot is also taken when the log is bigger than this
+    """
+    self.filename = filename
+    self.lock = lock
+    self.snapshot_interval = snapshot_interval
+    self.segment_size = segment_size
+    self.condition = threading.Condition()
+    self.pending = []    # encoded records not yet written, and segment numbers to switch to
+    self.written = 0     # number of records written and synced
+    self.queued = 0      # number of records passed to write()
+    self.lastSegment = 0 # the highest segment number used or requested
+    self.callbacks = []  # (record count, function) to call once that many records are synced
+    self.running = False
+    self.segment = 0
+    self.file = None
+    self.logsize = 0     # bytes written to the segments since the last snapshot started
+    self.snapshotter = None
+    self.closing = False # no automatic snapshots once close has started
+    self.sharedData = SharedData(self)
+    self.recovering = False
+
+  def segmentName(self, segment):
+    return "%s.log.%08d" % (self.filename, segment)
+
+  def segments(self):
+    "segment numbers on disk, in order"
+    segments = []
+    for name in glob.glob(glob.escape(self.filename) + ".log.*"):
+      try:
+        segments.append(int(name.rsplit(".", 1)[1]))
+      except ValueError:
+        pass
+    return sorted(segments)
+
+  def open(self):
+    "recover the data from disk, start logging, and return the shared data"
+    started = time.monotonic()
+    self.recovering = True
+    first = 0
+    data = {}
+    snapshotName = self.filename + ".snapshot"
+    if os.path.exists(snapshotName):
+      with open(snapshotName, "rb") as snapshot:
+        first, data = pickle.load(snapshot)
+    for name, value in data.items():
+      self.sharedData.restore(name, value)
+    records = 0
+    segments = [s for s in self.segments() if s >= first]
+    for segment in segments:
+      records += self.replay(segment)
+    self.recovering = False
+    logger.info("Recovered persistent data from %s in %.3f seconds, %d log records replayed",
+                self.filename, time.monotonic() - started, records)
+
+    self.segment = self.lastSegment = (segments[-1] if len(segments) > 0 else first) + 1
+    self.file = open(self.segmentName(self.segment), "ab")
+    self.lastSnapshot = time.monotonic()
+    self.logsize = sum([os.path.getsize(self.segmentName(s)) for s in segments])
+    self.running = True
+    self.writer = threading.Thread(target=self.writeLoop, name="write ahead log")
+    self.writer.daemon = True
+    self.writer.start()
+    return self.sharedData
+
+  def replay(self, segment):
+    "apply the records of one segment to the shared data, returns the number of records"
+    count = 0
+    name = self.segmentName(segment)
+    with open(name, "rb") as segmentFile:
+      buffer = segmentFile.read()
+    offset = 0
+    indexes = {} # name -> {key: item}, so that lists can be updated by key
+    while offset + HEADER.size <= len(buffer):
+      length, crc = HEADER.unpack_from(buffer, offset)
+      data = buffer[offset + HEADER.size:offset + HEADER.size + length]
+      if len(data) < length or zlib.crc32(data) != crc:
+        break
+      self.apply(pickle.loads(data), indexes)
+      offset += HEADER.size + length
+      count += 1
+    if offset < len(buffer):
+      logger.info("Discarding %d bytes of incomplete log record at the end of %s", len(buffer) - offset, name)
+      with open(name, "r+b") as segmentFile:
+        segmentFile.truncate(offset)
+    for name, index in indexes.items():
+      self.sharedData.restore(name, list(index.values()))
+    return count
+
+  def apply(self, record, indexes):
+    op, name, key, value = record
+    if op == CLEAR:
+      if value == None: # cleared in place
+        value = [] if isinstance(self.sharedData.get(name), list) or name in indexes else {}
+      indexes.pop(name, None)
+      if isinstance(value, list):
+        indexes[name] = {keyOf(item) : item for item in value}
+        self.sharedData.restore(name, [])
+      else:
+        self.sharedData.restore(name, value)
+      return
+    container = self.sharedData.get(name)
+    if isinstance(container, list) or name in indexes:
+      if name not in indexes:
+        indexes[name] = {keyOf(item) : item for item in container} if container else {}
+      if op == SET:
+        indexes[name][key] = value
+      else:
+        indexes[name].pop(key, None)
+    else:
+      if container == None:
+        self.sharedData.restore(name, {})
+        container = self.sharedData[name]
+      if op == SET:
+        dict.__setitem__(container, key, value)
+      else:
+        dict.pop(container, key, None)
+
+  def write(self, record):
+    "queue one record, called with the broker lock held"
+    if self.recovering:
+      return
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    with self.condition:
+      self.pending.append(HEADER.pack(len(data), zlib.crc32(data)) + data)
+      self.queued += 1
+      self.condition.notify_all()
+
+  def sync(self, timeout=None):
+    "wait until all the records queued so far are on disk"
+    with self.condition:
+      target = self.queued
+      return self.condition.wait_for(lambda: self.written >= target or not self.running, timeout)
+
+  def afterSync(self, callback):
+    """
+    call callback, with the broker lock held, once all the records queued so far are on disk.
+    Called with the broker lock held, so if they are already, the callback is called now.
+    """
+    with self.condition:
+      if self.written < self.queued or self.callbacks: # keep the callbacks in order
+        self.callbacks.append((self.queued, callback))
+        return
+    callback()
+
+  def callBack(self):
+    "call the callbacks which are waiting for records which have now been synced"
+    self.lock.acquire()
+    try:
+      with self.condition:
+        ready = [callback for (target, callback) in self.callbacks if target <= self.written]
+        self.callbacks = [(target, callback) for (target, callback) in self.callbacks if target > self.written]
+      for callback in ready:
+        try:
+          callback()
+        except:
+          logger.exception("Persistence callback")
+    finally:
+      self.lock.release()
+
+  def writeLoop(self):
+    while True:
+      with self.condition:
+        self.condition.wait_for(lambda: self.pending or not self.running, 1)
+        batch = self.pending
+        self.pending = []
+        running = self.running
+      records = []
+      for entry in batch + [None]:
+        if isinstance(entry, bytes):
+          records.append(entry)
+          continue
+        if records:
+          data = b"".join(records)
+          self.file.write(data)
+          self.file.flush()
+          os.fsync(self.file.fileno())
+          with self.condition:
+            self.logsize += len(data)
+            self.written += len(records)
+            self.condition.notify_all()
+          records = []
+          if self.callbacks:
+            self.callBack()
+        if entry != None: # switch to a new segment, the first not covered by a snapshot
+          self.file.close()
+          self.segment = entry
+          self.file = open(self.segmentName(self.segment), "ab")
+          with self.condition:
+            self.logsize = 0
+      if not running:
+        break
+      if self.callbacks and not batch: # added after the last batch was written
+        self.callBack()
+      with self.condition:
+        if self.snapshotter == None and not self.closing and self.logsize > 0 and \
+            (time.monotonic() - self.lastSnapshot > self.snapshot_interval or self.logsize > self.segment_size):
+          self.snapshotter = threading.Thread(target=self.snapshot, name="snapshot")
+          self.snapshotter.daemon = True
+          self.snapshotter.start()
+
+  def snapshot(self):
+    "write a snapshot and delete the log segments it replaces"
+    try:
+      self.lock.acquire()
+      try:
+        # records after this point go to a new segment, which the snapshot doesn't cover
+        with self.condition:
+          self.lastSegment += 1
+          first = self.lastSegment
+          self.pending.append(first)
+          self.condition.notify_all()
+        # only the containers are copied while the lock is held.  The items are pickled after,
+        # so may include changes made since, which the records in the new segment repeat
+        started = time.monotonic()
+        state = {name : value.__reduce__()[1][0] for name, value in self.sharedData.items()}
+      finally:
+        self.lock.release()
+      data = pickle.dumps((first, state), pickle.HIGHEST_PROTOCOL)
+      temporary = self.filename + ".snapshot.tmp"
+      with open(temporary, "wb") as snapshot:
+        snapshot.write(data)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+      os.replace(temporary, self.filename + ".snapshot")
+      for segment in self.segments():
+        if segment < first:
+          os.remove(self.segmentName(segment))
+      logger.info("Persistence snapshot written in %.3f seconds", time.monotonic() - started)
+    except:
+      logger.exception("Persistence snapshot")
+    finally:
+      self.lastSnapshot = time.monotonic()
+      self.snapshotter = None
+
+  def close(self):
+    "write all outstanding records, take a final snapshot and stop"
+    with self.condition:
+      self.closing = True
+      snapshotter = self.snapshotter
+    if snapshotter:
+      snapshotter.join()
+    if self.logsize > 0 or self.pending:
+      self.snapshot()
+    with self.condition:
+      self.running = False
+      self.condition.notify_all()
+    self.writer.join()
+    self.file.close()
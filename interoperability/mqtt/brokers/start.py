@@ -18,17 +18,22 @@
 *******************************************************************
 """
 
-import sys, traceback, logging, getopt, threading, ssl, signal
+import sys, traceback, logging, getopt, threading, ssl, signal, os
 
 from .V311 import MQTTBrokers as MQTTV3Brokers
-from .V5 import MQTTBrokers as MQTTV5Brokers
+from .V5 import MQTTBrokers as MQTTV5Brokers, TopicAliases
 from .SN import MQTTSNBrokers
-from .coverage import filter, measure
+from .SN.Gateways import Gateways
+from .coverage import filter, measure, load as loadCoverage
+from . import guards
 from mqtt.formats.MQTTV311 import MQTTException as MQTTV3Exception
 from mqtt.formats.MQTTV5 import MQTTException as MQTTV5Exception
 from mqtt.formats.MQTTSN import MQTTSNException
 from mqtt.brokers.listeners import TCPListeners, UDPListeners, HTTPListeners
 from mqtt.brokers.bridges import TCPBridges
+from mqtt.brokers.clusters import Workers, Peers
+from mqtt.brokers.persistence import WriteAheadLogs, SessionStores
+from mqtt.brokers.monitoring import Statistics, Histograms, Profilers
 
 logger = None
 
@@ -71,12 +76,48 @@ def process_config(config, options):
         options["receiveMaximum"] = int(words[1])
       elif words[0] == "topic_alias_maximum":
         options["topicAliasMaximum"] = int(words[1])
+      elif words[0] == "topic_alias_policy" and words[1] in TopicAliases.POLICIES:
+        options["topic_alias_policy"] = words[1]
       elif words[0] in ["maximum_packet_size", "message_size_limit"]:
         options["maximumPacketSize"] = int(words[1])
       elif words[0] == "persistence" and words[1] == "true":
         options["persistence"] = True
+      elif words[0] == "persistence_engine" and words[1] in ["wal", "zodb"]:
+        options["persistence_engine"] = words[1]
+      elif words[0] == "persistence_location":
+        options["persistence_location"] = words[1]
+      elif words[0] == "autosave_interval":
+        options["autosave_interval"] = int(words[1])
+      elif words[0] == "sys_interval":
+        options["sys_interval"] = int(words[1])
+      elif words[0] == "latency_clients":
+        options["latency_clients"] = int(words[1])
+      elif words[0] == "profile_file":
+        options["profile_file"] = words[1]
+      elif words[0] == "profile_interval":
+        options["profile_interval"] = float(words[1])
+      elif words[0] == "workers":
+        options["workers"] = int(words[1])
+      elif words[0] == "worker_dispatch" and words[1] in ["clientid", "reuseport"]:
+        options["worker_dispatch"] = words[1]
+      elif words[0] == "predefined_topic":
+        options["predefined_topics"][int(words[1])] = words[2]
+      elif words[0] in ["sleep_buffer_maximum", "sleep_buffer_bytes", "sleep_burst", "gateway_connections"]:
+        options[words[0]] = int(words[1])
+      elif words[0] == "gateway_address":
+        host, port = words[1].rsplit(":", 1)
+        options["gateway_address"] = (host, int(port))
+      elif words[0] == "gateway_clientid":
+        options["gateway_clientid"] = words[1]
+      elif words[0] == "cluster_listener":
+        options["cluster_listener"] = (words[2] if len(words) > 2 else "", int(words[1]))
+      elif words[0] == "cluster_peer":
+        host, port = words[1].rsplit(":", 1)
+        options["cluster_peers"].append((host, int(port)))
       elif words[0] in ["maximum_qos", "retain_available", "subscription_identifier_available",
-              "shared_subscription_available", "server_keep_alive", "visual", "mscfile"]:
+              "shared_subscription_available", "server_keep_alive", "visual", "visual_sample",
+              "visual_clients", "visual_packet_types", "mscfile", "mscfile_format", "mscfile_max_bytes",
+              "mscfile_backups", "production"]:
         bools = {"true":True,'false':False}
         result = words[1]
         if words[1] in bools.keys():
@@ -87,11 +128,38 @@ def process_config(config, options):
           except:
             pass
         options[words[0]] = result
+      elif words[0] == "connection":
+        bridge = {"name":words[1], "host":"localhost", "mappings":[]}
+        while lineno < len(config) and not config[lineno].strip().startswith(("listener", "connection")):
+          curline = config[lineno].strip()
+          lineno += 1
+          if curline.startswith('#') or len(curline) == 0:
+            continue
+          words = curline.split()
+          if words[0] == "address":
+            host, _, port = words[1].partition(":")
+            bridge["host"] = host
+            bridge["port"] = int(port) if port else 1883
+          elif words[0] == "clientid":
+            bridge["clientid"] = words[1]
+          elif words[0] == "topic":
+            bridge["mappings"].append(TCPBridges.Mappings.parse(words[1:]))
+          elif words[0] == "restart_timeout":
+            bridge["restartTimeout"] = (int(words[1]), int(words[-1]))
+          elif words[0] == "spool_location":
+            bridge["spoolLocation"] = words[1]
+          elif words[0] == "spool_segment_size":
+            bridge["spoolSegmentSize"] = int(words[1])
+          elif words[0] == "spool_maximum":
+            bridge["spoolMaximum"] = int(words[1])
+          elif words[0] == "spool_rate":
+            bridge["spoolRate"] = int(words[1])
+        options["bridges"].append(bridge)
       elif words[0] == "listener":
         ca_certs = certfile = keyfile = None
         cert_reqs=ssl.CERT_REQUIRED
         bind_address = ""
-        port = 1883; TLS=False; allow_non_sni_connections=True;
+        port = 1883; TLS=False; allow_non_sni_connections=True; threads=True
         if len(words) > 1:
           port = int(words[1])
         protocol = "mqtt"
@@ -100,7 +168,7 @@ def process_config(config, options):
         if len(words) >= 4:
           if words[3] in ["mqttsn", "http"]:
             protocol = words[3]
-        while lineno < len(config) and not config[lineno].strip().startswith("listener"):
+        while lineno < len(config) and not config[lineno].strip().startswith(("listener", "connection")):
           curline = config[lineno].strip()
           lineno += 1
           if curline.startswith('#') or len(curline) == 0:
@@ -118,25 +186,35 @@ def process_config(config, options):
           elif words[0] == "allow_non_sni_connections":
             if words[1] == "false":
               allow_non_sni_connections = False
+          elif words[0] == "threads":
+            if protocol == "mqttsn":
+              threads = words[1] != "false"
+            else:
+              logger.warning("The threads option is only used by mqttsn listeners, not by listener %d", port)
         if protocol == "mqtt":
           servers_to_create.append((TCPListeners, {"host":bind_address, "port":port, "TLS":TLS, "cert_reqs":cert_reqs,
                       "ca_certs":ca_certs, "certfile":certfile, "keyfile":keyfile, 
                       "allow_non_sni_connections":allow_non_sni_connections}))
         elif protocol == "mqttsn":
-          servers_to_create.append((UDPListeners, {"host":bind_address, "port":port}))
+          servers_to_create.append((UDPListeners, {"host":bind_address, "port":port, "threads":threads}))
         elif protocol == "http":
           servers_to_create.append((HTTPListeners, {"host":bind_address, "port":port, "TLS":TLS, "cert_reqs":cert_reqs,
               "ca_certs":ca_certs, "certfile":certfile, "keyfile":keyfile}))
     servers_to_create[-1][1]["serve_forever"] = True
     return servers_to_create, options
 
-def run(config=None):
+def runWorker(worker, config):
+  "entry point of each process of a multi-process broker"
+  run(config, worker)
+
+def run(config=None, worker=None):
   global logger, broker3, broker5, brokerSN, server
   logger = logging.getLogger('MQTT broker')
   logger.setLevel(logging.INFO)
   logger.addFilter(filter)
 
-  logger.info("Python version "+sys.version)
+  if worker == None:
+    logger.info("Python version "+sys.version)
 
   signal.signal(signal.SIGTERM, handler)
 
@@ -144,12 +222,17 @@ def run(config=None):
 
   options = {
     "visual":False,
+    "production":False,
     "persistence": False,
+    "persistence_engine": "wal",
+    "persistence_location": "",
+    "autosave_interval": 300,
     "overlapping_single": True,
     "dropQoS0": True, 
     "zero_length_clientids":True, 
     "publish_on_pubrel":False,
     "topicAliasMaximum":2,
+    "topic_alias_policy":"lru",
     "maximumPacketSize":256,
     "receiveMaximum":2,
     "serverKeepAlive":60,
@@ -158,14 +241,56 @@ def run(config=None):
     "subscription_identifier_available":True,
     "shared_subscription_available":True,
     "server_keep_alive":None,
+    "workers":1,
+    "sys_interval":0,
+    "latency_clients":100,
+    "profile_file":"broker.profile",
+    "profile_interval":0.005,
+    "worker_dispatch":"clientid",
+    "predefined_topics":{},
+    "sleep_buffer_maximum":100,
+    "sleep_buffer_bytes":65536,
+    "sleep_burst":10,
+    "gateway_address":None,
+    "gateway_connections":4,
+    "gateway_clientid":"gateway",
+    "bridges":[],
+    "cluster_listener":None,
+    "cluster_peers":[],
   }
 
   if config != None:
     servers_to_create, options = process_config(config, options)
-
+  else:
+    servers_to_create = [(TCPListeners, {"port":1883, "serve_forever":True})]
+
+  guards.setProduction(options["production"])
+  if not options["production"]:
+    loadCoverage() # before the brokers start counting conformance statements
+  Histograms.latencies.maxClients = options["latency_clients"]
+  Profilers.profiler.filename = options["profile_file"] if worker == None else \
+      "%s.%d" % (options["profile_file"], worker.index)
+  Profilers.profiler.interval = options["profile_interval"]
+  if hasattr(signal, "SIGUSR1"):
+    Profilers.handleSignal(signal.SIGUSR1)
+  if options["production"] and worker == None:
+    logger.info("Production mode: conformance statements are not recorded")
+
+  if worker == None and options["workers"] > 1:
+    Workers.run(options["workers"], options["worker_dispatch"], runWorker, config, servers_to_create)
+    return
+
+  store = None
   if options["persistence"]:
-    logger.info("Using persistence")    
-    connection, sharedData = setup_persistence("sharedData") # location for data shared between brokers - subscriptions for example
+    logger.info("Using %s persistence", options["persistence_engine"])
+    persistence_filename = "sharedData" if worker == None else "sharedData.%d" % worker.index
+    if options["persistence_engine"] == "wal":
+      persistence_filename = os.path.join(options["persistence_location"], persistence_filename)
+      wal = WriteAheadLogs.WriteAheadLogs(persistence_filename, lock, options["autosave_interval"])
+      sharedData = wal.open()
+      store = SessionStores.SessionStores(sharedData, wal) # queued and in-flight messages
+    else:
+      connection, sharedData = setup_persistence(persistence_filename) # location for data shared between brokers - subscriptions for example
   else:
     sharedData = {}
   logger.debug("Starting sharedData %s", sharedData)
@@ -174,30 +299,73 @@ def run(config=None):
 
   broker5 = MQTTV5Brokers(options=options.copy(), lock=lock, sharedData=sharedData)
 
-  brokerSN = MQTTSNBrokers(lock=lock, sharedData=sharedData)
+  brokerSN = MQTTSNBrokers(predefined_topics=options["predefined_topics"],
+      sleep_buffer_maximum=options["sleep_buffer_maximum"], sleep_buffer_bytes=options["sleep_buffer_bytes"],
+      sleep_burst=options["sleep_burst"], lock=lock,
+      sharedData=sharedData if options["gateway_address"] == None else {}) # a gateway's subscriptions are its own
 
   brokers = [broker3, broker5, brokerSN]
 
   broker3.setBroker5(broker5)
   broker5.setBroker3(broker3)
 
+  broker3.setBrokerSN(brokerSN)
+  broker5.setBrokerSN(brokerSN)
   brokerSN.setBroker3(broker3)
   brokerSN.setBroker5(broker5)
 
+  if store:
+    broker3.setStore(store)
+    broker5.setStore(store)
+
   servers = []
   UDPListeners.setBroker(brokerSN)
   TCPListeners.setBrokers(broker3, broker5)
   HTTPListeners.setBrokers(broker3, broker5, brokerSN)
   HTTPListeners.setSharedData(lock, sharedData)
 
+  cluster = None
+  if worker != None:
+    cluster = Workers.Clusters(worker.index, worker.connections, lock)
+    cluster.setBrokers(broker3, broker5, brokerSN)
+    if (options["cluster_listener"] or options["cluster_peers"]) and worker.index == 0:
+      logger.error("A cluster of brokers can't be used with more than one worker process")
+  elif options["cluster_listener"] or options["cluster_peers"]:
+    cluster = Peers.Clusters(lock, options["cluster_listener"], options["cluster_peers"])
+    cluster.setBrokers(broker3, broker5, brokerSN)
+
+  if options["gateway_address"] and (worker == None or worker.index == 0): # stopped by brokerSN.shutdown
+    host, port = options["gateway_address"]
+    Gateways(brokerSN, host, port, options["gateway_connections"], options["gateway_clientid"]).start()
+
+  bridges = []
+  if worker == None or worker.index == 0:
+    for kwargs in options["bridges"]:
+      bridges.append(TCPBridges.create(broker5.broker, lock, **kwargs))
+
+  statistics = None
+  if options["sys_interval"] > 0:
+    statistics = Statistics.Statistics({"mqtt311" : broker3, "mqtt5" : broker5}, lock, sharedData,
+        options["sys_interval"], "$SYS/broker/" if worker == None else "$SYS/broker/worker/%d/" % worker.index)
+
   try:
-    if config == None:
-      #TCPBridges.setBroker5(broker5)
-      #TCPBridges.create(1886)
-      servers.append(TCPListeners.create(1883, serve_forever=True))
-    else:
+    if worker == None:
       for server in servers_to_create:
         servers.append(server[0].create(**server[1]))
+    else:
+      dispatched = None
+      for module, kwargs in servers_to_create:
+        kwargs = dict(kwargs, serve_forever=False)
+        if worker.isDispatched((module, kwargs)):
+          if dispatched == None: # one server takes all the dispatched connections
+            dispatched = module.create(dispatched=True, **kwargs)
+            servers.append(dispatched)
+        elif module == TCPListeners:
+          servers.append(module.create(reuse_port=True, **kwargs))
+        elif worker.index == 0: # UDP and HTTP can't be shared between processes
+          servers.append(module.create(**kwargs))
+      logger.info("Broker worker %d of %d started", worker.index, worker.count)
+      worker.serve_forever(dispatched)
   except (KeyboardInterrupt, OSError):
     pass
   except:
@@ -212,6 +380,17 @@ def run(config=None):
     except:
       traceback.print_exc()
 
+  for bridge in bridges:
+    bridge.shutdown()
+
+  if cluster:
+    cluster.shutdown()
+
+  if statistics:
+    statistics.stop()
+
+  Profilers.profiler.stop()
+
   logger.info("Shutdown brokers")
   for broker in brokers:
     try:
@@ -219,10 +398,13 @@ def run(config=None):
       broker.shutdown()
     except:
       traceback.print_exc()
-  filter.measure()
+  if not options["production"]:
+    filter.measure()
 
   logger.debug("Ending sharedData %s", sharedData)
-  if options["persistence"]:
+  if options["persistence"] and options["persistence_engine"] == "wal":
+    wal.close()
+  elif options["persistence"]:
     sharedData._p_changed = True
     import transaction
     transaction.commit()
@@ -249,8 +431,8 @@ def read_config(filename):
 
 def main(argv):
   try:
-    opts, args = getopt.gnu_getopt(argv[1:], "hp:o:d:z:c:", ["help", "publish_on_pubrel=", "overlapping_single=",
-        "dropQoS0=", "port=", "zero_length_clientids=", "config-file="])
+    opts, args = getopt.gnu_getopt(argv[1:], "hp:o:d:z:c:w:", ["help", "publish_on_pubrel=", "overlapping_single=",
+        "dropQoS0=", "port=", "zero_length_clientids=", "config-file=", "workers=", "production"])
   except getopt.GetoptError as err:
     print(err) # will print something like "option -a not recognized"
     usage()
@@ -259,6 +441,8 @@ def main(argv):
   publish_on_pubrel = False
   port = 1883
   cfg = None
+  workers = None
+  production = False
   for o, a in opts:
     if o in ("-h", "--help"):
       usage()
@@ -267,9 +451,17 @@ def main(argv):
       port = int(a)
     elif o in ("-c", "--config-file"):
       cfg = read_config(a)
+    elif o in ("-w", "--workers"):
+      workers = int(a)
+    elif o == "--production":
+      production = True
     else:
       assert False, "unhandled option"
 
+  if workers != None:
+    cfg = ["workers %d" % workers] + (cfg or ["listener %d" % port])
+  if production:
+    cfg = ["production true"] + (cfg or ["listener %d" % port])
   run(config=cfg)
 
 def usage():
@@ -280,6 +472,8 @@ Eclipse Paho combined MQTT V311 and MQTT V5 broker
  -h --help: print this message
  -c --confile-file: the name of a configuration file
  --port= port number to listen to
+ -w --workers= number of broker processes to run
+ --production: don't record conformance statements or format packets for debug logging
 
 """)
 
@@ -0,0 +1,152 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+
+"""
+
+Message sequence chart traces of the packets sent and received by the broker.
+
+The broker threads only append a record (direction, socket number, packet type) to a
+queue.  A writer thread takes the records in batches, formats them and writes them,
+so no file output is done while the broker lock is held.
+
+Two file formats:
+
+  text    - the msc input language, which mscgen draws, one line per packet
+  binary  - a header, then 6 bytes per packet: direction, socket number, packet type.
+            Smaller and cheaper to write, converted to text with toMSC
+
+When a file reaches maxBytes, it is closed and renamed with the suffix .1 (.1 becomes .2,
+and so on, up to the number of backups), and a new file started.  Each text file is a
+complete chart.
+
+"""
+
+import os, struct, threading, collections, logging
+
+from mqtt.formats import MQTTV5
+
+logger = logging.getLogger('MQTT broker')
+
+IN, OUT = range(2) # directions: client to broker, broker to client
+
+MAGIC = b"MSCTRACE1\n"
+RECORD = struct.Struct("!BIB") # direction, socket number, packet type
+
+HEADER = "msc {\n broker;\n"
+FOOTER = "}\n"
+
+def formatRecord(direction, fileno, packetType):
+  name = MQTTV5.classes[packetType - 1].__name__ if 0 < packetType <= len(MQTTV5.classes) else str(packetType)
+  if direction == IN:
+    return "client%d=>broker[label=%s];\n" % (fileno, name)
+  return "broker=>client%d[label=%s];\n" % (fileno, name)
+
+def toMSC(infilename, outfilename):
+  "convert a binary trace to the msc text format"
+  with open(infilename, "rb") as infile, open(outfilename, "w") as outfile:
+    if infile.read(len(MAGIC)) != MAGIC:
+      raise ValueError("%s is not a binary MSC trace" % infilename)
+    outfile.write(HEADER)
+    while True:
+      data = infile.read(RECORD.size * 4096)
+      for direction, fileno, packetType in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+        outfile.write(formatRecord(direction, fileno, packetType))
+      if len(data) < RECORD.size * 4096:
+        break
+    outfile.write(FOOTER)
+
+
+class MSCTraces:
+
+  def __init__(self, filename, binary=False, maxBytes=0, backups=1, interval=0.2):
+    self.filename = filename
+    self.binary = binary
+    self.maxBytes = maxBytes
+    self.backups = max(backups, 1)
+    self.interval = interval # seconds between writes
+    self.records = collections.deque() # appends and pops are atomic, no lock is needed
+    self.file = None
+    self.written = 0
+    self.open()
+    self.running = True
+    self.wakeup = threading.Event()
+    self.writer = threading.Thread(target=self.writeLoop, name="MSC trace writer", daemon=True)
+    self.writer.start()
+
+  def record(self, direction, fileno, packetType):
+    "called by the broker for each packet"
+    self.records.append((direction, fileno, packetType))
+
+  def open(self):
+    if self.binary:
+      self.file = open(self.filename, "wb")
+      self.file.write(MAGIC)
+      self.written = len(MAGIC)
+    else:
+      self.file = open(self.filename, "w")
+      self.file.write(HEADER)
+      self.written = len(HEADER)
+
+  def finish(self):
+    if not self.binary:
+      self.file.write(FOOTER)
+    self.file.close()
+
+  def rotate(self):
+    self.finish()
+    for i in range(self.backups - 1, 0, -1):
+      name = "%s.%d" % (self.filename, i)
+      if os.path.exists(name):
+        os.replace(name, "%s.%d" % (self.filename, i + 1))
+    os.replace(self.filename, self.filename + ".1")
+    self.open()
+
+  def write(self):
+    "write the records queued so far"
+    count = len(self.records)
+    if count == 0:
+      return
+    records = [self.records.popleft() for i in range(count)]
+    if self.binary:
+      data = b"".join([RECORD.pack(*record) for record in records])
+    else:
+      data = "".join([formatRecord(*record) for record in records])
+    self.file.write(data)
+    self.file.flush()
+    self.written += len(data)
+    if self.maxBytes > 0 and self.written >= self.maxBytes:
+      self.rotate()
+
+  def writeLoop(self):
+    while self.running:
+      self.wakeup.wait(self.interval)
+      try:
+        self.write()
+      except:
+        logger.exception("MSC trace writer")
+
+  def close(self):
+    "write the records left and close the file"
+    if not self.running:
+      return
+    self.running = False
+    self.wakeup.set()
+    self.writer.join()
+    self.write()
+    self.finish()
@@ -0,0 +1,142 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+
+"""
+
+Visual mode: a copy of the packets sent and received by the MQTT 5.0 broker is
+published, as JSON, on $SYS/clients-packets.
+
+The broker threads select the packets, and keep the bytes of each as it is sent or
+received, as the broker changes some packets afterwards.  A separate thread converts
+them to JSON and publishes them in batches, taking the broker lock once per batch.
+Packets are selected by:
+
+  sample       - mirror 1 in every sample packets which pass the filters
+  clientids    - client identifier patterns, as for fnmatch, or all clients if empty
+  packetTypes  - packet type names, such as publish or subscribe, or all if empty
+
+Nothing is queued while there are no subscriptions matching $SYS/clients-packets.
+
+"""
+
+import time, json, fnmatch, threading, collections, logging
+
+from mqtt.formats import MQTTV5
+from mqtt.brokers.V5 import Topics
+
+logger = logging.getLogger('MQTT broker')
+
+TOPIC = "$SYS/clients-packets"
+
+def splitOption(value):
+  "a list from a comma separated option value"
+  if value in [None, "", True, False]:
+    return []
+  return [item.strip() for item in str(value).split(",") if item.strip() != ""]
+
+
+class VisualMirrors:
+
+  def __init__(self, broker, lock, sample=1, clientids=[], packetTypes=[], interval=0.1):
+    self.broker = broker # the V5 Brokers object, which publishes the copies
+    self.lock = lock
+    self.sample = max(sample, 1)
+    self.patterns = clientids
+    self.matched = {} # client identifier -> whether it matches a pattern
+    names = [name.lower() for name in MQTTV5.Packets.Names]
+    self.packetTypes = set([names.index(name.lower()) for name in packetTypes if name.lower() in names])
+    self.interval = interval
+    self.engines = []
+    self.active = False # are there any subscribers?
+    self.count = 0
+    self.records = collections.deque() # (direction, socket, clientid, packet bytes); appends and pops are atomic
+    self.running = True
+    self.publisher = threading.Thread(target=self.publishLoop, name="visual mirror", daemon=True)
+    self.publisher.start()
+
+  def observe(self, engine):
+    "follow the subscriptions of a subscription engine"
+    self.engines.append(engine)
+    engine.addObserver(self)
+    self.update()
+
+  def update(self):
+    self.active = any([engine.getSubscriptions(TOPIC) for engine in self.engines])
+
+  def subscribed(self, topicFilter):
+    if Topics.topicMatches(topicFilter, TOPIC):
+      self.update()
+
+  def unsubscribed(self, topicFilter):
+    if Topics.topicMatches(topicFilter, TOPIC):
+      self.update()
+
+  def clientMatches(self, clientid):
+    if len(self.patterns) == 0:
+      return True
+    if clientid not in self.matched:
+      self.matched[clientid] = any([fnmatch.fnmatchcase(clientid, pattern) for pattern in self.patterns])
+    return self.matched[clientid]
+
+  def mirror(self, direction, sock, clientid, packet, packed):
+    "called by the broker for each packet and its bytes, direction is CtoS or StoC"
+    if not self.active:
+      return
+    packetType = packet.fh.PacketType
+    if self.packetTypes and packetType not in self.packetTypes:
+      return
+    if packetType == MQTTV5.PacketTypes.PUBLISH and packet.topicName == TOPIC:
+      return # not the copies themselves
+    if not self.clientMatches(clientid):
+      return
+    self.count += 1
+    if self.count % self.sample != 0:
+      return
+    self.records.append((direction, sock.fileno(), clientid, packed))
+
+  def publish(self):
+    "publish the copies of the packets queued so far"
+    count = len(self.records)
+    if count == 0:
+      return
+    messages = []
+    for i in range(count):
+      direction, fileno, clientid, packed = self.records.popleft()
+      try:
+        packet = MQTTV5.unpackPacket(packed, MQTTV5.MAX_PACKET_SIZE)
+        data = {"direction" : direction, "socket" : fileno, "clientid" : clientid, "packet" : packet.json()}
+        messages.append(bytes(json.dumps(data), 'utf-8'))
+      except:
+        logger.exception("visual mirror")
+    with self.lock:
+      for databytes in messages:
+        self.broker.publish('$internal', TOPIC, databytes, 0, 0,
+                            MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH), time.monotonic())
+
+  def publishLoop(self):
+    while self.running:
+      time.sleep(self.interval)
+      try:
+        self.publish()
+      except:
+        logger.exception("visual mirror")
+
+  def stop(self):
+    self.running = False
+    self.publisher.join()
@@ -44,7 +44,10 @@ class Receivers:
   def receive(self, callback=None):
     packet = None
     try:
-      packet = MQTTV5.unpackPacket(MQTTV5.getPacket(self.socket))
+      buffer = MQTTV5.getPacket(self.socket)
+      if buffer == None and not self.stopping:
+        raise socket.error("connection closed")
+      packet = MQTTV5.unpackPacket(buffer)
     except:
       if not self.stopping and sys.exc_info()[0] != socket.timeout:
         logger.info("receive: unexpected exception %s", str(sys.exc_info()))
@@ -164,4 +167,6 @@ class Receivers:
       if not self.stopping and sys.exc_info()[0] != socket.error:
         logger.error("call: unexpected exception %s", str(sys.exc_info()))
         traceback.print_exc()
+      if not self.stopping and hasattr(callback, "connectionLost"):
+        callback.connectionLost(sys.exc_info()[1])
     self.running = False
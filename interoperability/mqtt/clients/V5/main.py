@@ -34,14 +34,16 @@ ch.setFormatter(formatter)
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
-def sendtosocket(mysocket, data):
+def sendtosocket(mysocket, data, raiseErrors=False):
   logger.debug("out: %s", str(data))
   sent = 0
   length = len(data)
   try:
     while sent < length:
-      sent += mysocket.send(data)
+      sent += mysocket.send(data[sent:])
   except:
+    if raiseErrors:
+      raise
     pass # could be socket error
   return sent
 
@@ -73,8 +75,10 @@ class Client:
   def getReceiver(self):
     return self.__receiver
 
-  def __init__(self, clientid):
+  def __init__(self, clientid, raiseErrors=False):
+    "with raiseErrors, socket errors in subscribe, unsubscribe and publish are raised, not ignored"
     self.clientid = clientid
+    self.raiseErrors = raiseErrors
     self.msgid = 1
     self.callback = None
     self.__receiver = None
@@ -168,7 +172,7 @@ class Client:
       count += 1
     if properties:
       subscribe.properties = properties
-    sendtosocket(self.sock, subscribe.pack())
+    sendtosocket(self.sock, subscribe.pack(), self.raiseErrors)
     return subscribe.packetIdentifier
 
 
@@ -176,7 +180,7 @@ class Client:
     unsubscribe = MQTTV5.Unsubscribes()
     unsubscribe.packetIdentifier = self.__nextMsgid()
     unsubscribe.topicFilters = topics
-    sendtosocket(self.sock, unsubscribe.pack())
+    sendtosocket(self.sock, unsubscribe.pack(), self.raiseErrors)
     return unsubscribe.packetIdentifier
 
 
@@ -195,7 +199,7 @@ class Client:
     if properties:
       publish.properties = properties
     publish.data = payload if type(payload) == type(b"") else bytes(payload, "utf8")
-    sendtosocket(self.sock, publish.pack())
+    sendtosocket(self.sock, publish.pack(), self.raiseErrors)
     return publish.packetIdentifier
 
 
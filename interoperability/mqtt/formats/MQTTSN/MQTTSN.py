@@ -1,6 +1,6 @@
 """
 *******************************************************************
-  Copyright (c) 2013, 2018 IBM Corp.
+  Copyright (c) 2013, 2026 IBM Corp.
 
   All rights reserved. This program and the accompanying materials
   are made available under the terms of the Eclipse Public License v1.0
@@ -70,15 +70,13 @@ class Messages(object):
   classNames = [name+'es' if name == "Publish" else
                 name+'s' if name != "reserved" else name for name in Names]
 
-  def pack(self):
-    buffer = self.fh.pack(0)
-    return buffer
-
   def __str__(self):
-    return str(self.fh)
+    return self.Names[self.messageType] + " (" + ", ".join(["%s=%s" % (name, getattr(self, name))
+        for name in self.names if name != "messageType"]) + ")"
 
   def __eq__(self, packet):
-    return self.fh == packet.fh if packet else False
+    return packet != None and self.messageType == packet.messageType and \
+      all([getattr(self, name) == getattr(packet, name) for name in self.names])
 
   def __setattr__(self, name, value):
     if name not in self.names:
@@ -122,6 +120,27 @@ def writeData(data):
   # data could be a string, or bytes.  If string, encode into bytes with utf-8
   return data if type(data) == type(b"") else bytes(data, "utf-8")
 
+def packMessage(messageType, body):
+  "the length, which is of the whole message, and message type before the body"
+  length = len(body) + 2
+  if length < 256:
+    return bytes([length, messageType]) + body
+  return bytes([1]) + writeInt16(length + 2) + bytes([messageType]) + body
+
+def bodyOf(buffer, messageType):
+  "the bytes of a message after the message type"
+  assert len(buffer) >= 2
+  assert MessageType(buffer) == messageType
+  messagelen, lenlen = MessageLens.decode(buffer)
+  assert messagelen <= len(buffer)
+  return buffer[lenlen + 1:messagelen]
+
+class TopicIdTypes:
+  NORMAL, PREDEFINED, SHORT_NAME = range(3)
+
+class ReturnCodes:
+  ACCEPTED, REJECTED_CONGESTION, REJECTED_INVALID_TOPIC_ID, REJECTED_NOT_SUPPORTED = range(4)
+
 class MessageLens:
 
   @staticmethod
@@ -165,7 +184,7 @@ class Flags:
   def __setattr__(self, name, value):
     names = ["DUP", "QoS", "RETAIN", "Will", "CleanSession", "TopicIdType"]
     if name not in names:
-      raise MQTTException(name + " Attribute name must be one of "+str(names))
+      raise MQTTSNException(name + " Attribute name must be one of "+str(names))
     object.__setattr__(self, name, value)
 
   def __str__(self):
@@ -210,10 +229,8 @@ class Connects(Messages):
       self.unpack(buffer)
 
   def pack(self):
-    msglen = 6 + len(self.ClientId)
-    buffer = bytes([msglen, MessageTypes.CONNECT]) + self.Flags.pack() +\
-      bytes([self.ProtocolId]) + writeInt16(self.Duration) + writeData(self.ClientId)
-    return buffer
+    return packMessage(MessageTypes.CONNECT, self.Flags.pack() +
+      bytes([self.ProtocolId]) + writeInt16(self.Duration) + writeData(self.ClientId))
 
   def unpack(self, buffer):
     assert len(buffer) >= 2
@@ -286,10 +303,8 @@ class Publishes(Messages):
       self.unpack(buffer)
 
   def pack(self):
-    msglen = 6 + len(self.Data)
-    buffer = bytes([msglen, self.messageType]) + self.Flags.pack() +\
-      writeInt16(self.TopicId) + writeInt16(self.MsgId) + writeData(self.Data)
-    return buffer
+    return packMessage(self.messageType, self.Flags.pack() +
+      writeInt16(self.TopicId) + writeInt16(self.MsgId) + writeData(self.Data))
 
   def unpack(self, buffer):
     assert len(buffer) >= 2
@@ -315,15 +330,239 @@ class Publishes(Messages):
       self.Data == packet.Data
     return rc
 
-WillTopicReqs = WillTopics = WillMsgReqs = WillMsgs = Registers = Regacks = Pubacks = None
+class Registers(Messages):
+
+  def __init__(self, buffer=None):
+    object.__setattr__(self, "names", ["messageType", "TopicId", "MsgId", "TopicName"])
+    self.messageType = MessageTypes.REGISTER
+    self.TopicId = 0
+    self.MsgId = 0
+    self.TopicName = ""
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    return packMessage(self.messageType, writeInt16(self.TopicId) + writeInt16(self.MsgId) +
+      writeData(self.TopicName))
+
+  def unpack(self, buffer):
+    body = bodyOf(buffer, self.messageType)
+    assert len(body) >= 4
+    self.TopicId = readInt16(body)
+    self.MsgId = readInt16(body[2:])
+    self.TopicName = body[4:].decode("utf-8")
+
+
+class Acks(Messages):
+  "the acknowledgements of a topic id: regacks and pubacks"
+
+  def __init__(self, messageType, buffer=None):
+    object.__setattr__(self, "names", ["messageType", "TopicId", "MsgId", "ReturnCode"])
+    self.messageType = messageType
+    self.TopicId = 0
+    self.MsgId = 0
+    self.ReturnCode = ReturnCodes.ACCEPTED
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    return packMessage(self.messageType, writeInt16(self.TopicId) + writeInt16(self.MsgId) +
+      bytes([self.ReturnCode]))
+
+  def unpack(self, buffer):
+    body = bodyOf(buffer, self.messageType)
+    assert len(body) == 5
+    self.TopicId = readInt16(body)
+    self.MsgId = readInt16(body[2:])
+    self.ReturnCode = body[4]
+
+class Regacks(Acks):
+
+  def __init__(self, buffer=None):
+    Acks.__init__(self, MessageTypes.REGACK, buffer)
+
+class Pubacks(Acks):
+
+  def __init__(self, buffer=None):
+    Acks.__init__(self, MessageTypes.PUBACK, buffer)
+
+
+class MsgIds(Messages):
+  "the messages with only a message id: pubrecs, pubrels, pubcomps and unsubacks"
+
+  def __init__(self, messageType, buffer=None):
+    object.__setattr__(self, "names", ["messageType", "MsgId"])
+    self.messageType = messageType
+    self.MsgId = 0
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    return packMessage(self.messageType, writeInt16(self.MsgId))
+
+  def unpack(self, buffer):
+    body = bodyOf(buffer, self.messageType)
+    assert len(body) == 2
+    self.MsgId = readInt16(body)
+
+class Pubrecs(MsgIds):
+
+  def __init__(self, buffer=None):
+    MsgIds.__init__(self, MessageTypes.PUBREC, buffer)
+
+class Pubrels(MsgIds):
+
+  def __init__(self, buffer=None):
+    MsgIds.__init__(self, MessageTypes.PUBREL, buffer)
+
+class Pubcomps(MsgIds):
+
+  def __init__(self, buffer=None):
+    MsgIds.__init__(self, MessageTypes.PUBCOMP, buffer)
+
+class Unsubacks(MsgIds):
+
+  def __init__(self, buffer=None):
+    MsgIds.__init__(self, MessageTypes.UNSUBACK, buffer)
+
+
+class Subscriptions(Messages):
+  """
+  subscribes and unsubscribes: the topic is in TopicName, or for a predefined topic id,
+  in TopicId.  A short topic name is two bytes, each one character of TopicName.
+  """
+
+  def __init__(self, messageType, buffer=None):
+    object.__setattr__(self, "names", ["messageType", "Flags", "MsgId", "TopicName", "TopicId"])
+    self.messageType = messageType
+    self.Flags = Flags()
+    self.MsgId = 0
+    self.TopicName = ""
+    self.TopicId = 0
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    if self.Flags.TopicIdType == TopicIdTypes.PREDEFINED:
+      topic = writeInt16(self.TopicId)
+    elif self.Flags.TopicIdType == TopicIdTypes.SHORT_NAME:
+      topic = self.TopicName.encode("latin-1")
+    else:
+      topic = writeData(self.TopicName)
+    return packMessage(self.messageType, self.Flags.pack() + writeInt16(self.MsgId) + topic)
+
+  def unpack(self, buffer):
+    body = bodyOf(buffer, self.messageType)
+    assert len(body) >= 3
+    self.Flags.unpack(body[0])
+    self.MsgId = readInt16(body[1:])
+    if self.Flags.TopicIdType == TopicIdTypes.PREDEFINED:
+      assert len(body) == 5
+      self.TopicId = readInt16(body[3:])
+    elif self.Flags.TopicIdType == TopicIdTypes.SHORT_NAME:
+      assert len(body) == 5
+      self.TopicName = body[3:].decode("latin-1")
+    else:
+      self.TopicName = body[3:].decode("utf-8")
+
+class Subscribes(Subscriptions):
+
+  def __init__(self, buffer=None):
+    Subscriptions.__init__(self, MessageTypes.SUBSCRIBE, buffer)
+
+class Unsubscribes(Subscriptions):
+
+  def __init__(self, buffer=None):
+    Subscriptions.__init__(self, MessageTypes.UNSUBSCRIBE, buffer)
+
+
+class Subacks(Messages):
+
+  def __init__(self, buffer=None):
+    object.__setattr__(self, "names", ["messageType", "Flags", "TopicId", "MsgId", "ReturnCode"])
+    self.messageType = MessageTypes.SUBACK
+    self.Flags = Flags()
+    self.TopicId = 0
+    self.MsgId = 0
+    self.ReturnCode = ReturnCodes.ACCEPTED
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    return packMessage(self.messageType, self.Flags.pack() + writeInt16(self.TopicId) +
+      writeInt16(self.MsgId) + bytes([self.ReturnCode]))
+
+  def unpack(self, buffer):
+    body = bodyOf(buffer, self.messageType)
+    assert len(body) == 6
+    self.Flags.unpack(body[0])
+    self.TopicId = readInt16(body[1:])
+    self.MsgId = readInt16(body[3:])
+    self.ReturnCode = body[5]
+
+
+class Pingreqs(Messages):
+  "ClientId is given by a sleeping client to wake up"
+
+  def __init__(self, buffer=None):
+    object.__setattr__(self, "names", ["messageType", "ClientId"])
+    self.messageType = MessageTypes.PINGREQ
+    self.ClientId = ""
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    return packMessage(self.messageType, writeData(self.ClientId))
+
+  def unpack(self, buffer):
+    self.ClientId = bodyOf(buffer, self.messageType).decode("utf-8")
+
+class Pingresps(Messages):
+
+  def __init__(self, buffer=None):
+    object.__setattr__(self, "names", ["messageType"])
+    self.messageType = MessageTypes.PINGRESP
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    return packMessage(self.messageType, b"")
+
+  def unpack(self, buffer):
+    assert len(bodyOf(buffer, self.messageType)) == 0
+
+class Disconnects(Messages):
+  "Duration is given, in seconds, by a client going to sleep"
+
+  def __init__(self, buffer=None):
+    object.__setattr__(self, "names", ["messageType", "Duration"])
+    self.messageType = MessageTypes.DISCONNECT
+    self.Duration = None
+    if buffer != None:
+      self.unpack(buffer)
+
+  def pack(self):
+    return packMessage(self.messageType, b"" if self.Duration == None else writeInt16(self.Duration))
+
+  def unpack(self, buffer):
+    body = bodyOf(buffer, self.messageType)
+    assert len(body) in [0, 2]
+    self.Duration = readInt16(body) if len(body) == 2 else None
+
+
+WillTopicReqs = WillTopics = WillMsgReqs = WillMsgs = None
 
-classes = [None, None, None, None, Connects, Connacks, 
+classes = [None, None, None, None, Connects, Connacks,
            WillTopicReqs, WillTopics, WillMsgReqs, WillMsgs,
-           Registers, Regacks, Publishes, Pubacks]
+           Registers, Regacks, Publishes, Pubacks, Pubcomps, Pubrecs, Pubrels,
+           None, Subscribes, Subacks, Unsubscribes, Unsubacks,
+           Pingreqs, Pingresps, Disconnects]
 
 def unpackPacket(buffer, maximumPacketSize=MAX_PACKET_SIZE):
-  if MessageType(buffer) != None:
-    packet = classes[MessageType(buffer)]()
+  "the message in buffer, or None if it's of a type not supported"
+  messageType = MessageType(buffer)
+  if messageType < len(classes) and classes[messageType] != None:
+    packet = classes[messageType]()
     packet.unpack(buffer) #, maximumPacketSize=maximumPacketSize)
   else:
     packet = None
@@ -22,6 +22,25 @@ class Test(unittest.TestCase):
         #print("out", str(outpacket))
         assert inpacket == outpacket
 
+    def testLongPackets(self):
+      inpacket = MQTTSN.Publishes()
+      inpacket.Data = b"x" * 300
+      buf = inpacket.pack()
+      assert buf[0] == 1 and MQTTSN.readInt16(buf[1:]) == len(buf)
+      assert MQTTSN.unpackPacket(buf) == inpacket
+
+    def testTopicIds(self):
+      inpacket = MQTTSN.Subscribes()
+      inpacket.Flags.TopicIdType = MQTTSN.TopicIdTypes.PREDEFINED
+      inpacket.TopicId = 7
+      assert len(inpacket.pack()) == 7
+      assert MQTTSN.unpackPacket(inpacket.pack()) == inpacket
+      inpacket = MQTTSN.Subscribes()
+      inpacket.Flags.TopicIdType = MQTTSN.TopicIdTypes.SHORT_NAME
+      inpacket.TopicName = b"\xff\x01".decode("latin-1") # not UTF-8
+      assert len(inpacket.pack()) == 7
+      assert MQTTSN.unpackPacket(inpacket.pack()) == inpacket
+
 
 
 if __name__ == "__main__":
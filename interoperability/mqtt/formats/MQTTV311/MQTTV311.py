@@ -28,6 +28,8 @@ import logging
 
 logger = logging.getLogger('MQTT broker')
 
+conformance = logger.info # records conformance statements, a broker in production mode replaces it
+
 # Low-level protocol interface
 
 class MQTTException(Exception):
@@ -170,7 +172,8 @@ def readInt16(buf):
 
 def writeUTF(data):
   # data could be a string, or bytes.  If string, encode into bytes with utf-8
-  return writeInt16(len(data)) + (data if type(data) == type(b"") else bytes(data, "utf-8"))
+  data = data if type(data) == type(b"") else bytes(data, "utf-8")
+  return writeInt16(len(data)) + data
 
 def readUTF(buffer, maxlen):
   if maxlen >= 2:
@@ -181,7 +184,7 @@ def readUTF(buffer, maxlen):
   if length > maxlen:
     raise MQTTException("Length delimited string too long")
   buf = buffer[2:2+length].decode("utf-8")
-  logger.info("[MQTT-4.7.3-2] topic names and filters not include null")
+  conformance("[MQTT-4.7.3-2] topic names and filters not include null")
   zz = buf.find("\x00") # look for null in the UTF string
   if zz != -1:
     raise MQTTException("[MQTT-1.5.3-2] Null found in UTF data "+buf)
@@ -190,7 +193,7 @@ def readUTF(buffer, maxlen):
     if zz != -1:
       raise MQTTException("[MQTT-1.5.3-1] D800-DFFF found in UTF data "+buf)
   if buf.find("\uFEFF") != -1:
-    logger.info("[MQTT-1.5.3-3] U+FEFF in UTF string")
+    conformance("[MQTT-1.5.3-3] U+FEFF in UTF string")
   return buf
 
 def writeBytes(buffer):
@@ -271,7 +274,7 @@ class Connects(Packets):
       assert self.fh.RETAIN == False, "[MQTT-2.1.2-1]"
 
       self.ProtocolName = readUTF(buffer[curlen:], packlen - curlen)
-      curlen += len(self.ProtocolName) + 2
+      curlen += len(bytes(self.ProtocolName, "utf-8")) + 2
       assert self.ProtocolName == "MQTT", "Wrong protocol name %s" % self.ProtocolName
 
       self.ProtocolVersion = buffer[curlen]
@@ -295,39 +298,39 @@ class Connects(Packets):
 
       self.KeepAliveTimer = readInt16(buffer[curlen:])
       curlen += 2
-      logger.info("[MQTT-3.1.3-3] Clientid must be present, and first field")
-      logger.info("[MQTT-3.1.3-4] Clientid must be Unicode, and between 0 and 65535 bytes long")
+      conformance("[MQTT-3.1.3-3] Clientid must be present, and first field")
+      conformance("[MQTT-3.1.3-4] Clientid must be Unicode, and between 0 and 65535 bytes long")
       self.ClientIdentifier = readUTF(buffer[curlen:], packlen - curlen)
-      curlen += len(self.ClientIdentifier) + 2
+      curlen += len(bytes(self.ClientIdentifier, "utf-8")) + 2
 
       if self.WillFlag:
         self.WillTopic = readUTF(buffer[curlen:], packlen - curlen)
-        curlen += len(self.WillTopic) + 2
+        curlen += len(bytes(self.WillTopic, "utf-8")) + 2
         self.WillMessage = readBytes(buffer[curlen:])
         curlen += len(self.WillMessage) + 2
-        logger.info("[MQTT-3.1.2-9] will topic and will message fields must be present")
+        conformance("[MQTT-3.1.2-9] will topic and will message fields must be present")
       else:
         self.WillTopic = self.WillMessage = None
 
       if self.usernameFlag:
         assert len(buffer) > curlen+2, "Buffer too short to read username length"
         self.username = readUTF(buffer[curlen:], packlen - curlen)
-        curlen += len(self.username) + 2
-        logger.info("[MQTT-3.1.2-19] username must be in payload if user name flag is 1")
+        curlen += len(bytes(self.username, "utf-8")) + 2
+        conformance("[MQTT-3.1.2-19] username must be in payload if user name flag is 1")
       else:
-        logger.info("[MQTT-3.1.2-18] username must not be in payload if user name flag is 0")
+        conformance("[MQTT-3.1.2-18] username must not be in payload if user name flag is 0")
         assert self.passwordFlag == False, "[MQTT-3.1.2-22] password flag must be 0 if username flag is 0"
 
       if self.passwordFlag:
         assert len(buffer) > curlen+2, "Buffer too short to read password length"
         self.password = readBytes(buffer[curlen:])
         curlen += len(self.password) + 2
-        logger.info("[MQTT-3.1.2-21] password must be in payload if password flag is 0")
+        conformance("[MQTT-3.1.2-21] password must be in payload if password flag is 0")
       else:
-        logger.info("[MQTT-3.1.2-20] password must not be in payload if password flag is 0")
+        conformance("[MQTT-3.1.2-20] password must not be in payload if password flag is 0")
 
       if self.WillFlag and self.usernameFlag and self.passwordFlag:
-        logger.info("[MQTT-3.1.3-1] clientid, will topic, will message, username and password all present")
+        conformance("[MQTT-3.1.3-1] clientid, will topic, will message, username and password all present")
 
       assert curlen == packlen, "Packet is wrong length curlen %d != packlen %d"
     except:
@@ -422,7 +425,7 @@ class Disconnects(Packets):
     assert MessageType(buffer) == DISCONNECT
     self.fh.unpack(buffer)
     assert self.fh.remainingLength == 0, "Disconnect packet is wrong length %d" % self.fh.remainingLength
-    logger.info("[MQTT-3.14.1-1] disconnect reserved bits must be 0")
+    conformance("[MQTT-3.14.1-1] disconnect reserved bits must be 0")
     assert self.fh.DUP == False, "[MQTT-2.1.2-1]"
     assert self.fh.QoS == 0, "[MQTT-2.1.2-1]"
     assert self.fh.RETAIN == False, "[MQTT-2.1.2-1]"
@@ -465,16 +468,16 @@ class Publishes(Packets):
     try:
       self.topicName = readUTF(buffer[fhlen:], packlen - curlen)
     except UnicodeDecodeError:
-      logger.info("[MQTT-3.3.2-1] topic name in publish must be utf-8")
+      conformance("[MQTT-3.3.2-1] topic name in publish must be utf-8")
       raise
-    curlen += len(self.topicName) + 2
+    curlen += len(bytes(self.topicName, "utf-8")) + 2
     if self.fh.QoS != 0:
       self.messageIdentifier = readInt16(buffer[curlen:])
-      logger.info("[MQTT-2.3.1-1] packet indentifier must be in publish if QoS is 1 or 2")
+      conformance("[MQTT-2.3.1-1] packet indentifier must be in publish if QoS is 1 or 2")
       curlen += 2
       assert self.messageIdentifier > 0, "[MQTT-2.3.1-1] packet indentifier must be > 0"
     else:
-      logger.info("[MQTT-2.3.1-5] no packet indentifier in publish if QoS is 0")
+      conformance("[MQTT-2.3.1-5] no packet indentifier in publish if QoS is 0")
       self.messageIdentifier = 0
     self.data = buffer[curlen:fhlen + self.fh.remainingLength]
     if self.fh.QoS == 0:
@@ -598,7 +601,7 @@ class Pubrels(Packets):
     assert self.fh.DUP == False, "[MQTT-2.1.2-1] DUP should be False in PUBREL"
     assert self.fh.QoS == 1, "[MQTT-2.1.2-1] QoS should be 1 in PUBREL"
     assert self.fh.RETAIN == False, "[MQTT-2.1.2-1] RETAIN should be False in PUBREL"
-    logger.info("[MQTT-3.6.1-1] bits in fixed header for pubrel are ok")
+    conformance("[MQTT-3.6.1-1] bits in fixed header for pubrel are ok")
     return fhlen + 2
 
   def __repr__(self):
@@ -672,14 +675,14 @@ class Subscribes(Packets):
     assert MessageType(buffer) == SUBSCRIBE
     fhlen = self.fh.unpack(buffer)
     assert len(buffer) >= fhlen + self.fh.remainingLength
-    logger.info("[MQTT-2.3.1-1] packet indentifier must be in subscribe")
+    conformance("[MQTT-2.3.1-1] packet indentifier must be in subscribe")
     self.messageIdentifier = readInt16(buffer[fhlen:])
     assert self.messageIdentifier > 0, "[MQTT-2.3.1-1] packet indentifier must be > 0"
     leftlen = self.fh.remainingLength - 2
     self.data = []
     while leftlen > 0:
       topic = readUTF(buffer[-leftlen:], leftlen)
-      leftlen -= len(topic) + 2
+      leftlen -= len(bytes(topic, "utf-8")) + 2
       qos = buffer[-leftlen]
       assert qos in [0, 1, 2], "[MQTT-3-8.3-2] reserved bits must be zero"
       leftlen -= 1
@@ -777,20 +780,20 @@ class Unsubscribes(Packets):
     assert MessageType(buffer) == UNSUBSCRIBE
     fhlen = self.fh.unpack(buffer)
     assert len(buffer) >= fhlen + self.fh.remainingLength
-    logger.info("[MQTT-2.3.1-1] packet indentifier must be in unsubscribe")
+    conformance("[MQTT-2.3.1-1] packet indentifier must be in unsubscribe")
     self.messageIdentifier = readInt16(buffer[fhlen:])
     assert self.messageIdentifier > 0, "[MQTT-2.3.1-1] packet indentifier must be > 0"
     leftlen = self.fh.remainingLength - 2
     self.data = []
     while leftlen > 0:
       topic = readUTF(buffer[-leftlen:], leftlen)
-      leftlen -= len(topic) + 2
+      leftlen -= len(bytes(topic, "utf-8")) + 2
       self.data.append(topic)
     assert leftlen == 0
     assert self.fh.DUP == False, "[MQTT-2.1.2-1]"
     assert self.fh.QoS == 1, "[MQTT-2.1.2-1]"
     assert self.fh.RETAIN == False, "[MQTT-2.1.2-1]"
-    logger.info("[MQTT-3-10.1-1] fixed header bits are 0,0,1,0")
+    conformance("[MQTT-3-10.1-1] fixed header bits are 0,0,1,0")
     return fhlen + self.fh.remainingLength
 
   def __repr__(self):
@@ -0,0 +1,36 @@
+import unittest
+
+import MQTTV311
+
+class Test(unittest.TestCase):
+
+    def testUTF(self):
+      topic = "café/über/温度"
+      encoded = topic.encode("utf-8")
+      self.assertEqual(MQTTV311.writeUTF(topic), MQTTV311.writeInt16(len(encoded)) + encoded)
+      self.assertEqual(MQTTV311.readUTF(MQTTV311.writeUTF(topic), len(encoded) + 2), topic)
+
+    def testPackets(self):
+      topic = "café/über/温度"
+      publish = MQTTV311.Publishes(QoS=1, MsgId=7, TopicName=topic, Payload=b"payload")
+      after = MQTTV311.unpackPacket(publish.pack())
+      self.assertEqual((after.topicName, after.messageIdentifier, after.data), (topic, 7, b"payload"))
+      subscribe = MQTTV311.Subscribes(MsgId=3, Data=[(topic, 1), ("#", 2)])
+      self.assertEqual(MQTTV311.unpackPacket(subscribe.pack()).data, [(topic, 1), ("#", 2)])
+      unsubscribe = MQTTV311.Unsubscribes(MsgId=4, Data=[topic, "#"])
+      self.assertEqual(MQTTV311.unpackPacket(unsubscribe.pack()).data, [topic, "#"])
+      connect = MQTTV311.Connects()
+      connect.ClientIdentifier = "é"
+      connect.WillFlag = True
+      connect.WillTopic = topic
+      connect.WillMessage = b"will"
+      after = MQTTV311.unpackPacket(connect.pack())
+      self.assertEqual((after.ClientIdentifier, after.WillTopic, after.WillMessage), ("é", topic, b"will"))
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.version_info[0] < 3:
+        print("This program requires Python 3")
+        sys.exit()
+    unittest.main()
@@ -28,6 +28,8 @@ import logging, struct
 
 logger = logging.getLogger('MQTT broker')
 
+conformance = logger.info # records conformance statements, a broker in production mode replaces it
+
 # Low-level protocol interface
 
 class MQTTException(Exception):
@@ -382,7 +384,8 @@ def readInt32(buf):
 
 def writeUTF(data):
   # data could be a string, or bytes.  If string, encode into bytes with utf-8
-  return writeInt16(len(data)) + (data if type(data) == type(b"") else bytes(data, "utf-8"))
+  data = data if type(data) == type(b"") else bytes(data, "utf-8")
+  return writeInt16(len(data)) + data
 
 def readUTF(buffer, maxlen):
   if maxlen >= 2:
@@ -393,7 +396,7 @@ def readUTF(buffer, maxlen):
   if length > maxlen:
     raise MalformedPacket("Length delimited string too long")
   buf = buffer[2:2+length].decode("utf-8")
-  logger.info("[MQTT5-4.7.3-2] topic names and filters must not include null")
+  conformance("[MQTT5-4.7.3-2] topic names and filters must not include null")
   zz = buf.find("\x00") # look for null in the UTF string
   if zz != -1:
     raise MalformedPacket("[MQTT5-1.5.4-2] Null found in UTF data "+buf)
@@ -402,7 +405,7 @@ def readUTF(buffer, maxlen):
     if zz != -1:
       raise MalformedPacket("[MQTT5-1.5.4-1] D800-DFFF found in UTF data "+buf)
   if buf.find("\uFEFF") != -1:
-    logger.info("[MQTT5-1.5.4-3] U+FEFF in UTF string")
+    conformance("[MQTT5-1.5.4-3] U+FEFF in UTF string")
   return buf, length+2
 
 def writeBytes(buffer):
@@ -603,7 +606,7 @@ class Properties(object):
           buffer += self.writeProperty(identifier, attr_type,
                            getattr(self, compressedName))
     if len(buffer) == 0:
-       logger.info("[MQTT5-2.2.2-1] If there are no properties, a property length of 0 must be included")
+       conformance("[MQTT5-2.2.2-1] If there are no properties, a property length of 0 must be included")
     return VBIs.encode(len(buffer)) + buffer
 
   def readProperty(self, buffer, type, propslen):
@@ -623,7 +626,7 @@ class Properties(object):
     elif type == self.types.index("UTF-8 Encoded String"):
       value, valuelen = readUTF(buffer, propslen)
     elif type == self.types.index("UTF-8 String Pair"):
-      logger.info("[MQTT5-1.5.7-1] Both string pair strings must be properly formed")
+      conformance("[MQTT5-1.5.7-1] Both string pair strings must be properly formed")
       value, valuelen = readUTF(buffer, propslen)
       buffer = buffer[valuelen:] # strip the bytes used by the value
       value1, valuelen1 = readUTF(buffer, propslen - valuelen)
@@ -733,12 +736,12 @@ class Connects(Packets):
       self.ProtocolName, valuelen = readUTF(buffer[curlen:], packlen - curlen)
       curlen += valuelen
       assert self.ProtocolName == "MQTT", "[MQTT5-3.1.2-1-error] Wrong protocol name %s" % self.ProtocolName
-      logger.info("[MQTT5-3.1.2-1] Protocol name must be MQTT")
+      conformance("[MQTT5-3.1.2-1] Protocol name must be MQTT")
 
       self.ProtocolVersion = buffer[curlen]
       curlen += 1
       assert self.ProtocolVersion == 5, "[MQTT5-3.1.2-2-error] Wrong protocol version %s" % self.ProtocolVersion
-      logger.info("[MQTT5-3.1.2-2] Protocol name must be 5")
+      conformance("[MQTT5-3.1.2-2] Protocol name must be 5")
 
       connectFlags = buffer[curlen]
       assert (connectFlags & 0x01) == 0, "[MQTT5-3.1.2-3] reserved connect flag must be 0"
@@ -761,19 +764,19 @@ class Connects(Packets):
 
       curlen += self.properties.unpack(buffer[curlen:])[1]
 
-      logger.info("[MQTT5-3.1.3-3] Clientid must be present, and first field")
-      logger.info("[MQTT5-3.1.3-4] Clientid must be a UTF-8 encoded string")
+      conformance("[MQTT5-3.1.3-3] Clientid must be present, and first field")
+      conformance("[MQTT5-3.1.3-4] Clientid must be a UTF-8 encoded string")
       self.ClientIdentifier, valuelen = readUTF(buffer[curlen:], packlen - curlen)
       curlen += valuelen
 
       if self.WillFlag:
         curlen += self.WillProperties.unpack(buffer[curlen:])[1]
         self.WillTopic, valuelen = readUTF(buffer[curlen:], packlen - curlen)
-        logger.info("[MQTT5-3.1.3-11] will topic must be a UTF-8 encoded string")
+        conformance("[MQTT5-3.1.3-11] will topic must be a UTF-8 encoded string")
         curlen += valuelen
         self.WillMessage, valuelen = readBytes(buffer[curlen:])
         curlen += valuelen
-        logger.info("[MQTT5-3.1.2-9] will topic and will message fields must be present")
+        conformance("[MQTT5-3.1.2-9] will topic and will message fields must be present")
       else:
         self.WillTopic = self.WillMessage = None
 
@@ -781,22 +784,22 @@ class Connects(Packets):
         assert len(buffer) > curlen+2, "Buffer too short to read username length"
         self.username, valuelen = readUTF(buffer[curlen:], packlen - curlen)
         curlen += valuelen
-        logger.info("[MQTT5-3.1.2-17] username must be in payload if user name flag is 1")
-        logger.info("[MQTT5-3.1.3-12] username must be next and UTF-8 encoded string")
+        conformance("[MQTT5-3.1.2-17] username must be in payload if user name flag is 1")
+        conformance("[MQTT5-3.1.3-12] username must be next and UTF-8 encoded string")
       else:
-        logger.info("[MQTT5-3.1.2-16] username must not be in payload if user name flag is 0")
+        conformance("[MQTT5-3.1.2-16] username must not be in payload if user name flag is 0")
         assert self.passwordFlag == False, "[MQTT5-3.1.2-22] password flag must be 0 if username flag is 0"
 
       if self.passwordFlag:
         assert len(buffer) > curlen+2, "Buffer too short to read password length"
         self.password, valuelen = readBytes(buffer[curlen:])
         curlen += valuelen
-        logger.info("[MQTT5-3.1.2-19] password must be in payload if password flag is 1")
+        conformance("[MQTT5-3.1.2-19] password must be in payload if password flag is 1")
       else:
-        logger.info("[MQTT5-3.1.2-18] password must not be in payload if password flag is 0")
+        conformance("[MQTT5-3.1.2-18] password must not be in payload if password flag is 0")
 
       if self.WillFlag and self.usernameFlag and self.passwordFlag:
-        logger.info("[MQTT5-3.1.3-1] clientid, will topic, will message, username and password all present")
+        conformance("[MQTT5-3.1.3-1] clientid, will topic, will message, username and password all present")
 
       assert curlen == packlen, "Packet is wrong length curlen %d != packlen %d" % (curlen, packlen)
     except:
@@ -883,7 +886,7 @@ class Connacks(Packets):
 
   def pack(self):
     flags = 0x01 if self.sessionPresent else 0x00
-    logger.info("[MQTT5-3.2.2-1] bits 7-1 of the connack flags are reserved and must be set to 0")
+    conformance("[MQTT5-3.2.2-1] bits 7-1 of the connack flags are reserved and must be set to 0")
     buffer = bytes([flags])
     buffer += self.reasonCode.pack()
     buffer += self.properties.pack()
@@ -989,7 +992,7 @@ class Publishes(Packets):
   def __init__(self, buffer=None, DUP=False, QoS=0, RETAIN=False, MsgId=1, TopicName="", Payload=b""):
     object.__setattr__(self, "names",
           ["fh", "DUP", "QoS", "RETAIN", "topicName", "packetIdentifier",
-           "properties", "data", "qos2state", "receivedTime"])
+           "properties", "data", "qos2state", "receivedTime", "storeRef", "resent"])
     self.fh = FixedHeaders(PacketTypes.PUBLISH)
     self.fh.DUP = DUP
     self.fh.QoS = QoS
@@ -1006,9 +1009,9 @@ class Publishes(Packets):
   def pack(self):
     buffer = writeUTF(self.topicName)
     if self.fh.QoS == 0:
-      logger.info("[MQTT5-2.2.1-2] no packet indentifier in publish if QoS is 0")
+      conformance("[MQTT5-2.2.1-2] no packet indentifier in publish if QoS is 0")
     else:
-      logger.info("[MQTT5-2.2.1-4] packet indentifier must be in publish if QoS is 1 or 2")
+      conformance("[MQTT5-2.2.1-4] packet indentifier must be in publish if QoS is 1 or 2")
       buffer +=  writeInt16(self.packetIdentifier)
     buffer += self.properties.pack()
     buffer += self.data
@@ -1026,16 +1029,16 @@ class Publishes(Packets):
     try:
       self.topicName, valuelen = readUTF(buffer[fhlen:], packlen - curlen)
     except UnicodeDecodeError:
-      logger.info("[MQTT5-3.3.2-1] topic name in publish must be utf-8")
+      conformance("[MQTT5-3.3.2-1] topic name in publish must be utf-8")
       raise
     curlen += valuelen
     if self.fh.QoS != 0:
       self.packetIdentifier = readInt16(buffer[curlen:])
-      logger.info("[MQTT5-2.2.1-3] packet indentifier must be in publish if QoS is 1 or 2")
+      conformance("[MQTT5-2.2.1-3] packet indentifier must be in publish if QoS is 1 or 2")
       curlen += 2
       assert self.packetIdentifier > 0, "[MQTT5-2.3.1-1] packet indentifier must be > 0"
     else:
-      logger.info("[MQTT5-2.2.1-2] no packet indentifier in publish if QoS is 0")
+      conformance("[MQTT5-2.2.1-2] no packet indentifier in publish if QoS is 0")
       self.packetIdentifier = 0
     curlen += self.properties.unpack(buffer[curlen:])[1]
     self.data = buffer[curlen:fhlen + self.fh.remainingLength]
@@ -1252,7 +1255,7 @@ class Subscribes(Packets):
     assert PacketType(buffer) == PacketTypes.SUBSCRIBE
     fhlen = self.fh.unpack(buffer, maximumPacketSize)
     assert len(buffer) >= fhlen + self.fh.remainingLength
-    logger.info("[MQTT5-2.2.1-3] packet indentifier must be in subscribe")
+    conformance("[MQTT5-2.2.1-3] packet indentifier must be in subscribe")
     self.packetIdentifier = readInt16(buffer[fhlen:])
     assert self.packetIdentifier > 0, "[MQTT5-2.2.1-3] packet indentifier must be > 0"
     leftlen = self.fh.remainingLength - 2
@@ -1401,7 +1404,7 @@ class Unsubscribes(Packets):
     assert PacketType(buffer) == PacketTypes.UNSUBSCRIBE
     fhlen = self.fh.unpack(buffer, maximumPacketSize)
     assert len(buffer) >= fhlen + self.fh.remainingLength
-    logger.info("[MQTT5-2.2.1-3] packet indentifier must be in unsubscribe")
+    conformance("[MQTT5-2.2.1-3] packet indentifier must be in unsubscribe")
     self.packetIdentifier = readInt16(buffer[fhlen:])
     assert self.packetIdentifier > 0, "[MQTT5-2.2.1-3] packet indentifier must be > 0"
     leftlen = self.fh.remainingLength - 2
@@ -1415,7 +1418,7 @@ class Unsubscribes(Packets):
     assert self.fh.DUP == False, "[MQTT5-2.1.3-1]"
     assert self.fh.QoS == 1, "[MQTT5-2.1.3-1]"
     assert self.fh.RETAIN == False, "[MQTT5-2.1.3-1]"
-    logger.info("[MQTT5-3-10.1-1] fixed header bits are 0,0,1,0")
+    conformance("[MQTT5-3-10.1-1] fixed header bits are 0,0,1,0")
     return fhlen + self.fh.remainingLength
 
   def __str__(self):
@@ -98,6 +98,19 @@ class Test(unittest.TestCase):
           r.__getName__(146, MQTTV5.PacketTypes.CONNACK)
           r.getId("rubbish")
 
+    def testUTF(self):
+      topic = "caf\u00e9/\u00fcber/\u6e29\u5ea6"
+      encoded = topic.encode("utf-8")
+      self.assertEqual(MQTTV5.writeUTF(topic), MQTTV5.writeInt16(len(encoded)) + encoded)
+      self.assertEqual(MQTTV5.readUTF(MQTTV5.writeUTF(topic), len(encoded) + 2), (topic, len(encoded) + 2))
+      publish = MQTTV5.Publishes()
+      publish.topicName = topic
+      publish.fh.QoS = 1
+      publish.packetIdentifier = 7
+      publish.data = b"payload"
+      after = MQTTV5.unpackPacket(publish.pack())
+      self.assertEqual((after.topicName, after.packetIdentifier, after.data), (topic, 7, b"payload"))
+
 
 if __name__ == "__main__":
     import sys
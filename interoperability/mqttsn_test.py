@@ -0,0 +1,199 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Tests of the topic ids of MQTT-SN clients, against a running broker with an MQTT
+listener and an MQTT-SN listener:
+
+  listener 1883
+  listener 1884 INADDR_ANY mqttsn
+
+  python3 mqttsn_test.py --port 1883 --sn_port 1884
+
+"""
+
+import unittest
+
+import socket, time, logging, sys, getopt
+
+import mqtt.clients.V5 as mqtt_client
+import mqtt.formats.MQTTV5 as MQTTV5
+import mqtt.formats.MQTTSN as MQTTSN
+
+class Clients:
+  "an MQTT-SN client, which sends and receives one message at a time"
+
+  def __init__(self, clientid):
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.sock.settimeout(5)
+    self.sock.connect((host, sn_port))
+    connect = MQTTSN.Connects()
+    connect.ClientId = clientid
+    connect.Flags.CleanSession = True
+    self.send(connect)
+    assert self.receive().ReturnCode == MQTTSN.ReturnCodes.ACCEPTED
+
+  def send(self, packet):
+    self.sock.send(packet.pack())
+
+  def receive(self):
+    return MQTTSN.unpackPacket(self.sock.recv(2048))
+
+  def subscribe(self, msgid, topicIdType, topic):
+    subscribe = MQTTSN.Subscribes()
+    subscribe.MsgId = msgid
+    subscribe.Flags.TopicIdType = topicIdType
+    subscribe.Flags.QoS = 1
+    subscribe.TopicName = topic
+    self.send(subscribe)
+    suback = self.receive()
+    assert isinstance(suback, MQTTSN.Subacks) and suback.MsgId == msgid, suback
+    return suback
+
+  def publish(self, msgid, topicIdType, topicId, data):
+    "publish at QoS 1, returning the PUBACK"
+    publish = MQTTSN.Publishes()
+    publish.MsgId = msgid
+    publish.Flags.QoS = 1
+    publish.Flags.TopicIdType = topicIdType
+    publish.TopicId = topicId
+    publish.Data = data
+    self.send(publish)
+    puback = self.receive()
+    assert isinstance(puback, MQTTSN.Pubacks) and puback.MsgId == msgid, puback
+    return puback
+
+  def received(self):
+    "the next publication, acknowledged if it is QoS 1"
+    publish = self.receive()
+    assert isinstance(publish, MQTTSN.Publishes), publish
+    if publish.Flags.QoS == 1:
+      puback = MQTTSN.Pubacks()
+      puback.MsgId = publish.MsgId
+      puback.TopicId = publish.TopicId
+      self.send(puback)
+    return publish
+
+  def disconnect(self):
+    self.send(MQTTSN.Disconnects())
+    self.receive()
+    self.sock.close()
+
+
+class Callbacks(mqtt_client.Callback):
+
+  def __init__(self):
+    self.messages = []
+
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.messages.append((topicName, payload))
+    return True
+
+  def published(self, msgid):
+    pass
+
+  def subscribed(self, msgid, data):
+    pass
+
+
+class Test(unittest.TestCase):
+
+  def setUp(self):
+    self.publisher = Clients("mqttsn_test publisher")
+    self.subscriber = Clients("mqttsn_test subscriber")
+
+  def tearDown(self):
+    self.publisher.disconnect()
+    self.subscriber.disconnect()
+
+  def test_registered_topics(self):
+    suback = self.subscriber.subscribe(1, MQTTSN.TopicIdTypes.NORMAL, "mqttsn_test/a")
+    self.assertNotEqual(suback.TopicId, 0)
+    register = MQTTSN.Registers()
+    register.MsgId = 2
+    register.TopicName = "mqttsn_test/a"
+    self.publisher.send(register)
+    regack = self.publisher.receive()
+    self.assertEqual(regack.ReturnCode, MQTTSN.ReturnCodes.ACCEPTED)
+    puback = self.publisher.publish(3, MQTTSN.TopicIdTypes.NORMAL, regack.TopicId, b"registered")
+    self.assertEqual(puback.ReturnCode, MQTTSN.ReturnCodes.ACCEPTED)
+    publish = self.subscriber.received()
+    self.assertEqual((publish.Flags.TopicIdType, publish.TopicId, publish.Data),
+                     (MQTTSN.TopicIdTypes.NORMAL, suback.TopicId, b"registered"))
+    puback = self.publisher.publish(4, MQTTSN.TopicIdTypes.NORMAL, regack.TopicId + 100, b"unknown")
+    self.assertEqual(puback.ReturnCode, MQTTSN.ReturnCodes.REJECTED_INVALID_TOPIC_ID)
+
+  def test_short_names(self):
+    callback = Callbacks()
+    client = mqtt_client.Client("mqttsn_test".encode("utf-8"))
+    client.registerCallback(callback)
+    client.connect(host=host, port=port, cleanstart=True)
+    try:
+      # any two bytes are a short name, not only UTF-8
+      for name in ["st", b"\xff\x01".decode("latin-1")]:
+        topicId = MQTTSN.readInt16(name.encode("latin-1"))
+        self.subscriber.subscribe(1, MQTTSN.TopicIdTypes.SHORT_NAME, name)
+        client.subscribe([name.encode("utf-8")], [MQTTV5.SubscribeOptions(0)])
+        time.sleep(.5)
+        self.publisher.publish(2, MQTTSN.TopicIdTypes.SHORT_NAME, topicId, b"from MQTT-SN")
+        publish = self.subscriber.received()
+        self.assertEqual((publish.Flags.TopicIdType, publish.TopicId, publish.Data),
+                         (MQTTSN.TopicIdTypes.SHORT_NAME, topicId, b"from MQTT-SN"))
+        client.publish(name.encode("utf-8"), b"from MQTT", 0)
+        publish = self.subscriber.received()
+        self.assertEqual((publish.Flags.TopicIdType, publish.TopicId, publish.Data),
+                         (MQTTSN.TopicIdTypes.SHORT_NAME, topicId, b"from MQTT"))
+        time.sleep(.5)
+        self.assertIn((name, b"from MQTT-SN"), callback.messages)
+    finally:
+      client.disconnect()
+
+
+def usage():
+  print(
+"""mqttsn_test.py
+   [-h --hostname hostname]
+   [-p --port mqtt port]
+   [--sn_port mqtt-sn port]
+""")
+
+if __name__ == "__main__":
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h:p:",
+      ["help", "hostname=", "port=", "sn_port="])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+
+  host = "localhost"
+  port = 1883
+  sn_port = 1884
+  for o, a in opts:
+    if o == "--help":
+      usage()
+      sys.exit()
+    elif o in ("-h", "--hostname"):
+      host = a
+    elif o in ("-p", "--port"):
+      port = int(a)
+    elif o == "--sn_port":
+      sn_port = int(a)
+
+  logging.getLogger().setLevel(logging.ERROR)
+  unittest.main(argv=[sys.argv[0]] + args)
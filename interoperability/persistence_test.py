@@ -0,0 +1,210 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Tests of the persistence of sessions, which start a broker with persistence in a
+temporary directory, on a free port, and restart it:
+
+  python3 persistence_test.py --port 18871
+
+"""
+
+import unittest
+
+import socket, subprocess, tempfile, time, logging, sys, os, getopt
+
+import mqtt.clients.V5 as mqtt_client
+import mqtt.formats.MQTTV5 as MQTTV5
+
+TOPIC = "persistence_test/a"
+
+class Callbacks(mqtt_client.Callback):
+
+  def __init__(self):
+    self.messages = []
+
+  def publishArrived(self, topicName, payload, qos, retained, msgid, properties=None):
+    self.messages.append((topicName, payload, qos, retained))
+    return True
+
+  def published(self, msgid):
+    pass
+
+  def subscribed(self, msgid, data):
+    pass
+
+def waitFor(condition, timeout=10):
+  "whether condition() became true within timeout seconds"
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(.1)
+  return True
+
+def listening(port):
+  try:
+    socket.create_connection((host, port), timeout=1).close()
+    return True
+  except OSError:
+    return False
+
+class Brokers:
+  "a broker process with persistence in a directory of its own"
+
+  def __init__(self, name):
+    self.location = os.path.join(directory.name, name)
+    os.mkdir(self.location)
+    self.config = os.path.join(self.location, "broker.conf")
+    with open(self.config, "w") as config:
+      config.write("persistence true\npersistence_location %s\nlistener %d\n" % (self.location, port))
+    self.process = None
+
+  def start(self):
+    self.process = subprocess.Popen([sys.executable, "startbroker.py", "-c", self.config],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    assert waitFor(lambda: listening(port)), "broker on port %d didn't start" % port
+
+  def stop(self, kill=False):
+    "stop the broker, or kill it so that it can't take a final snapshot"
+    if self.process:
+      if kill:
+        self.process.kill()
+      else:
+        self.process.terminate()
+      self.process.wait()
+      self.process = None
+      assert waitFor(lambda: not listening(port))
+
+def connected(clientid, cleanstart=True, receiveMaximum=None):
+  "a client with a session which outlives its connection"
+  callback = Callbacks()
+  client = mqtt_client.Client(clientid.encode("utf-8"))
+  client.registerCallback(callback)
+  properties = MQTTV5.Properties(MQTTV5.PacketTypes.CONNECT)
+  properties.SessionExpiryInterval = 3600
+  if receiveMaximum:
+    properties.ReceiveMaximum = receiveMaximum
+  client.connect(host=host, port=port, cleanstart=cleanstart, properties=properties)
+  return client, callback
+
+def published(client, topic, payload, qos, retained=False):
+  "publish, and wait for the acknowledgement, as the broker's receive maximum is 2"
+  client.publish(topic, payload, qos, retained)
+  return waitFor(lambda: len(client.getReceiver().outMsgs) == 0)
+
+def ended(client):
+  "disconnect, ending the session"
+  properties = MQTTV5.Properties(MQTTV5.PacketTypes.DISCONNECT)
+  properties.SessionExpiryInterval = 0
+  client.disconnect(properties)
+
+
+class Test(unittest.TestCase):
+
+  def restart(self, name, kill):
+    """
+    queue messages for a disconnected client, two of them in flight when it disconnected,
+    restart the broker, and check that they are all sent when the client reconnects
+    """
+    broker = Brokers(name)
+    broker.start()
+    try:
+      subscriber, callback = connected("persistence_test subscriber", receiveMaximum=2)
+      subscriber.subscribe([TOPIC], [MQTTV5.SubscribeOptions(2)])
+      time.sleep(.5)
+      subscriber.pause() # so the first two publications stay in flight
+      publisher, publisherCallback = connected("persistence_test publisher")
+      payloads = [("message %d" % i).encode("utf-8") for i in range(6)]
+      # acknowledged only once on disk
+      for i in range(2):
+        self.assertTrue(published(publisher, TOPIC, payloads[i], 1 + i % 2))
+      time.sleep(.5)
+      subscriber.terminate()
+      for i in range(2, 6):
+        self.assertTrue(published(publisher, TOPIC, payloads[i], 1 + i % 2))
+      self.assertTrue(published(publisher, "persistence_test/retained", b"retained", 1, retained=True))
+      publisher.disconnect()
+
+      broker.stop(kill)
+      broker.start()
+
+      subscriber, callback = connected("persistence_test subscriber", cleanstart=False)
+      self.assertTrue(waitFor(lambda: len(callback.messages) >= len(payloads)))
+      time.sleep(.5)
+      # QoS 2 messages arrive once released, so only the order of each QoS is kept
+      for qos in [1, 2]:
+        self.assertEqual([message[1] for message in callback.messages if message[2] == qos],
+                         [payloads[i] for i in range(len(payloads)) if 1 + i % 2 == qos])
+      self.assertEqual(len(callback.messages), len(payloads))
+
+      # the subscription was kept too, and the retained message
+      publisher, publisherCallback = connected("persistence_test publisher")
+      self.assertTrue(published(publisher, TOPIC, b"after restart", 1))
+      self.assertTrue(waitFor(lambda: len(callback.messages) > len(payloads)))
+      self.assertEqual(callback.messages[-1][1], b"after restart")
+      publisher.subscribe(["persistence_test/retained"], [MQTTV5.SubscribeOptions(1)])
+      self.assertTrue(waitFor(lambda: len(publisherCallback.messages) > 0))
+      self.assertEqual(publisherCallback.messages[0], ("persistence_test/retained", b"retained", 1, True))
+      self.assertTrue(published(publisher, "persistence_test/retained", b"", 1, retained=True))
+      ended(publisher)
+      ended(subscriber)
+    finally:
+      broker.stop()
+
+  def test_restart(self):
+    self.restart("restart", kill=False)
+
+  def test_recovery_from_log(self):
+    "without the final snapshot, the log is replayed"
+    self.restart("recovery", kill=True)
+
+
+def usage():
+  print(
+"""persistence_test.py
+   [-h --hostname hostname]
+   [-p --port port]
+""")
+
+if __name__ == "__main__":
+  try:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "h:p:",
+      ["help", "hostname=", "port="])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+
+  host = "localhost"
+  port = 18871
+  for o, a in opts:
+    if o == "--help":
+      usage()
+      sys.exit()
+    elif o in ("-h", "--hostname"):
+      host = a
+    elif o in ("-p", "--port"):
+      port = int(a)
+
+  logging.getLogger().setLevel(logging.ERROR)
+  directory = tempfile.TemporaryDirectory()
+  try:
+    unittest.main(argv=[sys.argv[0]] + args)
+  finally:
+    directory.cleanup()
@@ -0,0 +1,189 @@
+"""
+*******************************************************************
+  Copyright (c) 2013, 2026 IBM Corp.
+
+  All rights reserved. This program and the accompanying materials
+  are made available under the terms of the Eclipse Public License v1.0
+  and Eclipse Distribution License v1.0 which accompany this distribution.
+
+  The Eclipse Public License is available at
+     http://www.eclipse.org/legal/epl-v10.html
+  and the Eclipse Distribution License is available at
+    http://www.eclipse.org/org/documents/edl-v10.php.
+
+  Contributors:
+     agent - initial implementation
+*******************************************************************
+"""
+
+"""
+Persistence recovery benchmark.
+
+Writes the persistent state of a broker with many retained messages and durable
+sessions, then measures the time and memory the broker needs to recover it at startup,
+and the time to load the messages of one session when its client reconnects:
+
+  python3 recovery_benchmark.py --retained 1000000 --sessions 100000
+
+Each session has one subscription and a number of queued messages.  The messages
+are shared between the sessions, as they are when many clients subscribe to the
+same topics.  Recovery runs in a new process, so that its peak memory can be measured.
+To measure the recovery of files written before:
+
+  python3 recovery_benchmark.py --recover
+
+"""
+
+import sys, os, time, getopt, glob, threading, resource, tempfile, logging, subprocess
+
+import mqtt.formats.MQTTV5 as MQTTV5
+from mqtt.brokers.V311 import MQTTBrokers as MQTTV3Brokers
+from mqtt.brokers.V5 import MQTTBrokers as MQTTV5Brokers
+from mqtt.brokers.V5.Subscriptions import Subscriptions
+from mqtt.brokers.persistence import WriteAheadLogs, SessionStores
+
+logging.getLogger('MQTT broker').setLevel(logging.WARNING)
+
+options = {
+  "overlapping_single": True,
+  "dropQoS0": True,
+  "zero_length_clientids": True,
+  "publish_on_pubrel": False,
+  "topicAliasMaximum": 2,
+  "maximumPacketSize": 256,
+  "receiveMaximum": 2,
+  "serverKeepAlive": 60,
+  "maximum_qos": 2,
+}
+
+def generate(filename, retained, sessions, queued, size):
+  "write the persistent state, in the form a broker would leave it"
+  for name in glob.glob(glob.escape(filename) + ".*"):
+    os.remove(name)
+  started = time.perf_counter()
+  payload = b"x" * size
+  now = time.monotonic()
+  retainedMessages = {}
+  for i in range(retained):
+    retainedMessages["recovery/%d/%d" % (i // 1000, i % 1000)] = (payload, 1, now, None)
+
+  subscriptions = []
+  data = {}
+  store = SessionStores.SessionStores(data, None) # built in memory, then logged in one record each
+  properties = MQTTV5.Properties(MQTTV5.PacketTypes.PUBLISH)
+  clientids = ["recovery_%d" % i for i in range(sessions)]
+  for clientid in clientids:
+    subscriptions.append(Subscriptions(clientid, "recovery/queued/#",
+        (MQTTV5.SubscribeOptions(QoS=1), MQTTV5.Properties(MQTTV5.PacketTypes.SUBSCRIBE))))
+    store.openSession(clientid, "V5", 3600)
+  for j in range(queued): # each message is delivered to every session in turn, as the broker would
+    for clientid in clientids:
+      store.add(clientid, SessionStores.OUTBOUND, "recovery/queued/%d" % j, payload, properties, 1, False)
+  for clientid in clientids:
+    store.endSession(clientid, "V5", 3600)
+
+  lock = threading.RLock()
+  wal = WriteAheadLogs.WriteAheadLogs(filename, lock)
+  sharedData = wal.open()
+  with lock:
+    sharedData["retained"] = retainedMessages
+    sharedData["subscriptions"] = subscriptions
+    for name, value in data.items():
+      sharedData[name] = value
+  wal.close() # writes the snapshot
+  print("Generated %d retained messages, %d sessions with %d queued messages each in %.2f seconds" %
+        (retained, sessions, queued, time.perf_counter() - started))
+  print("Snapshot size %.1f MB" % (os.path.getsize(filename + ".snapshot") / 1024 / 1024))
+
+def peakMemory():
+  "peak resident memory of this process in KB"
+  try:
+    with open("/proc/self/status") as status: # ru_maxrss includes the process before exec on Linux
+      for line in status:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1])
+  except OSError:
+    pass
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def recover(filename):
+  "the startup recovery of the broker, as in start.run"
+  baseline = peakMemory()
+  lock = threading.RLock()
+  started = time.perf_counter()
+  wal = WriteAheadLogs.WriteAheadLogs(filename, lock)
+  sharedData = wal.open()
+  store = SessionStores.SessionStores(sharedData, wal)
+  broker3 = MQTTV3Brokers(options=options.copy(), lock=lock, sharedData=sharedData)
+  broker5 = MQTTV5Brokers(options=options.copy(), lock=lock, sharedData=sharedData)
+  broker3.setStore(store)
+  broker5.setStore(store)
+  elapsed = time.perf_counter() - started
+  peak = peakMemory()
+
+  # the first reconnection of a client loads the messages of its session
+  reconnect = 0
+  client = broker5.broker.getClient("recovery_0")
+  if client:
+    started = time.perf_counter()
+    client.loadStored()
+    reconnect = time.perf_counter() - started
+  print("Recovered %d sessions in %.2f seconds" % (len(broker5.broker.getClients()), elapsed))
+  print("Peak resident memory %.1f MB, %.1f MB more than at the start" % (peak / 1024, (peak - baseline) / 1024))
+  print("Loading the messages of one session on reconnection took %.3f ms" % (reconnect * 1000))
+  broker3.shutdown()
+  broker5.shutdown()
+  wal.close()
+
+def usage():
+  print(
+"""
+MQTT broker persistence recovery benchmark
+
+ -h --help: print this message
+ -l --location= directory for the persistence files, default the temporary directory
+ -r --retained= number of retained messages, default 1000000
+ -s --sessions= number of durable sessions, default 100000
+ -q --queued= messages queued for each session, default 10
+ --size= payload size in bytes, default 16
+ --recover: measure the recovery of the files written by a previous run
+
+""")
+
+def main(argv):
+  try:
+    opts, args = getopt.gnu_getopt(argv[1:], "hl:r:s:q:", ["help", "location=", "retained=",
+        "sessions=", "queued=", "size=", "recover"])
+  except getopt.GetoptError as err:
+    print(err)
+    usage()
+    sys.exit(2)
+  location = tempfile.gettempdir()
+  retained = 1000000; sessions = 100000; queued = 10; size = 16
+  recovering = False
+  for o, a in opts:
+    if o in ("-h", "--help"):
+      usage()
+      sys.exit()
+    elif o in ("-l", "--location"):
+      location = a
+    elif o in ("-r", "--retained"):
+      retained = int(a)
+    elif o in ("-s", "--sessions"):
+      sessions = int(a)
+    elif o in ("-q", "--queued"):
+      queued = int(a)
+    elif o == "--size":
+      size = int(a)
+    elif o == "--recover":
+      recovering = True
+  filename = os.path.join(location, "recovery_benchmark")
+  if recovering:
+    recover(filename)
+  else:
+    generate(filename, retained, sessions, queued, size)
+    # a new process, so that the memory used to generate the data is not counted
+    sys.exit(subprocess.call([sys.executable, argv[0], "--recover", "--location", location]))
+
+if __name__ == "__main__":
+  main(sys.argv)